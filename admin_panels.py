@@ -0,0 +1,137 @@
+"""
+Admin dashboard panels
+
+The dashboard renders only its headline counters; each table (users, contact
+messages, ebooks, blogs) is filled by a JSON endpoint that pages with a keyset
+cursor over (sort columns..., id), so a page costs the same however deep into
+the table it is. The counters come from one aggregate query per admin and are
+cached for DASHBOARD_STATS_TTL seconds.
+"""
+import base64
+import json
+import threading
+import time
+from datetime import datetime
+
+# Counters are recomputed at most this often per admin
+DASHBOARD_STATS_TTL = 30  # 30 seconds
+
+DEFAULT_PAGE_SIZE = 25
+MAX_PAGE_SIZE = 100
+
+
+def page_size(value):
+    """Clamp a ?limit= value to 1..MAX_PAGE_SIZE"""
+    try:
+        return max(1, min(int(value), MAX_PAGE_SIZE))
+    except (TypeError, ValueError):
+        return DEFAULT_PAGE_SIZE
+
+
+def encode_cursor(values):
+    """Opaque cursor for the last row of a page"""
+    payload = [{'dt': value.isoformat()} if isinstance(value, datetime) else value for value in values]
+    return base64.urlsafe_b64encode(json.dumps(payload).encode('utf-8')).decode('ascii')
+
+
+def decode_cursor(cursor):
+    """Inverse of encode_cursor, returns None for a missing or malformed cursor"""
+    if not cursor:
+        return None
+    try:
+        payload = json.loads(base64.urlsafe_b64decode(cursor.encode('ascii')))
+    except (ValueError, TypeError):
+        return None
+    return [datetime.fromisoformat(value['dt']) if isinstance(value, dict) else value for value in payload]
+
+
+def keyset_page(query, columns, cursor=None, limit=DEFAULT_PAGE_SIZE):
+    """
+    Fetch one page of `query` ordered by `columns` descending
+
+    Args:
+        query: SQLAlchemy query selecting the rows
+        columns (list): Sort expressions, the last one must be unique (normally the id)
+        cursor (str): next_cursor from the previous page, or None for the first page
+        limit (int): Page size
+
+    Returns:
+        tuple: (rows, next_cursor or None when this is the last page)
+    """
+    from sqlalchemy import tuple_
+
+    values = decode_cursor(cursor)
+    if values and len(values) == len(columns):
+        if len(columns) == 1:
+            query = query.filter(columns[0] < values[0])
+        else:
+            query = query.filter(tuple_(*columns) < tuple_(*values))
+
+    rows = query.order_by(*[column.desc() for column in columns]).limit(limit + 1).all()
+    if len(rows) <= limit:
+        return rows, None
+
+    rows = rows[:limit]
+    return rows, encode_cursor(_sort_values(rows[-1], columns))
+
+
+def _sort_values(row, columns):
+    values = []
+    for column in columns:
+        key = getattr(column, 'key', None) or column.name
+        values.append(getattr(row, key))
+    return values
+
+
+class DashboardStats:
+    """Headline counters for the admin dashboard, one query per refresh"""
+
+    def __init__(self):
+        self._cache = {}  # admin_id -> (expires_at, stats)
+        self._lock = threading.Lock()
+
+    def _query(self, admin_id):
+        import models
+        from sqlalchemy import select, func
+        db = models.db
+        User, Ebook = models.User, models.Ebook
+
+        today = datetime.now().date()
+
+        def count(model, *criteria):
+            return select(func.count(model.id)).where(*criteria).scalar_subquery()
+
+        row = db.session.execute(select(
+            count(User, User.is_admin == False).label('total_users'),
+            count(User, User.is_admin == False, User.created_at >= today).label('new_users_today'),
+            count(models.Course).label('total_courses'),
+            count(models.ContactMessage).label('total_contact_messages'),
+            count(models.ContactMessage, models.ContactMessage.is_read == False).label('unread_contact_messages'),
+            count(Ebook, Ebook.admin_id == admin_id).label('total_ebooks'),
+            count(Ebook, Ebook.admin_id == admin_id, Ebook.is_published == True).label('published_ebooks'),
+            count(models.EbookPurchase).label('total_ebook_purchases'),
+            count(models.Blog).label('total_blogs')
+        )).one()
+        db.session.rollback()
+        return dict(row._mapping)
+
+    def get(self, admin_id):
+        """Counters for this admin, at most DASHBOARD_STATS_TTL seconds old"""
+        now = time.monotonic()
+        with self._lock:
+            cached = self._cache.get(admin_id)
+        if cached and cached[0] > now:
+            return cached[1]
+
+        stats = self._query(admin_id)
+        with self._lock:
+            self._cache[admin_id] = (now + DASHBOARD_STATS_TTL, stats)
+        return stats
+
+    def invalidate(self):
+        with self._lock:
+            self._cache.clear()
+
+
+# Shared counters for the application
+dashboard_stats = DashboardStats()
@@ -0,0 +1,351 @@
+"""
+Daily analytics rollups
+
+One daily_rollups row per (item_type, day, item_id) holds that day's course
+enrollments, ebook purchases, gateway revenue and (for item_type 'user')
+registrations. Fulfilment and signup add to the row inside their own
+transaction with a single INSERT ... ON CONFLICT DO UPDATE, and the admin
+analytics endpoints read a date range of rows instead of counting the source
+tables.
+
+backfill() rebuilds a range of days from the source tables a chunk of days at
+a time. It fills the table after the migration that introduces it and repairs
+drift (e.g. after users or purchases are deleted).
+
+Metrics:
+    enrollments    CourseEnrollment rows created, per course
+    purchases      EbookPurchase rows created, per ebook
+    revenue        total_amount of fulfilled (VALIDATED) payment transactions
+    registrations  non-admin users created (item_type 'user', item_id 0)
+"""
+import threading
+import time
+from datetime import date, datetime, timedelta
+
+ITEM_TYPES = ('course', 'ebook', 'user')
+METRICS = ('enrollments', 'purchases', 'revenue', 'registrations')
+
+# Days rebuilt per commit by backfill()
+BACKFILL_CHUNK_DAYS = 31
+
+# pg_try_advisory_lock key so only one worker backfills at a time
+BACKFILL_LOCK_KEY = 724918303
+
+
+def _as_date(value):
+    """func.date() returns a date on Postgres and an ISO string on SQLite"""
+    if isinstance(value, datetime):
+        return value.date()
+    if isinstance(value, date):
+        return value
+    return date.fromisoformat(str(value)[:10])
+
+
+class AnalyticsRollup:
+    """Maintains and reads the daily_rollups table"""
+
+    def __init__(self):
+        self.app = None
+        self._run_lock = threading.Lock()
+        self._thread = None
+        self.metrics = {
+            'running': False,
+            'last_backfill_started_at': None,
+            'last_backfill_finished_at': None,
+            'last_backfill_duration': None,
+            'last_backfill_days': 0,
+            'last_error': None
+        }
+
+    def init_app(self, app):
+        """Bind to the Flask app; backfills run in its app context"""
+        self.app = app
+
+    # Incremental updates (staged in the caller's transaction, never committed here)
+
+    def record(self, item_type, item_id=0, day=None, **increments):
+        """
+        Add to one day's counters for an item
+
+        Args:
+            item_type (str): 'course', 'ebook' or 'user'
+            item_id (int): Course/ebook id, 0 for site-wide counters
+            day (date): Defaults to today (UTC)
+            **increments: Amounts to add, keyed by METRICS
+        """
+        import models
+
+        values = {metric: increments.get(metric, 0) for metric in METRICS}
+        if not any(values.values()):
+            return
+
+        db = models.db
+        table = models.DailyRollup.__table__
+        row = dict(values, item_type=item_type, item_id=item_id or 0, day=day or datetime.utcnow().date())
+
+        dialect = db.engine.dialect.name
+        if dialect == 'postgresql':
+            from sqlalchemy.dialects.postgresql import insert
+        elif dialect == 'sqlite':
+            from sqlalchemy.dialects.sqlite import insert
+        else:
+            insert = None
+
+        if insert is None:
+            existing = db.session.get(models.DailyRollup, (row['item_type'], row['day'], row['item_id']))
+            if existing:
+                for metric in METRICS:
+                    setattr(existing, metric, (getattr(existing, metric) or 0) + values[metric])
+            else:
+                db.session.add(models.DailyRollup(**row))
+            return
+
+        stmt = insert(table).values(**row)
+        stmt = stmt.on_conflict_do_update(
+            index_elements=['item_type', 'day', 'item_id'],
+            set_={metric: table.c[metric] + stmt.excluded[metric] for metric in METRICS}
+        )
+        db.session.execute(stmt)
+
+    def record_enrollment(self, course_id, revenue=0.0):
+        self.record('course', course_id, enrollments=1, revenue=revenue or 0.0)
+
+    def record_purchase(self, ebook_id, revenue=0.0):
+        self.record('ebook', ebook_id, purchases=1, revenue=revenue or 0.0)
+
+    def record_registration(self, user):
+        if not user.is_admin:
+            self.record('user', registrations=1)
+
+    # Range reads
+
+    def item_totals(self, item_type, start=None, end=None):
+        """
+        Sum each item's counters over [start, end]
+
+        Returns:
+            dict: item_id -> {metric: total}
+        """
+        import models
+        from sqlalchemy import func
+
+        DailyRollup = models.DailyRollup
+        query = models.db.session.query(
+            DailyRollup.item_id,
+            *[func.sum(getattr(DailyRollup, metric)).label(metric) for metric in METRICS]
+        ).filter(DailyRollup.item_type == item_type)
+        query = self._in_range(query, start, end)
+
+        return {
+            row.item_id: {metric: getattr(row, metric) or 0 for metric in METRICS}
+            for row in query.group_by(DailyRollup.item_id).all()
+        }
+
+    def daily(self, item_type, start, end=None):
+        """
+        Per-day counters over [start, end], summed across items and with missing days filled with zeros
+
+        Returns:
+            list: [{'date': 'YYYY-MM-DD', metric: total, ...}] oldest first
+        """
+        import models
+        from sqlalchemy import func
+
+        DailyRollup = models.DailyRollup
+        end = end or datetime.utcnow().date()
+        query = models.db.session.query(
+            DailyRollup.day,
+            *[func.sum(getattr(DailyRollup, metric)).label(metric) for metric in METRICS]
+        ).filter(DailyRollup.item_type == item_type)
+        query = self._in_range(query, start, end)
+
+        by_day = {_as_date(row.day): row for row in query.group_by(DailyRollup.day).all()}
+        series = []
+        day = start
+        while day <= end:
+            row = by_day.get(day)
+            series.append(dict(
+                {metric: (getattr(row, metric) or 0) if row else 0 for metric in METRICS},
+                date=day.isoformat()
+            ))
+            day += timedelta(days=1)
+        return series
+
+    @staticmethod
+    def _in_range(query, start, end):
+        import models
+        if start:
+            query = query.filter(models.DailyRollup.day >= start)
+        if end:
+            query = query.filter(models.DailyRollup.day <= end)
+        return query
+
+    # Backfill
+
+    def _first_day(self):
+        """Earliest day with any source data, or None"""
+        import models
+        from sqlalchemy import func
+
+        db = models.db
+        candidates = [
+            db.session.query(func.min(models.CourseEnrollment.enrolled_at)).scalar(),
+            db.session.query(func.min(models.EbookPurchase.purchased_at)).scalar(),
+            db.session.query(func.min(models.User.created_at)).scalar(),
+            db.session.query(func.min(models.PaymentTransaction.updated_at)).filter(
+                models.PaymentTransaction.status == 'VALIDATED'
+            ).scalar()
+        ]
+        days = [_as_date(value) for value in candidates if value]
+        return min(days) if days else None
+
+    def _aggregate(self, start, end):
+        """Rebuild the rollup rows for [start, end] from the source tables"""
+        import models
+        from sqlalchemy import func
+
+        db = models.db
+        lower = datetime.combine(start, datetime.min.time())
+        upper = datetime.combine(end + timedelta(days=1), datetime.min.time())
+        rows = {}
+
+        def add(item_type, item_id, day, metric, value):
+            key = (item_type, _as_date(day), item_id or 0)
+            row = rows.setdefault(key, dict(
+                {name: 0 for name in METRICS},
+                item_type=key[0], day=key[1], item_id=key[2]
+            ))
+            row[metric] += value or 0
+
+        def grouped(column, item_column, timestamp, *criteria, aggregate=None):
+            day = func.date(timestamp)
+            return db.session.query(day, item_column, aggregate if aggregate is not None else func.count(column)).filter(
+                timestamp >= lower, timestamp < upper, *criteria
+            ).group_by(day, item_column).all()
+
+        CourseEnrollment, EbookPurchase = models.CourseEnrollment, models.EbookPurchase
+        PaymentTransaction, User = models.PaymentTransaction, models.User
+
+        for day, course_id, count in grouped(CourseEnrollment.id, CourseEnrollment.course_id,
+                                             CourseEnrollment.enrolled_at):
+            add('course', course_id, day, 'enrollments', count)
+
+        for day, ebook_id, count in grouped(EbookPurchase.id, EbookPurchase.ebook_id, EbookPurchase.purchased_at):
+            add('ebook', ebook_id, day, 'purchases', count)
+
+        for purchase_type, item_column in (('course', PaymentTransaction.course_id),
+                                           ('ebook', PaymentTransaction.ebook_id)):
+            for day, item_id, amount in grouped(
+                PaymentTransaction.id, item_column, PaymentTransaction.updated_at,
+                PaymentTransaction.status == 'VALIDATED',
+                PaymentTransaction.purchase_type == purchase_type,
+                aggregate=func.sum(PaymentTransaction.total_amount)
+            ):
+                add(purchase_type, item_id, day, 'revenue', amount)
+
+        day = func.date(User.created_at)
+        for day_value, count in db.session.query(day, func.count(User.id)).filter(
+            User.created_at >= lower, User.created_at < upper, User.is_admin == False
+        ).group_by(day).all():
+            add('user', 0, day_value, 'registrations', count)
+
+        return list(rows.values())
+
+    def _try_lock(self, conn):
+        if conn.dialect.name != 'postgresql':
+            return True
+        from sqlalchemy import text
+        return bool(conn.execute(text('SELECT pg_try_advisory_lock(:key)'), {'key': BACKFILL_LOCK_KEY}).scalar())
+
+    def _unlock(self, conn):
+        if conn.dialect.name == 'postgresql':
+            from sqlalchemy import text
+            conn.execute(text('SELECT pg_advisory_unlock(:key)'), {'key': BACKFILL_LOCK_KEY})
+
+    def backfill(self, start=None, end=None):
+        """
+        Recompute the rollups for [start, end] from the source tables; call inside an app context
+
+        Args:
+            start (date): First day to rebuild, defaults to the earliest source row
+            end (date): Last day to rebuild, defaults to today (UTC)
+
+        Returns:
+            dict: metrics
+        """
+        import models
+
+        if not self._run_lock.acquire(blocking=False):
+            return self.metrics
+
+        db = models.db
+        conn = db.engine.connect()
+        try:
+            if not self._try_lock(conn):
+                return self.metrics
+
+            started = time.monotonic()
+            self.metrics.update({
+                'running': True,
+                'last_backfill_started_at': datetime.utcnow().isoformat(),
+                'last_backfill_days': 0,
+                'last_error': None
+            })
+
+            end = end or datetime.utcnow().date()
+            start = start or self._first_day() or end
+            table = models.DailyRollup.__table__
+
+            chunk_start = start
+            while chunk_start <= end:
+                chunk_end = min(chunk_start + timedelta(days=BACKFILL_CHUNK_DAYS - 1), end)
+                rows = self._aggregate(chunk_start, chunk_end)
+                db.session.execute(table.delete().where(table.c.day >= chunk_start, table.c.day <= chunk_end))
+                if rows:
+                    db.session.execute(table.insert(), rows)
+                db.session.commit()
+
+                self.metrics['last_backfill_days'] += (chunk_end - chunk_start).days + 1
+                chunk_start = chunk_end + timedelta(days=1)
+
+            duration = time.monotonic() - started
+            self.metrics.update({
+                'last_backfill_finished_at': datetime.utcnow().isoformat(),
+                'last_backfill_duration': round(duration, 3)
+            })
+            print(f"📊 Rebuilt analytics rollups for {self.metrics['last_backfill_days']} days in {duration:.2f}s")
+        except Exception as e:
+            db.session.rollback()
+            self.metrics['last_error'] = str(e)
+            print(f"❌ Analytics rollup backfill error: {str(e)}")
+        finally:
+            self.metrics['running'] = False
+            try:
+                self._unlock(conn)
+                conn.commit()
+            finally:
+                conn.close()
+            self._run_lock.release()
+
+        return self.metrics
+
+    def start_backfill(self, start=None, end=None):
+        """Run backfill() in a background thread, returns False if one is already running"""
+        if self.metrics['running'] or (self._thread and self._thread.is_alive()):
+            return False
+
+        def worker():
+            with self.app.app_context():
+                try:
+                    self.backfill(start, end)
+                finally:
+                    import models
+                    models.db.session.remove()
+
+        self._thread = threading.Thread(target=worker, name='analytics-rollup-backfill', daemon=True)
+        self._thread.start()
+        return True
+
+
+# Shared rollups for the application
+analytics_rollup = AnalyticsRollup()
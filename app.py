@@ -1,4 +1,8 @@
-from flask import Flask, render_template, request, redirect, url_for, flash, session, jsonify, make_response, Response, send_from_directory
+from flask import Flask, render_template, request, redirect, url_for, flash, session, jsonify, make_response, Response, send_from_directory, abort
+
+# Fork the image encoding processes while this is still the only thread (see image_variants.py)
+from image_variants import image_variants
+image_variants.start_workers()
 
 import os
 import json
@@ -43,7 +47,7 @@ import hmac
 # Set up Firebase Application Default Credentials before any Firebase imports
 os.environ['GOOGLE_APPLICATION_CREDENTIALS'] = os.path.join(os.path.dirname(__file__), 'firebase-service-key.json')
 from utils import (send_verification_code, check_verification_code, 
-                 verify_turnstile, 
+                 verify_turnstile, verify_turnstile_async, 
                  store_otp_session, validate_otp_session, clear_otp_session, mask_email, send_password_reset_code)
 
 app = Flask(__name__, static_folder=None)  # Disable built-in static folder
@@ -67,62 +71,72 @@ encoded_password = quote_plus(SUPABASE_PASSWORD)
 app.config['SQLALCHEMY_DATABASE_URI'] = f'postgresql://{SUPABASE_USER}:{encoded_password}@{SUPABASE_HOST}:{SUPABASE_PORT}/{SUPABASE_DATABASE}?sslmode=require'
 app.config['SQLALCHEMY_TRACK_MODIFICATIONS'] = False
 
+# Tools such as the template benchmark run the app against a throwaway database
+if os.environ.get('SQLALCHEMY_DATABASE_URI'):
+    app.config['SQLALCHEMY_DATABASE_URI'] = os.environ['SQLALCHEMY_DATABASE_URI']
+
+# BACKGROUND_WORKERS=0 keeps the periodic threads (payment reconciliation, CDN sync,
+# catalog refresh, payment analytics) from starting, for tools that import the app
+app.config['BACKGROUND_WORKERS'] = os.environ.get('BACKGROUND_WORKERS', '1') != '0'
+
 # Configure Bunny CDN for static files
 app.config['BUNNY_CDN_STATIC_URL'] = 'https://skill-finesse-videos.b-cdn.net/static'
 
 # Set a local static folder path for file operations (but not for serving)
 LOCAL_STATIC_FOLDER = os.path.join(os.path.dirname(__file__), 'static')
 
+# Which static files are on Bunny CDN, kept in memory instead of probed per request
+from cdn_presence import cdn_presence
+cdn_presence.init_app(app)
+if app.config['BACKGROUND_WORKERS']:
+    cdn_presence.start_periodic()
+
+# Viewer CSS/JS built into fingerprinted, precompressed bundles under static/dist
+from static_assets import static_assets
+static_assets.init_app(app)
+
+# Compiled templates shared by the workers on local disk, warmed at the end of this module
+from template_cache import template_cache
+template_cache.init_app(app)
+
+# Browser cache lifetime for static files served from the local fallback
+STATIC_MAX_AGE = 24 * 60 * 60  # 1 day in seconds
+# Uploaded images get a unique name per upload, so they never change
+UPLOADED_STATIC_MAX_AGE = 365 * 24 * 60 * 60  # 1 year in seconds
+UPLOADED_STATIC_PREFIXES = ('images/about_', 'images/homepage_', 'images/blog_', 'images/site_')
+
 # Override static file serving to redirect to Bunny CDN
 @app.route('/static/<path:filename>')
 def serve_static(filename):
-    """Serve static files with fallback to local when CDN fails"""
+    """Serve static files from Bunny CDN, falling back to the local copy when the CDN does not have them"""
     from flask import redirect, send_from_directory
-    import requests
-    import os
-    
-    # For newly uploaded about and homepage images, serve locally first
-    if filename.startswith('images/about_') or filename.startswith('images/homepage_'):
-        local_path = os.path.join(LOCAL_STATIC_FOLDER, filename)
-        if os.path.exists(local_path):
-            # Check if file exists on CDN
-            try:
-                cdn_url = f"{app.config['BUNNY_CDN_STATIC_URL']}/{filename}"
-                response = requests.head(cdn_url, timeout=2)
-                if response.status_code == 200:
-                    # File exists on CDN, redirect there
-                    return redirect(cdn_url, code=301)
-                else:
-                    # File doesn't exist on CDN, serve locally
-                    return send_from_directory(LOCAL_STATIC_FOLDER, filename)
-            except:
-                # CDN check failed, serve locally
-                return send_from_directory(LOCAL_STATIC_FOLDER, filename)
     
-    # For all other static files, try CDN first with fallback to local
-    local_path = os.path.join(LOCAL_STATIC_FOLDER, filename)
+    # Fingerprinted bundles are served locally, precompressed and cached for good
+    if filename.startswith('dist/'):
+        return static_assets.send(filename[len('dist/'):])
     
-    # Check if file exists on CDN
-    try:
-        cdn_url = f"{app.config['BUNNY_CDN_STATIC_URL']}/{filename}"
-        response = requests.head(cdn_url, timeout=2)
-        if response.status_code == 200:
-            # File exists on CDN, redirect there
-            return redirect(cdn_url, code=301)
-    except:
-        pass
-    
-    # CDN doesn't have file or is unreachable, try local
-    if os.path.exists(local_path):
-        return send_from_directory(LOCAL_STATIC_FOLDER, filename)
+    cdn_url = f"{app.config['BUNNY_CDN_STATIC_URL']}/{filename}"
+    if cdn_presence.is_present(filename):
+        return redirect(cdn_url, code=301)
+    
+    # CDN doesn't have the file (e.g. an upload that fell back to local storage), serve it locally
+    if os.path.isfile(os.path.join(LOCAL_STATIC_FOLDER, filename)):
+        max_age = UPLOADED_STATIC_MAX_AGE if filename.startswith(UPLOADED_STATIC_PREFIXES) else STATIC_MAX_AGE
+        return send_from_directory(LOCAL_STATIC_FOLDER, filename, max_age=max_age)
     
     # Neither CDN nor local has file, redirect to CDN anyway (for cached/future files)
-    return redirect(f"{app.config['BUNNY_CDN_STATIC_URL']}/{filename}", code=301)
+    return redirect(cdn_url, code=302)
 # SSLCommerz Configuration (Live Environment)
 app.config['SSLCOMMERZ_STORE_ID'] = 'skillfinesse0live'
 app.config['SSLCOMMERZ_STORE_PASSWORD'] = '6832CA5EDAA6856122'
 app.config['SSLCOMMERZ_SESSION_API'] = 'https://securepay.sslcommerz.com/gwprocess/v4/api.php'
 app.config['SSLCOMMERZ_VALIDATION_API'] = 'https://securepay.sslcommerz.com/validator/api/validationserverAPI.php'
+app.config['SSLCOMMERZ_TRANSACTION_QUERY_API'] = 'https://securepay.sslcommerz.com/validator/api/merchantTransIDvalidationAPI.php'
+
+# Point the validation APIs at a local stand-in (see sslcommerz_standin.py) when testing
+if os.environ.get('SSLCOMMERZ_API_BASE'):
+    app.config['SSLCOMMERZ_VALIDATION_API'] = os.environ['SSLCOMMERZ_API_BASE'].rstrip('/') + '/validator/api/validationserverAPI.php'
+    app.config['SSLCOMMERZ_TRANSACTION_QUERY_API'] = os.environ['SSLCOMMERZ_API_BASE'].rstrip('/') + '/validator/api/merchantTransIDvalidationAPI.php'
 
 # Dynamic URL configuration - will use actual domain in production
 # These will be set dynamically in the create_session function based on request context
@@ -135,6 +149,14 @@ app.config['BUNNY_PULL_ZONE'] = 'skill-finesse-videos'
 app.config['BUNNY_STORAGE_HOSTNAME'] = 'ny.storage.bunnycdn.com'
 app.config['BUNNY_CDN_HOSTNAME'] = 'skill-finesse-videos.b-cdn.net'
 
+# Token authentication for lesson videos and attachments, see signed_urls.py
+app.config['BUNNY_TOKEN_KEY'] = os.environ.get('BUNNY_TOKEN_KEY')
+app.config['BUNNY_TOKEN_HOSTNAME'] = os.environ.get('BUNNY_TOKEN_HOSTNAME')
+app.config['BUNNY_TOKEN_BIND_IP'] = os.environ.get('BUNNY_TOKEN_BIND_IP') == '1'
+
+from signed_urls import url_signer
+url_signer.init_app(app)
+
 # Add custom template filter for JSON parsing
 @app.template_filter('from_json')
 def from_json_filter(value):
@@ -180,6 +202,11 @@ def url_for(endpoint, **values):
 def bunny_url_for_template(endpoint, **values):
     return bunny_url_for(endpoint, **values)
 
+@app.template_global()
+def asset_url(name):
+    """URL of a fingerprinted static bundle (see static_assets.py)"""
+    return static_assets.url(name)
+
 # Add custom Jinja2 filters
 import json
 
@@ -286,6 +313,12 @@ class TrustedDevice(db.Model):
     # Relationship with User
     user = db.relationship('User', backref=db.backref('trusted_devices', lazy=True, cascade='all, delete-orphan'))
     
+    # One row per browser per user (upsert target), plus expiry cleanup by last_used
+    __table_args__ = (
+        db.Index('unique_user_device_fingerprint', 'user_id', 'fingerprint', unique=True),
+        db.Index('ix_trusted_device_last_used', 'last_used'),
+    )
+    
     def __repr__(self):
         return f'<TrustedDevice {self.id} for User {self.user_id}>'
 
@@ -304,12 +337,58 @@ class LoginAttempt(db.Model):
     # Relationship with User
     user = db.relationship('User', backref=db.backref('login_attempts', lazy=True, cascade='all, delete-orphan'))
     
+    # Indexes for brute-force lookups and retention pruning
+    __table_args__ = (
+        db.Index('ix_login_attempt_ip_timestamp', 'ip_address', 'timestamp'),
+        db.Index('ix_login_attempt_user_timestamp', 'user_id', 'timestamp'),
+        db.Index('ix_login_attempt_timestamp', 'timestamp'),
+    )
+    
     def __repr__(self):
         return f'<LoginAttempt {self.id} for User {self.user_id} - {self.status}>'
 
+class SecurityEvent(db.Model):
+    """
+    Model for security events reported by the course player and eBook reader (devtools, download attempts, ...)
+    """
+    __tablename__ = 'security_event'
+    
+    id = db.Column(db.Integer, primary_key=True)
+    user_id = db.Column(db.Integer, db.ForeignKey('user.id', ondelete='CASCADE'), nullable=True)
+    event_type = db.Column(db.String(64), nullable=False)  # e.g. dev_tools_detected, rate_limited
+    count = db.Column(db.Integer, nullable=False, default=1)  # repeats merged by the client
+    course_id = db.Column(db.Integer, nullable=True)
+    video_id = db.Column(db.Integer, nullable=True)
+    ebook_id = db.Column(db.Integer, nullable=True)
+    page_url = db.Column(db.String(500), nullable=True)
+    ip_address = db.Column(db.String(45), nullable=True)
+    user_agent = db.Column(db.String(512), nullable=True)
+    details = db.Column(db.Text, nullable=True)  # JSON of the other fields the client sent
+    occurred_at = db.Column(db.DateTime, nullable=True)  # browser clock
+    timestamp = db.Column(db.DateTime, default=datetime.utcnow)  # when the server received it
+    
+    # Indexes for abuse review per user or event type, and retention pruning
+    __table_args__ = (
+        db.Index('ix_security_event_user_timestamp', 'user_id', 'timestamp'),
+        db.Index('ix_security_event_type_timestamp', 'event_type', 'timestamp'),
+        db.Index('ix_security_event_timestamp', 'timestamp'),
+    )
+    
+    def __repr__(self):
+        return f'<SecurityEvent {self.id} {self.event_type} for User {self.user_id}>'
+
 # Replace placeholder models
 models.TrustedDevice = TrustedDevice
 models.LoginAttempt = LoginAttempt
+models.SecurityEvent = SecurityEvent
+
+# Batched login attempt writer
+from login_attempts import login_attempt_recorder
+login_attempt_recorder.init_app(app)
+
+# Rate-limited, batched writer for client security telemetry
+from security_telemetry import security_event_recorder
+security_event_recorder.init_app(app)
 
 
 
@@ -334,7 +413,7 @@ class User(db.Model):
     phone_verified = db.Column(db.Boolean, default=False)
     email_verified = db.Column(db.Boolean, default=False)
     profile_picture = db.Column(db.String(200), nullable=True)  # Profile picture filename
-    created_at = db.Column(db.DateTime, default=datetime.utcnow)
+    created_at = db.Column(db.DateTime, default=datetime.utcnow, index=True)
     messages = db.relationship('Message', foreign_keys='Message.user_id', backref='user', lazy=True)
     enrollments = db.relationship('Enrollment', backref='user', lazy=True)
     
@@ -486,6 +565,34 @@ class Message(db.Model):
     user_id = db.Column(db.Integer, db.ForeignKey('user.id'), nullable=False)
     admin_id = db.Column(db.Integer, db.ForeignKey('user.id'), nullable=True)
     is_from_admin = db.Column(db.Boolean, default=False)
+    conversation_key = db.Column(db.String(32), nullable=True)  # see chat_sync.conversation_key
+    
+    # Conversations are read by (conversation_key, id) ranges
+    __table_args__ = (
+        db.Index('ix_message_conversation_id', 'conversation_key', 'id'),
+    )
+
+class ChatConversation(db.Model):
+    """Last message and unread counters of one user/admin conversation, see chat_inbox.py"""
+    __tablename__ = 'chat_conversations'
+    
+    conversation_key = db.Column(db.String(32), primary_key=True)
+    user_id = db.Column(db.Integer, db.ForeignKey('user.id'), nullable=False)
+    admin_id = db.Column(db.Integer, db.ForeignKey('user.id'), nullable=False)
+    last_message_id = db.Column(db.Integer, nullable=False)
+    last_message_at = db.Column(db.DateTime, nullable=False)
+    last_message_preview = db.Column(db.String(120), nullable=True)
+    last_message_from_admin = db.Column(db.Boolean, default=False)
+    user_unread = db.Column(db.Integer, nullable=False, default=0)  # sent by the admin, not yet seen by the user
+    admin_unread = db.Column(db.Integer, nullable=False, default=0)  # sent by the user, not yet seen by the admin
+    
+    user = db.relationship('User', foreign_keys=[user_id])
+    
+    # Inboxes are listed newest conversation first
+    __table_args__ = (
+        db.Index('ix_chat_conversations_admin_last', 'admin_id', 'last_message_at', 'conversation_key'),
+        db.Index('ix_chat_conversations_user', 'user_id'),
+    )
 
 class Alert(db.Model):
     id = db.Column(db.Integer, primary_key=True)
@@ -501,6 +608,17 @@ class Alert(db.Model):
     def __repr__(self):
         return f'<Alert {self.id}: {self.message[:50]}...>'
 
+class ImageAsset(db.Model):
+    """Responsive variants generated for an uploaded image, see image_variants.py"""
+    __tablename__ = 'image_assets'
+    
+    path = db.Column(db.String(300), primary_key=True)  # storage path of the stored copy, e.g. static/images/x.jpg
+    width = db.Column(db.Integer, nullable=False)
+    height = db.Column(db.Integer, nullable=False)
+    widths = db.Column(db.String(100), nullable=False)  # comma-separated variant widths
+    formats = db.Column(db.String(50), nullable=False)  # comma-separated, e.g. avif,webp,jpeg
+    created_at = db.Column(db.DateTime, default=datetime.utcnow)
+
 # Contact Message Model
 class ContactMessage(db.Model):
     """Model for storing contact form submissions"""
@@ -520,6 +638,11 @@ class ContactMessage(db.Model):
     # Relationship with admin who replied
     admin = db.relationship('User', backref='contact_replies')
     
+    # Unread triage lists newest first
+    __table_args__ = (
+        db.Index('ix_contact_message_read_submitted', 'is_read', 'submitted_at'),
+    )
+    
     def __repr__(self):
         return f'<ContactMessage {self.id}: {self.subject} from {self.full_name}>'
     
@@ -532,15 +655,27 @@ class ContactMessage(db.Model):
         """Return truncated message for display"""
         return self.message[:100] + ('...' if len(self.message) > 100 else '')
     
-    def mark_as_read(self):
+    def mark_as_read(self, commit=True):
         """Mark message as read"""
         self.is_read = True
-        db.session.commit()
+        if commit:
+            db.session.commit()
     
-    def update_status(self, new_status):
+    def update_status(self, new_status, commit=True):
         """Update message status"""
         self.status = new_status
-        db.session.commit()
+        if commit:
+            db.session.commit()
+    
+    def add_admin_reply(self, reply, admin_id, commit=False):
+        """Record an admin's reply; the message counts as read and replied"""
+        self.admin_reply = reply
+        self.replied_at = datetime.utcnow()
+        self.replied_by = admin_id
+        self.is_read = True
+        self.status = 'replied'
+        if commit:
+            db.session.commit()
 
 # eBook Model
 class Ebook(db.Model):
@@ -670,6 +805,13 @@ class PaymentTransaction(db.Model):
     course = db.relationship('Course', backref='payment_transactions')
     ebook = db.relationship('Ebook', backref='payment_transactions')
     
+    # Stuck-payment reconciliation pages through (status, created_at),
+    # the analytics snapshot extracts by (updated_at, id)
+    __table_args__ = (
+        db.Index('ix_payment_transactions_status_created', 'status', 'created_at', 'id'),
+        db.Index('ix_payment_transactions_updated', 'updated_at', 'id'),
+    )
+    
     def __repr__(self):
         return f'<PaymentTransaction {self.transaction_id} - {self.status}>'
     
@@ -698,7 +840,7 @@ class PaymentTransaction(db.Model):
         random_suffix = str(uuid.uuid4())[:8]
         return f"SF_{timestamp}_{random_suffix}"
     
-    def update_status(self, new_status, gateway_data=None):
+    def update_status(self, new_status, gateway_data=None, commit=True):
         """Update transaction status with optional gateway data"""
         self.status = new_status
         self.updated_at = datetime.utcnow()
@@ -725,7 +867,8 @@ class PaymentTransaction(db.Model):
             if 'risk_title' in gateway_data:
                 self.risk_title = gateway_data['risk_title']
         
-        db.session.commit()
+        if commit:
+            db.session.commit()
 
 class PaymentLog(db.Model):
     __tablename__ = 'payment_logs'
@@ -753,8 +896,8 @@ class PaymentLog(db.Model):
         return f'<PaymentLog {self.transaction_id} - {self.action}>'
     
     @staticmethod
-    def log_action(transaction_id, action, status, message=None, data=None, request_obj=None):
-        """Create a payment log entry"""
+    def log_action(transaction_id, action, status, message=None, data=None, request_obj=None, commit=True):
+        """Create a payment log entry (commit=False leaves it in the caller's transaction)"""
         log_entry = PaymentLog(
             transaction_id=transaction_id,
             action=action,
@@ -765,9 +908,38 @@ class PaymentLog(db.Model):
             user_agent=request_obj.headers.get('User-Agent', '')[:500] if request_obj else None
         )
         db.session.add(log_entry)
-        db.session.commit()
+        if commit:
+            db.session.commit()
         return log_entry
 
+class PaymentIdempotencyKey(db.Model):
+    """Outcome of an already-handled payment callback, see payment_pipeline.py"""
+    __tablename__ = 'payment_idempotency_keys'
+    
+    key = db.Column(db.String(200), primary_key=True)  # e.g. 'ipn:<tran_id>:<val_id>'
+    transaction_id = db.Column(db.String(100), nullable=False, index=True)
+    outcome = db.Column(db.String(20), nullable=False)
+    status = db.Column(db.String(20), nullable=True)
+    created_at = db.Column(db.DateTime, default=datetime.utcnow)
+    
+    def __repr__(self):
+        return f'<PaymentIdempotencyKey {self.key} - {self.status}>'
+
+class DailyRollup(db.Model):
+    """Per-day, per-item analytics counters, see analytics_rollup.py"""
+    __tablename__ = 'daily_rollups'
+    
+    item_type = db.Column(db.String(10), primary_key=True)  # 'course', 'ebook' or 'user'
+    day = db.Column(db.Date, primary_key=True)
+    item_id = db.Column(db.Integer, primary_key=True, default=0)  # 0 for site-wide counters
+    enrollments = db.Column(db.Integer, nullable=False, default=0)
+    purchases = db.Column(db.Integer, nullable=False, default=0)
+    revenue = db.Column(db.Float, nullable=False, default=0.0)
+    registrations = db.Column(db.Integer, nullable=False, default=0)
+    
+    def __repr__(self):
+        return f'<DailyRollup {self.item_type}:{self.item_id} {self.day}>'
+
 # Coupon Models for Courses and Ebooks
 class CourseCoupon(db.Model):
     __tablename__ = 'course_coupons'
@@ -879,10 +1051,99 @@ class EbookCoupon(db.Model):
             'final_price': final_price
         }
 
+# Expose models used by helper modules
+models.CourseEnrollment = CourseEnrollment
+models.EbookPurchase = EbookPurchase
+models.PaymentTransaction = PaymentTransaction
+models.PaymentLog = PaymentLog
+models.PaymentIdempotencyKey = PaymentIdempotencyKey
+models.DailyRollup = DailyRollup
+models.User = User
+models.Enrollment = Enrollment
+models.Message = Message
+models.ChatConversation = ChatConversation
+models.ContactMessage = ContactMessage
+models.Alert = Alert
+models.ImageAsset = ImageAsset
+models.Course = Course
+models.Ebook = Ebook
+models.CourseCoupon = CourseCoupon
+models.EbookCoupon = EbookCoupon
+
+# Idempotent payment state machine
+from payment_pipeline import (PaymentPipeline, OUTCOME_PROCESSED, OUTCOME_DUPLICATE,
+                              OUTCOME_BUSY, OUTCOME_NOT_FOUND, OUTCOME_ERROR)
+
+# Background reconciliation of stuck payments against SSLCommerz
+from payment_reconciliation import payment_reconciler
+payment_reconciler.init_app(app)
+if app.config['BACKGROUND_WORKERS']:
+    payment_reconciler.start_periodic()
+
+# Coupon validation index and atomic redemption
+from coupon_engine import CouponEngine
+
+# In-memory catalog of courses and ebooks for the catalog pages and JSON views
+from catalog import catalog
+catalog.init_app(app)
+
+# Cursor-based chat history
+from chat_sync import ChatHistory, conversation_key, serialize as serialize_message, CHAT_PAGE_SIZE
+
+# Per-conversation inbox summaries with unread counters
+from chat_inbox import ChatInbox
+
+# Server-Sent Events delivery of chat messages
+from chat_hub import chat_hub
+chat_hub.init_app(app)
+
+# Paginated admin dashboard panels and cached headline counters
+from admin_panels import dashboard_stats, keyset_page, page_size
+
+# Contact message search, bulk triage and unread badge
+from contact_messages import contact_inbox, STATUSES as CONTACT_STATUSES
+
+# Blog tag index, ranked search and cached sidebar
+from blog_index import blog_index
+
+# Rendered public pages for anonymous visitors, purged by tag from the admin endpoints
+from page_cache import page_cache
+page_cache.init_app(app)
+
+# About page and policy content held in memory, versioned by the page cache purges
+from content_store import content_store, about_sections
+
+# Active alert banner, rendered into every page from memory
+from site_alert import site_alert, ALERT_MAX_AGE, ALERT_STALE_WHILE_REVALIDATE
+
+@app.context_processor
+def inject_site_alert():
+    """Make the active alert banner available to all templates"""
+    return {'site_alert': site_alert.get()}
+
+# Responsive variants of uploaded images, rendered with srcset by the templates
+from image_variants import PROFILE_WIDTHS
+image_variants.init_app(app)
+app.add_template_global(image_variants.responsive_image, 'responsive_image')
+app.add_template_global(image_variants.responsive_background, 'responsive_background')
+
+# Brotli/gzip compression of HTML and JSON responses
+from compression import response_compressor
+response_compressor.init_app(app)
+
+# Daily analytics rollups maintained by fulfilment and signup
+from analytics_rollup import analytics_rollup
+analytics_rollup.init_app(app)
+
+# Revenue and funnel reports computed from a local payment snapshot
+from payment_analytics import payment_analytics
+payment_analytics.init_app(app)
+
 # Blog model moved to after routes section
 
 # Routes
 @app.route('/')
+@page_cache.cached(['homepage', 'courses'])
 def index():
     # Get featured courses for homepage
     courses = Course.query.order_by(Course.created_at.desc()).limit(6).all()
@@ -1074,6 +1335,7 @@ def join_signup():
     )
     
     db.session.add(new_user)
+    analytics_rollup.record_registration(new_user)
     db.session.commit()
     print(f"User created with ID: {new_user.id}, email_verified=False")
     
@@ -1163,6 +1425,7 @@ def verify_otp(mode):
                 )
                 
                 db.session.add(new_user)
+                analytics_rollup.record_registration(new_user)
                 db.session.commit()
                 
                 # Clean up session
@@ -1215,11 +1478,11 @@ def resend_otp(mode):
 
 @app.route('/join/signin', methods=['POST'])
 def join_signin():
-    # Verify Cloudflare Turnstile (skip in test mode)
+    # Verify Cloudflare Turnstile (skip in test mode) concurrently with the user lookup
     turnstile_response = request.form.get('cf-turnstile-response')
-    if not app.config.get('TESTING') and not verify_turnstile(turnstile_response, request.remote_addr):
-        flash('Security check failed. Please try again.', 'danger')
-        return redirect(url_for('join'))
+    turnstile_check = None
+    if not app.config.get('TESTING'):
+        turnstile_check = verify_turnstile_async(turnstile_response, request.remote_addr)
     
     login_method = request.form.get('login_method')
     password = request.form.get('password')
@@ -1234,27 +1497,32 @@ def join_signin():
         country_code = request.form.get('country_code')
         user = User.query.filter_by(phone_number=phone_number, country_code=country_code).first()
     
-    # Record login attempt
-    login_attempt = LoginAttempt(
-        user_id=user.id if user else None,
-        ip_address=request.remote_addr,
-        user_agent=request.user_agent.string,
-        status='pending'
-    )
-    db.session.add(login_attempt)
-    db.session.commit()
+    if turnstile_check is not None and not turnstile_check.result():
+        flash('Security check failed. Please try again.', 'danger')
+        return redirect(url_for('join'))
+    
+    # Login attempts are buffered and written in batches with their final status
+    user_id = user.id if user else None
+    
+    def record_attempt(status):
+        login_attempt_recorder.record(request.remote_addr, status,
+                                      user_id=user_id, user_agent=request.user_agent.string)
+    
+    # Too many recent failures from this IP or for this account
+    if login_attempt_recorder.is_locked_out(request.remote_addr, user_id):
+        record_attempt('blocked')
+        flash('Too many failed login attempts. Please try again in a few minutes.', 'danger')
+        return redirect(url_for('join'))
     
     if not user:
-        login_attempt.status = 'failed'
-        db.session.commit()
+        record_attempt('failed')
         flash('Invalid credentials', 'danger')
         return redirect(url_for('join'))
     
     if check_password_hash(user.password, password):
         # Check if user has verified their email
         if not user.email_verified:
-            login_attempt.status = 'failed'
-            db.session.commit()
+            record_attempt('failed')
             flash('Please verify your email before logging in. Check your inbox for the verification link.', 'warning')
             return redirect(url_for('join'))
         
@@ -1263,8 +1531,7 @@ def join_signin():
         session['is_admin'] = user.is_admin
         
         # Record successful login
-        login_attempt.status = 'success'
-        db.session.commit()
+        record_attempt('success')
         
         # Register this device as trusted (optional - for consistency)
         device_token = AuthManager.register_trusted_device(user.id)
@@ -1300,21 +1567,19 @@ def join_signin():
         return resp
     else:
         # Wrong password
-        login_attempt.status = 'failed'
-        db.session.commit()
+        record_attempt('failed')
         flash('Invalid credentials', 'danger')
         return redirect(url_for('join'))
 
 @app.route('/courses')
+@page_cache.cached(['courses'])
 def courses():
     # Get page number from query parameter, default to 1
     page = request.args.get('page', 1, type=int)
     per_page = 6  # 6 courses per page
     
-    # Get only published courses with pagination
-    courses_pagination = Course.query.filter_by(is_published=True)\
-        .order_by(Course.created_at.desc())\
-        .paginate(page=page, per_page=per_page, error_out=False)
+    # Get only published courses with pagination (served from the in-memory catalog)
+    courses_pagination = catalog.published_courses(page=page, per_page=per_page)
     
     courses = courses_pagination.items
     
@@ -1331,7 +1596,7 @@ def stream_video(video_id):
         
         # For preview videos, allow access
         if video.is_preview:
-            return redirect(video.video_url)
+            return redirect(url_signer.for_user(None, 'lesson', video.id, video.video_url))
         
         # For non-preview videos, check enrollment
         if not session.get('user_id'):
@@ -1346,7 +1611,7 @@ def stream_video(video_id):
         if not enrollment:
             return jsonify({'error': 'Enrollment required'}), 403
             
-        return redirect(video.video_url)
+        return redirect(url_signer.for_user(session['user_id'], 'lesson', video.id, video.video_url))
         
     except Exception as e:
         return jsonify({'error': str(e)}), 500
@@ -1367,7 +1632,7 @@ def get_course_preview_videos(course_id):
                 'id': video.id,
                 'title': video.title,
                 'description': video.description,
-                'video_url': video.video_url,
+                'video_url': url_signer.for_user(None, 'lesson', video.id, video.video_url),
                 'duration': video.duration,
                 'order_index': video.order_index
             })
@@ -1384,9 +1649,12 @@ def get_course_preview_videos(course_id):
         }), 500
 
 @app.route('/course/<int:course_id>')
+@page_cache.cached(lambda course_id: [f'course:{course_id}'])
 def course_details(course_id):
     # Get course details
-    course = Course.query.filter_by(id=course_id, is_published=True).first_or_404()
+    course = catalog.get_course(course_id, published_only=True)
+    if course is None:
+        abort(404)
     
     # Check if user is enrolled (if logged in)
     is_enrolled = False
@@ -1432,15 +1700,14 @@ def course_purchase(course_id):
 
 # eBook Routes
 @app.route('/ebooks')
+@page_cache.cached(['ebooks'])
 def ebooks():
     # Get page number from query parameter, default to 1
     page = request.args.get('page', 1, type=int)
     per_page = 6  # 6 ebooks per page
     
-    # Get only published ebooks with pagination
-    ebooks_pagination = Ebook.query.filter_by(is_published=True)\
-        .order_by(Ebook.created_at.desc())\
-        .paginate(page=page, per_page=per_page, error_out=False)
+    # Get only published ebooks with pagination (served from the in-memory catalog)
+    ebooks_pagination = catalog.published_ebooks(page=page, per_page=per_page)
     
     ebooks = ebooks_pagination.items
     
@@ -1450,9 +1717,12 @@ def ebooks():
                          now=datetime.utcnow())
 
 @app.route('/ebook/<int:ebook_id>')
+@page_cache.cached(lambda ebook_id: [f'ebook:{ebook_id}'])
 def ebook_details(ebook_id):
     # Get ebook details
-    ebook = Ebook.query.filter_by(id=ebook_id, is_published=True).first_or_404()
+    ebook = catalog.get_ebook(ebook_id, published_only=True)
+    if ebook is None:
+        abort(404)
     
     # Check if user has purchased (if logged in)
     has_purchased = False
@@ -1989,213 +2259,9 @@ def protected_pdf_stream(ebook_id):
         <meta http-equiv="Content-Security-Policy" content="default-src 'self' 'unsafe-inline' https://cdnjs.cloudflare.com; script-src 'self' 'unsafe-inline' https://cdnjs.cloudflare.com; object-src 'none'; frame-src 'self';">
         <meta name="robots" content="noindex, nofollow, nosnippet, noarchive">
         <script src="https://cdnjs.cloudflare.com/ajax/libs/pdf.js/3.11.174/pdf.min.js"></script>
-        <style>
-            * {{
-                margin: 0;
-                padding: 0;
-                box-sizing: border-box;
-            }}
-            body {{
-                font-family: -apple-system, BlinkMacSystemFont, sans-serif;
-                background: #1a1a1a;
-                height: 100vh;
-                overflow: hidden;
-                margin: 0;
-                padding: 0;
-            }}
-            .header {{
-                background: linear-gradient(135deg, #2563eb, #1d4ed8);
-                color: white;
-                padding: 12px 20px;
-                display: flex;
-                align-items: center;
-                justify-content: space-between;
-                box-shadow: 0 2px 8px rgba(0,0,0,0.15);
-                z-index: 1000;
-                position: relative;
-            }}
-            .back-button {{
-                background: rgba(255,255,255,0.15);
-                color: white;
-                padding: 8px 16px;
-                border-radius: 8px;
-                text-decoration: none;
-                border: 1px solid rgba(255,255,255,0.2);
-                cursor: pointer;
-                font-size: 14px;
-                font-weight: 500;
-                transition: all 0.2s ease;
-            }}
-            .back-button:hover {{
-                background: rgba(255,255,255,0.25);
-                color: white;
-                text-decoration: none;
-                transform: translateY(-1px);
-            }}
-            .book-info {{
-                flex: 1;
-                text-align: center;
-            }}
-            .book-title {{
-                font-size: 18px;
-                font-weight: 600;
-                margin-bottom: 2px;
-            }}
-            .book-author {{
-                font-size: 14px;
-                opacity: 0.9;
-            }}
-            .security-badge {{
-                background: rgba(34,197,94,0.2);
-                color: #dcfce7;
-                padding: 6px 12px;
-                border-radius: 15px;
-                font-size: 12px;
-                display: flex;
-                align-items: center;
-                gap: 5px;
-                border: 1px solid rgba(34,197,94,0.3);
-            }}
-            .pdf-container {{
-                height: calc(100vh - 56px);
-                background: #2a2a2a;
-                position: relative;
-                padding: 20px;
-                overflow-y: auto;
-                display: flex;
-                flex-direction: column;
-                align-items: center;
-            }}
-            .page-container {{
-                background: white;
-                margin-bottom: 20px;
-                box-shadow: 0 4px 20px rgba(0,0,0,0.3);
-                border-radius: 8px;
-                overflow: hidden;
-                position: relative;
-            }}
-            .page-canvas {{
-                display: block;
-                width: 100%;
-                height: auto;
-                pointer-events: none;
-                user-select: none;
-            }}
-            .loading-container {{
-                display: flex;
-                justify-content: center;
-                align-items: center;
-                height: 200px;
-                color: white;
-                font-size: 18px;
-            }}
-            .loading-spinner {{
-                border: 3px solid rgba(255,255,255,0.3);
-                border-top: 3px solid #2563eb;
-                border-radius: 50%;
-                width: 40px;
-                height: 40px;
-                animation: spin 1s linear infinite;
-                margin-right: 15px;
-            }}
-            @keyframes spin {{
-                0% {{ transform: rotate(0deg); }}
-                100% {{ transform: rotate(360deg); }}
-            }}
-            .control-panel {{
-                position: fixed;
-                bottom: 30px;
-                left: 50%;
-                transform: translateX(-50%);
-                background: rgba(0, 0, 0, 0.8);
-                backdrop-filter: blur(10px);
-                color: white;
-                padding: 12px 20px;
-                border-radius: 25px;
-                display: flex;
-                align-items: center;
-                gap: 15px;
-                z-index: 9999;
-                border: 1px solid rgba(255, 255, 255, 0.1);
-                max-width: 90%;
-                box-shadow: 0 8px 32px rgba(0, 0, 0, 0.3);
-            }}
-            .control-btn {{
-                background: rgba(255, 255, 255, 0.1);
-                border: 1px solid rgba(255, 255, 255, 0.2);
-                color: white;
-                padding: 8px 12px;
-                border-radius: 8px;
-                cursor: pointer;
-                transition: all 0.2s ease;
-                font-size: 14px;
-                min-width: 36px;
-                text-align: center;
-            }}
-            .control-btn:hover {{
-                background: rgba(255, 255, 255, 0.2);
-                transform: translateY(-1px);
-            }}
-            .control-divider {{
-                width: 1px;
-                height: 20px;
-                background: rgba(255, 255, 255, 0.3);
-                margin: 0 5px;
-            }}
-            .zoom-display {{
-                font-size: 12px;
-                color: rgba(255, 255, 255, 0.8);
-                min-width: 40px;
-                text-align: center;
-            }}
-            .page-info {{
-                font-size: 12px;
-                color: rgba(255, 255, 255, 0.8);
-                min-width: 60px;
-                text-align: center;
-            }}
-            /* Mobile responsive */
-            @media (max-width: 768px) {{
-                .header {{
-                    padding: 10px 15px;
-                }}
-                .book-title {{
-                    font-size: 16px;
-                }}
-                .book-author {{
-                    font-size: 12px;
-                }}
-                .control-panel {{
-                    bottom: 20px;
-                    padding: 10px 15px;
-                    gap: 10px;
-                }}
-                .control-btn {{
-                    padding: 6px 10px;
-                    font-size: 12px;
-                }}
-                .pdf-container {{
-                    padding: 10px;
-                }}
-            }}
-            @media (max-width: 480px) {{
-                .header {{
-                    padding: 8px 10px;
-                }}
-                .book-title {{
-                    font-size: 14px;
-                }}
-                .security-badge {{
-                    display: none;
-                }}
-                .control-panel {{
-                    width: calc(100% - 20px);
-                    max-width: none;
-                }}
-            }}
-        </style>
+        <link rel="stylesheet" href="{asset_url('protected-pdf.css')}">
     </head>
-    <body oncontextmenu="return false;">
+    <body oncontextmenu="return false;" data-ebook-id="{ebook_id}">
         <div class="header">
             <a href="/user-dashboard" class="back-button">← Dashboard</a>
             <div class="book-info">
@@ -2231,122 +2297,7 @@ def protected_pdf_stream(ebook_id):
             </button>
         </div>
         
-        <script>
-            // Disable right-click and keyboard shortcuts
-            document.addEventListener('contextmenu', e => e.preventDefault());
-            document.addEventListener('keydown', function(e) {{
-                if (e.ctrlKey && (e.key === 's' || e.key === 'p' || e.key === 'u')) {{
-                    e.preventDefault();
-                }}
-                if (e.key === 'F12') {{
-                    e.preventDefault();
-                }}
-            }});
-            
-            // PDF.js setup
-            pdfjsLib.GlobalWorkerOptions.workerSrc = 'https://cdnjs.cloudflare.com/ajax/libs/pdf.js/3.11.174/pdf.worker.min.js';
-            
-            let pdfDoc = null;
-            let currentZoom = 1.0;
-            let totalPages = 0;
-            
-            // Load and render PDF
-            async function loadPDF() {{
-                try {{
-                    const response = await fetch('/secure-pdf-data/{ebook_id}');
-                    const arrayBuffer = await response.arrayBuffer();
-                    
-                    pdfDoc = await pdfjsLib.getDocument(arrayBuffer).promise;
-                    totalPages = pdfDoc.numPages;
-                    
-                    updatePageInfo();
-                    renderAllPages();
-                    
-                }} catch (error) {{
-                    console.error('Error loading PDF:', error);
-                    document.getElementById('pdfContainer').innerHTML = '<div class="loading-container" style="color: #ff6b6b;">Error loading document</div>';
-                }}
-            }}
-            
-            async function renderAllPages() {{
-                const container = document.getElementById('pdfContainer');
-                container.innerHTML = '';
-                
-                for (let pageNum = 1; pageNum <= totalPages; pageNum++) {{
-                    const pageContainer = document.createElement('div');
-                    pageContainer.className = 'page-container';
-                    pageContainer.id = `page-${{pageNum}}`;
-                    
-                    const canvas = document.createElement('canvas');
-                    canvas.className = 'page-canvas';
-                    pageContainer.appendChild(canvas);
-                    
-                    container.appendChild(pageContainer);
-                    
-                    await renderPage(pageNum, canvas);
-                }}
-            }}
-            
-            async function renderPage(pageNum, canvas) {{
-                try {{
-                    const page = await pdfDoc.getPage(pageNum);
-                    const viewport = page.getViewport({{ scale: currentZoom }});
-                    
-                    canvas.height = viewport.height;
-                    canvas.width = viewport.width;
-                    
-                    const renderContext = {{
-                        canvasContext: canvas.getContext('2d'),
-                        viewport: viewport
-                    }};
-                    
-                    await page.render(renderContext).promise;
-                    
-                    // Block canvas operations to prevent saving
-                    const originalToDataURL = canvas.toDataURL;
-                    canvas.toDataURL = function() {{
-                        return 'data:,';
-                    }};
-                    
-                }} catch (error) {{
-                    console.error(`Error rendering page ${{pageNum}}:`, error);
-                }}
-            }}
-            
-            function updatePageInfo() {{
-                document.getElementById('pageInfo').textContent = `${{totalPages}} pages`;
-            }}
-            
-            function zoomIn() {{
-                if (currentZoom < 2.0) {{
-                    currentZoom += 0.25;
-                    updateZoom();
-                }}
-            }}
-            
-            function zoomOut() {{
-                if (currentZoom > 0.5) {{
-                    currentZoom -= 0.25;
-                    updateZoom();
-                }}
-            }}
-            
-            function updateZoom() {{
-                document.getElementById('zoomLevel').textContent = Math.round(currentZoom * 100) + '%';
-                renderAllPages();
-            }}
-            
-            function toggleFullscreen() {{
-                if (document.fullscreenElement) {{
-                    document.exitFullscreen();
-                }} else {{
-                    document.documentElement.requestFullscreen();
-                }}
-            }}
-            
-            // Load PDF when page is ready
-            document.addEventListener('DOMContentLoaded', loadPDF);
-        </script>
+        <script src="{asset_url('protected-pdf.js')}"></script>
     </body>
     </html>
     """
@@ -2705,201 +2656,9 @@ def image_pdf_viewer(ebook_id):
     <meta charset="UTF-8">
     <meta name="viewport" content="width=device-width, initial-scale=1.0">
     <title>{ebook.name} - Secure Reader</title>
-    <style>
-        * {{
-            margin: 0;
-            padding: 0;
-            box-sizing: border-box;
-            user-select: none;
-            -webkit-user-select: none;
-            -moz-user-select: none;
-            -ms-user-select: none;
-            -webkit-touch-callout: none;
-        }}
-        
-        body {{
-            background: #2c3e50;
-            font-family: Arial, sans-serif;
-            overflow-x: hidden;
-        }}
-        
-        .header {{
-            background: #34495e;
-            color: white;
-            padding: 15px 20px;
-            display: flex;
-            justify-content: space-between;
-            align-items: center;
-            box-shadow: 0 2px 10px rgba(0,0,0,0.3);
-            position: sticky;
-            top: 0;
-            z-index: 1000;
-        }}
-        
-        .header h2 {{
-            margin: 0;
-            font-size: 1.2rem;
-        }}
-        
-        .nav-controls {{
-            display: flex;
-            gap: 10px;
-            align-items: center;
-        }}
-        
-        .nav-btn {{
-            background: #00a651;
-            border: none;
-            color: white;
-            padding: 8px 16px;
-            border-radius: 5px;
-            cursor: pointer;
-            font-size: 0.9rem;
-            transition: background 0.3s;
-        }}
-        
-        .nav-btn:hover:not(:disabled) {{
-            background: #008a44;
-        }}
-        
-        .nav-btn:disabled {{
-            background: #555;
-            cursor: not-allowed;
-            opacity: 0.6;
-        }}
-        
-        .page-info {{
-            background: #2c3e50;
-            padding: 8px 16px;
-            border-radius: 5px;
-            font-size: 0.9rem;
-            min-width: 120px;
-            text-align: center;
-        }}
-        
-        .page-input {{
-            background: #2c3e50;
-            border: 1px solid #555;
-            color: white;
-            padding: 5px 10px;
-            border-radius: 3px;
-            width: 60px;
-            text-align: center;
-            font-size: 0.9rem;
-        }}
-        
-        .reader-container {{
-            min-height: calc(100vh - 80px);
-            display: flex;
-            justify-content: center;
-            align-items: flex-start;
-            padding: 20px;
-            background: #ecf0f1;
-        }}
-        
-        .page-container {{
-            background: white;
-            box-shadow: 0 10px 30px rgba(0,0,0,0.3);
-            border-radius: 10px;
-            overflow: hidden;
-            position: relative;
-            max-width: 900px;
-            width: 100%;
-        }}
-        
-        .page-image {{
-            width: 100%;
-            height: auto;
-            display: block;
-            pointer-events: none;
-            -webkit-user-drag: none;
-            -khtml-user-drag: none;
-            -moz-user-drag: none;
-            -o-user-drag: none;
-            user-drag: none;
-        }}
-        
-        .loading {{
-            text-align: center;
-            padding: 100px 20px;
-            color: #7f8c8d;
-        }}
-        
-        .spinner {{
-            width: 50px;
-            height: 50px;
-            border: 4px solid #bdc3c7;
-            border-top: 4px solid #00a651;
-            border-radius: 50%;
-            animation: spin 1s linear infinite;
-            margin: 0 auto 20px;
-        }}
-        
-        @keyframes spin {{
-            0% {{ transform: rotate(0deg); }}
-            100% {{ transform: rotate(360deg); }}
-        }}
-        
-        .error {{
-            text-align: center;
-            padding: 50px 20px;
-            color: #e74c3c;
-            background: #fff5f5;
-            border: 2px dashed #e74c3c;
-            border-radius: 10px;
-            margin: 20px;
-        }}
-        
-        .back-btn {{
-            background: #e74c3c;
-            text-decoration: none;
-        }}
-        
-        .back-btn:hover {{
-            background: #c0392b;
-        }}
-        
-        /* Security overlay */
-        .security-overlay {{
-            position: fixed;
-            top: 0;
-            left: 0;
-            width: 100%;
-            height: 100%;
-            background: rgba(231, 76, 60, 0.9);
-            color: white;
-            display: none;
-            align-items: center;
-            justify-content: center;
-            z-index: 9999;
-            text-align: center;
-            font-size: 1.2rem;
-        }}
-        
-        .security-overlay.show {{
-            display: flex;
-        }}
-        
-        /* Mobile responsive */
-        @media (max-width: 768px) {{
-            .header {{
-                flex-direction: column;
-                gap: 10px;
-                padding: 10px;
-            }}
-            
-            .nav-controls {{
-                flex-wrap: wrap;
-                justify-content: center;
-            }}
-            
-            .reader-container {{
-                padding: 10px;
-            }}
-        }}
-    </style>
+    <link rel="stylesheet" href="{asset_url("image-pdf.css")}">
 </head>
-<body>
+<body data-ebook-id="{ebook_id}" data-total-pages="{total_pages}">
     <!-- Security overlay -->
     <div class="security-overlay" id="securityOverlay">
         <div>
@@ -2946,138 +2705,7 @@ def image_pdf_viewer(ebook_id):
         </div>
     </div>
     
-    <script>
-        let currentPage = 1;
-        const totalPages = {total_pages};
-        const ebookId = {ebook_id};
-        
-        // Security measures
-        document.addEventListener('contextmenu', function(e) {{
-            e.preventDefault();
-            showSecurityMessage();
-            return false;
-        }});
-        
-        document.addEventListener('keydown', function(e) {{
-            // Block save, print, copy shortcuts
-            if ((e.ctrlKey && ['s', 'p', 'a', 'c', 'u'].includes(e.key.toLowerCase())) || 
-                e.key === 'F12' || 
-                (e.ctrlKey && e.shiftKey && ['i', 'j', 'c'].includes(e.key.toLowerCase()))) {{
-                e.preventDefault();
-                showSecurityMessage();
-                return false;
-            }}
-            
-            // Navigation shortcuts
-            if (e.key === 'ArrowRight' || e.key === 'PageDown') {{
-                e.preventDefault();
-                nextPage();
-            }} else if (e.key === 'ArrowLeft' || e.key === 'PageUp') {{
-                e.preventDefault();
-                previousPage();
-            }}
-        }});
-        
-        document.addEventListener('selectstart', function(e) {{
-            e.preventDefault();
-            return false;
-        }});
-        
-        document.addEventListener('dragstart', function(e) {{
-            e.preventDefault();
-            return false;
-        }});
-        
-        function showSecurityMessage() {{
-            const overlay = document.getElementById('securityOverlay');
-            overlay.classList.add('show');
-            setTimeout(() => {{
-                overlay.classList.remove('show');
-            }}, 2000);
-        }}
-        
-        function loadPage(page) {{
-            if (page < 1 || page > totalPages) return;
-            
-            currentPage = page;
-            updateControls();
-            
-            const loadingDiv = document.getElementById('loadingDiv');
-            const pageImage = document.getElementById('pageImage');
-            const errorDiv = document.getElementById('errorDiv');
-            
-            // Show loading
-            loadingDiv.style.display = 'block';
-            pageImage.style.display = 'none';
-            errorDiv.style.display = 'none';
-            
-            // Load page image
-            const imageUrl = `/pdf-page-stream/${{ebookId}}/${{page}}?t=${{Date.now()}}`;
-            
-            pageImage.onload = function() {{
-                loadingDiv.style.display = 'none';
-                pageImage.style.display = 'block';
-                errorDiv.style.display = 'none';
-            }};
-            
-            pageImage.onerror = function() {{
-                loadingDiv.style.display = 'none';
-                pageImage.style.display = 'none';
-                errorDiv.style.display = 'block';
-                document.getElementById('errorMessage').textContent = `Failed to load page ${{page}}`;
-            }};
-            
-            pageImage.src = imageUrl;
-        }}
-        
-        function updateControls() {{
-            document.getElementById('pageInput').value = currentPage;
-            document.getElementById('firstBtn').disabled = currentPage <= 1;
-            document.getElementById('prevBtn').disabled = currentPage <= 1;
-            document.getElementById('nextBtn').disabled = currentPage >= totalPages;
-            document.getElementById('lastBtn').disabled = currentPage >= totalPages;
-        }}
-        
-        function nextPage() {{
-            if (currentPage < totalPages) {{
-                loadPage(currentPage + 1);
-            }}
-        }}
-        
-        function previousPage() {{
-            if (currentPage > 1) {{
-                loadPage(currentPage - 1);
-            }}
-        }}
-        
-        function goToPage(page) {{
-            loadPage(page);
-        }}
-        
-        function goToInputPage() {{
-            const page = parseInt(document.getElementById('pageInput').value);
-            if (page >= 1 && page <= totalPages) {{
-                loadPage(page);
-            }} else {{
-                document.getElementById('pageInput').value = currentPage;
-            }}
-        }}
-        
-        function retryCurrentPage() {{
-            loadPage(currentPage);
-        }}
-        
-        // Initialize
-        document.addEventListener('DOMContentLoaded', function() {{
-            loadPage(1);
-        }});
-        
-        // Prevent back button
-        history.pushState(null, null, location.href);
-        window.onpopstate = function () {{
-            history.go(1);
-        }};
-    </script>
+    <script src="{asset_url("image-pdf.js")}"></script>
 </body>
 </html>
     '''
@@ -3154,77 +2782,9 @@ def secure_pdf_viewer(ebook_id):
     <meta charset="UTF-8">
     <meta name="viewport" content="width=device-width, initial-scale=1.0">
     <title>Secure PDF Viewer</title>
-    <style>
-        * {{
-            margin: 0;
-            padding: 0;
-            box-sizing: border-box;
-            user-select: none;
-            -webkit-user-select: none;
-            -moz-user-select: none;
-            -ms-user-select: none;
-            -webkit-touch-callout: none;
-        }}
-        
-        body {{
-            background: #2c3e50;
-            overflow: hidden;
-            font-family: Arial, sans-serif;
-        }}
-        
-        #pdfContainer {{
-            width: 100vw;
-            height: 100vh;
-            position: relative;
-            background: #34495e;
-        }}
-        
-        #pdfEmbed {{
-            width: 100%;
-            height: 100%;
-            border: none;
-            background: white;
-        }}
-        
-        #pdfObject {{
-            width: 100%;
-            height: 100%;
-            border: none;
-            background: white;
-        }}
-        
-        .security-overlay {{
-            position: absolute;
-            top: 0;
-            left: 0;
-            width: 100%;
-            height: 100%;
-            z-index: 999999;
-            background: transparent;
-            pointer-events: none;
-        }}
-        
-        .loading {{
-            position: absolute;
-            top: 50%;
-            left: 50%;
-            transform: translate(-50%, -50%);
-            color: white;
-            font-size: 18px;
-            z-index: 1000000;
-        }}
-        
-        /* Hide any PDF controls that might appear */
-        embed[type="application/pdf"] {{
-            pointer-events: none !important;
-        }}
-        
-        object[type="application/pdf"] {{
-            pointer-events: none !important;
-        }}
-    </style>
+    <link rel="stylesheet" href="{asset_url("secure-pdf.css")}">
 </head>
-<body>
+<body data-pdf="{pdf_content}">
     <div id="pdfContainer">
         <div class="loading" id="loadingText">Loading secure PDF...</div>
         <object id="pdfObject" type="application/pdf" style="display: none;">
@@ -3234,182 +2794,7 @@ def secure_pdf_viewer(ebook_id):
         <div class="security-overlay" id="securityOverlay"></div>
     </div>
     
-    <script>
-        // Block all right-click attempts
-        document.addEventListener('contextmenu', function(e) {{
-            e.preventDefault();
-            e.stopPropagation();
-            return false;
-        }}, true);
-        
-        // Block all keyboard shortcuts
-        document.addEventListener('keydown', function(e) {{
-            // Block Ctrl+S, Ctrl+P, Ctrl+A, Ctrl+C, F12, etc.
-            if ((e.ctrlKey && ['s', 'p', 'a', 'c', 'u', 'r'].includes(e.key.toLowerCase())) || 
-                e.key === 'F12' || 
-                (e.ctrlKey && e.shiftKey && ['i', 'j', 'c'].includes(e.key.toLowerCase()))) {{
-                e.preventDefault();
-                e.stopPropagation();
-                return false;
-            }}
-        }}, true);
-        
-        // Advanced protection against devtools (disabled for better UX)
-        function protectFromDevtools() {{
-            // Disabled aggressive devtools detection to prevent false positives
-            // Users with different browser configurations were getting blocked
-            console.log('DevTools protection initialized but disabled for better user experience');
-        }}
-        
-        // Load PDF with enhanced security - multiple fallback methods
-        function loadSecurePDF() {{
-            try {{
-                const pdfData = "data:application/pdf;base64,{pdf_content}";
-                const embed = document.getElementById('pdfEmbed');
-                const object = document.getElementById('pdfObject');
-                
-                console.log('Loading PDF data, size:', pdfData.length);
-                
-                // Check if PDF data is valid
-                if (!pdfData || pdfData === "data:application/pdf;base64,") {{
-                    throw new Error('No PDF content available');
-                }}
-                
-                // Method 1: Try object element first (more reliable)
-                object.data = pdfData;
-                object.style.display = 'block';
-                
-                // Method 2: Also set embed as fallback
-                embed.src = pdfData;
-                
-                document.getElementById('loadingText').style.display = 'none';
-                
-                // Add error handling
-                let loadTimeout = setTimeout(function() {{
-                    console.warn('PDF load timeout - trying alternative method');
-                    // Fallback: try iframe instead
-                    tryIframeMethod(pdfData);
-                }}, 5000);
-                
-                // Success handler
-                function onPDFLoadSuccess() {{
-                    clearTimeout(loadTimeout);
-                    console.log('PDF loaded successfully');
-                    document.getElementById('loadingText').style.display = 'none';
-                    object.style.display = 'block';
-                    setupSecurity();
-                }}
-                
-                // Error handler
-                function onPDFLoadError() {{
-                    clearTimeout(loadTimeout);
-                    console.error('PDF load failed - trying iframe fallback');
-                    tryIframeMethod(pdfData);
-                }}
-                
-                // Try to detect successful load
-                setTimeout(function() {{
-                    // Check if object has loaded content
-                    try {{
-                        if (object.contentDocument || (object.offsetHeight > 100)) {{
-                            onPDFLoadSuccess();
-                        }} else {{
-                            onPDFLoadError();
-                        }}
-                    }} catch (e) {{
-                        // Cross-origin restrictions mean it's probably loaded
-                        onPDFLoadSuccess();
-                    }}
-                }}, 2000);
-                
-            }} catch (error) {{
-                console.error('PDF loading error:', error);
-                document.getElementById('loadingText').textContent = 'Failed to load PDF: ' + error.message;
-                document.getElementById('loadingText').style.display = 'block';
-            }}
-        }}
-        
-        // Fallback iframe method
-        function tryIframeMethod(pdfData) {{
-            console.log('Trying iframe fallback method');
-            const container = document.getElementById('pdfContainer');
-            
-            // Remove object and create iframe
-            const object = document.getElementById('pdfObject');
-            if (object) object.style.display = 'none';
-            
-            const iframe = document.createElement('iframe');
-            iframe.src = pdfData;
-            iframe.style.width = '100%';
-            iframe.style.height = '100%';
-            iframe.style.border = 'none';
-            iframe.style.background = 'white';
-            iframe.onload = function() {{
-                console.log('PDF loaded via iframe');
-                document.getElementById('loadingText').style.display = 'none';
-                setupSecurity();
-            }};
-            iframe.onerror = function() {{
-                console.error('Iframe method also failed');
-                document.getElementById('loadingText').textContent = 'Unable to display PDF in this browser';
-            }};
-            
-            container.appendChild(iframe);
-        }}
-        
-        // Setup security overlay
-        function setupSecurity() {{
-            const overlay = document.getElementById('securityOverlay');
-            
-            // Smart overlay management for scrolling
-            overlay.addEventListener('wheel', function(e) {{
-                // Allow scroll but block right-clicks
-                overlay.style.pointerEvents = 'none';
-                setTimeout(() => {{
-                    overlay.style.pointerEvents = 'auto';
-                }}, 100);
-            }}, {{ passive: true }});
-            
-            overlay.addEventListener('mousedown', function(e) {{
-                if (e.button === 2) {{
-                    e.preventDefault();
-                    e.stopPropagation();
-                    return false;
-                }}
-                // Allow other interactions but re-enable protection quickly
-                overlay.style.pointerEvents = 'none';
-                setTimeout(() => {{
-                    overlay.style.pointerEvents = 'auto';
-                }}, 50);
-            }}, true);
-            
-            overlay.style.pointerEvents = 'auto';
-        }}
-        
-        // Initialize everything
-        document.addEventListener('DOMContentLoaded', function() {{
-            protectFromDevtools();
-            setTimeout(loadSecurePDF, 500);
-        }});
-        
-        // Prevent print
-        window.addEventListener('beforeprint', function(e) {{
-            e.preventDefault();
-            return false;
-        }});
-        
-        // Block selection
-        document.addEventListener('selectstart', function(e) {{
-            e.preventDefault();
-            return false;
-        }});
-        
-        // Block drag
-        document.addEventListener('dragstart', function(e) {{
-            e.preventDefault();
-            return false;
-        }});
-    </script>
+    <script src="{asset_url("secure-pdf.js")}"></script>
 </body>
 </html>'''
     
@@ -3428,126 +2813,55 @@ def secure_pdf_viewer(ebook_id):
     return response
 
 
+@app.route('/api/security-events', methods=['POST'])
+@login_required
+def ingest_security_events():
+    """Batch of security events queued by security-telemetry.js"""
+    data = request.get_json(silent=True, force=True)
+    events = data.get('events') if isinstance(data, dict) else data
+    if not isinstance(events, list):
+        return jsonify({'success': False, 'message': 'Expected a list of events'}), 400
+    
+    accepted, dropped = security_event_recorder.record(
+        session.get('user_id'), events, request.remote_addr, request.headers.get('User-Agent')
+    )
+    return jsonify({'success': True, 'accepted': accepted, 'dropped': dropped}), 202
+
+# Single-event endpoints kept for pages still open with the previous scripts
+
 @app.route('/api/report-download-attempt', methods=['POST'])
 @login_required
 def report_download_attempt():
-    """Report attempted downloads for monitoring"""
-    try:
-        user_id = session.get('user_id')
-        data = request.get_json()
-        
-        # Log the attempt (in a real system, you'd save this to database)
-        print(f"⚠️ VIDEO DOWNLOAD ATTEMPT DETECTED: User {user_id}, Course: {data.get('course_id')}, Video: {data.get('video_id')}, Time: {data.get('timestamp')}")
-        
-        # You could implement account warnings/suspensions here
-        # For now, just log and return success
-        
-        return jsonify({'success': True, 'message': 'Attempt logged'})
-        
-    except Exception as e:
-        print(f"Error logging download attempt: {e}")
-        return jsonify({'success': False, 'message': 'Failed to log attempt'})
-
-@app.route('/api/security-log', methods=['POST'])
-@login_required  
-def log_security_event():
-    """Enhanced security event logging endpoint"""
-    try:
-        user_id = session.get('user_id')
-        data = request.get_json()
-        
-        # Log security event with comprehensive details
-        event_info = {
-            'user_id': user_id,
-            'event_type': data.get('event_type', 'unknown'),
-            'ebook_id': data.get('ebook_id'),
-            'ebook_name': data.get('ebook_name'),
-            'pdf_source': data.get('pdf_source'),
-            'timestamp': data.get('timestamp'),
-            'user_agent': data.get('user_agent'),
-            'page_url': data.get('page_url'),
-            'screen_resolution': data.get('screen_resolution'),
-            'viewport_size': data.get('viewport_size'),
-            'reading_time': data.get('reading_time'),
-            'additional_data': data.get('additional_data', {})
-        }
-        
-        # In a production system, you would save this to a security_logs table
-        print(f"🔒 SECURITY EVENT LOGGED: {event_info['event_type']}")
-        print(f"   User: {user_id}")
-        print(f"   eBook: {event_info['ebook_name']} (ID: {event_info['ebook_id']})")
-        print(f"   Details: {event_info}")
-        
-        return jsonify({'success': True, 'message': 'Security event logged'})
-        
-    except Exception as e:
-        print(f"Error logging security event: {e}")
-        return jsonify({'success': False, 'message': 'Failed to log security event'})
+    """Report attempted downloads for monitoring"""
+    data = request.get_json(silent=True) or {}
+    security_event_recorder.record(session.get('user_id'), [data], request.remote_addr, request.headers.get('User-Agent'),
+                                   default_type='video_download_attempt')
+    return jsonify({'success': True, 'message': 'Attempt logged'})
+
+@app.route('/api/security-log', methods=['POST'])
+@login_required  
+def log_security_event():
+    """Enhanced security event logging endpoint"""
+    data = request.get_json(silent=True) or {}
+    security_event_recorder.record(session.get('user_id'), [data], request.remote_addr, request.headers.get('User-Agent'))
+    return jsonify({'success': True, 'message': 'Security event logged'})
 
 @app.route('/api/report-ebook-download-attempt', methods=['POST'])
 @login_required
 def report_ebook_download_attempt():
     """Report attempted ebook downloads for monitoring"""
-    try:
-        user_id = session.get('user_id')
-        data = request.get_json()
-        
-        # Log the attempt (in a real system, you'd save this to database)
-        print(f"⚠️ EBOOK DOWNLOAD ATTEMPT DETECTED: User {user_id}, eBook: {data.get('ebook_id')}, Time: {data.get('timestamp')}, User Agent: {data.get('user_agent')}")
-        
-        # You could implement account warnings/suspensions here
-        # For now, just log and return success
-        
-        return jsonify({'success': True, 'message': 'eBook download attempt logged'})
-        
-    except Exception as e:
-        print(f"Error logging ebook download attempt: {e}")
-        return jsonify({'success': False, 'message': 'Failed to log attempt'})
+    data = request.get_json(silent=True) or {}
+    security_event_recorder.record(session.get('user_id'), [data], request.remote_addr, request.headers.get('User-Agent'),
+                                   default_type='ebook_download_attempt')
+    return jsonify({'success': True, 'message': 'eBook download attempt logged'})
 
 @app.route('/about')
+@page_cache.cached(['about'])
 def about():
-    # Get about page content for all sections
-    main_about_content = AboutPageContent.get_main_about_content()
-    mission_content = AboutPageContent.get_mission_content()
-    team_content = AboutPageContent.get_team_content()
-    
-    # Use defaults if no content exists for each section
-    if not main_about_content:
-        main_about_data = AboutPageContent.get_default_main_about_content()
-    else:
-        main_about_data = {
-            'main_about_title': main_about_content.main_about_title,
-            'main_about_subtitle': main_about_content.main_about_subtitle,
-            'main_about_content': main_about_content.main_about_content,
-            'main_about_images': main_about_content.main_about_images,
-            'main_about_features': main_about_content.main_about_features
-        }
-    
-    if not mission_content:
-        mission_data = AboutPageContent.get_default_mission_content()
-    else:
-        mission_data = {
-            'mission_title': mission_content.mission_title,
-            'mission_content': mission_content.mission_content,
-            'mission_vision_title': mission_content.mission_vision_title,
-            'mission_vision_content': mission_content.mission_vision_content,
-            'mission_points': mission_content.mission_points,
-            'vision_points': mission_content.vision_points
-        }
-    
-    if not team_content:
-        team_data = AboutPageContent.get_default_team_content()
-    else:
-        team_data = {
-            'team_title': team_content.team_title,
-            'team_subtitle': team_content.team_subtitle,
-            'team_members': team_content.team_members
-        }
-    
+    # All sections come from memory, rendered once per content version
+    about_content = content_store.about()
     return render_template('about.html', 
-                         main_about_data=main_about_data,
-                         mission_data=mission_data,
-                         team_data=team_data,
+                         about_sections=about_content['sections_html'],
                          now=datetime.utcnow())
 
 @app.route('/contact', methods=['GET', 'POST'])
@@ -3586,6 +2900,7 @@ def contact():
             # Save to database
             db.session.add(contact_message)
             db.session.commit()
+            contact_inbox.invalidate()
             
             flash('Thank you for your message! We\'ll get back to you within 24 hours.', 'success')
             return redirect(url_for('contact'))
@@ -3598,23 +2913,27 @@ def contact():
     return render_template('contact.html', now=datetime.utcnow())
 
 @app.route('/privacy-policy')
+@page_cache.cached(['policy:privacy_policy'])
 def privacy_policy():
-    policy = PolicyContent.get_or_create_default('privacy_policy')
+    policy = content_store.policy('privacy_policy')
     return render_template('privacy_policy.html', policy=policy, now=datetime.utcnow())
 
 @app.route('/terms-of-service')
+@page_cache.cached(['policy:terms_of_service'])
 def terms_of_service():
-    policy = PolicyContent.get_or_create_default('terms_of_service')
+    policy = content_store.policy('terms_of_service')
     return render_template('terms_of_service.html', policy=policy, now=datetime.utcnow())
 
 @app.route('/refund-policy')
+@page_cache.cached(['policy:refund_policy'])
 def refund_policy():
-    policy = PolicyContent.get_or_create_default('refund_policy')
+    policy = content_store.policy('refund_policy')
     return render_template('refund_policy.html', policy=policy, now=datetime.utcnow())
 
 @app.route('/cookie-policy')
+@page_cache.cached(['policy:cookie_policy'])
 def cookie_policy():
-    policy = PolicyContent.get_or_create_default('cookie_policy')
+    policy = content_store.policy('cookie_policy')
     return render_template('cookie_policy.html', policy=policy, now=datetime.utcnow())
 
 # Blog model
@@ -3629,7 +2948,42 @@ class Blog(db.Model):
     author = db.relationship('User', backref='blogs')
     date = db.Column(db.DateTime, default=datetime.utcnow)
     read_time = db.Column(db.String(20), nullable=True)
-    tags = db.Column(db.String(200), nullable=True)
+    tags = db.Column(db.String(200), nullable=True)  # comma-separated, indexed in blog_tag (see blog_index.py)
+    
+    # Listing pages filter by category and order newest first
+    __table_args__ = (
+        db.Index('ix_blog_category_date', 'category', 'date'),
+        db.Index('ix_blog_date', 'date'),
+    )
+
+class BlogTag(db.Model):
+    """Distinct blog tag with the number of posts carrying it"""
+    __tablename__ = 'blog_tag'
+    
+    id = db.Column(db.Integer, primary_key=True)
+    name = db.Column(db.String(50), nullable=False)  # as first entered
+    slug = db.Column(db.String(50), nullable=False, unique=True)  # lowercased name
+    post_count = db.Column(db.Integer, nullable=False, default=0)
+    
+    __table_args__ = (
+        db.Index('ix_blog_tag_post_count', 'post_count'),
+    )
+
+class BlogTagLink(db.Model):
+    """One tag of one blog post"""
+    __tablename__ = 'blog_tag_link'
+    
+    blog_id = db.Column(db.Integer, db.ForeignKey('blog.id', ondelete='CASCADE'), primary_key=True)
+    tag_id = db.Column(db.Integer, db.ForeignKey('blog_tag.id', ondelete='CASCADE'), primary_key=True)
+    
+    # Tag filter looks up posts by tag
+    __table_args__ = (
+        db.Index('ix_blog_tag_link_tag', 'tag_id', 'blog_id'),
+    )
+
+models.Blog = Blog
+models.BlogTag = BlogTag
+models.BlogTagLink = BlogTagLink
 
 # Site Settings model
 class SiteSettings(db.Model):
@@ -3951,6 +3305,8 @@ class AboutPageContent(db.Model):
             ])
         }
 
+models.AboutPageContent = AboutPageContent
+
 # Homepage Content model
 class HomepageContent(db.Model):
     """Model for storing homepage section content"""
@@ -4596,7 +3952,10 @@ class PolicyContent(db.Model):
         }
         return defaults.get(policy_type)
 
+models.PolicyContent = PolicyContent
+
 @app.route('/blog')
+@page_cache.cached(['blogs'])
 def blog():
     # Get query parameters
     page = request.args.get('page', 1, type=int)
@@ -4611,13 +3970,14 @@ def blog():
     # Apply filters if provided
     if category:
         query = query.filter_by(category=category)
-    if search:
-        query = query.filter(Blog.title.contains(search) | Blog.content.contains(search))
     if tag:
-        query = query.filter(Blog.tags.contains(tag))
+        query = blog_index.filter_tag(query, tag)
+    if search:
+        # Ranked by relevance; the date order below breaks ties
+        query = blog_index.search(query, search)
     
     # Order by date, newest first
-    query = query.order_by(Blog.date.desc())
+    query = query.order_by(Blog.date.desc(), Blog.id.desc())
     
     # Get paginated results
     pagination = query.paginate(page=page, per_page=per_page, error_out=False)
@@ -4627,24 +3987,11 @@ def blog():
     if not blogs:
         blogs = None
     
-    # Get recent posts for sidebar and featured section
-    recent_posts = Blog.query.order_by(Blog.date.desc()).limit(3).all()
-    
-    # Get categories for sidebar with post count
-    categories = db.session.query(Blog.category, db.func.count(Blog.id).label('count')).\
-                  group_by(Blog.category).order_by(db.desc('count')).all()
-    
-    # Get popular tags for tag cloud
-    all_tags = []
-    for blog in Blog.query.all():
-        if blog.tags:
-            blog_tags = [tag.strip() for tag in blog.tags.split(',')]
-            all_tags.extend(blog_tags)
-    
-    # Count tag occurrences and get top tags
-    from collections import Counter
-    tag_counter = Counter(all_tags)
-    popular_tags = [{'name': tag, 'count': count} for tag, count in tag_counter.most_common(12)]
+    # Categories, popular tags and recent posts for the sidebar
+    sidebar = blog_index.sidebar()
+    recent_posts = sidebar['recent_posts']
+    categories = sidebar['categories']
+    popular_tags = sidebar['popular_tags']
     
     return render_template('blog.html', blogs=blogs, pagination=pagination, 
                            recent_posts=recent_posts, now=datetime.utcnow(),
@@ -4652,6 +3999,8 @@ def blog():
                            categories=categories, popular_tags=popular_tags)
 
 @app.route('/blog/<int:blog_id>')
+# Related posts come from the whole blog list
+@page_cache.cached(lambda blog_id: [f'blog:{blog_id}', 'blogs'])
 def blog_single(blog_id):
     # Get blog post from database
     blog = Blog.query.get_or_404(blog_id)
@@ -4883,6 +4232,7 @@ def verify_email_complete():
                     )
                     
                     db.session.add(new_user)
+                    analytics_rollup.record_registration(new_user)
                     db.session.commit()
                     
                     # Clear signup data
@@ -5258,6 +4608,7 @@ def admin_create_user():
         
         db.session.add(new_user)
         db.session.flush()  # Get the user ID without committing
+        analytics_rollup.record_registration(new_user)
         
         # Handle course assignments
         selected_courses = request.form.getlist('courses[]')
@@ -5274,6 +4625,7 @@ def admin_create_user():
                         is_completed=False
                     )
                     db.session.add(enrollment)
+                    analytics_rollup.record_enrollment(course_id)
             except (ValueError, TypeError):
                 continue
         
@@ -5291,6 +4643,7 @@ def admin_create_user():
                         total_paid=ebook.price
                     )
                     db.session.add(purchase)
+                    analytics_rollup.record_purchase(ebook_id)
             except (ValueError, TypeError):
                 continue
         
@@ -5517,6 +4870,7 @@ def admin_update_user(user_id):
                             is_completed=False
                         )
                         db.session.add(enrollment)
+                        analytics_rollup.record_enrollment(course_id)
                 except (ValueError, TypeError):
                     continue
         
@@ -5543,6 +4897,7 @@ def admin_update_user(user_id):
                             total_paid=ebook.price
                         )
                         db.session.add(purchase)
+                        analytics_rollup.record_purchase(ebook_id)
                 except (ValueError, TypeError):
                     continue
         
@@ -5572,38 +4927,170 @@ def test_about_cache():
 @app.route('/admin/dashboard')
 @admin_required
 def admin_dashboard():
-    
-    courses = Course.query.filter_by(admin_id=session['user_id']).all()
-    users = User.query.filter_by(is_admin=False).all()
-    blogs = Blog.query.order_by(Blog.date.desc()).all()
-    contact_messages = ContactMessage.query.order_by(ContactMessage.submitted_at.desc()).all()
-    ebooks = Ebook.query.filter_by(admin_id=session['user_id']).all()
-    ebook_purchases = EbookPurchase.query.all()
     current_user = User.query.get(session['user_id'])
     
-    # Calculate real dashboard stats
-    total_users = User.query.filter_by(is_admin=False).count()
-    total_courses = Course.query.count()
-    
-    # Get new users today
-    today = datetime.now().date()
-    new_users_today = User.query.filter(
-        User.created_at >= today,
-        User.is_admin == False
-    ).count()
+    # Only the headline counters are rendered here; the tables are loaded
+    # page by page from the /admin/api/dashboard/* endpoints
+    stats = dashboard_stats.get(session['user_id'])
     
     return render_template('admin/dashboard.html', 
-                         courses=courses, 
-                         users=users, 
-                         blogs=blogs, 
-                         contact_messages=contact_messages, 
-                         ebooks=ebooks, 
-                         ebook_purchases=ebook_purchases, 
                          current_user=current_user, 
                          now=datetime.utcnow(),
-                         total_users=total_users,
-                         total_courses=total_courses,
-                         new_users_today=new_users_today)
+                         stats=stats,
+                         total_users=stats['total_users'],
+                         total_courses=stats['total_courses'],
+                         new_users_today=stats['new_users_today'])
+
+@app.route('/admin/api/dashboard/stats')
+@admin_required
+def admin_dashboard_stats():
+    """Headline counters for the dashboard (cached for a few seconds)"""
+    return jsonify({'success': True, 'stats': dashboard_stats.get(session['user_id'])})
+
+@app.route('/admin/api/dashboard/users')
+@admin_required
+def admin_dashboard_users():
+    """One page of non-admin users, newest first"""
+    query = User.query.filter_by(is_admin=False)
+    
+    search = request.args.get('q', '').strip()
+    if search:
+        pattern = f'%{search}%'
+        query = query.filter(db.or_(
+            User.first_name.ilike(pattern),
+            User.last_name.ilike(pattern),
+            User.email.ilike(pattern),
+            User.username.ilike(pattern)
+        ))
+    
+    users, next_cursor = keyset_page(query, [User.id], request.args.get('cursor'),
+                                     page_size(request.args.get('limit')))
+    
+    items = [{
+        'id': user.id,
+        'name': f'{user.first_name} {user.last_name}',
+        'email': user.email,
+        'avatar_url': url_for('static', filename='uploads/profiles/' + user.profile_picture) if user.profile_picture
+                      else url_for('static', filename='images/default-avatar.png'),
+        'joined': user.created_at.strftime('%b %d, %Y') if user.created_at else 'N/A'
+    } for user in users]
+    
+    return jsonify({'success': True, 'items': items, 'next_cursor': next_cursor})
+
+@app.route('/admin/api/dashboard/contact-messages')
+@admin_required
+def admin_dashboard_contact_messages():
+    """One page of contact messages, newest first (?status=read|unread|new|replied|resolved, ?q=)"""
+    status = request.args.get('status')
+    query = contact_inbox.filtered(
+        read=status if status in ('read', 'unread') else request.args.get('read'),
+        status=status,
+        search=request.args.get('q', '').strip()
+    )
+    
+    messages, next_cursor = keyset_page(query, [ContactMessage.submitted_at, ContactMessage.id],
+                                        request.args.get('cursor'), page_size(request.args.get('limit')))
+    
+    items = [{
+        'id': message.id,
+        'first_name': message.first_name,
+        'last_name': message.last_name,
+        'email': message.email,
+        'subject': message.subject,
+        'is_read': bool(message.is_read),
+        'status': message.status,
+        'submitted_at': message.submitted_at.strftime('%Y-%m-%d %H:%M') if message.submitted_at else ''
+    } for message in messages]
+    
+    return jsonify({'success': True, 'items': items, 'next_cursor': next_cursor})
+
+@app.route('/admin/api/dashboard/ebooks')
+@admin_required
+def admin_dashboard_ebooks():
+    """One page of the current admin's ebooks, newest first"""
+    query = Ebook.query.filter_by(admin_id=session['user_id'])
+    
+    status = request.args.get('status')
+    if status == 'published':
+        query = query.filter(Ebook.is_published == True)
+    elif status == 'draft':
+        query = query.filter(Ebook.is_published == False)
+    
+    search = request.args.get('q', '').strip()
+    if search:
+        pattern = f'%{search}%'
+        query = query.filter(db.or_(
+            Ebook.name.ilike(pattern),
+            Ebook.author.ilike(pattern),
+            Ebook.category.ilike(pattern)
+        ))
+    
+    ebooks, next_cursor = keyset_page(query, [Ebook.id], request.args.get('cursor'),
+                                      page_size(request.args.get('limit')))
+    
+    # Purchase counts for this page only
+    purchase_counts = dict(db.session.query(EbookPurchase.ebook_id, db.func.count(EbookPurchase.id))
+                           .filter(EbookPurchase.ebook_id.in_([ebook.id for ebook in ebooks]))
+                           .group_by(EbookPurchase.ebook_id).all()) if ebooks else {}
+    
+    items = []
+    for ebook in ebooks:
+        cover = ebook.cover_image
+        if not cover:
+            cover_url = url_for('static', filename='images/premium_course_1.png')
+        elif '_' in cover and cover.split('_')[-1].split('.')[0].isdigit():
+            cover_url = f'https://skill-finesse-videos.b-cdn.net/ebooks/{cover}'
+        else:
+            cover_url = url_for('static', filename='images/ebook_cover/' + cover)
+        
+        items.append({
+            'id': ebook.id,
+            'name': ebook.name,
+            'author': ebook.author,
+            'category': ebook.category,
+            'pages': ebook.pages,
+            'price': ebook.price,
+            'coupon': ebook.coupon,
+            'coupon_discount': ebook.coupon_discount,
+            'is_published': bool(ebook.is_published),
+            'cover_url': cover_url,
+            'total_purchases': purchase_counts.get(ebook.id, 0)
+        })
+    
+    return jsonify({'success': True, 'items': items, 'next_cursor': next_cursor})
+
+@app.route('/admin/api/dashboard/blogs')
+@admin_required
+def admin_dashboard_blogs():
+    """One page of blog posts, newest first"""
+    query = Blog.query
+    
+    category = request.args.get('category')
+    if category:
+        query = query.filter(Blog.category == category)
+    
+    search = request.args.get('q', '').strip()
+    if search:
+        pattern = f'%{search}%'
+        query = query.filter(db.or_(
+            Blog.title.ilike(pattern),
+            Blog.category.ilike(pattern),
+            Blog.tags.ilike(pattern)
+        ))
+    
+    blogs, next_cursor = keyset_page(query, [Blog.date, Blog.id], request.args.get('cursor'),
+                                     page_size(request.args.get('limit')))
+    
+    items = [{
+        'id': blog.id,
+        'title': blog.title,
+        'category': blog.category,
+        'read_time': blog.read_time or '5 min read',
+        'image_url': 'https://skill-finesse-videos.b-cdn.net/static/images/' + (blog.image or f'blog{blog.id % 3 + 1}.png'),
+        'date': blog.date.strftime('%b %d, %Y') if blog.date else ''
+    } for blog in blogs]
+    
+    return jsonify({'success': True, 'items': items, 'next_cursor': next_cursor})
 
 # Admin Profile Management Routes
 @app.route('/admin/upload-profile-picture', methods=['POST'])
@@ -5653,9 +5140,11 @@ def upload_profile_picture():
         upload_dir = os.path.join(LOCAL_STATIC_FOLDER, 'uploads', 'profiles')
         os.makedirs(upload_dir, exist_ok=True)
         
-        # Save file
+        # Save file without metadata, with avatar-sized variants on the CDN
+        file_content = image_variants.optimize(file.read(), f'static/uploads/profiles/{unique_filename}', PROFILE_WIDTHS)
         upload_path = os.path.join(upload_dir, unique_filename)
-        file.save(upload_path)
+        with open(upload_path, 'wb') as f:
+            f.write(file_content)
         
         # Update user profile picture path in database
         current_user.profile_picture = unique_filename
@@ -5854,9 +5343,11 @@ def upload_site_image():
         # Generate unique filename
         unique_filename = f"site_{uuid.uuid4().hex[:8]}_{secure_filename(file.filename)}"
         
-        # Save file
+        # Save file without metadata, with responsive variants on the CDN
+        file_content = image_variants.optimize(file.read(), f'static/images/{unique_filename}')
         upload_path = os.path.join(LOCAL_STATIC_FOLDER, 'images', unique_filename)
-        file.save(upload_path)
+        with open(upload_path, 'wb') as f:
+            f.write(file_content)
         
         return jsonify({
             'success': True,
@@ -5932,6 +5423,7 @@ def save_site_settings():
             db.session.add(contact_settings)
         
         db.session.commit()
+        page_cache.purge('settings')
         
         return jsonify({
             'success': True,
@@ -5953,6 +5445,7 @@ def reset_site_settings():
         # Deactivate all existing settings
         SiteSettings.query.update({'is_active': False})
         db.session.commit()
+        page_cache.purge('settings')
         
         return jsonify({
             'success': True,
@@ -6006,6 +5499,8 @@ def admin_add_course():
         
         db.session.add(new_course)
         db.session.commit()
+        catalog.course_changed(new_course.id)
+        page_cache.purge(f'course:{new_course.id}', 'courses')
         
         flash('Course added successfully!', 'success')
         return redirect(url_for('admin_courses'))
@@ -6044,6 +5539,9 @@ def admin_edit_course(course_id):
             course.image = image_filename
         
         db.session.commit()
+        CouponEngine.invalidate('course', course_id)
+        catalog.course_changed(course_id)
+        page_cache.purge(f'course:{course_id}', 'courses')
         
         flash('Course updated successfully!', 'success')
         return redirect(url_for('admin_courses'))
@@ -6234,6 +5732,8 @@ def admin_create_course():
                     continue
         
         db.session.commit()
+        catalog.course_changed(new_course.id)
+        page_cache.purge(f'course:{new_course.id}', 'courses')
         
         return jsonify({'success': True, 'message': 'Course created successfully!', 'course_id': new_course.id})
         
@@ -6253,47 +5753,36 @@ def admin_courses_list():
         print(f"🔍 Admin courses list requested by admin ID: {current_admin_id}")
         
         # Show only courses created by current admin
-        query = Course.query.filter_by(admin_id=current_admin_id)
-        
-        print(f"🔍 Query: {query}")
-        all_courses_count = Course.query.count()
-        print(f"🔍 Total courses in database: {all_courses_count}")
-        admin_courses_count = query.count()
-        print(f"🔍 Courses for admin {current_admin_id}: {admin_courses_count}")
-        
-        if status == 'published':
-            query = query.filter_by(is_published=True)
-        elif status == 'draft':
-            query = query.filter_by(is_published=False)
-        
-        courses = query.order_by(Course.created_at.desc()).all()
-        
-        courses_data = []
-        for course in courses:
-            courses_data.append({
-                'id': course.id,
-                'title': course.title,
-                'description': course.description,
-                'price': course.price,
-                'image': course.image,
-                'category': course.category,
-                'coupon': course.coupon,
-                'coupon_discount': course.coupon_discount,
-                'discount_percent': course.discount_percent or 0,
-                'discounted_price': course.discounted_price or course.price,
-                'instructor_name': course.instructor_name,
-                'instructor_image': course.instructor_image,
-                'about_course': course.about_course,
-                'what_youll_learn': course.what_youll_learn,
-                'course_requirements': course.course_requirements,
-                'instructor_bio': course.instructor_bio,
-                'is_published': course.is_published,
-                'created_at': course.created_at.isoformat(),
-                'enrollments_count': len(course.enrollments)
-            })
+        published = {'published': True, 'draft': False}.get(status)
+        
+        def build():
+            courses_data = []
+            for course in catalog.courses(admin_id=current_admin_id, published=published):
+                courses_data.append({
+                    'id': course.id,
+                    'title': course.title,
+                    'description': course.description,
+                    'price': course.price,
+                    'image': course.image,
+                    'category': course.category,
+                    'coupon': course.coupon,
+                    'coupon_discount': course.coupon_discount,
+                    'discount_percent': course.discount_percent or 0,
+                    'discounted_price': course.discounted_price or course.price,
+                    'instructor_name': course.instructor_name,
+                    'instructor_image': course.instructor_image,
+                    'about_course': course.about_course,
+                    'what_youll_learn': course.what_youll_learn,
+                    'course_requirements': course.course_requirements,
+                    'instructor_bio': course.instructor_bio,
+                    'is_published': course.is_published,
+                    'created_at': course.created_at.isoformat(),
+                    'enrollments_count': course.enrollment_count
+                })
+            return {'success': True, 'courses': courses_data}
         
-        print(f"🔍 Returning {len(courses_data)} courses to frontend")
-        return jsonify({'success': True, 'courses': courses_data})
+        body = catalog.json_bytes(('admin_courses_list', current_admin_id, published), build)
+        return Response(body, mimetype='application/json')
         
     except Exception as e:
         print(f"❌ Error in admin_courses_list: {str(e)}")
@@ -6503,6 +5992,9 @@ def admin_update_course(course_id):
                     continue
         
         db.session.commit()
+        CouponEngine.invalidate('course', course_id)
+        catalog.course_changed(course_id)
+        page_cache.purge(f'course:{course_id}', 'courses')
         
         return jsonify({'success': True, 'message': 'Course updated successfully!'})
         
@@ -6524,6 +6016,8 @@ def admin_publish_course(course_id):
         
         course.is_published = True
         db.session.commit()
+        catalog.course_changed(course_id)
+        page_cache.purge(f'course:{course_id}', 'courses')
         
         return jsonify({'success': True, 'message': 'Course published successfully!'})
         
@@ -6545,6 +6039,8 @@ def admin_unpublish_course(course_id):
         
         course.is_published = False
         db.session.commit()
+        catalog.course_changed(course_id)
+        page_cache.purge(f'course:{course_id}', 'courses')
         
         return jsonify({'success': True, 'message': 'Course unpublished successfully!'})
         
@@ -6586,6 +6082,8 @@ def admin_delete_course(course_id):
                 os.remove(instructor_path)
         
         db.session.commit()
+        catalog.course_removed(course_id)
+        page_cache.purge(f'course:{course_id}', 'courses')
         
         return jsonify({'success': True, 'message': 'Course deleted successfully!'})
         
@@ -6632,18 +6130,19 @@ def admin_course_stats():
         return jsonify({'success': False, 'message': 'Unauthorized'}), 401
     
     try:
-        total_courses = Course.query.filter_by(admin_id=session['user_id']).count()
-        published_courses = Course.query.filter_by(admin_id=session['user_id'], is_published=True).count()
-        draft_courses = Course.query.filter_by(admin_id=session['user_id'], is_published=False).count()
+        admin_courses = catalog.courses(admin_id=session['user_id'])
+        published_courses = sum(1 for course in admin_courses if course.is_published)
         
-        # Get total enrollments for admin's courses
-        admin_courses = Course.query.filter_by(admin_id=session['user_id']).all()
-        total_enrollments = sum(len(course.enrollments) for course in admin_courses)
+        # Get total enrollments for admin's courses from the daily rollups
+        enrollment_totals = analytics_rollup.item_totals('course')
+        total_enrollments = sum(
+            enrollment_totals.get(course.id, {}).get('enrollments', 0) for course in admin_courses
+        )
         
         stats = {
-            'total': total_courses,
+            'total': len(admin_courses),
             'published': published_courses,
-            'drafts': draft_courses,
+            'drafts': len(admin_courses) - published_courses,
             'enrollments': total_enrollments
         }
         
@@ -6663,25 +6162,26 @@ def admin_ebooks_list():
         current_admin_id = session['user_id']
         
         # Show only ebooks created by current admin
-        ebooks = Ebook.query.filter_by(admin_id=current_admin_id).order_by(Ebook.created_at.desc()).all()
-        
-        ebooks_data = []
-        for ebook in ebooks:
-            ebooks_data.append({
-                'id': ebook.id,
-                'name': ebook.name,  # Ebook model uses 'name' field
-                'author': ebook.author,
-                'description': ebook.description,
-                'price': ebook.price,
-                'cover_image': ebook.cover_image,
-                'discount_percent': ebook.discount_percent or 0,
-                'discounted_price': ebook.discounted_price or ebook.price,
-                'is_published': ebook.is_published,
-                'created_at': ebook.created_at.isoformat(),
-                'category': ebook.category
-            })
+        def build():
+            ebooks_data = []
+            for ebook in catalog.ebooks(admin_id=current_admin_id):
+                ebooks_data.append({
+                    'id': ebook.id,
+                    'name': ebook.name,  # Ebook model uses 'name' field
+                    'author': ebook.author,
+                    'description': ebook.description,
+                    'price': ebook.price,
+                    'cover_image': ebook.cover_image,
+                    'discount_percent': ebook.discount_percent or 0,
+                    'discounted_price': ebook.discounted_price or ebook.price,
+                    'is_published': ebook.is_published,
+                    'created_at': ebook.created_at.isoformat(),
+                    'category': ebook.category
+                })
+            return {'success': True, 'ebooks': ebooks_data}
         
-        return jsonify({'success': True, 'ebooks': ebooks_data})
+        body = catalog.json_bytes(('admin_ebooks_list', current_admin_id), build)
+        return Response(body, mimetype='application/json')
         
     except Exception as e:
         return jsonify({'success': False, 'message': str(e)}), 500
@@ -6709,6 +6209,8 @@ def admin_update_course_discount(course_id):
             course.discounted_price = course.price
         
         db.session.commit()
+        catalog.course_changed(course_id)
+        page_cache.purge(f'course:{course_id}', 'courses')
         
         return jsonify({
             'success': True, 
@@ -6743,6 +6245,8 @@ def admin_update_ebook_discount(ebook_id):
             ebook.discounted_price = ebook.price
         
         db.session.commit()
+        catalog.ebook_changed(ebook_id)
+        page_cache.purge(f'ebook:{ebook_id}', 'ebooks')
         
         return jsonify({
             'success': True, 
@@ -6793,6 +6297,7 @@ def admin_create_course_coupon(course_id):
         
         db.session.add(coupon)
         db.session.commit()
+        CouponEngine.invalidate('course', course_id)
         
         return jsonify({
             'success': True,
@@ -6852,6 +6357,7 @@ def admin_create_ebook_coupon(ebook_id):
         
         db.session.add(coupon)
         db.session.commit()
+        CouponEngine.invalidate('ebook', ebook_id)
         
         return jsonify({
             'success': True,
@@ -6909,6 +6415,7 @@ def admin_edit_coupon(coupon_id):
             coupon.valid_until = datetime.fromisoformat(data['valid_until']) if data['valid_until'] else None
         
         db.session.commit()
+        CouponEngine.invalidate(coupon_type, coupon.course_id if coupon_type == 'course' else coupon.ebook_id)
         
         return jsonify({
             'success': True,
@@ -6948,8 +6455,10 @@ def admin_delete_coupon(coupon_id):
         if not coupon:
             return jsonify({'success': False, 'message': 'Coupon not found'}), 404
         
+        item_id = coupon.course_id if coupon_type == 'course' else coupon.ebook_id
         db.session.delete(coupon)
         db.session.commit()
+        CouponEngine.invalidate(coupon_type, item_id)
         
         return jsonify({'success': True, 'message': 'Coupon deleted successfully'})
         
@@ -6962,9 +6471,12 @@ def admin_chat():
     if not session.get('user_id') or not session.get('is_admin'):
         return redirect(url_for('login'))
     
-    users = User.query.filter_by(is_admin=False).all()
+    # Most recent conversations first; older ones are loaded from /admin/api/chat/inbox?cursor=
+    conversations, next_cursor = admin_inbox_page(session['user_id'])
+    unread_total = ChatInbox.unread_total(admin_id=session['user_id'])
     current_user = User.query.get(session['user_id'])
-    return render_template('admin/chat.html', users=users, current_user=current_user, now=datetime.utcnow())
+    return render_template('admin/chat.html', conversations=conversations, next_cursor=next_cursor,
+                           unread_total=unread_total, current_user=current_user, now=datetime.utcnow())
 
 @app.route('/admin/chat/<int:user_id>')
 def admin_chat_user(user_id):
@@ -6973,12 +6485,14 @@ def admin_chat_user(user_id):
     
     user = User.query.get_or_404(user_id)
     current_user = User.query.get(session['user_id'])
-    messages = Message.query.filter(
-        ((Message.user_id == user_id) & (Message.admin_id == session['user_id'])) |
-        ((Message.user_id == session['user_id']) & (Message.admin_id == user_id))
-    ).order_by(Message.timestamp).all()
     
-    return render_template('admin/chat_user.html', user=user, messages=messages, current_user=current_user, now=datetime.utcnow())
+    # Only the most recent messages; older ones are loaded with ?before_id= as the admin scrolls up
+    key = conversation_key(user_id, session['user_id'])
+    messages, has_more_messages = ChatHistory.page(key)
+    ChatInbox.mark_read(key, 'admin')
+    
+    return render_template('admin/chat_user.html', user=user, messages=messages, has_more_messages=has_more_messages,
+                           current_user=current_user, now=datetime.utcnow())
 
 @app.route('/admin/send_message', methods=['POST'])
 def admin_send_message():
@@ -6995,11 +6509,16 @@ def admin_send_message():
         content=content,
         user_id=session['user_id'],
         admin_id=user_id,
-        is_from_admin=True
+        is_from_admin=True,
+        conversation_key=conversation_key(session['user_id'], user_id)
     )
     
     db.session.add(message)
+    db.session.flush()
+    ChatInbox.record_message(message, user_id, session['user_id'])
+    chat_hub.notify(message.conversation_key, serialize_message(message))
     db.session.commit()
+    chat_hub.publish(message.conversation_key, serialize_message(message))
     
     return jsonify({
         'id': message.id,
@@ -7008,6 +6527,61 @@ def admin_send_message():
         'is_from_admin': True
     })
 
+def admin_inbox_page(admin_id, cursor=None, limit=None, unread_only=False):
+    """One page of an admin's conversations, most recent message first"""
+    query = ChatConversation.query.options(db.joinedload(ChatConversation.user)).filter(
+        ChatConversation.admin_id == admin_id
+    )
+    if unread_only:
+        query = query.filter(ChatConversation.admin_unread > 0)
+    
+    conversations, next_cursor = keyset_page(
+        query, [ChatConversation.last_message_at, ChatConversation.conversation_key], cursor, page_size(limit)
+    )
+    items = [{
+        'user_id': conversation.user_id,
+        'name': f'{conversation.user.first_name} {conversation.user.last_name}' if conversation.user else 'Deleted user',
+        'email': conversation.user.email if conversation.user else None,
+        'last_message_id': conversation.last_message_id,
+        'last_message_at': conversation.last_message_at.strftime('%Y-%m-%d %H:%M:%S'),
+        'last_message_preview': conversation.last_message_preview,
+        'last_message_from_admin': conversation.last_message_from_admin,
+        'unread': conversation.admin_unread
+    } for conversation in conversations]
+    return items, next_cursor
+
+@app.route('/admin/api/chat/inbox')
+@admin_required
+def admin_chat_inbox():
+    """Paginated conversation list for the chat sidebar (?cursor=, ?limit=, ?unread=1)"""
+    items, next_cursor = admin_inbox_page(
+        session['user_id'],
+        cursor=request.args.get('cursor'),
+        limit=request.args.get('limit'),
+        unread_only=request.args.get('unread') == '1'
+    )
+    return jsonify({
+        'success': True,
+        'items': items,
+        'next_cursor': next_cursor,
+        'unread_total': ChatInbox.unread_total(admin_id=session['user_id'])
+    })
+
+@app.route('/admin/api/chat/unread-count')
+@admin_required
+def admin_chat_unread_count():
+    """Unread badge for the admin navigation"""
+    return jsonify({'success': True, 'unread_total': ChatInbox.unread_total(admin_id=session['user_id'])})
+
+@app.route('/api/messages/<int:user_id>/<int:admin_id>/read', methods=['POST'])
+def mark_messages_read(user_id, admin_id):
+    """Clear the caller's unread counter, e.g. after messages arrive over the stream"""
+    if session.get('user_id') not in (user_id, admin_id):
+        return jsonify({'error': 'Unauthorized'}), 401
+    
+    ChatInbox.mark_read(conversation_key(user_id, admin_id), 'admin' if session.get('is_admin') else 'user')
+    return jsonify({'success': True})
+
 # Alert management routes
 @app.route('/admin/get-current-alert')
 @admin_required
@@ -7061,6 +6635,8 @@ def save_alert():
         
         db.session.add(new_alert)
         db.session.commit()
+        site_alert.changed()
+        page_cache.purge('alert')
         
         return jsonify({
             'success': True,
@@ -7083,6 +6659,8 @@ def clear_alert():
         # Deactivate all alerts
         Alert.query.update({'is_active': False})
         db.session.commit()
+        site_alert.changed()
+        page_cache.purge('alert')
         
         return jsonify({
             'success': True,
@@ -7098,23 +6676,16 @@ def clear_alert():
 
 @app.route('/api/get-active-alert')
 def get_active_alert():
-    """Public API to get the current active alert for website display"""
-    alert = Alert.query.filter_by(is_active=True).order_by(Alert.updated_at.desc()).first()
-    
-    if alert:
-        return jsonify({
-            'success': True,
-            'alert': {
-                'message': alert.message,
-                'background_color': alert.background_color,
-                'text_color': alert.text_color
-            }
-        })
-    else:
-        return jsonify({
-            'success': False,
-            'alert': None
-        })
+    """Public API to get the current active alert for website display (cacheable, see site_alert.py)"""
+    etag, body = site_alert.response_parts()
+    
+    response = make_response(body)
+    response.content_type = 'application/json'
+    response.set_etag(etag)
+    response.headers['Cache-Control'] = (
+        f'public, max-age={ALERT_MAX_AGE}, stale-while-revalidate={ALERT_STALE_WHILE_REVALIDATE}'
+    )
+    return response.make_conditional(request)
 
 # Dashboard route - redirects to appropriate dashboard based on user role
 @app.route('/dashboard')
@@ -7228,9 +6799,11 @@ def user_upload_profile_picture():
         upload_dir = os.path.join(LOCAL_STATIC_FOLDER, 'uploads', 'profiles')
         os.makedirs(upload_dir, exist_ok=True)
         
-        # Save file
+        # Save file without metadata, with avatar-sized variants on the CDN
+        file_content = image_variants.optimize(file.read(), f'static/uploads/profiles/{unique_filename}', PROFILE_WIDTHS)
         upload_path = os.path.join(upload_dir, unique_filename)
-        file.save(upload_path)
+        with open(upload_path, 'wb') as f:
+            f.write(file_content)
         
         # Update user profile picture path in database
         current_user.profile_picture = unique_filename
@@ -7367,6 +6940,7 @@ def revoke_device(device_id):
     # Delete the device
     db.session.delete(device)
     db.session.commit()
+    AuthManager.invalidate_device_cache(device.user_id, device.fingerprint)
     
     flash('Device has been removed from trusted devices', 'success')
     return redirect(url_for('user_security'))
@@ -7632,6 +7206,7 @@ def user_purchase_ebook(ebook_id):
             )
             
             db.session.add(new_purchase)
+            analytics_rollup.record_purchase(ebook_id)
             db.session.commit()
             
             return jsonify({'success': True, 'message': 'Successfully purchased!'})
@@ -7790,13 +7365,13 @@ def create_payment_session():
         
         # Get item details based on purchase type
         if data['purchase_type'] == 'course':
-            item = Course.query.get(data['item_id'])
+            item = catalog.get_course(int(data['item_id']))
             if not item:
                 return jsonify({'success': False, 'error': 'Course not found'})
             product_name = f"Course: {item.title}"
             product_category = "Online Course"
         elif data['purchase_type'] == 'ebook':
-            item = Ebook.query.get(data['item_id'])
+            item = catalog.get_ebook(int(data['item_id']))
             if not item:
                 return jsonify({'success': False, 'error': 'eBook not found'})
             product_name = f"eBook: {item.name}"
@@ -7846,17 +7421,18 @@ def create_payment_session():
         )
         
         db.session.add(payment_transaction)
-        db.session.commit()
         
-        # Log transaction creation
+        # Log transaction creation (committed together with the transaction row)
         PaymentLog.log_action(
             transaction_id=transaction_id,
             action='transaction_created',
             status='SUCCESS',
             message='Payment transaction created successfully',
             data={'purchase_type': data['purchase_type'], 'item_id': data['item_id']},
-            request_obj=request
+            request_obj=request,
+            commit=False
         )
+        db.session.commit()
         
         # Prepare transaction data for SSLCommerz
         transaction_data = {
@@ -7878,10 +7454,8 @@ def create_payment_session():
         session_result = SSLCommerzPayment.create_session(transaction_data)
         
         if session_result['success']:
-            # Update transaction status
-            payment_transaction.update_status('PROCESSING', session_result.get('response'))
-            
-            # Log session creation
+            # Update transaction status and log session creation in one commit
+            payment_transaction.update_status('PROCESSING', session_result.get('response'), commit=False)
             PaymentLog.log_action(
                 transaction_id=transaction_id,
                 action='session_created',
@@ -7897,10 +7471,8 @@ def create_payment_session():
                 'transaction_id': transaction_id
             })
         else:
-            # Update transaction status to failed
-            payment_transaction.update_status('FAILED')
-            
-            # Log session creation failure
+            # Update transaction status to failed and log session creation failure
+            payment_transaction.update_status('FAILED', commit=False)
             PaymentLog.log_action(
                 transaction_id=transaction_id,
                 action='session_creation_failed',
@@ -7933,34 +7505,12 @@ def payment_ipn():
         if not all([transaction_id, val_id, status]):
             return 'Missing required parameters', 400
         
-        # Find the payment transaction
-        payment_transaction = PaymentTransaction.query.filter_by(
-            transaction_id=transaction_id
-        ).first()
-        
-        if not payment_transaction:
-            # Log unknown transaction
-            PaymentLog.log_action(
-                transaction_id=transaction_id,
-                action='ipn_unknown_transaction',
-                status='FAILED',
-                message='IPN received for unknown transaction',
-                data=ipn_data,
-                request_obj=request
-            )
-            return 'Transaction not found', 404
-        
-        # Log IPN receipt
-        PaymentLog.log_action(
-            transaction_id=transaction_id,
-            action='ipn_received',
-            status=status,
-            message=f'IPN received with status: {status}',
-            data=ipn_data,
-            request_obj=request
-        )
+        # Duplicate IPNs for the same validation are answered without revalidating
+        idempotency_key = f'ipn:{transaction_id}:{val_id}'
+        if PaymentPipeline.get_recorded_result(idempotency_key):
+            return 'IPN already processed', 200
         
-        # Validate the payment with SSLCommerz
+        # Validate the payment with SSLCommerz (outside the row lock)
         validation_result = SSLCommerzPayment.validate_payment(
             val_id=val_id,
             store_id=app.config['SSLCOMMERZ_STORE_ID'],
@@ -7968,128 +7518,71 @@ def payment_ipn():
             transaction_id=transaction_id
         )
         
-        if validation_result['success']:
-            validated_data = validation_result['data']
-            validated_status = validated_data.get('status')
-            
-            # Update transaction with validation data
-            payment_transaction.update_status(validated_status, validated_data)
-            
-            # Log validation success
-            PaymentLog.log_action(
-                transaction_id=transaction_id,
-                action='validation_success',
-                status=validated_status,
-                message='Payment validation successful',
-                data=validated_data,
-                request_obj=request
-            )
-            
-            # Process successful payment
-            if validated_status == 'VALID':
-                # Check risk level
-                risk_level = int(validated_data.get('risk_level', 0))
-                
-                if risk_level == 0:
-                    # Low risk - process immediately
-                    process_successful_payment(payment_transaction)
-                else:
-                    # High risk - hold for manual review
-                    PaymentLog.log_action(
-                        transaction_id=transaction_id,
-                        action='high_risk_hold',
-                        status='HOLD',
-                        message=f'Transaction held for review due to risk level: {risk_level}',
-                        data={'risk_level': risk_level, 'risk_title': validated_data.get('risk_title')},
-                        request_obj=request
-                    )
-            
-            return 'IPN processed successfully', 200
-        else:
-            # Log validation failure
-            PaymentLog.log_action(
-                transaction_id=transaction_id,
-                action='validation_failed',
-                status='FAILED',
-                message=f"Payment validation failed: {validation_result.get('error')}",
-                data=validation_result,
-                request_obj=request
-            )
-            
+        logs = [{
+            'action': 'ipn_received',
+            'status': status,
+            'message': f'IPN received with status: {status}',
+            'data': ipn_data
+        }]
+        
+        if not validation_result['success']:
+            logs.append({
+                'action': 'validation_failed',
+                'status': 'FAILED',
+                'message': f"Payment validation failed: {validation_result.get('error')}",
+                'data': validation_result
+            })
+            result = PaymentPipeline.transition(transaction_id, logs=logs, request_obj=request)
+            if result['outcome'] == OUTCOME_NOT_FOUND:
+                return 'Transaction not found', 404
             return 'Validation failed', 400
-    
-    except Exception as e:
-        # Log IPN processing error
-        PaymentLog.log_action(
-            transaction_id=transaction_id if 'transaction_id' in locals() else 'unknown',
-            action='ipn_error',
-            status='ERROR',
-            message=f'IPN processing error: {str(e)}',
-            data={'error': str(e)},
-            request_obj=request
-        )
         
-        return f'IPN processing error: {str(e)}', 500
-
-def process_successful_payment(payment_transaction):
-    """Process a successful payment by creating enrollment/purchase"""
-    try:
-        print(f"⚡ PROCESSING PAYMENT: {payment_transaction.transaction_id} - Type: {payment_transaction.purchase_type}")
-        if payment_transaction.purchase_type == 'course':
-            # Create course enrollment
-            enrollment = CourseEnrollment(
-                user_id=payment_transaction.user_id,
-                course_id=payment_transaction.course_id,
-                enrolled_at=datetime.utcnow()
-            )
-            db.session.add(enrollment)
-            print(f"✅ CREATED COURSE ENROLLMENT: User {payment_transaction.user_id}, Course {payment_transaction.course_id}")
-            
-            # Log enrollment creation
-            PaymentLog.log_action(
-                transaction_id=payment_transaction.transaction_id,
-                action='enrollment_created',
-                status='SUCCESS',
-                message='Course enrollment created successfully'
-            )
-            
-        elif payment_transaction.purchase_type == 'ebook':
-            # Create ebook purchase
-            ebook_purchase = EbookPurchase(
-                user_id=payment_transaction.user_id,
-                ebook_id=payment_transaction.ebook_id,
-                purchased_at=datetime.utcnow(),
-                coupon_used=payment_transaction.coupon_code,
-                discount_amount=payment_transaction.discount_amount,
-                total_paid=payment_transaction.total_amount
-            )
-            db.session.add(ebook_purchase)
-            print(f"✅ CREATED EBOOK PURCHASE: User {payment_transaction.user_id}, Ebook {payment_transaction.ebook_id}")
-            
-            # Log purchase creation
-            PaymentLog.log_action(
-                transaction_id=payment_transaction.transaction_id,
-                action='purchase_created',
-                status='SUCCESS',
-                message='eBook purchase created successfully'
-            )
+        validated_data = validation_result['data']
+        validated_status = validated_data.get('status')
+        logs.append({
+            'action': 'validation_success',
+            'status': validated_status,
+            'message': 'Payment validation successful',
+            'data': validated_data
+        })
+        
+        # Low risk payments are fulfilled immediately, others are held for manual review
+        risk_level = int(validated_data.get('risk_level', 0) or 0)
+        fulfil = validated_status == 'VALID' and risk_level == 0
+        if validated_status == 'VALID' and risk_level != 0:
+            logs.append({
+                'action': 'high_risk_hold',
+                'status': 'HOLD',
+                'message': f'Transaction held for review due to risk level: {risk_level}',
+                'data': {'risk_level': risk_level, 'risk_title': validated_data.get('risk_title')}
+            })
         
-        # Update transaction status to validated
-        payment_transaction.update_status('VALIDATED')
+        result = PaymentPipeline.transition(
+            transaction_id,
+            new_status=validated_status,
+            gateway_data=validated_data,
+            logs=logs,
+            fulfil=fulfil,
+            idempotency_key=idempotency_key,
+            request_obj=request
+        )
         
-        db.session.commit()
-        print(f"💾 PAYMENT PROCESSING COMPLETED AND COMMITTED: {payment_transaction.transaction_id}")
+        if result['outcome'] == OUTCOME_NOT_FOUND:
+            print(f"❌ IPN: Payment transaction {transaction_id} not found")
+            return 'Transaction not found', 404
+        if result['outcome'] == OUTCOME_BUSY:
+            # Another callback is processing this transaction right now; a non-2xx
+            # answer makes SSLCommerz retry, in case that callback fails or does not fulfil
+            return 'IPN processing in progress', 503
+        if result['outcome'] == OUTCOME_ERROR:
+            return f"IPN processing error: {result.get('error')}", 500
         
+        return 'IPN processed successfully', 200
+    
     except Exception as e:
         db.session.rollback()
-        print(f"❌ PAYMENT PROCESSING FAILED: {str(e)}")
-        PaymentLog.log_action(
-            transaction_id=payment_transaction.transaction_id,
-            action='processing_error',
-            status='ERROR',
-            message=f'Error processing successful payment: {str(e)}',
-            data={'error': str(e)}
-        )
+        print(f"❌ IPN ERROR: {str(e)}")
+        return f'IPN processing error: {str(e)}', 500
 
 @app.route('/debug/user-purchases/<int:user_id>')
 @login_required
@@ -8155,14 +7648,30 @@ def payment_success():
     val_id = request.args.get('val_id') or request.form.get('val_id')
     
     print(f"🔄 SUCCESS CALLBACK: Received for transaction {transaction_id}")
-    print(f"🔄 SUCCESS CALLBACK: Request args: {dict(request.args)}")
-    print(f"🔄 SUCCESS CALLBACK: Request form: {dict(request.form)}")
     
     if not transaction_id:
         print("❌ SUCCESS CALLBACK: No transaction ID provided")
         flash('Invalid payment response', 'error')
         return redirect(url_for('dashboard'))
     
+    def success_redirect(result):
+        if result['outcome'] == OUTCOME_BUSY:
+            flash('Payment is being processed. Please check your dashboard in a few minutes.', 'info')
+        elif result['fulfilled']:
+            flash('Payment successful! Check your dashboard for purchased items.', 'success')
+        elif result['status'] == 'VALID':
+            flash('Payment successful but under review. You will be notified once approved.', 'info')
+        else:
+            flash('Payment validation failed. Please contact support.', 'error')
+        return redirect(url_for('dashboard'))
+    
+    # A refreshed or re-posted success page is answered from the idempotency key
+    idempotency_key = f'success:{transaction_id}:{val_id or ""}'
+    recorded = PaymentPipeline.get_recorded_result(idempotency_key)
+    if recorded:
+        print("✅ SUCCESS CALLBACK: Callback already handled")
+        return success_redirect(recorded)
+    
     # Find the payment transaction
     payment_transaction = PaymentTransaction.query.filter_by(
         transaction_id=transaction_id
@@ -8184,45 +7693,29 @@ def payment_success():
     # AGGRESSIVE FALLBACK: If payment is in PROCESSING/PENDING, process it immediately
     # This ensures bKash and other payments that don't trigger IPN still work
     if payment_transaction.status in ['PENDING', 'PROCESSING']:
-        try:
-            print(f"🔧 SUCCESS CALLBACK: Processing payment {transaction_id} immediately (fallback)")
-            
-            # For bKash and similar payments, we assume success if we reach the success callback
-            # Update status to VALID
-            payment_transaction.update_status('VALID')
-            
-            # Log fallback processing
-            PaymentLog.log_action(
-                transaction_id=transaction_id,
-                action='success_callback_fallback',
-                status='VALID',
-                message='Payment processed via success callback fallback (bKash/mobile payment)',
-                data={'method': 'fallback', 'original_status': payment_transaction.status},
-                request_obj=request
-            )
-            
-            # Process the payment immediately
-            process_successful_payment(payment_transaction)
-            
-            print(f"✅ SUCCESS CALLBACK: Payment {transaction_id} processed successfully via fallback")
-            
-            # Redirect to dashboard with success message
-            flash('Payment successful! Check your dashboard for purchased items.', 'success')
-            return redirect(url_for('dashboard'))
-            
-        except Exception as e:
-            print(f"❌ SUCCESS CALLBACK FALLBACK ERROR: {str(e)}")
-            # Log error but still try validation if we have val_id
-            PaymentLog.log_action(
-                transaction_id=transaction_id,
-                action='success_callback_fallback_error',
-                status='ERROR',
-                message=f'Error in success callback fallback: {str(e)}',
-                data={'error': str(e)},
-                request_obj=request
-            )
-            
-            # Continue to validation if we have val_id
+        print(f"🔧 SUCCESS CALLBACK: Processing payment {transaction_id} immediately (fallback)")
+        
+        # For bKash and similar payments, we assume success if we reach the success callback
+        result = PaymentPipeline.transition(
+            transaction_id,
+            new_status='VALID',
+            logs=[{
+                'action': 'success_callback_fallback',
+                'status': 'VALID',
+                'message': 'Payment processed via success callback fallback (bKash/mobile payment)',
+                'data': {'method': 'fallback', 'original_status': payment_transaction.status}
+            }],
+            fulfil=True,
+            idempotency_key=idempotency_key,
+            request_obj=request
+        )
+        
+        if result['outcome'] != OUTCOME_ERROR:
+            print(f"✅ SUCCESS CALLBACK: Payment {transaction_id} handled via fallback ({result['outcome']})")
+            return success_redirect(result)
+        
+        print(f"❌ SUCCESS CALLBACK FALLBACK ERROR: {result.get('error')}")
+        # Continue to validation if we have val_id
     
     # If we have val_id, try validation as additional fallback
     if val_id:
@@ -8237,59 +7730,49 @@ def payment_success():
                 transaction_id=transaction_id
             )
             
-            if validation_result['success']:
-                validated_data = validation_result['data']
-                validated_status = validated_data.get('status')
-                
-                print(f"✅ SUCCESS CALLBACK: Payment validated with status {validated_status}")
-                
-                # Update transaction with validation data
-                payment_transaction.update_status(validated_status, validated_data)
-                
-                # Log validation success
-                PaymentLog.log_action(
-                    transaction_id=transaction_id,
-                    action='success_callback_validation',
-                    status=validated_status,
-                    message='Payment validated in success callback (IPN fallback)',
-                    data=validated_data,
-                    request_obj=request
-                )
-                
-                # Process successful payment if validated
-                if validated_status == 'VALID':
-                    # Check risk level
-                    risk_level = int(validated_data.get('risk_level', 0))
-                    
-                    if risk_level == 0:
-                        # Low risk - process immediately
-                        process_successful_payment(payment_transaction)
-                        print(f"💾 SUCCESS CALLBACK: Payment processed successfully")
-                        
-                        # Redirect to dashboard with success message
-                        flash('Payment successful! Check your dashboard for purchased items.', 'success')
-                        return redirect(url_for('dashboard'))
-                    else:
-                        # High risk - hold for manual review
-                        PaymentLog.log_action(
-                            transaction_id=transaction_id,
-                            action='high_risk_hold_success_callback',
-                            status='HOLD',
-                            message=f'Transaction held for review due to risk level: {risk_level}',
-                            data={'risk_level': risk_level, 'risk_title': validated_data.get('risk_title')},
-                            request_obj=request
-                        )
-                        flash('Payment successful but under review. You will be notified once approved.', 'info')
-                        return redirect(url_for('dashboard'))
-                else:
-                    # Invalid payment
-                    flash('Payment validation failed. Please contact support.', 'error')
-                    return redirect(url_for('dashboard'))
-            else:
+            if not validation_result['success']:
                 # Validation failed
                 print(f"❌ SUCCESS CALLBACK: Payment validation failed - {validation_result.get('error')}")
                 flash('Payment validation failed. Please contact support.', 'error')
                 return redirect(url_for('dashboard'))
+            
+            validated_data = validation_result['data']
+            validated_status = validated_data.get('status')
+            
+            print(f"✅ SUCCESS CALLBACK: Payment validated with status {validated_status}")
+            
+            logs = [{
+                'action': 'success_callback_validation',
+                'status': validated_status,
+                'message': 'Payment validated in success callback (IPN fallback)',
+                'data': validated_data
+            }]
+            
+            # Low risk payments are fulfilled immediately, others are held for manual review
+            risk_level = int(validated_data.get('risk_level', 0) or 0)
+            if validated_status == 'VALID' and risk_level != 0:
+                logs.append({
+                    'action': 'high_risk_hold_success_callback',
+                    'status': 'HOLD',
+                    'message': f'Transaction held for review due to risk level: {risk_level}',
+                    'data': {'risk_level': risk_level, 'risk_title': validated_data.get('risk_title')}
+                })
+            
+            result = PaymentPipeline.transition(
+                transaction_id,
+                new_status=validated_status,
+                gateway_data=validated_data,
+                logs=logs,
+                fulfil=validated_status == 'VALID' and risk_level == 0,
+                idempotency_key=idempotency_key,
+                request_obj=request
+            )
+            
+            if result['outcome'] == OUTCOME_ERROR:
+                flash('Payment processing error. Please contact support.', 'error')
+                return redirect(url_for('dashboard'))
+            
+            return success_redirect(result)
                 
         except Exception as e:
             print(f"❌ SUCCESS CALLBACK VALIDATION ERROR: {str(e)}")
@@ -8317,24 +7800,25 @@ def payment_failure():
     error_msg = request.args.get('error', 'Payment failed') or request.form.get('error', 'Payment failed')
     
     if transaction_id:
+        # Mark as failed unless another callback already fulfilled it
+        PaymentPipeline.transition(
+            transaction_id,
+            new_status='FAILED',
+            logs=[{
+                'action': 'payment_failed',
+                'status': 'FAILED',
+                'message': f'Payment failed: {error_msg}'
+            }],
+            idempotency_key=f'failure:{transaction_id}',
+            request_obj=request
+        )
+        
         # Find the payment transaction
         payment_transaction = PaymentTransaction.query.filter_by(
             transaction_id=transaction_id
         ).first()
         
         if payment_transaction:
-            # Update transaction status
-            payment_transaction.update_status('FAILED')
-            
-            # Log failure
-            PaymentLog.log_action(
-                transaction_id=transaction_id,
-                action='payment_failed',
-                status='FAILED',
-                message=f'Payment failed: {error_msg}',
-                request_obj=request
-            )
-            
             # Redirect to the appropriate item details page
             if payment_transaction.purchase_type == 'course':
                 course = Course.query.get(payment_transaction.course_id)
@@ -8356,24 +7840,25 @@ def payment_cancel():
     transaction_id = request.args.get('tran_id') or request.form.get('tran_id')
     
     if transaction_id:
+        # Mark as cancelled unless another callback already fulfilled it
+        PaymentPipeline.transition(
+            transaction_id,
+            new_status='CANCELLED',
+            logs=[{
+                'action': 'payment_cancelled',
+                'status': 'CANCELLED',
+                'message': 'Payment was cancelled by user'
+            }],
+            idempotency_key=f'cancel:{transaction_id}',
+            request_obj=request
+        )
+        
         # Find the payment transaction
         payment_transaction = PaymentTransaction.query.filter_by(
             transaction_id=transaction_id
         ).first()
         
         if payment_transaction:
-            # Update transaction status
-            payment_transaction.update_status('CANCELLED')
-            
-            # Log cancellation
-            PaymentLog.log_action(
-                transaction_id=transaction_id,
-                action='payment_cancelled',
-                status='CANCELLED',
-                message='Payment was cancelled by user',
-                request_obj=request
-            )
-            
             # Redirect to the appropriate item details page
             if payment_transaction.purchase_type == 'course':
                 course = Course.query.get(payment_transaction.course_id)
@@ -8417,23 +7902,30 @@ def manual_validate_payment(transaction_id):
         
         # For testing, we'll skip SSLCommerz validation and process directly
         # In production, you would validate with SSLCommerz first
-        
-        print(f"🔧 MANUAL VALIDATION: Processing payment {transaction_id}")
-        
-        # Update status to VALID
-        payment_transaction.update_status('VALID')
-        
-        # Log manual validation
-        PaymentLog.log_action(
-            transaction_id=transaction_id,
-            action='manual_validation',
-            status='VALID',
-            message='Payment manually validated by admin',
+        result = PaymentPipeline.transition(
+            transaction_id,
+            new_status='VALID',
+            logs=[{
+                'action': 'manual_validation',
+                'status': 'VALID',
+                'message': 'Payment manually validated by admin'
+            }],
+            fulfil=True,
             request_obj=request
         )
         
-        # Process the payment
-        process_successful_payment(payment_transaction)
+        if result['outcome'] == OUTCOME_NOT_FOUND:
+            return jsonify({'error': 'Payment transaction not found'}), 404
+        if result['outcome'] == OUTCOME_DUPLICATE:
+            return jsonify({
+                'success': True,
+                'message': 'Payment already validated',
+                'status': result['status']
+            })
+        if result['outcome'] == OUTCOME_BUSY:
+            return jsonify({'error': 'Payment is currently being processed, try again shortly'}), 409
+        if result['outcome'] == OUTCOME_ERROR:
+            return jsonify({'error': f"Validation failed: {result.get('error')}"}), 500
         
         return jsonify({
             'success': True,
@@ -8448,64 +7940,73 @@ def manual_validate_payment(transaction_id):
 @app.route('/admin/process-stuck-payments')
 @login_required
 def process_stuck_payments_endpoint():
-    """Admin endpoint to process stuck payments"""
+    """Admin endpoint to reconcile stuck payments against SSLCommerz in the background"""
     if not session.get('is_admin'):
         return jsonify({'error': 'Admin access required'}), 403
     
     try:
-        from datetime import timedelta
-        
-        # Find payments that are stuck in PROCESSING/PENDING
-        stuck_payments = PaymentTransaction.query.filter(
-            PaymentTransaction.status.in_(['PENDING', 'PROCESSING'])
-        ).order_by(PaymentTransaction.created_at.desc()).all()
-        
-        if not stuck_payments:
-            return jsonify({
-                'success': True,
-                'message': 'No stuck payments found',
-                'processed': 0
-            })
-        
-        processed_count = 0
-        errors = []
-        
-        for payment in stuck_payments:
-            try:
-                print(f"🔧 ADMIN PROCESSING: {payment.transaction_id}")
-                
-                # Update status to VALID
-                payment.update_status('VALID')
-                
-                # Log admin processing
-                PaymentLog.log_action(
-                    transaction_id=payment.transaction_id,
-                    action='admin_manual_processing',
-                    status='VALID',
-                    message='Payment manually processed by admin',
-                    request_obj=request
-                )
-                
-                # Process the payment
-                process_successful_payment(payment)
-                
-                processed_count += 1
-                
-            except Exception as e:
-                errors.append(f"{payment.transaction_id}: {str(e)}")
-                continue
+        # min_age=0 reconciles everything stuck right now instead of waiting for the grace period
+        started = payment_reconciler.start(min_age=0)
         
         return jsonify({
             'success': True,
-            'message': f'Processed {processed_count} out of {len(stuck_payments)} payments',
-            'processed': processed_count,
-            'total': len(stuck_payments),
-            'errors': errors
+            'message': 'Reconciliation started' if started else 'Reconciliation already running',
+            'started': started,
+            'backlog': payment_reconciler.backlog(),
+            'metrics': payment_reconciler.metrics
         })
         
     except Exception as e:
         return jsonify({'error': f'Error processing stuck payments: {str(e)}'}), 500
 
+@app.route('/admin/api/payment-reconciliation/status')
+@login_required
+def payment_reconciliation_status():
+    """Throughput and backlog metrics for the payment reconciliation worker"""
+    if not session.get('is_admin'):
+        return jsonify({'error': 'Admin access required'}), 403
+    
+    try:
+        payment_reconciler.backlog()
+        return jsonify({'success': True, 'metrics': payment_reconciler.metrics})
+    except Exception as e:
+        return jsonify({'error': f'Error loading reconciliation status: {str(e)}'}), 500
+
+@app.route('/admin/api/analytics/payments')
+@admin_required
+def admin_payment_analytics():
+    """Funnel, revenue and failure-rate report from the local payment snapshot (no database queries)"""
+    try:
+        days = max(1, min(request.args.get('days', 30, type=int), 366))
+        report = dict(payment_analytics.report(days))
+        
+        # Item titles come from the in-memory catalog
+        titled = []
+        for item in report['revenue_by_item']:
+            record = catalog.get_course(item['item_id']) if item['item_type'] == 'course' else catalog.get_ebook(item['item_id'])
+            title = (record.title if item['item_type'] == 'course' else record.name) if record else None
+            titled.append(dict(item, title=title))
+        report['revenue_by_item'] = titled
+        
+        return jsonify({'success': True, 'report': report})
+    except Exception as e:
+        return jsonify({'success': False, 'message': str(e)}), 500
+
+@app.route('/admin/api/analytics/payments/refresh', methods=['POST'])
+@admin_required
+def admin_refresh_payment_analytics():
+    """Extract new payment rows into the analytics snapshot now instead of waiting for the next cycle"""
+    try:
+        extracted = payment_analytics.refresh()
+        return jsonify({
+            'success': True,
+            'extracted': extracted,
+            'snapshot': payment_analytics.info(),
+            'metrics': payment_analytics.metrics
+        })
+    except Exception as e:
+        return jsonify({'success': False, 'message': str(e)}), 500
+
 @app.route('/user/chat')
 def user_chat():
     if not session.get('user_id') or session.get('is_admin'):
@@ -8513,7 +8014,11 @@ def user_chat():
     
     admins = User.query.filter_by(is_admin=True).all()
     current_user = User.query.get(session['user_id'])
-    return render_template('user/chat.html', admins=admins, current_user=current_user, now=datetime.utcnow())
+    unread_by_admin = dict(db.session.query(ChatConversation.admin_id, ChatConversation.user_unread).filter(
+        ChatConversation.user_id == session['user_id'], ChatConversation.user_unread > 0
+    ).all())
+    return render_template('user/chat.html', admins=admins, unread_by_admin=unread_by_admin,
+                           current_user=current_user, now=datetime.utcnow())
 
 @app.route('/user/chat/<int:admin_id>')
 def user_chat_admin(admin_id):
@@ -8525,12 +8030,13 @@ def user_chat_admin(admin_id):
     if not admin.is_admin:
         return redirect(url_for('user_chat'))
     
-    messages = Message.query.filter(
-        ((Message.user_id == session['user_id']) & (Message.admin_id == admin_id)) |
-        ((Message.user_id == admin_id) & (Message.admin_id == session['user_id']))
-    ).order_by(Message.timestamp).all()
+    # Only the most recent messages; older ones are loaded with ?before_id= as the user scrolls up
+    key = conversation_key(session['user_id'], admin_id)
+    messages, has_more_messages = ChatHistory.page(key)
+    ChatInbox.mark_read(key, 'user')
     
-    return render_template('user/chat_admin.html', admin=admin, messages=messages, current_user=current_user, now=datetime.utcnow())
+    return render_template('user/chat_admin.html', admin=admin, messages=messages, has_more_messages=has_more_messages,
+                           current_user=current_user, now=datetime.utcnow())
 
 @app.route('/user/send_message', methods=['POST'])
 def user_send_message():
@@ -8547,11 +8053,16 @@ def user_send_message():
         content=content,
         user_id=session['user_id'],
         admin_id=admin_id,
-        is_from_admin=False
+        is_from_admin=False,
+        conversation_key=conversation_key(session['user_id'], admin_id)
     )
     
     db.session.add(message)
+    db.session.flush()
+    ChatInbox.record_message(message, session['user_id'], admin_id)
+    chat_hub.notify(message.conversation_key, serialize_message(message))
     db.session.commit()
+    chat_hub.publish(message.conversation_key, serialize_message(message))
     
     return jsonify({
         'id': message.id,
@@ -8563,21 +8074,91 @@ def user_send_message():
 # API Routes for messages
 @app.route('/api/messages/<int:user_id>/<int:admin_id>')
 def get_messages(user_id, admin_id):
-    messages = Message.query.filter(
-        ((Message.user_id == user_id) & (Message.admin_id == admin_id)) |
-        ((Message.user_id == admin_id) & (Message.admin_id == user_id))
-    ).order_by(Message.timestamp).all()
+    """
+    Messages between two parties, oldest first
     
-    result = []
-    for message in messages:
-        result.append({
-            'id': message.id,
-            'content': message.content,
-            'timestamp': message.timestamp.strftime('%Y-%m-%d %H:%M:%S'),
-            'is_from_admin': message.is_from_admin
-        })
+    Without a cursor returns the most recent messages. ?since_id= returns only newer
+    messages (polling) and ?before_id= the page before an id (scrolling back).
+    X-Has-More says whether more messages exist past the returned page, and an
+    unchanged poll sent with If-None-Match gets a 304.
+    """
+    if session.get('user_id') not in (user_id, admin_id):
+        return jsonify({'error': 'Unauthorized'}), 401
     
-    return jsonify(result)
+    since_id = request.args.get('since_id', type=int)
+    before_id = request.args.get('before_id', type=int)
+    limit = request.args.get('limit', CHAT_PAGE_SIZE, type=int)
+    key = conversation_key(user_id, admin_id)
+    
+    # One index lookup answers a poll when nothing has been sent since the last one
+    latest_id = ChatHistory.latest_id(key)
+    etag = ChatHistory.etag(key, latest_id)
+    # Weak comparison: compression turns the ETag of a compressed 200 into W/"..."
+    if before_id is None and request.if_none_match.contains_weak(etag):
+        response = make_response('', 304)
+        response.set_etag(etag)
+        return response
+    
+    if since_id is not None and since_id >= latest_id:
+        messages, has_more = [], False
+    else:
+        messages, has_more = ChatHistory.page(key, since_id=since_id, before_id=before_id, limit=limit)
+    
+    response = jsonify([serialize_message(message) for message in messages])
+    response.headers['X-Has-More'] = '1' if has_more else '0'
+    if before_id is None:
+        response.set_etag(etag)
+        response.headers['Cache-Control'] = 'private, no-cache'
+    return response
+
+@app.route('/api/messages/<int:user_id>/<int:admin_id>/stream')
+def stream_messages(user_id, admin_id):
+    """
+    Server-Sent Events stream of new messages between two parties
+    
+    Resumes after Last-Event-ID (or ?since_id=) with a query for what was missed;
+    after that the stream is fed from chat_hub without touching the database.
+    """
+    if session.get('user_id') not in (user_id, admin_id):
+        return jsonify({'error': 'Unauthorized'}), 401
+    
+    key = conversation_key(user_id, admin_id)
+    since_id = request.headers.get('Last-Event-ID', type=int)
+    if since_id is None:
+        since_id = request.args.get('since_id', type=int)
+    
+    # Read before subscribing, so a failed query cannot leave a subscription behind
+    backlog = []
+    has_more = False
+    try:
+        if since_id is not None:
+            messages, has_more = ChatHistory.page(key, since_id=since_id)
+            backlog = [serialize_message(message) for message in messages]
+        
+        subscription = chat_hub.subscribe(key)
+        if subscription is None:
+            return jsonify({'error': 'Too many open chat streams, poll instead'}), 503
+        
+        try:
+            # A message published between the backlog read and subscribe() reached neither
+            last_id = backlog[-1]['id'] if backlog else since_id
+            if last_id is not None and not has_more and ChatHistory.latest_id(key) > last_id:
+                messages, has_more = ChatHistory.page(key, since_id=last_id)
+                backlog += [serialize_message(message) for message in messages]
+        except Exception:
+            chat_hub.unsubscribe(subscription)
+            raise
+    finally:
+        db.session.remove()
+    
+    stream = chat_hub.stream(subscription, backlog, backlog_complete=not has_more)
+    response = Response(stream, mimetype='text/event-stream', headers={
+        'Cache-Control': 'no-cache',
+        'X-Accel-Buffering': 'no'
+    })
+    # The generator's own cleanup never runs if it is not started (HEAD, client gone before the first frame)
+    response.call_on_close(lambda: chat_hub.unsubscribe(subscription))
+    return response
 
 # Blog Management Routes
 @app.route('/admin/blog/add', methods=['POST'])
@@ -8620,6 +8201,7 @@ def admin_add_blog():
                 
                 if response.status_code == 201:
                     # Successfully uploaded to Bunny CDN - no need for local storage
+                    cdn_presence.mark_present(f'images/{image_filename}')
                     print(f"DEBUG: Blog image uploaded to Bunny CDN successfully: {image_filename}")
                 else:
                     # Fallback to local storage
@@ -8650,7 +8232,11 @@ def admin_add_blog():
         )
         
         db.session.add(new_blog)
+        db.session.flush()
+        blog_index.sync_tags(new_blog)
         db.session.commit()
+        blog_index.invalidate()
+        page_cache.purge(f'blog:{new_blog.id}', 'blogs')
         
         # Return JSON response for AJAX request
         return jsonify({
@@ -8715,6 +8301,7 @@ def admin_edit_blog(blog_id):
                 
                 if response.status_code == 201:
                     # Successfully uploaded to Bunny CDN - no need for local storage
+                    cdn_presence.mark_present(f'images/{image_filename}')
                     print(f"DEBUG: Edited blog image uploaded to Bunny CDN successfully: {image_filename}")
                 else:
                     # Fallback to local storage
@@ -8740,7 +8327,10 @@ def admin_edit_blog(blog_id):
                     os.remove(old_image_path)
             blog.image = None
         
+        blog_index.sync_tags(blog)
         db.session.commit()
+        blog_index.invalidate()
+        page_cache.purge(f'blog:{blog_id}', 'blogs')
         
         # Return JSON response for AJAX request
         return jsonify({
@@ -8768,8 +8358,11 @@ def admin_delete_blog(blog_id):
             if os.path.exists(image_path):
                 os.remove(image_path)
         
+        blog_index.remove(blog)
         db.session.delete(blog)
         db.session.commit()
+        blog_index.invalidate()
+        page_cache.purge(f'blog:{blog_id}', 'blogs')
         
         # Return JSON response for AJAX request
         return jsonify({
@@ -8858,6 +8451,13 @@ def debug_session():
 
 
 
+@app.route('/admin/api/cdn-presence/sync', methods=['POST'])
+@admin_required
+def sync_cdn_presence():
+    """Rebuild the CDN presence index now, e.g. after files were uploaded outside the app"""
+    found = cdn_presence.sync()
+    return jsonify({'success': found is not None, 'paths': found, 'metrics': cdn_presence.metrics})
+
 @app.route('/admin/upload-homepage-image', methods=['POST'])
 @admin_required
 def upload_homepage_image():
@@ -8902,6 +8502,9 @@ def upload_homepage_image():
         file.seek(0)  # Reset file pointer
         file_content = file.read()
         
+        # Strip metadata, cap the size and publish responsive variants for the homepage
+        file_content = image_variants.optimize(file_content, f'static/images/{unique_filename}')
+        
         # Upload to Bunny CDN
         print(f"Uploading to Bunny CDN: {storage_url}")
         response = requests.put(storage_url, headers=headers, data=file_content)
@@ -8909,6 +8512,7 @@ def upload_homepage_image():
         
         if response.status_code == 201:
             # Successfully uploaded to Bunny CDN - no need for local storage
+            cdn_presence.mark_present(f'images/{unique_filename}')
             return jsonify({
                 'success': True,
                 'filename': unique_filename,
@@ -8919,8 +8523,8 @@ def upload_homepage_image():
             print(f"CDN upload failed, saving locally instead")
             os.makedirs(os.path.join(LOCAL_STATIC_FOLDER, 'images'), exist_ok=True)
             upload_path = os.path.join(LOCAL_STATIC_FOLDER, 'images', unique_filename)
-            file.seek(0)  # Reset file pointer
-            file.save(upload_path)
+            with open(upload_path, 'wb') as f:
+                f.write(file_content)
             
             return jsonify({
                 'success': True,
@@ -9170,6 +8774,7 @@ def save_homepage_content():
             db.session.add(cta_content)
         
         db.session.commit()
+        page_cache.purge('homepage')
         
         return jsonify({
             'success': True,
@@ -9286,6 +8891,7 @@ def reset_homepage_content():
         db.session.add(cta_content)
         
         db.session.commit()
+        page_cache.purge('homepage')
         
         return jsonify({
             'success': True,
@@ -9361,6 +8967,9 @@ def upload_about_image():
         # Get file content for Bunny CDN upload
         file_content = file.read()
         
+        # Strip metadata, cap the size and publish responsive variants for the about page
+        file_content = image_variants.optimize(file_content, f'static/images/{unique_filename}')
+        
         # Upload to Bunny CDN Storage
         storage_url = f"https://{app.config['BUNNY_STORAGE_HOSTNAME']}/{app.config['BUNNY_STORAGE_ZONE']}/static/images/{unique_filename}"
         
@@ -9379,8 +8988,8 @@ def upload_about_image():
             # Fallback to local storage
             upload_path = os.path.join(LOCAL_STATIC_FOLDER, 'images', unique_filename)
             os.makedirs(os.path.dirname(upload_path), exist_ok=True)
-            file.seek(0)
-            file.save(upload_path)
+            with open(upload_path, 'wb') as f:
+                f.write(file_content)
             
             return jsonify({
                 'success': True,
@@ -9390,6 +8999,7 @@ def upload_about_image():
         
         if response.status_code == 201:
             # Successfully uploaded to Bunny CDN - no need for local storage
+            cdn_presence.mark_present(f'images/{unique_filename}')
             
             return jsonify({
                 'success': True,
@@ -9399,8 +9009,8 @@ def upload_about_image():
         else:
             # Fallback to local storage if CDN upload fails
             upload_path = os.path.join(LOCAL_STATIC_FOLDER, 'images', unique_filename)
-            file.seek(0)
-            file.save(upload_path)
+            with open(upload_path, 'wb') as f:
+                f.write(file_content)
             
             return jsonify({
                 'success': True,
@@ -9419,39 +9029,10 @@ def upload_about_image():
 def get_about_content():
     """Get current about page content"""
     try:
-        main_about_content = AboutPageContent.get_main_about_content()
-        mission_content = AboutPageContent.get_mission_content()
-        team_content = AboutPageContent.get_team_content()
-        
-        main_about_data = None
-        mission_data = None
-        team_data = None
-        
-        if main_about_content:
-            main_about_data = {
-                'main_about_title': main_about_content.main_about_title,
-                'main_about_subtitle': main_about_content.main_about_subtitle,
-                'main_about_content': main_about_content.main_about_content,
-                'main_about_images': main_about_content.main_about_images,
-                'main_about_features': main_about_content.main_about_features
-            }
-        
-        if mission_content:
-            mission_data = {
-                'mission_title': mission_content.mission_title,
-                'mission_content': mission_content.mission_content,
-                'mission_vision_title': mission_content.mission_vision_title,
-                'mission_vision_content': mission_content.mission_vision_content,
-                'mission_points': mission_content.mission_points,
-                'vision_points': mission_content.vision_points
-            }
-        
-        if team_content:
-            team_data = {
-                'team_title': team_content.team_title,
-                'team_subtitle': team_content.team_subtitle,
-                'team_members': team_content.team_members
-            }
+        sections = about_sections()
+        main_about_data = sections['main_about']
+        mission_data = sections['mission']
+        team_data = sections['team']
         
         return jsonify({
             'success': True,
@@ -9547,6 +9128,8 @@ def save_about_content():
             db.session.add(team_content)
         
         db.session.commit()
+        page_cache.purge('about')
+        content_store.invalidate('about')
         
         return jsonify({
             'success': True,
@@ -9612,6 +9195,8 @@ def reset_about_content():
         db.session.add(team_content)
         
         db.session.commit()
+        page_cache.purge('about')
+        content_store.invalidate('about')
         
         return jsonify({
             'success': True,
@@ -9627,189 +9212,17 @@ def reset_about_content():
 
 # Function to initialize the database and create admin user
 def migrate_database():
-    """Add missing columns to existing database"""
+    """Apply pending versioned schema migrations (see schema_migrations.py)"""
     try:
-        from sqlalchemy import text
-        
-        # Add discount_percent column to course table if it doesn't exist
-        try:
-            with db.engine.connect() as conn:
-                conn.execute(text('ALTER TABLE course ADD COLUMN discount_percent FLOAT'))
-                conn.commit()
-            print("Added discount_percent column to course table")
-        except Exception as e:
-            if "duplicate column name" in str(e).lower() or "already exists" in str(e).lower():
-                print("discount_percent column already exists in course table")
-            else:
-                print(f"Error adding discount_percent to course: {e}")
-        
-        # Add discounted_price column to course table if it doesn't exist
-        try:
-            with db.engine.connect() as conn:
-                conn.execute(text('ALTER TABLE course ADD COLUMN discounted_price FLOAT'))
-                conn.commit()
-            print("Added discounted_price column to course table")
-        except Exception as e:
-            if "duplicate column name" in str(e).lower() or "already exists" in str(e).lower():
-                print("discounted_price column already exists in course table")
-            else:
-                print(f"Error adding discounted_price to course: {e}")
-        
-        # Add discount_percent column to ebook table if it doesn't exist
-        try:
-            with db.engine.connect() as conn:
-                conn.execute(text('ALTER TABLE ebook ADD COLUMN discount_percent FLOAT'))
-                conn.commit()
-            print("Added discount_percent column to ebook table")
-        except Exception as e:
-            if "duplicate column name" in str(e).lower() or "already exists" in str(e).lower():
-                print("discount_percent column already exists in ebook table")
-            else:
-                print(f"Error adding discount_percent to ebook: {e}")
-        
-        # Add discounted_price column to ebook table if it doesn't exist
-        try:
-            with db.engine.connect() as conn:
-                conn.execute(text('ALTER TABLE ebook ADD COLUMN discounted_price FLOAT'))
-                conn.commit()
-            print("Added discounted_price column to ebook table")
-        except Exception as e:
-            if "duplicate column name" in str(e).lower() or "already exists" in str(e).lower():
-                print("discounted_price column already exists in ebook table")
-            else:
-                print(f"Error adding discounted_price to ebook: {e}")
-        
-        # Add missing columns to video_lesson table
-        video_lesson_columns = [
-            ('video_url', 'VARCHAR(500)'),
-            ('bunny_video_id', 'VARCHAR(100)'),
-            ('storage_path', 'VARCHAR(500)'),
-            ('duration', 'INTEGER'),
-            ('is_preview', 'BOOLEAN DEFAULT FALSE'),
-            ('instructions', 'TEXT'),
-            ('external_links', 'TEXT'),
-            ('created_at', 'DATETIME'),
-            ('updated_at', 'DATETIME')
-        ]
-        
-        for column_name, column_type in video_lesson_columns:
-            try:
-                with db.engine.connect() as conn:
-                    conn.execute(text(f'ALTER TABLE video_lesson ADD COLUMN {column_name} {column_type}'))
-                    conn.commit()
-                print(f"Added {column_name} column to video_lesson table")
-            except Exception as e:
-                if "duplicate column name" in str(e).lower() or "already exists" in str(e).lower():
-                    print(f"{column_name} column already exists in video_lesson table")
-                else:
-                    print(f"Error adding {column_name} to video_lesson: {e}")
-        
-        # Add missing columns to lesson_progress table
-        lesson_progress_columns = [
-            ('user_id', 'INTEGER'),
-            ('lesson_id', 'INTEGER'),
-            ('watched_duration', 'INTEGER DEFAULT 0'),
-            ('is_completed', 'BOOLEAN DEFAULT FALSE'),
-            ('last_watched_at', 'DATETIME'),
-            ('completion_percentage', 'FLOAT DEFAULT 0.0')
-        ]
-        
-        for column_name, column_type in lesson_progress_columns:
-            try:
-                with db.engine.connect() as conn:
-                    conn.execute(text(f'ALTER TABLE lesson_progress ADD COLUMN {column_name} {column_type}'))
-                    conn.commit()
-                print(f"Added {column_name} column to lesson_progress table")
-            except Exception as e:
-                if "duplicate column name" in str(e).lower() or "already exists" in str(e).lower():
-                    print(f"{column_name} column already exists in lesson_progress table")
-                else:
-                    print(f"Error adding {column_name} to lesson_progress: {e}")
-        
-        # Fix bunny_video_id column to allow NULL values (SQLite doesn't support ALTER COLUMN, so we'll recreate table if needed)
-        try:
-            with db.engine.connect() as conn:
-                # Check if the column allows NULL
-                result = conn.execute(text("PRAGMA table_info(video_lesson)"))
-                columns = result.fetchall()
-                bunny_video_id_info = None
-                for col in columns:
-                    if col[1] == 'bunny_video_id':  # col[1] is column name
-                        bunny_video_id_info = col
-                        break
-                
-                if bunny_video_id_info and bunny_video_id_info[3] == 1:  # col[3] is notnull flag
-                    print("bunny_video_id column has NOT NULL constraint, recreating table...")
-                    
-                    # Create new table with correct schema
-                    conn.execute(text("""
-                        CREATE TABLE video_lesson_new (
-                            id INTEGER PRIMARY KEY,
-                            course_id INTEGER NOT NULL,
-                            title VARCHAR(200) NOT NULL,
-                            description TEXT,
-                            video_url VARCHAR(500),
-                            bunny_video_id VARCHAR(100),
-                            order_index INTEGER DEFAULT 0,
-                            duration INTEGER,
-                            is_preview BOOLEAN DEFAULT FALSE,
-                            instructions TEXT,
-                            external_links TEXT,
-                            created_at DATETIME,
-                            updated_at DATETIME,
-                            FOREIGN KEY (course_id) REFERENCES course (id)
-                        )
-                    """))
-                    
-                    # Copy data from old table
-                    conn.execute(text("""
-                        INSERT INTO video_lesson_new 
-                        SELECT id, course_id, title, description, video_url, bunny_video_id, 
-                               order_index, duration, is_preview, instructions, external_links, 
-                               created_at, updated_at
-                        FROM video_lesson
-                    """))
-                    
-                    # Drop old table and rename new one
-                    conn.execute(text("DROP TABLE video_lesson"))
-                    conn.execute(text("ALTER TABLE video_lesson_new RENAME TO video_lesson"))
-                    
-                    conn.commit()
-                    print("Successfully recreated video_lesson table with nullable bunny_video_id")
-                else:
-                    print("bunny_video_id column already allows NULL values")
-                    
-        except Exception as e:
-            print(f"Error fixing bunny_video_id column: {e}")
-            # If recreation fails, we'll continue - the upload might still work
+        from schema_migrations import run_migrations
         
-        # Add email_verified column to user table if it doesn't exist
-        try:
-            with db.engine.connect() as conn:
-                conn.execute(text('ALTER TABLE "user" ADD COLUMN email_verified BOOLEAN'))
-                conn.commit()
-            print("Added email_verified column to user table")
-        except Exception as e:
-            if "duplicate column name" in str(e).lower() or "already exists" in str(e).lower():
-                print("email_verified column already exists in user table")
-            else:
-                print(f"Error adding email_verified to user: {e}")
-        
-        # Update default values for existing records
-        try:
-            with db.engine.connect() as conn:
-                conn.execute(text('UPDATE course SET discount_percent = 0.0 WHERE discount_percent IS NULL'))
-                conn.execute(text('UPDATE ebook SET discount_percent = 0.0 WHERE discount_percent IS NULL'))
-                conn.execute(text("UPDATE video_lesson SET is_preview = FALSE WHERE is_preview IS NULL"))
-                conn.execute(text("UPDATE video_lesson SET created_at = datetime('now') WHERE created_at IS NULL"))
-                conn.execute(text("UPDATE video_lesson SET updated_at = datetime('now') WHERE updated_at IS NULL"))
-                # Set email_verified to FALSE for existing users (they need to verify)
-                conn.execute(text('UPDATE "user" SET email_verified = FALSE WHERE email_verified IS NULL'))
-                conn.commit()
-            print("Updated default values for all columns")
-        except Exception as e:
-            print(f"Error updating default values: {e}")
+        applied = run_migrations(db.engine)
+        if applied:
+            print(f"Database migrated to version {applied[-1]}")
         
+        # Version 7 introduced the analytics rollups, fill them from the existing rows
+        if 7 in applied:
+            analytics_rollup.start_backfill()
     except Exception as e:
         print(f"Migration error: {e}")
 
@@ -10095,6 +9508,8 @@ def init_db():
             if admin:
                 blog.author_id = admin.id
             db.session.add(blog)
+            db.session.flush()
+            blog_index.sync_tags(blog)
         
         db.session.commit()
         print("Sample blog posts created successfully!")
@@ -10136,6 +9551,7 @@ def mark_contact_message_read(message_id):
     try:
         message = ContactMessage.query.get_or_404(message_id)
         message.mark_as_read()
+        contact_inbox.invalidate()
         
         return jsonify({
             'success': True,
@@ -10153,12 +9569,12 @@ def mark_contact_message_read(message_id):
 def mark_all_contact_messages_read():
     """Mark all contact messages as read"""
     try:
-        ContactMessage.query.filter_by(is_read=False).update({'is_read': True})
-        db.session.commit()
+        updated = contact_inbox.bulk_update(contact_inbox.filtered(read='unread'), is_read=True)
         
         return jsonify({
             'success': True,
-            'message': 'All messages marked as read successfully'
+            'message': 'All messages marked as read successfully',
+            'updated': updated
         })
     except Exception as e:
         db.session.rollback()
@@ -10170,26 +9586,24 @@ def mark_all_contact_messages_read():
 @app.route('/admin/contact-messages/mark-selected-read', methods=['POST'])
 @admin_required
 def mark_selected_contact_messages_read():
-    """Mark selected contact messages as read"""
+    """Mark selected contact messages (message_ids, or every message matching filter) as read"""
     try:
-        data = request.get_json()
-        message_ids = data.get('message_ids', [])
+        data = request.get_json(silent=True) or {}
+        selection = contact_inbox.selection(data.get('message_ids'), data.get('filter'))
         
-        if not message_ids:
+        if selection is None:
             return jsonify({
                 'success': False,
-                'message': 'No message IDs provided'
+                'message': 'No message IDs provided, or the filter does not narrow the messages'
             })
         
-        # Update selected messages
-        ContactMessage.query.filter(ContactMessage.id.in_(message_ids)).update(
-            {'is_read': True}, synchronize_session=False
-        )
-        db.session.commit()
+        # One UPDATE for the whole selection
+        updated = contact_inbox.bulk_update(selection, is_read=True)
         
         return jsonify({
             'success': True,
-            'message': f'{len(message_ids)} messages marked as read successfully'
+            'message': f'{updated} messages marked as read successfully',
+            'updated': updated
         })
     except Exception as e:
         db.session.rollback()
@@ -10201,26 +9615,24 @@ def mark_selected_contact_messages_read():
 @app.route('/admin/contact-messages/delete-selected', methods=['POST'])
 @admin_required
 def delete_selected_contact_messages():
-    """Delete selected contact messages"""
+    """Delete selected contact messages (message_ids, or every message matching filter)"""
     try:
-        data = request.get_json()
-        message_ids = data.get('message_ids', [])
+        data = request.get_json(silent=True) or {}
+        selection = contact_inbox.selection(data.get('message_ids'), data.get('filter'))
         
-        if not message_ids:
+        if selection is None:
             return jsonify({
                 'success': False,
-                'message': 'No message IDs provided'
+                'message': 'No message IDs provided, or the filter does not narrow the messages'
             })
         
-        # Delete selected messages
-        ContactMessage.query.filter(ContactMessage.id.in_(message_ids)).delete(
-            synchronize_session=False
-        )
-        db.session.commit()
+        # One DELETE for the whole selection
+        deleted = contact_inbox.bulk_delete(selection)
         
         return jsonify({
             'success': True,
-            'message': f'{len(message_ids)} messages deleted successfully'
+            'message': f'{deleted} messages deleted successfully',
+            'deleted': deleted
         })
     except Exception as e:
         db.session.rollback()
@@ -10229,6 +9641,48 @@ def delete_selected_contact_messages():
             'message': f'Error deleting selected messages: {str(e)}'
         })
 
+@app.route('/admin/contact-messages/update-selected', methods=['POST'])
+@admin_required
+def update_selected_contact_messages():
+    """Set is_read and/or status on selected contact messages (message_ids, or every message matching filter)"""
+    try:
+        data = request.get_json(silent=True) or {}
+        selection = contact_inbox.selection(data.get('message_ids'), data.get('filter'))
+        
+        if selection is None:
+            return jsonify({
+                'success': False,
+                'message': 'No message IDs provided, or the filter does not narrow the messages'
+            })
+        
+        is_read = data.get('is_read')
+        status = data.get('status')
+        if is_read is None and status not in CONTACT_STATUSES:
+            return jsonify({
+                'success': False,
+                'message': 'Nothing to update'
+            })
+        
+        updated = contact_inbox.bulk_update(selection, is_read=is_read, status=status)
+        
+        return jsonify({
+            'success': True,
+            'message': f'{updated} messages updated successfully',
+            'updated': updated
+        })
+    except Exception as e:
+        db.session.rollback()
+        return jsonify({
+            'success': False,
+            'message': f'Error updating selected messages: {str(e)}'
+        })
+
+@app.route('/admin/api/contact-messages/unread-count')
+@admin_required
+def contact_messages_unread_count():
+    """Unread badge for the admin navigation"""
+    return jsonify({'success': True, 'unread_count': contact_inbox.unread_count()})
+
 @app.route('/admin/contact-message/<int:message_id>', methods=['DELETE'])
 @admin_required
 def delete_contact_message(message_id):
@@ -10237,6 +9691,7 @@ def delete_contact_message(message_id):
         message = ContactMessage.query.get_or_404(message_id)
         db.session.delete(message)
         db.session.commit()
+        contact_inbox.invalidate()
         
         return jsonify({
             'success': True,
@@ -10266,6 +9721,7 @@ def reply_to_contact_message():
         message = ContactMessage.query.get_or_404(message_id)
         message.add_admin_reply(admin_reply, session['user_id'])
         db.session.commit()
+        contact_inbox.invalidate()
         
         # Here you could also send an email notification to the user
         # using the existing email utility functions
@@ -10448,6 +9904,8 @@ def admin_create_ebook():
                     continue
         
         db.session.commit()
+        catalog.ebook_changed(ebook.id)
+        page_cache.purge(f'ebook:{ebook.id}', 'ebooks')
         
         return jsonify({
             'success': True,
@@ -10573,7 +10031,9 @@ def admin_update_ebook(ebook_id):
             filename = f"{uuid.uuid4()}_{filename}"
             cover_path = os.path.join(app.root_path, 'static', 'images', 'ebook_cover', filename)
             os.makedirs(os.path.dirname(cover_path), exist_ok=True)
-            cover_image.save(cover_path)
+            cover_content = image_variants.optimize(cover_image.read(), f'static/images/ebook_cover/{filename}')
+            with open(cover_path, 'wb') as f:
+                f.write(cover_content)
             ebook.cover_image = filename
         
         # Handle PDF file upload to Bunny CDN
@@ -10649,6 +10109,9 @@ def admin_update_ebook(ebook_id):
                     continue
         
         db.session.commit()
+        CouponEngine.invalidate('ebook', ebook_id)
+        catalog.ebook_changed(ebook_id)
+        page_cache.purge(f'ebook:{ebook_id}', 'ebooks')
         
         return jsonify({
             'success': True,
@@ -10670,6 +10133,8 @@ def admin_publish_ebook(ebook_id):
         ebook = Ebook.query.get_or_404(ebook_id)
         ebook.is_published = True
         db.session.commit()
+        catalog.ebook_changed(ebook_id)
+        page_cache.purge(f'ebook:{ebook_id}', 'ebooks')
         
         return jsonify({
             'success': True,
@@ -10690,6 +10155,8 @@ def admin_unpublish_ebook(ebook_id):
         ebook = Ebook.query.get_or_404(ebook_id)
         ebook.is_published = False
         db.session.commit()
+        catalog.ebook_changed(ebook_id)
+        page_cache.purge(f'ebook:{ebook_id}', 'ebooks')
         
         return jsonify({
             'success': True,
@@ -10722,6 +10189,8 @@ def admin_delete_ebook(ebook_id):
         
         db.session.delete(ebook)
         db.session.commit()
+        catalog.ebook_removed(ebook_id)
+        page_cache.purge(f'ebook:{ebook_id}', 'ebooks')
         
         return jsonify({
             'success': True,
@@ -10796,6 +10265,8 @@ def save_policy(policy_type):
             policy.updated_at = datetime.utcnow()
         
         db.session.commit()
+        page_cache.purge(f'policy:{policy_type}')
+        content_store.invalidate('policies')
         
         return jsonify({
             'success': True,
@@ -10849,6 +10320,8 @@ def reset_policy(policy_type):
             policy.updated_at = datetime.utcnow()
         
         db.session.commit()
+        page_cache.purge(f'policy:{policy_type}')
+        content_store.invalidate('policies')
         
         return jsonify({
             'success': True,
@@ -11036,6 +10509,7 @@ def admin_create_coupon():
         
         db.session.add(coupon)
         db.session.commit()
+        CouponEngine.invalidate(data['item_type'], data['item_id'])
         
         return jsonify({
             'success': True,
@@ -11093,6 +10567,7 @@ def admin_update_coupon(coupon_type, coupon_id):
             coupon.valid_until = datetime.fromisoformat(data['valid_until'].replace('Z', '+00:00')) if data['valid_until'] else None
         
         db.session.commit()
+        CouponEngine.invalidate(coupon_type, coupon.course_id if coupon_type == 'course' else coupon.ebook_id)
         
         return jsonify({
             'success': True,
@@ -11114,17 +10589,14 @@ def admin_get_courses_ebooks():
         return jsonify({'success': False, 'message': 'Admin privileges required'}), 403
     
     try:
-        courses = Course.query.filter_by(is_published=True).all()
-        ebooks = Ebook.query.filter_by(is_published=True).all()
-        
-        course_data = [{'id': c.id, 'title': c.title, 'price': c.price} for c in courses]
-        ebook_data = [{'id': e.id, 'name': e.name, 'price': e.price} for e in ebooks]
+        def build():
+            return {
+                'success': True,
+                'courses': [{'id': c.id, 'title': c.title, 'price': c.price} for c in catalog.courses(published=True)],
+                'ebooks': [{'id': e.id, 'name': e.name, 'price': e.price} for e in catalog.ebooks(published=True)]
+            }
         
-        return jsonify({
-            'success': True,
-            'courses': course_data,
-            'ebooks': ebook_data
-        })
+        return Response(catalog.json_bytes('admin_courses_ebooks', build), mimetype='application/json')
         
     except Exception as e:
         return jsonify({'success': False, 'message': str(e)}), 500
@@ -11151,6 +10623,8 @@ def admin_set_course_discount(course_id):
         course.calculate_discounted_price()
         
         db.session.commit()
+        catalog.course_changed(course_id)
+        page_cache.purge(f'course:{course_id}', 'courses')
         
         return jsonify({
             'success': True,
@@ -11184,6 +10658,8 @@ def admin_set_ebook_discount(ebook_id):
         ebook.calculate_discounted_price()
         
         db.session.commit()
+        catalog.ebook_changed(ebook_id)
+        page_cache.purge(f'ebook:{ebook_id}', 'ebooks')
         
         return jsonify({
             'success': True,
@@ -11196,6 +10672,16 @@ def admin_set_ebook_discount(ebook_id):
         return jsonify({'success': False, 'message': str(e)}), 500
 
 # ===== DASHBOARD ANALYTICS API ENDPOINTS =====
+def analytics_start_date(days):
+    """First day of a ?days=N window ending today (UTC), or None for all time"""
+    try:
+        days = int(days)
+    except (TypeError, ValueError):
+        return None
+    if days <= 0:
+        return None
+    return datetime.utcnow().date() - timedelta(days=days - 1)
+
 @app.route('/admin/api/course-purchase-analytics')
 def admin_course_purchase_analytics():
     """Get course purchase analytics data"""
@@ -11207,21 +10693,19 @@ def admin_course_purchase_analytics():
         return jsonify({'success': False, 'message': 'Admin privileges required'}), 403
     
     try:
-        # Get course purchase data by counting enrollments for each course
-        course_data = db.session.query(
-            Course.title,
-            db.func.count(CourseEnrollment.id).label('purchase_count')
-        ).outerjoin(CourseEnrollment, Course.id == CourseEnrollment.course_id)\
-         .group_by(Course.id, Course.title)\
-         .order_by(db.func.count(CourseEnrollment.id).desc())\
-         .all()
+        # Enrollments per course from the daily rollups, optionally over the last ?days=N
+        start = analytics_start_date(request.args.get('days'))
+        totals = analytics_rollup.item_totals('course', start)
         
         courses = []
-        for course_title, purchase_count in course_data:
+        for course in catalog.courses():
+            course_totals = totals.get(course.id, {})
             courses.append({
-                'title': course_title,
-                'purchase_count': purchase_count or 0
+                'title': course.title,
+                'purchase_count': course_totals.get('enrollments', 0),
+                'revenue': round(course_totals.get('revenue', 0.0), 2)
             })
+        courses.sort(key=lambda item: item['purchase_count'], reverse=True)
         
         return jsonify({
             'success': True,
@@ -11242,21 +10726,19 @@ def admin_ebook_purchase_analytics():
         return jsonify({'success': False, 'message': 'Admin privileges required'}), 403
     
     try:
-        # Get ebook purchase data by counting purchases for each ebook
-        ebook_data = db.session.query(
-            Ebook.name,
-            db.func.count(EbookPurchase.id).label('purchase_count')
-        ).outerjoin(EbookPurchase, Ebook.id == EbookPurchase.ebook_id)\
-         .group_by(Ebook.id, Ebook.name)\
-         .order_by(db.func.count(EbookPurchase.id).desc())\
-         .all()
+        # Purchases per ebook from the daily rollups, optionally over the last ?days=N
+        start = analytics_start_date(request.args.get('days'))
+        totals = analytics_rollup.item_totals('ebook', start)
         
         ebooks = []
-        for ebook_name, purchase_count in ebook_data:
+        for ebook in catalog.ebooks():
+            ebook_totals = totals.get(ebook.id, {})
             ebooks.append({
-                'title': ebook_name,
-                'purchase_count': purchase_count or 0
+                'title': ebook.name,
+                'purchase_count': ebook_totals.get('purchases', 0),
+                'revenue': round(ebook_totals.get('revenue', 0.0), 2)
             })
+        ebooks.sort(key=lambda item: item['purchase_count'], reverse=True)
         
         return jsonify({
             'success': True,
@@ -11349,6 +10831,9 @@ def admin_new_user_registrations():
         # Get users registered in the last 30 days
         thirty_days_ago = datetime.now() - timedelta(days=30)
         
+        # Registrations per day from the daily rollups
+        daily = analytics_rollup.daily('user', (datetime.utcnow() - timedelta(days=30)).date())
+        
         new_users = User.query.filter(
             User.created_at >= thirty_days_ago
         ).order_by(User.created_at.desc()).limit(50).all()
@@ -11367,9 +10852,34 @@ def admin_new_user_registrations():
         
         return jsonify({
             'success': True,
-            'users': users_list
+            'users': users_list,
+            'daily': [{'date': day['date'], 'registrations': day['registrations']} for day in daily],
+            'total': sum(day['registrations'] for day in daily)
+        })
+        
+    except Exception as e:
+        return jsonify({'success': False, 'message': str(e)}), 500
+
+@app.route('/admin/api/analytics/rollups/backfill', methods=['POST'])
+@admin_required
+def admin_backfill_analytics_rollups():
+    """Rebuild the daily analytics rollups from the source tables in the background"""
+    try:
+        data = request.get_json(silent=True) or {}
+        start = datetime.strptime(data['start'], '%Y-%m-%d').date() if data.get('start') else None
+        end = datetime.strptime(data['end'], '%Y-%m-%d').date() if data.get('end') else None
+        
+        started = analytics_rollup.start_backfill(start, end)
+        
+        return jsonify({
+            'success': True,
+            'message': 'Backfill started' if started else 'Backfill already running',
+            'started': started,
+            'metrics': analytics_rollup.metrics
         })
         
+    except ValueError:
+        return jsonify({'success': False, 'message': 'Dates must be YYYY-MM-DD'}), 400
     except Exception as e:
         return jsonify({'success': False, 'message': str(e)}), 500
 
@@ -11393,47 +10903,21 @@ def validate_coupon():
         if item_type not in ['course', 'ebook']:
             return jsonify({'success': False, 'message': 'Invalid item type'}), 400
         
-        # Find the coupon
-        if item_type == 'course':
-            coupon = CourseCoupon.query.filter_by(
-                course_id=item_id,
-                code=coupon_code
-            ).first()
-            
-            if not coupon:
-                return jsonify({
-                    'success': False,
-                    'message': 'Invalid coupon code'
-                })
-            
-            # Get the course to calculate price
-            course = Course.query.get(item_id)
-            if not course:
-                return jsonify({'success': False, 'message': 'Course not found'}), 404
-            
-            item = course
-            
-        else:  # ebook
-            coupon = EbookCoupon.query.filter_by(
-                ebook_id=item_id,
-                code=coupon_code
-            ).first()
-            
-            if not coupon:
-                return jsonify({
-                    'success': False,
-                    'message': 'Invalid coupon code'
-                })
-            
-            # Get the ebook to calculate price
-            ebook = Ebook.query.get(item_id)
-            if not ebook:
-                return jsonify({'success': False, 'message': 'Ebook not found'}), 404
-            
-            item = ebook
+        # Served from the in-process coupon index
+        coupon, original_price = CouponEngine.lookup(item_type, item_id, coupon_code)
+        
+        if not coupon:
+            return jsonify({
+                'success': False,
+                'message': 'Invalid coupon code'
+            })
+        
+        if original_price is None:
+            message = 'Course not found' if item_type == 'course' else 'Ebook not found'
+            return jsonify({'success': False, 'message': message}), 404
         
         # Validate coupon
-        is_valid, validation_message = coupon.is_valid()
+        is_valid, validation_message = CouponEngine.check(coupon)
         
         if not is_valid:
             return jsonify({
@@ -11442,15 +10926,14 @@ def validate_coupon():
             })
         
         # Calculate discount
-        original_price = item.price
-        discount_calculation = coupon.apply_discount(original_price)
+        discount_calculation = CouponEngine.apply_discount(coupon, original_price)
         
         return jsonify({
             'success': True,
             'message': 'Coupon is valid',
             'coupon': {
-                'code': coupon.code,
-                'discount_percent': coupon.discount_percent,
+                'code': coupon['code'],
+                'discount_percent': coupon['discount_percent'],
                 'original_price': discount_calculation['original_price'],
                 'discount_amount': discount_calculation['discount_amount'],
                 'final_price': discount_calculation['final_price']
@@ -11482,42 +10965,8 @@ def apply_coupon():
         if item_type not in ['course', 'ebook']:
             return jsonify({'success': False, 'message': 'Invalid item type'}), 400
         
-        # Find and validate the coupon
-        if item_type == 'course':
-            coupon = CourseCoupon.query.filter_by(
-                course_id=item_id,
-                code=coupon_code
-            ).first()
-        else:  # ebook
-            coupon = EbookCoupon.query.filter_by(
-                ebook_id=item_id,
-                code=coupon_code
-            ).first()
-        
-        if not coupon:
-            return jsonify({
-                'success': False,
-                'message': 'Invalid coupon code'
-            })
-        
-        # Validate coupon
-        is_valid, validation_message = coupon.is_valid()
-        
-        if not is_valid:
-            return jsonify({
-                'success': False,
-                'message': validation_message
-            })
-        
-        # Increment usage count
-        coupon.used_count += 1
-        db.session.commit()
-        
-        return jsonify({
-            'success': True,
-            'message': 'Coupon applied successfully',
-            'used_count': coupon.used_count
-        })
+        # Single conditional UPDATE, so concurrent redemptions can't exceed usage_limit
+        return jsonify(CouponEngine.redeem(item_type, item_id, coupon_code))
         
     except Exception as e:
         db.session.rollback()
@@ -12559,9 +12008,13 @@ def watch_course(course_id):
         progress = LessonProgress.query.filter_by(user_id=user_id, lesson_id=video.id).first()
         user_progress[video.id] = progress
     
+    # Signed per viewer; the player loads them from the CDN without a redirect
+    video_urls = {video.id: url_signer.for_user(user_id, 'lesson', video.id, video.video_url) for video in videos}
+    
     return render_template('course_watch.html', 
                          course=course, 
                          videos=videos, 
+                         video_urls=video_urls,
                          user_progress=user_progress,
                          enrollment=enrollment)
 
@@ -12631,7 +12084,7 @@ def get_video_details(video_id):
             'id': video.id,
             'title': video.title,
             'description': video.description,
-            'video_url': video.video_url,
+            'video_url': url_signer.for_user(user_id, 'lesson', video.id, video.video_url),
             'duration': video.duration,
             'is_preview': video.is_preview,
             'instructions': video.instructions,
@@ -12644,7 +12097,8 @@ def get_video_details(video_id):
                     'file_type': att.file_type,
                     'file_size': att.file_size,
                     'description': att.description,
-                    'file_url': att.file_url or f"/api/attachment/{att.id}/download"  # Fallback for missing URLs
+                    # Signed CDN URL, so the download skips the redirect; fallback for missing URLs
+                    'file_url': url_signer.for_user(user_id, 'attachment', att.id, att.file_url) if att.file_url else f"/api/attachment/{att.id}/download"
                 } for att in video.attachments
             ]
         }
@@ -12678,14 +12132,14 @@ def download_attachment(attachment_id):
         
         # If attachment has a direct file_url (Bunny.net), redirect to it
         if attachment.file_url:
-            return redirect(attachment.file_url)
+            return redirect(url_signer.for_user(user_id, 'attachment', attachment.id, attachment.file_url))
         
         # If no direct URL, try to construct Bunny.net path based on course folder
         try:
             from simple_progress_uploader import simple_uploader
             course_folder = simple_uploader.get_course_folder_name(video.course_id)
             bunny_url = f"https://skill-finesse-videos.b-cdn.net/courses/{course_folder}/{attachment.filename}"
-            return redirect(bunny_url)
+            return redirect(url_signer.for_user(user_id, 'attachment', attachment.id, bunny_url))
         except Exception as e:
             print(f"❌ Error constructing attachment URL: {e}")
             return jsonify({
@@ -12782,6 +12236,9 @@ def test_delete_video(video_id):
 from direct_bunny_upload_route import direct_bunny_bp
 app.register_blueprint(direct_bunny_bp, url_prefix='/admin')
 
+# Every filter and global is registered now; compile all templates before the first request
+template_cache.warm()
+
 if __name__ == '__main__':
     with app.app_context():
         try:
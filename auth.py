@@ -2,13 +2,31 @@ import os
 import uuid
 import datetime
 import hashlib
+import hmac
 import json
+import time
+import threading
 from functools import wraps
 from flask import session, request, redirect, url_for, flash
 
 # Maximum age of a trusted device token (30 days)
 DEVICE_TOKEN_MAX_AGE = 30 * 24 * 60 * 60  # 30 days in seconds
 
+# How long a verified device stays in the in-process cache
+DEVICE_CACHE_TTL = 5 * 60  # 5 minutes in seconds
+
+# Only rewrite last_used for a known device once this much time has passed
+DEVICE_TOUCH_INTERVAL = 24 * 60 * 60  # 1 day in seconds
+
+# How often expired trusted devices are bulk-deleted
+DEVICE_CLEANUP_INTERVAL = 60 * 60  # 1 hour in seconds
+
+# (user_id, fingerprint) -> verified device details, see AuthManager.lookup_trusted_device.
+# Entries verified before the user's 'devices:<id>' tag was last purged (a device was
+# revoked or re-issued in some worker) are not trusted.
+_device_cache = {}
+_device_cache_lock = threading.Lock()
+
 class AuthManager:
     """Manages authentication and security decisions for the application"""
     
@@ -63,38 +81,97 @@ class AuthManager:
             # No device token means this is a new device/browser
             return True
             
-        # Check if this device is associated with this user
-        import models
-        trusted_device = models.TrustedDevice.query.filter_by(
-            user_id=user.id,
-            fingerprint=AuthManager.get_device_fingerprint()
-        ).first()
+        # Check if this device is associated with this user and the token matches
+        trusted_device = AuthManager.lookup_trusted_device(
+            user.id, AuthManager.get_device_fingerprint(), device_token
+        )
         
         if not trusted_device:
-            # Device not recognized for this user
-            return True
-            
-        # Verify the device token
-        if not AuthManager.verify_token(device_token, trusted_device.token_hash, trusted_device.token_salt):
-            # Token doesn't match what we have stored
+            # Device not recognized for this user or token doesn't match what we have stored
             return True
             
         # Check if the token has expired
-        if (datetime.datetime.utcnow() - trusted_device.last_used).total_seconds() > DEVICE_TOKEN_MAX_AGE:
+        if (datetime.datetime.utcnow() - trusted_device['last_used']).total_seconds() > DEVICE_TOKEN_MAX_AGE:
             # Token has expired
             return True
             
         # Check for suspicious activity (different IP from usual pattern)
-        if trusted_device.last_ip and trusted_device.last_ip != request.remote_addr:
+        if trusted_device['last_ip'] and trusted_device['last_ip'] != request.remote_addr:
             # IP has changed, might be suspicious
             # Could implement more advanced logic here based on geo-location, etc.
             # For now, we'll be cautious and require OTP
-            if not AuthManager.is_ip_in_same_network(trusted_device.last_ip, request.remote_addr):
+            if not AuthManager.is_ip_in_same_network(trusted_device['last_ip'], request.remote_addr):
                 return True
         
         # Device is trusted and recently verified, no need for OTP
         return False
     
+    @staticmethod
+    def _token_digest(token):
+        return hashlib.sha256(token.encode()).hexdigest()
+    
+    @staticmethod
+    def _cache_device(user_id, fingerprint, device_token, last_used, last_ip, checked_at=None):
+        with _device_cache_lock:
+            _device_cache[(user_id, fingerprint)] = {
+                'token_digest': AuthManager._token_digest(device_token),
+                'last_used': last_used,
+                'last_ip': last_ip,
+                'cached_at': time.monotonic(),
+                'checked_at': checked_at or time.time()
+            }
+    
+    @staticmethod
+    def invalidate_device_cache(user_id, fingerprint=None):
+        """
+        Drop cached verification results for a user (or one of their devices) in
+        this worker, and make every other worker re-check the user's devices
+        """
+        from page_cache import page_cache
+        
+        page_cache.purge(f'devices:{user_id}')
+        with _device_cache_lock:
+            for key in list(_device_cache):
+                if key[0] == user_id and (fingerprint is None or key[1] == fingerprint):
+                    del _device_cache[key]
+    
+    @staticmethod
+    def lookup_trusted_device(user_id, fingerprint, device_token):
+        """
+        Return {'last_used', 'last_ip'} for a trusted device whose stored token
+        matches device_token, or None. Verified devices are cached in-process
+        for DEVICE_CACHE_TTL so repeat logins from a known browser skip the query,
+        until a revocation in any worker purges the user's 'devices:<id>' tag.
+        """
+        from page_cache import page_cache
+        
+        if not device_token:
+            return None
+        
+        with _device_cache_lock:
+            cached = _device_cache.get((user_id, fingerprint))
+        if (cached and time.monotonic() - cached['cached_at'] < DEVICE_CACHE_TTL
+                and page_cache.purged_at(f'devices:{user_id}') < cached['checked_at']
+                and hmac.compare_digest(cached['token_digest'], AuthManager._token_digest(device_token))):
+            return cached
+        
+        # Taken before the query, so a revocation committed while it runs still invalidates the entry
+        checked_at = time.time()
+        import models
+        trusted_device = models.TrustedDevice.query.filter_by(
+            user_id=user_id,
+            fingerprint=fingerprint
+        ).first()
+        
+        if not trusted_device or not AuthManager.verify_token(device_token, trusted_device.token_hash, trusted_device.token_salt):
+            return None
+        
+        AuthManager._cache_device(user_id, fingerprint, device_token,
+                                  trusted_device.last_used or datetime.datetime.min, trusted_device.last_ip,
+                                  checked_at=checked_at)
+        with _device_cache_lock:
+            return _device_cache.get((user_id, fingerprint))
+    
     @staticmethod
     def is_ip_in_same_network(ip1, ip2, subnet_size=24):
         """
@@ -121,41 +198,109 @@ class AuthManager:
         """Register the current device as trusted for this user"""
         import models
         
+        now = datetime.datetime.utcnow()
+        fingerprint = AuthManager.get_device_fingerprint()
+        
+        # Already trusted with a valid token: keep it, and only write when last_used is stale
+        device_token = request.cookies.get('device_token')
+        trusted_device = AuthManager.lookup_trusted_device(user_id, fingerprint, device_token)
+        if trusted_device:
+            stale = (now - trusted_device['last_used']).total_seconds() > DEVICE_TOUCH_INTERVAL
+            if stale or trusted_device['last_ip'] != request.remote_addr:
+                models.TrustedDevice.query.filter_by(user_id=user_id, fingerprint=fingerprint).update(
+                    {'last_used': now, 'last_ip': request.remote_addr},
+                    synchronize_session=False
+                )
+                models.db.session.commit()
+                AuthManager._cache_device(user_id, fingerprint, device_token, now, request.remote_addr)
+            return device_token
+        
         # Generate a new device token
         device_token = AuthManager.generate_device_token()
         token_hash, token_salt = AuthManager.hash_token(device_token)
         
-        # Get device fingerprint
-        fingerprint = AuthManager.get_device_fingerprint()
+        # Insert or replace the single row for (user_id, fingerprint)
+        AuthManager._upsert_trusted_device({
+            'user_id': user_id,
+            'token_hash': token_hash,
+            'token_salt': token_salt,
+            'fingerprint': fingerprint,
+            'device_name': request.user_agent.browser,
+            'last_ip': request.remote_addr,
+            'created_at': now,
+            'last_used': now
+        })
+        # Any other worker's cached entry holds the token this one replaced
+        AuthManager.invalidate_device_cache(user_id, fingerprint)
+        AuthManager._cache_device(user_id, fingerprint, device_token, now, request.remote_addr)
         
-        # Check if this device is already registered
-        existing_device = models.TrustedDevice.query.filter_by(
-            user_id=user_id,
-            fingerprint=fingerprint
-        ).first()
+        AuthManager.cleanup_expired_devices()
         
-        if existing_device:
-            # Update the existing device
-            existing_device.token_hash = token_hash
-            existing_device.token_salt = token_salt
-            existing_device.last_used = datetime.datetime.utcnow()
-            existing_device.last_ip = request.remote_addr
-            models.db.session.commit()
+        return device_token
+    
+    @staticmethod
+    def _upsert_trusted_device(values):
+        """Single-statement INSERT ... ON CONFLICT (user_id, fingerprint) DO UPDATE"""
+        import models
+        
+        dialect = models.db.engine.dialect.name
+        if dialect == 'postgresql':
+            from sqlalchemy.dialects.postgresql import insert
+        elif dialect == 'sqlite':
+            from sqlalchemy.dialects.sqlite import insert
         else:
-            # Create a new trusted device record
-            new_device = models.TrustedDevice(
-                user_id=user_id,
-                token_hash=token_hash,
-                token_salt=token_salt,
-                fingerprint=fingerprint,
-                device_name=request.user_agent.browser,
-                last_ip=request.remote_addr,
-                last_used=datetime.datetime.utcnow()
-            )
-            models.db.session.add(new_device)
+            insert = None
+        
+        if insert is None:
+            existing_device = models.TrustedDevice.query.filter_by(
+                user_id=values['user_id'],
+                fingerprint=values['fingerprint']
+            ).first()
+            if existing_device:
+                for key in ('token_hash', 'token_salt', 'device_name', 'last_ip', 'last_used'):
+                    setattr(existing_device, key, values[key])
+            else:
+                models.db.session.add(models.TrustedDevice(**values))
             models.db.session.commit()
+            return
         
-        return device_token
+        stmt = insert(models.TrustedDevice.__table__).values(**values)
+        stmt = stmt.on_conflict_do_update(
+            index_elements=['user_id', 'fingerprint'],
+            set_={key: stmt.excluded[key] for key in ('token_hash', 'token_salt', 'device_name', 'last_ip', 'last_used')}
+        )
+        models.db.session.execute(stmt)
+        models.db.session.commit()
+    
+    _last_device_cleanup = None
+    
+    @staticmethod
+    def cleanup_expired_devices(force=False):
+        """Bulk-delete trusted devices unused for longer than DEVICE_TOKEN_MAX_AGE"""
+        import models
+        
+        now = time.monotonic()
+        last_cleanup = AuthManager._last_device_cleanup
+        if not force and last_cleanup is not None and now - last_cleanup < DEVICE_CLEANUP_INTERVAL:
+            return 0
+        AuthManager._last_device_cleanup = now
+        
+        cutoff = datetime.datetime.utcnow() - datetime.timedelta(seconds=DEVICE_TOKEN_MAX_AGE)
+        try:
+            deleted = models.TrustedDevice.query.filter(
+                models.TrustedDevice.last_used < cutoff
+            ).delete(synchronize_session=False)
+            models.db.session.commit()
+        except Exception as e:
+            models.db.session.rollback()
+            print(f"Error cleaning up expired trusted devices: {e}")
+            return 0
+        
+        if deleted:
+            with _device_cache_lock:
+                for key in [k for k, v in _device_cache.items() if v['last_used'] < cutoff]:
+                    del _device_cache[key]
+        return deleted
     
     @staticmethod
     def update_device_usage(user_id):
@@ -173,6 +318,7 @@ class AuthManager:
             device.last_used = datetime.datetime.utcnow()
             device.last_ip = request.remote_addr
             models.db.session.commit()
+            AuthManager.invalidate_device_cache(user_id, fingerprint)
     
     @staticmethod
     def revoke_all_devices(user_id):
@@ -181,6 +327,7 @@ class AuthManager:
         
         models.TrustedDevice.query.filter_by(user_id=user_id).delete()
         models.db.session.commit()
+        AuthManager.invalidate_device_cache(user_id)
 
 def login_required(f):
     """Decorator to require login for views"""
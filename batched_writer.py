@@ -0,0 +1,150 @@
+"""
+Background, batched writes to append-only tables
+
+Login attempts and client security events are recorded on hot request paths
+and only read later by admins. Rows are appended to an in-memory buffer and a
+daemon thread writes them every flush_interval seconds (or as soon as
+batch_size rows are waiting) in batched INSERTs, so a request never waits on a
+commit. Rows older than retention_days are deleted in batches once every
+prune_interval seconds.
+
+Subclasses name their model and set the constants; record() methods build the
+rows and hand them to _enqueue().
+"""
+import threading
+import time
+from collections import deque
+from datetime import datetime, timedelta
+
+
+class BatchedTableWriter:
+    """Buffer, background flush thread and retention prune for one table"""
+
+    model_name = None  # attribute of models, e.g. 'LoginAttempt'
+    label = 'rows'  # used in log messages
+    thread_name = 'batched-writer'
+
+    flush_interval = 5  # seconds
+    batch_size = 500
+    max_buffered = None  # rows beyond this are dropped (the database is unreachable)
+
+    retention_days = 90
+    prune_batch_size = 5000
+    prune_interval = 24 * 60 * 60  # once a day
+
+    def __init__(self):
+        self.app = None
+        self._buffer = deque()
+        self._wakeup = threading.Event()
+        self._thread = None
+        self._last_prune = None
+        self.metrics = {
+            'written': 0,
+            'last_error': None
+        }
+
+    def init_app(self, app):
+        """Bind to the Flask app used for the flush thread's context"""
+        self.app = app
+
+    def _ensure_worker(self):
+        if self._thread is None or not self._thread.is_alive():
+            self._thread = threading.Thread(target=self._run, name=self.thread_name, daemon=True)
+            self._thread.start()
+
+    def _enqueue(self, rows):
+        """Buffer rows for the next flush, returns how many were kept"""
+        if self.max_buffered is not None:
+            rows = rows[:max(0, self.max_buffered - len(self._buffer))]
+        self._buffer.extend(rows)
+
+        self._ensure_worker()
+        if len(self._buffer) >= self.batch_size:
+            self._wakeup.set()
+        return len(rows)
+
+    def _extra_rows(self):
+        """Rows a subclass adds at flush time (e.g. summaries of what it dropped)"""
+        return []
+
+    def flush(self):
+        """Write all buffered rows in batched INSERTs, returns rows written"""
+        import models
+
+        self._buffer.extend(self._extra_rows())
+
+        rows = []
+        while self._buffer and len(rows) < self.batch_size * 10:
+            rows.append(self._buffer.popleft())
+        if not rows:
+            return 0
+
+        table = getattr(models, self.model_name).__table__
+        try:
+            for start in range(0, len(rows), self.batch_size):
+                models.db.session.execute(table.insert(), rows[start:start + self.batch_size])
+            models.db.session.commit()
+        except Exception as e:
+            models.db.session.rollback()
+            self.metrics['last_error'] = str(e)
+            print(f"Error flushing {len(rows)} {self.label}: {e}")
+            # Requeued in order for the next flush
+            self._buffer.extendleft(reversed(rows))
+            return 0
+
+        self.metrics['written'] += len(rows)
+        return len(rows)
+
+    def prune(self, retention_days=None, batch_size=None):
+        """Delete rows older than retention_days in batches, returns rows deleted"""
+        import models
+
+        retention_days = retention_days or self.retention_days
+        batch_size = batch_size or self.prune_batch_size
+        model = getattr(models, self.model_name)
+        cutoff = datetime.utcnow() - timedelta(days=retention_days)
+        total = 0
+
+        while True:
+            ids = [row[0] for row in models.db.session.query(model.id)
+                   .filter(model.timestamp < cutoff)
+                   .order_by(model.timestamp)
+                   .limit(batch_size).all()]
+            if not ids:
+                break
+
+            model.query.filter(model.id.in_(ids)).delete(synchronize_session=False)
+            models.db.session.commit()
+            total += len(ids)
+
+            if len(ids) < batch_size:
+                break
+
+        return total
+
+    def _maintain(self):
+        """Periodic in-memory housekeeping, run after each prune"""
+
+    def _run(self):
+        while True:
+            self._wakeup.wait(self.flush_interval)
+            self._wakeup.clear()
+
+            if self.app is None:
+                continue
+
+            with self.app.app_context():
+                try:
+                    self.flush()
+
+                    if self._last_prune is None or time.monotonic() - self._last_prune > self.prune_interval:
+                        self._last_prune = time.monotonic()
+                        deleted = self.prune()
+                        if deleted:
+                            print(f"Pruned {deleted} {self.label} older than {self.retention_days} days")
+                        self._maintain()
+                except Exception as e:
+                    print(f"Error in the {self.thread_name} thread: {e}")
+                finally:
+                    import models
+                    models.db.session.remove()
@@ -0,0 +1,294 @@
+"""
+Blog tag index, full-text search and sidebar
+
+Blog.tags stays the comma-separated string the editor submits and the post
+page displays. Next to it, every post's tags are kept in blog_tag (one row per
+distinct tag, with the number of posts carrying it) and blog_tag_link, which
+the admin endpoints update in the same transaction as the post. Filtering by
+tag is an indexed join and the tag cloud reads the top blog_tag rows instead of
+splitting every post's tags in Python.
+
+Search ranks posts by relevance: Postgres full-text search over a weighted
+title/summary/content vector (backed by the ix_blog_search GIN index), or the
+blog_fts FTS5 table on SQLite. Without either it falls back to LIKE.
+
+The sidebar (categories, popular tags, recent posts) is built once and kept
+until a post is added, edited or deleted. invalidate() drops it in this worker
+and the 'blogs' page cache purge tells the other workers.
+"""
+import threading
+import time
+
+from text_search import prefix_tsquery, search_terms
+
+# Safety net for changes made outside the admin endpoints
+SIDEBAR_TTL = 10 * 60  # 10 minutes in seconds
+
+POPULAR_TAG_LIMIT = 12
+RECENT_POST_LIMIT = 3
+
+# Matches BlogTag.name
+MAX_TAG_LENGTH = 50
+
+# Title matches rank above summary matches, which rank above body matches.
+# The migration's GIN index is built on the same expression.
+SEARCH_VECTOR = (
+    "setweight(to_tsvector('english', coalesce(title, '')), 'A') || "
+    "setweight(to_tsvector('english', coalesce(summary, '')), 'B') || "
+    "setweight(to_tsvector('english', coalesce(content, '')), 'C')"
+)
+
+# bm25 column weights of blog_fts (title, summary, content)
+FTS_RANK = 'bm25(blog_fts, 10.0, 4.0, 1.0)'
+
+
+def parse_tags(raw):
+    """Distinct tag names of a comma-separated string, in the order given"""
+    names = []
+    seen = set()
+    for part in (raw or '').split(','):
+        name = ' '.join(part.split())[:MAX_TAG_LENGTH]
+        if name and name.lower() not in seen:
+            seen.add(name.lower())
+            names.append(name)
+    return names
+
+
+def tag_slug(name):
+    """Case-insensitive key of a tag name"""
+    return ' '.join((name or '').split())[:MAX_TAG_LENGTH].lower()
+
+
+class RecentPost:
+    """Read-only snapshot of a Blog row for the sidebar"""
+
+    __slots__ = ('id', 'title', 'image', 'date')
+
+    def __init__(self, blog):
+        for field in RecentPost.__slots__:
+            setattr(self, field, getattr(blog, field))
+
+    def __repr__(self):
+        return f'<RecentPost {self.id} {self.title}>'
+
+
+class BlogIndex:
+    """Tag bookkeeping, ranked search and the cached sidebar of the blog"""
+
+    def __init__(self):
+        self._sidebar = None  # (built_at, expires_at, data)
+        self._fts_available = None
+        self._lock = threading.Lock()
+        self.metrics = {
+            'sidebar_hits': 0,
+            'sidebar_builds': 0,
+            'tag_syncs': 0
+        }
+
+    # Tag bookkeeping (caller commits)
+
+    def sync_tags(self, blog):
+        """
+        Stage blog_tag/blog_tag_link changes for a flushed post's current tags
+
+        Counts are adjusted with relative UPDATEs, so concurrent edits of posts
+        sharing a tag do not overwrite each other.
+        """
+        import models
+
+        db = models.db
+        BlogTag, BlogTagLink = models.BlogTag, models.BlogTagLink
+
+        wanted = {tag_slug(name): name for name in parse_tags(blog.tags)}
+        linked = dict(
+            db.session.query(BlogTag.slug, BlogTag.id)
+            .join(BlogTagLink, BlogTagLink.tag_id == BlogTag.id)
+            .filter(BlogTagLink.blog_id == blog.id)
+            .all()
+        )
+
+        removed_ids = [tag_id for slug, tag_id in linked.items() if slug not in wanted]
+        if removed_ids:
+            BlogTagLink.query.filter(
+                BlogTagLink.blog_id == blog.id, BlogTagLink.tag_id.in_(removed_ids)
+            ).delete(synchronize_session=False)
+            BlogTag.query.filter(BlogTag.id.in_(removed_ids)).update(
+                {BlogTag.post_count: BlogTag.post_count - 1}, synchronize_session=False
+            )
+
+        added = {slug: name for slug, name in wanted.items() if slug not in linked}
+        if added:
+            tag_ids = self._ensure_tags(added)
+            for tag_id in tag_ids:
+                db.session.add(BlogTagLink(blog_id=blog.id, tag_id=tag_id))
+            BlogTag.query.filter(BlogTag.id.in_(tag_ids)).update(
+                {BlogTag.post_count: BlogTag.post_count + 1}, synchronize_session=False
+            )
+
+        self.metrics['tag_syncs'] += 1
+
+    def remove(self, blog):
+        """Stage the removal of a post's tag links, before the post is deleted"""
+        import models
+
+        BlogTag, BlogTagLink = models.BlogTag, models.BlogTagLink
+        tag_ids = [tag_id for (tag_id,) in BlogTagLink.query.with_entities(BlogTagLink.tag_id)
+                   .filter(BlogTagLink.blog_id == blog.id).all()]
+        if not tag_ids:
+            return
+
+        BlogTagLink.query.filter(BlogTagLink.blog_id == blog.id).delete(synchronize_session=False)
+        BlogTag.query.filter(BlogTag.id.in_(tag_ids)).update(
+            {BlogTag.post_count: BlogTag.post_count - 1}, synchronize_session=False
+        )
+
+    @staticmethod
+    def _ensure_tags(names_by_slug):
+        """Ids of the given tags, creating the missing ones"""
+        import models
+
+        db = models.db
+        BlogTag = models.BlogTag
+
+        dialect = db.engine.dialect.name
+        if dialect == 'postgresql':
+            from sqlalchemy.dialects.postgresql import insert
+        elif dialect == 'sqlite':
+            from sqlalchemy.dialects.sqlite import insert
+        else:
+            insert = None
+
+        if insert is None:
+            existing = {tag.slug for tag in BlogTag.query.filter(BlogTag.slug.in_(list(names_by_slug))).all()}
+            for slug, name in names_by_slug.items():
+                if slug not in existing:
+                    db.session.add(BlogTag(name=name, slug=slug, post_count=0))
+            db.session.flush()
+        else:
+            # Another admin may be creating the same tag right now
+            stmt = insert(BlogTag.__table__).values([
+                {'name': name, 'slug': slug, 'post_count': 0} for slug, name in names_by_slug.items()
+            ])
+            db.session.execute(stmt.on_conflict_do_nothing(index_elements=['slug']))
+
+        return [tag_id for (tag_id,) in db.session.query(BlogTag.id).filter(BlogTag.slug.in_(list(names_by_slug))).all()]
+
+    # Queries
+
+    @staticmethod
+    def filter_tag(query, tag):
+        """Restrict a Blog query to posts carrying `tag` (case-insensitive)"""
+        import models
+
+        Blog, BlogTag, BlogTagLink = models.Blog, models.BlogTag, models.BlogTagLink
+        tagged = (
+            models.db.session.query(BlogTagLink.blog_id)
+            .join(BlogTag, BlogTag.id == BlogTagLink.tag_id)
+            .filter(BlogTag.slug == tag_slug(tag))
+        )
+        return query.filter(Blog.id.in_(tagged))
+
+    def search(self, query, search):
+        """
+        Restrict a Blog query to posts matching every word of `search`, best match first
+
+        Callers add their own ordering after this one as the tie-breaker.
+        """
+        import models
+        from sqlalchemy import text
+
+        Blog = models.Blog
+        terms = search_terms(search)
+        if not terms:
+            return query
+
+        dialect = models.db.engine.dialect.name
+        if dialect == 'postgresql':
+            # Prefix match on every word, e.g. "flut react" finds "Flutter vs React Native"
+            tsquery = prefix_tsquery(terms)
+            return query.filter(
+                text(f"({SEARCH_VECTOR}) @@ to_tsquery('english', :blog_search)").bindparams(blog_search=tsquery)
+            ).order_by(
+                text(f"ts_rank({SEARCH_VECTOR}, to_tsquery('english', :blog_rank)) DESC").bindparams(blog_rank=tsquery)
+            )
+
+        if dialect == 'sqlite' and self._fts_ready():
+            from sqlalchemy import column, table
+
+            blog_fts = table('blog_fts', column('rowid'))
+            match = ' AND '.join(f'"{term}"*' for term in terms)
+            return query.join(blog_fts, blog_fts.c.rowid == Blog.id).filter(
+                text('blog_fts MATCH :blog_search').bindparams(blog_search=match)
+            ).order_by(text(FTS_RANK))
+
+        return query.filter(models.db.and_(*[
+            models.db.or_(
+                Blog.title.ilike(f'%{term}%'),
+                Blog.summary.ilike(f'%{term}%'),
+                Blog.content.ilike(f'%{term}%')
+            )
+            for term in terms
+        ]))
+
+    def _fts_ready(self):
+        """Whether the blog_fts table exists (created by migration 12 when SQLite has FTS5)"""
+        if self._fts_available is None:
+            import models
+            from sqlalchemy import text
+
+            self._fts_available = models.db.session.execute(
+                text("SELECT 1 FROM sqlite_master WHERE type = 'table' AND name = 'blog_fts'")
+            ).first() is not None
+        return self._fts_available
+
+    # Sidebar
+
+    def sidebar(self):
+        """{'categories': [(name, count)], 'popular_tags': [{'name', 'count'}], 'recent_posts': [RecentPost]}"""
+        from page_cache import page_cache
+
+        now = time.time()
+        with self._lock:
+            cached = self._sidebar
+        # A purge of 'blogs' by another worker also means the sidebar changed
+        if cached and cached[1] > now and page_cache.purged_at('blogs') < cached[0]:
+            self.metrics['sidebar_hits'] += 1
+            return cached[2]
+
+        data = self._build_sidebar()
+        with self._lock:
+            self._sidebar = (now, now + SIDEBAR_TTL, data)
+        self.metrics['sidebar_builds'] += 1
+        return data
+
+    @staticmethod
+    def _build_sidebar():
+        import models
+
+        db = models.db
+        Blog, BlogTag = models.Blog, models.BlogTag
+
+        categories = [
+            (name, count) for name, count in
+            db.session.query(Blog.category, db.func.count(Blog.id).label('count'))
+            .group_by(Blog.category).order_by(db.desc('count')).all()
+        ]
+        popular_tags = [
+            {'name': tag.name, 'count': tag.post_count} for tag in
+            BlogTag.query.filter(BlogTag.post_count > 0)
+            .order_by(BlogTag.post_count.desc(), BlogTag.name).limit(POPULAR_TAG_LIMIT).all()
+        ]
+        recent_posts = [
+            RecentPost(blog) for blog in
+            Blog.query.order_by(Blog.date.desc()).limit(RECENT_POST_LIMIT).all()
+        ]
+        return {'categories': categories, 'popular_tags': popular_tags, 'recent_posts': recent_posts}
+
+    def invalidate(self):
+        """Drop the cached sidebar after a post is added, edited or deleted"""
+        with self._lock:
+            self._sidebar = None
+
+
+# Shared blog index for the application
+blog_index = BlogIndex()
@@ -1,6 +1,6 @@
 import requests
 import os
-from urllib.parse import urljoin
+from urllib.parse import quote, urljoin
 import mimetypes
 from werkzeug.utils import secure_filename
 
@@ -22,6 +22,17 @@ class BunnyCDN:
             "Content-Type": "application/octet-stream"
         }
     
+    def _track_static(self, remote_path, present):
+        """Keep the CDN presence index used by serve_static in step with static/ uploads and deletes"""
+        if not remote_path.startswith('static/'):
+            return
+        from cdn_presence import cdn_presence
+        path = remote_path[len('static/'):]
+        if present:
+            cdn_presence.mark_present(path)
+        else:
+            cdn_presence.mark_absent(path)
+    
     def upload_file(self, file_path, remote_path):
         """
         Upload a file to Bunny CDN
@@ -53,6 +64,7 @@ class BunnyCDN:
             )
             
             if response.status_code in [200, 201]:
+                self._track_static(remote_path, present=True)
                 cdn_url = f"{self.cdn_url}/{remote_path}"
                 return {
                     'success': True,
@@ -73,6 +85,50 @@ class BunnyCDN:
                 'error': f'Upload error: {str(e)}'
             }
     
+    def upload_bytes(self, content, remote_path, content_type='application/octet-stream'):
+        """
+        Upload in-memory content to Bunny CDN
+        
+        Args:
+            content (bytes): File content
+            remote_path (str): Remote path on Bunny CDN (e.g., 'static/images/variants/x-640w.webp')
+            content_type (str): Content-Type the CDN serves it with
+        
+        Returns:
+            dict: Upload result with status and URL
+        """
+        try:
+            remote_path = remote_path.lstrip('/')
+            headers = self.headers.copy()
+            headers['Content-Type'] = content_type
+            
+            response = requests.put(
+                f"{self.base_url}/{quote(remote_path)}",
+                data=content,
+                headers=headers,
+                timeout=30
+            )
+            
+            if response.status_code in [200, 201]:
+                self._track_static(remote_path, present=True)
+                return {
+                    'success': True,
+                    'url': f"{self.cdn_url}/{quote(remote_path)}",
+                    'remote_path': remote_path
+                }
+            else:
+                return {
+                    'success': False,
+                    'error': f'Upload failed with status {response.status_code}: {response.text}',
+                    'status_code': response.status_code
+                }
+                
+        except Exception as e:
+            return {
+                'success': False,
+                'error': f'Upload error: {str(e)}'
+            }
+    
     def upload_ebook_file(self, file_obj, filename, file_type='pdf'):
         """
         Upload an ebook file to Bunny CDN in the 'ebooks' folder
@@ -105,6 +161,11 @@ class BunnyCDN:
             file_content = file_obj.read()
             file_obj.seek(0)  # Reset file pointer
             
+            # Covers are stored without metadata, with responsive variants next to them
+            if file_type == 'image':
+                from image_variants import image_variants
+                file_content = image_variants.optimize(file_content, remote_path)
+            
             # Set content type based on file type
             headers = self.headers.copy()
             if file_type == 'pdf':
@@ -189,6 +250,11 @@ class BunnyCDN:
             file_content = file_obj.read()
             file_obj.seek(0)  # Reset file pointer
             
+            # Course and instructor images are stored without metadata, with responsive variants next to them
+            if file_type == 'image':
+                from image_variants import image_variants
+                file_content = image_variants.optimize(file_content, remote_path)
+            
             # Set content type based on file type
             headers = self.headers.copy()
             if file_type == 'video':
@@ -256,6 +322,7 @@ class BunnyCDN:
             )
             
             if response.status_code == 200:
+                self._track_static(remote_path, present=False)
                 return {
                     'success': True,
                     'message': 'File deleted successfully'
@@ -274,19 +341,19 @@ class BunnyCDN:
     
     def generate_secure_url(self, remote_path, expiration_time=3600):
         """
-        Generate a secure URL with token (for future implementation)
+        Generate a secure URL with an expiring Bunny token (see signed_urls.py)
         
         Args:
             remote_path (str): Remote file path
             expiration_time (int): Expiration time in seconds
         
         Returns:
-            str: Secure URL with token
+            str: Secure URL with token, or the direct CDN URL when token authentication is not configured
         """
-        # For now, return the direct CDN URL
-        # In production, you can implement token-based authentication
+        import time
+        from signed_urls import url_signer
         remote_path = remote_path.lstrip('/')
-        return f"{self.cdn_url}/{remote_path}"
+        return url_signer.sign(f"{self.cdn_url}/{quote(remote_path)}", expires=time.time() + expiration_time)
     
     def upload_course_file_direct(self, file_obj, filename, file_type='video', course_name=None, progress_callback=None):
         """
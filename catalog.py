@@ -0,0 +1,420 @@
+"""
+In-process catalog of courses and ebooks
+
+Every course and ebook is held in memory as a compact __slots__ record with its
+pricing (current_price, has_public_discount) computed once when the record is
+built, along with the published ordering used by the listing pages. Catalog
+pages and JSON views read from here instead of querying Course/Ebook, and the
+JSON views are served from bytes serialized once per catalog version.
+
+Admin endpoints fire course_changed/ebook_changed/..._removed after they commit,
+which reloads just that row. Changes made by other worker processes are picked
+up by a background refresh that compares each table's (count, max(updated_at))
+watermark and reloads only the rows updated since the last refresh.
+"""
+import json
+import math
+import threading
+import time
+
+# How often the background thread checks for changes made by other workers
+CATALOG_REFRESH_INTERVAL = 30  # 30 seconds
+
+# Full rebuild as a safety net for changes that don't touch updated_at
+CATALOG_REBUILD_INTERVAL = 10 * 60  # 10 minutes in seconds
+
+
+def _pricing(price, discount_percent):
+    """Return (current_price, has_public_discount) as the Course/Ebook properties compute them"""
+    if discount_percent and discount_percent > 0:
+        return price * (1 - discount_percent / 100), True
+    return price, False
+
+
+class CourseRecord:
+    """Read-only snapshot of a Course row"""
+
+    __slots__ = (
+        'id', 'title', 'description', 'price', 'image', 'category',
+        'discount_percent', 'discounted_price', 'coupon', 'coupon_discount',
+        'instructor_name', 'instructor_image', 'about_course', 'what_youll_learn',
+        'course_requirements', 'instructor_bio', 'is_published', 'created_at',
+        'updated_at', 'admin_id', 'admin_name', 'current_price', 'has_public_discount',
+        'enrollment_count', 'admin_course_count'
+    )
+
+    def __init__(self, course, admin_name):
+        for field in CourseRecord.__slots__[:20]:
+            setattr(self, field, getattr(course, field))
+        self.admin_name = admin_name
+        self.current_price, self.has_public_discount = _pricing(course.price, course.discount_percent)
+        self.enrollment_count = 0
+        self.admin_course_count = 0
+
+    def __repr__(self):
+        return f'<CourseRecord {self.id} {self.title}>'
+
+
+class EbookRecord:
+    """Read-only snapshot of an Ebook row"""
+
+    __slots__ = (
+        'id', 'name', 'author', 'description', 'price', 'cover_image', 'category',
+        'discount_percent', 'discounted_price', 'coupon', 'coupon_discount',
+        'pages', 'language', 'isbn', 'publication_date', 'is_published',
+        'created_at', 'updated_at', 'admin_id', 'current_price', 'has_public_discount',
+        'total_purchases'
+    )
+
+    def __init__(self, ebook):
+        for field in EbookRecord.__slots__[:19]:
+            setattr(self, field, getattr(ebook, field))
+        self.current_price, self.has_public_discount = _pricing(ebook.price, ebook.discount_percent)
+        self.total_purchases = 0
+
+    def __repr__(self):
+        return f'<EbookRecord {self.id} {self.name}>'
+
+
+class CatalogPage:
+    """A page of catalog records with the same interface as Flask-SQLAlchemy's Pagination"""
+
+    def __init__(self, items, page, per_page, total):
+        self.items = items
+        self.page = page
+        self.per_page = per_page
+        self.total = total
+
+    @property
+    def pages(self):
+        return math.ceil(self.total / self.per_page) if self.total else 0
+
+    @property
+    def has_prev(self):
+        return self.page > 1
+
+    @property
+    def prev_num(self):
+        return self.page - 1 if self.has_prev else None
+
+    @property
+    def has_next(self):
+        return self.page < self.pages
+
+    @property
+    def next_num(self):
+        return self.page + 1 if self.has_next else None
+
+    def iter_pages(self, *, left_edge=2, left_current=2, right_current=4, right_edge=2):
+        """Page numbers for a pagination widget, with None marking skipped ranges"""
+        pages_end = self.pages + 1
+        if pages_end == 1:
+            return
+
+        left_end = min(1 + left_edge, pages_end)
+        yield from range(1, left_end)
+        if left_end == pages_end:
+            return
+
+        mid_start = max(left_end, self.page - left_current)
+        mid_end = min(self.page + right_current + 1, pages_end)
+        if mid_start - left_end > 0:
+            yield None
+        yield from range(mid_start, mid_end)
+        if mid_end == pages_end:
+            return
+
+        right_start = max(mid_end, pages_end - right_edge)
+        if right_start - mid_end > 0:
+            yield None
+        yield from range(right_start, pages_end)
+
+
+class Catalog:
+    """Courses and ebooks kept in memory, refreshed from admin change events"""
+
+    def __init__(self):
+        self.app = None
+        self.version = 0
+        self._courses = {}
+        self._ebooks = {}
+        self._published_courses = []  # ids, newest first
+        self._published_ebooks = []
+        self._watermarks = {}
+        self._json_cache = {}
+        self._loaded = False
+        self._last_rebuild = 0
+        self._lock = threading.RLock()
+        self._thread = None
+
+    def init_app(self, app):
+        """Bind to the Flask app used for the refresh thread's context"""
+        self.app = app
+
+    # Loading
+
+    def _load_courses(self, *criteria):
+        import models
+        Course, User = models.Course, models.User
+        rows = models.db.session.query(Course, User.first_name, User.last_name).outerjoin(
+            User, User.id == Course.admin_id
+        ).filter(*criteria).all()
+        records = [CourseRecord(course, f'{first_name} {last_name}' if first_name else None)
+                   for course, first_name, last_name in rows]
+        models.db.session.rollback()
+        return records
+
+    def _load_ebooks(self, *criteria):
+        import models
+        records = [EbookRecord(ebook) for ebook in models.Ebook.query.filter(*criteria).all()]
+        models.db.session.rollback()
+        return records
+
+    def _watermark(self, model):
+        import models
+        from sqlalchemy import func
+        return tuple(models.db.session.query(func.count(model.id), func.max(model.updated_at)).one())
+
+    def _query_counts(self):
+        """Return ({course_id: enrollments}, {ebook_id: purchases})"""
+        import models
+        from sqlalchemy import func
+        db = models.db
+
+        enrollments = dict(db.session.query(models.Enrollment.course_id, func.count(models.Enrollment.id))
+                           .group_by(models.Enrollment.course_id).all())
+        purchases = dict(db.session.query(models.EbookPurchase.ebook_id, func.count(models.EbookPurchase.id))
+                         .group_by(models.EbookPurchase.ebook_id).all())
+        db.session.rollback()
+        return enrollments, purchases
+
+    @staticmethod
+    def _apply_counts(courses, ebooks, enrollments, purchases):
+        """Set enrollment and purchase counts on records, returns True if any changed"""
+        changed = False
+        for course in courses:
+            count = enrollments.get(course.id, 0)
+            if course.enrollment_count != count:
+                course.enrollment_count = count
+                changed = True
+        for ebook in ebooks:
+            count = purchases.get(ebook.id, 0)
+            if ebook.total_purchases != count:
+                ebook.total_purchases = count
+                changed = True
+        return changed
+
+    def _reindex(self):
+        """Rebuild derived fields and published ordering; call with the lock held"""
+        admin_course_counts = {}
+        for course in self._courses.values():
+            admin_course_counts[course.admin_id] = admin_course_counts.get(course.admin_id, 0) + 1
+        for course in self._courses.values():
+            course.admin_course_count = admin_course_counts[course.admin_id]
+
+        def newest_first(records):
+            published = [record for record in records if record.is_published]
+            published.sort(key=lambda record: (record.created_at is not None, record.created_at, record.id),
+                           reverse=True)
+            return [record.id for record in published]
+
+        self._published_courses = newest_first(self._courses.values())
+        self._published_ebooks = newest_first(self._ebooks.values())
+        self.version += 1
+        self._json_cache = {}
+
+    def rebuild(self):
+        """Reload the whole catalog"""
+        import models
+        watermarks = {'course': self._watermark(models.Course), 'ebook': self._watermark(models.Ebook)}
+        courses = {record.id: record for record in self._load_courses()}
+        ebooks = {record.id: record for record in self._load_ebooks()}
+        self._apply_counts(courses.values(), ebooks.values(), *self._query_counts())
+
+        with self._lock:
+            self._courses = courses
+            self._ebooks = ebooks
+            self._watermarks = watermarks
+            self._reindex()
+            self._loaded = True
+            self._last_rebuild = time.monotonic()
+
+    def _ensure_loaded(self):
+        if not self._loaded:
+            with self._lock:
+                if not self._loaded:
+                    self.rebuild()
+        if (self.app is not None and self.app.config.get('BACKGROUND_WORKERS', True)
+                and (self._thread is None or not self._thread.is_alive())):
+            self._thread = threading.Thread(target=self._run, name='catalog-refresh', daemon=True)
+            self._thread.start()
+
+    def refresh(self):
+        """Pick up changes made by other workers since the last refresh"""
+        import models
+
+        if time.monotonic() - self._last_rebuild > CATALOG_REBUILD_INTERVAL:
+            self.rebuild()
+            return
+
+        changed = False
+        for kind, model, records, load in (
+            ('course', models.Course, lambda: self._courses, self._load_courses),
+            ('ebook', models.Ebook, lambda: self._ebooks, self._load_ebooks),
+        ):
+            watermark = self._watermark(model)
+            previous = self._watermarks.get(kind)
+            if watermark == previous:
+                continue
+
+            since = previous[1] if previous else None
+            updated = load(model.updated_at >= since) if since else load()
+            with self._lock:
+                current = records()
+                for record in updated:
+                    current[record.id] = record
+                self._watermarks[kind] = watermark
+                changed = True
+
+            # A row was deleted, or inserted without an updated_at
+            if len(records()) != watermark[0]:
+                self.rebuild()
+                return
+
+        enrollments, purchases = self._query_counts()
+        with self._lock:
+            if self._apply_counts(self._courses.values(), self._ebooks.values(), enrollments, purchases):
+                changed = True
+            if changed:
+                self._reindex()
+
+    def _run(self):
+        import models
+        while True:
+            time.sleep(CATALOG_REFRESH_INTERVAL)
+            with self.app.app_context():
+                try:
+                    self.refresh()
+                except Exception as e:
+                    models.db.session.rollback()
+                    print(f"Error refreshing catalog: {e}")
+                finally:
+                    models.db.session.remove()
+
+    # Change events from admin endpoints (call after committing)
+
+    def course_changed(self, course_id):
+        if not self._loaded:
+            return
+        import models
+        records = self._load_courses(models.Course.id == course_id)
+        with self._lock:
+            if records:
+                record = records[0]
+                previous = self._courses.get(course_id)
+                record.enrollment_count = previous.enrollment_count if previous else 0
+                self._courses[course_id] = record
+            else:
+                self._courses.pop(course_id, None)
+            self._reindex()
+
+    def ebook_changed(self, ebook_id):
+        if not self._loaded:
+            return
+        import models
+        records = self._load_ebooks(models.Ebook.id == ebook_id)
+        with self._lock:
+            if records:
+                record = records[0]
+                previous = self._ebooks.get(ebook_id)
+                record.total_purchases = previous.total_purchases if previous else 0
+                self._ebooks[ebook_id] = record
+            else:
+                self._ebooks.pop(ebook_id, None)
+            self._reindex()
+
+    def course_removed(self, course_id):
+        with self._lock:
+            if self._courses.pop(course_id, None) is not None:
+                self._reindex()
+
+    def ebook_removed(self, ebook_id):
+        with self._lock:
+            if self._ebooks.pop(ebook_id, None) is not None:
+                self._reindex()
+
+    # Reads
+
+    def get_course(self, course_id, published_only=False):
+        self._ensure_loaded()
+        course = self._courses.get(course_id)
+        if course is None or (published_only and not course.is_published):
+            return None
+        return course
+
+    def get_ebook(self, ebook_id, published_only=False):
+        self._ensure_loaded()
+        ebook = self._ebooks.get(ebook_id)
+        if ebook is None or (published_only and not ebook.is_published):
+            return None
+        return ebook
+
+    def _page(self, ids, records, page, per_page):
+        page = max(page, 1)
+        start = (page - 1) * per_page
+        items = [records[record_id] for record_id in ids[start:start + per_page]]
+        return CatalogPage(items, page, per_page, len(ids))
+
+    def published_courses(self, page=1, per_page=6):
+        """A page of published courses, newest first"""
+        self._ensure_loaded()
+        with self._lock:
+            return self._page(self._published_courses, self._courses, page, per_page)
+
+    def published_ebooks(self, page=1, per_page=6):
+        """A page of published ebooks, newest first"""
+        self._ensure_loaded()
+        with self._lock:
+            return self._page(self._published_ebooks, self._ebooks, page, per_page)
+
+    def courses(self, admin_id=None, published=None):
+        """All courses, newest first, optionally filtered by admin and published state"""
+        self._ensure_loaded()
+        with self._lock:
+            records = list(self._courses.values())
+        return self._filter(records, admin_id, published)
+
+    def ebooks(self, admin_id=None, published=None):
+        """All ebooks, newest first, optionally filtered by admin and published state"""
+        self._ensure_loaded()
+        with self._lock:
+            records = list(self._ebooks.values())
+        return self._filter(records, admin_id, published)
+
+    @staticmethod
+    def _filter(records, admin_id, published):
+        if admin_id is not None:
+            records = [record for record in records if record.admin_id == admin_id]
+        if published is not None:
+            records = [record for record in records if bool(record.is_published) == published]
+        records.sort(key=lambda record: (record.created_at is not None, record.created_at, record.id),
+                     reverse=True)
+        return records
+
+    def json_bytes(self, key, build):
+        """Return build() serialized to JSON, cached until the catalog next changes"""
+        self._ensure_loaded()
+        version = self.version
+        cached = self._json_cache.get(key)
+        if cached and cached[0] == version:
+            return cached[1]
+
+        body = json.dumps(build(), separators=(',', ':')).encode('utf-8')
+        with self._lock:
+            if self.version == version:
+                self._json_cache[key] = (version, body)
+        return body
+
+
+# Shared catalog for the application
+catalog = Catalog()
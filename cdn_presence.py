@@ -0,0 +1,200 @@
+"""
+Index of static files present on Bunny CDN
+
+serve_static has to decide, for every /static/ request that reaches Flask,
+whether to redirect to the CDN copy or serve the local file. Rather than
+sending a HEAD request to the CDN each time, this keeps the set of paths known
+to be in the storage zone's static/ directory in memory:
+
+- the upload endpoints add a path as soon as Bunny accepts the PUT
+  (and BunnyCDN.delete_file removes it);
+- a background sync walks static/ with the storage API every SYNC_INTERVAL
+  seconds and replaces the set, picking up files uploaded by other workers.
+
+A path that is not in the index is only probed with a HEAD request when the
+index has never been synced (or has gone stale); the answer is cached, and a
+miss expires after NEGATIVE_TTL seconds so a file uploaded elsewhere is picked
+up soon. Against a fresh index a miss is just a set lookup and is not recorded,
+so requests for arbitrary /static/ paths cannot grow the index.
+"""
+import threading
+import time
+
+import requests
+
+# How often the index is rebuilt from the storage API
+SYNC_INTERVAL = 10 * 60  # 10 minutes in seconds
+
+# An index older than this no longer counts as authoritative for misses
+STALE_AFTER = 3 * SYNC_INTERVAL
+
+# Misses are remembered this long before the path is looked up again
+NEGATIVE_TTL = 5 * 60  # 5 minutes in seconds
+
+# Remembered misses beyond this are dropped, oldest first
+MAX_ABSENT_PATHS = 10000
+
+# Directories listed per sync, a guard against runaway trees
+MAX_SYNC_DIRECTORIES = 500
+
+# Storage zone directory that mirrors the local static folder
+STATIC_ROOT = 'static'
+
+PROBE_TIMEOUT = 2
+
+
+class CdnPresence:
+    """In-memory set of static paths present on the CDN"""
+
+    def __init__(self):
+        self.app = None
+        self._present = set()
+        self._absent = {}  # path -> expires_at
+        self._marked_during_sync = None  # paths uploaded while a sync is listing
+        self._lock = threading.Lock()
+        self._synced_at = None
+        self.metrics = {
+            'paths': 0,
+            'hits': 0,
+            'misses': 0,
+            'probes': 0,
+            'last_sync_at': None,
+            'last_sync_duration': None,
+            'last_error': None
+        }
+
+    def init_app(self, app):
+        """Bind to the Flask app, whose BUNNY_CDN_STATIC_URL is used for probes"""
+        self.app = app
+
+    # Updates
+
+    def mark_present(self, path):
+        """Record a static path (relative to static/, e.g. 'images/x.png') as uploaded"""
+        path = path.lstrip('/')
+        with self._lock:
+            self._present.add(path)
+            self._absent.pop(path, None)
+            if self._marked_during_sync is not None:
+                self._marked_during_sync.add(path)
+            self.metrics['paths'] = len(self._present)
+
+    def mark_absent(self, path):
+        """Record a static path as missing (deleted, or not found by a probe)"""
+        path = path.lstrip('/')
+        with self._lock:
+            self._present.discard(path)
+            self._absent.pop(path, None)
+            self._absent[path] = time.monotonic() + NEGATIVE_TTL
+            while len(self._absent) > MAX_ABSENT_PATHS:
+                del self._absent[next(iter(self._absent))]
+            if self._marked_during_sync is not None:
+                self._marked_during_sync.discard(path)
+            self.metrics['paths'] = len(self._present)
+
+    # Lookup
+
+    def is_present(self, path):
+        """
+        Whether the CDN has static/<path>
+
+        A set lookup once the index has been synced; before that, an unknown path is
+        probed once and the answer cached.
+        """
+        path = path.lstrip('/')
+        now = time.monotonic()
+        with self._lock:
+            if path in self._present:
+                self.metrics['hits'] += 1
+                return True
+            expires_at = self._absent.get(path)
+            if expires_at and expires_at > now:
+                self.metrics['misses'] += 1
+                return False
+            fresh = self._synced_at is not None and now - self._synced_at < STALE_AFTER
+            if fresh:
+                # The index is authoritative; nothing to remember
+                self.metrics['misses'] += 1
+                return False
+
+        return self._probe(path)
+
+    def _probe(self, path):
+        self.metrics['probes'] += 1
+        try:
+            response = requests.head(f"{self.app.config['BUNNY_CDN_STATIC_URL']}/{path}", timeout=PROBE_TIMEOUT)
+            present = response.status_code == 200
+        except requests.RequestException:
+            present = False
+
+        if present:
+            self.mark_present(path)
+        else:
+            self.mark_absent(path)
+        return present
+
+    # Sync
+
+    def sync(self):
+        """Rebuild the index from the storage API, returns the number of paths found"""
+        from bunny_cdn import bunny_cdn
+
+        started = time.monotonic()
+        with self._lock:
+            self._marked_during_sync = set()
+        found = set()
+        pending = ['']
+        listed = 0
+        try:
+            while pending and listed < MAX_SYNC_DIRECTORIES:
+                directory = pending.pop()
+                result = bunny_cdn.list_files(f'{STATIC_ROOT}/{directory}'.rstrip('/'))
+                listed += 1
+                if not result['success']:
+                    raise RuntimeError(result['error'])
+
+                for entry in result['files']:
+                    name = f"{directory}{entry['ObjectName']}"
+                    if entry.get('IsDirectory'):
+                        pending.append(f'{name}/')
+                    else:
+                        found.add(name)
+        except Exception as e:
+            with self._lock:
+                self._marked_during_sync = None
+            self.metrics['last_error'] = str(e)
+            print(f"❌ CDN presence sync error: {str(e)}")
+            return None
+
+        if pending:
+            print(f"⚠️ CDN presence sync stopped after {MAX_SYNC_DIRECTORIES} directories")
+
+        with self._lock:
+            # Uploads that landed while the listing ran may be missing from it
+            self._present = found | self._marked_during_sync
+            self._marked_during_sync = None
+            now = time.monotonic()
+            self._absent = {path: expires_at for path, expires_at in self._absent.items()
+                            if path not in found and expires_at > now}
+            self._synced_at = time.monotonic()
+            self.metrics.update({
+                'paths': len(self._present),
+                'last_sync_at': time.time(),
+                'last_sync_duration': round(time.monotonic() - started, 3),
+                'last_error': None
+            })
+        print(f"🗂️ CDN presence index synced: {len(found)} static files")
+        return len(found)
+
+    def start_periodic(self, interval=SYNC_INTERVAL):
+        """Sync now and then every `interval` seconds for the lifetime of the process"""
+        def loop():
+            while True:
+                self.sync()
+                time.sleep(interval)
+
+        threading.Thread(target=loop, name='cdn-presence-sync', daemon=True).start()
+
+
+# Shared index for the application
+cdn_presence = CdnPresence()
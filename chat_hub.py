@@ -0,0 +1,257 @@
+"""
+Push delivery of chat messages over Server-Sent Events
+
+Each open chat tab holds one SSE stream subscribed to its conversation_key.
+A sent message is fanned out to the subscribers in this process as soon as it
+is committed, and to the other worker processes through Postgres
+LISTEN/NOTIFY: the NOTIFY is issued in the same transaction as the INSERT, so
+it is delivered exactly when the message becomes visible. One listener thread
+per process owns a dedicated connection for LISTEN; everything else is
+in-memory, so an idle tab costs no queries.
+
+Every subscriber has a bounded queue. A client that falls SUBSCRIBER_QUEUE_SIZE
+messages behind is sent a resync event and disconnected instead of buffering
+without limit; it reconnects with Last-Event-ID and fetches what it missed with
+/api/messages?since_id=. A client resuming after more than one page of missed
+messages is sent that page and a resync the same way. SQLite (development) has no NOTIFY, so delivery there
+is in-process only.
+"""
+import json
+import queue
+import threading
+import time
+from collections import defaultdict, deque
+
+NOTIFY_CHANNEL = 'chat_messages'
+
+# Postgres rejects NOTIFY payloads over 8000 bytes; larger messages are announced by id only
+MAX_NOTIFY_PAYLOAD = 7000
+
+# Comment line sent on an idle stream so proxies keep it open
+HEARTBEAT_INTERVAL = 15  # 15 seconds
+
+# Client reconnect delay sent with the stream's first frame
+RECONNECT_DELAY_MS = 3000
+
+# Messages buffered per subscriber before it is told to resync
+SUBSCRIBER_QUEUE_SIZE = 100
+
+# Message ids remembered per subscriber to drop the NOTIFY echo of a local publish
+SEEN_IDS = 500
+
+# Open streams allowed per process
+MAX_SUBSCRIBERS = 1000
+
+# Wait between attempts to re-establish the LISTEN connection
+LISTENER_RETRY_DELAY = 5  # 5 seconds
+
+
+class Subscription:
+    """One open stream on a conversation"""
+
+    __slots__ = ('key', 'queue', 'seen', 'seen_order', 'overflowed')
+
+    def __init__(self, key):
+        self.key = key
+        self.queue = queue.Queue(maxsize=SUBSCRIBER_QUEUE_SIZE)
+        self.seen = set()
+        self.seen_order = deque()
+        self.overflowed = False
+
+    def first_sight(self, message_id):
+        """Remember a message id, False if it was already seen"""
+        if message_id in self.seen:
+            return False
+        self.seen.add(message_id)
+        self.seen_order.append(message_id)
+        if len(self.seen_order) > SEEN_IDS:
+            self.seen.discard(self.seen_order.popleft())
+        return True
+
+
+class ChatHub:
+    """In-process fan-out of chat messages, relayed between workers with LISTEN/NOTIFY"""
+
+    def __init__(self):
+        self.app = None
+        self._subscribers = defaultdict(set)  # conversation_key -> {Subscription}
+        self._lock = threading.Lock()
+        self._listener = None
+        self.metrics = {
+            'subscribers': 0,
+            'published': 0,
+            'relayed': 0,
+            'dropped_slow_clients': 0,
+            'listener_connected': False,
+            'last_error': None
+        }
+
+    def init_app(self, app):
+        """Bind to the Flask app; the LISTEN thread starts with the first subscriber"""
+        self.app = app
+
+    def _uses_notify(self):
+        return self.app.config.get('SQLALCHEMY_DATABASE_URI', '').startswith('postgresql')
+
+    # Subscribing
+
+    def subscribe(self, key):
+        """Register a stream, returns None when the process already has MAX_SUBSCRIBERS"""
+        subscription = Subscription(key)
+        with self._lock:
+            if self.metrics['subscribers'] >= MAX_SUBSCRIBERS:
+                return None
+            self._subscribers[key].add(subscription)
+            self.metrics['subscribers'] += 1
+
+        if self._uses_notify():
+            self._ensure_listener()
+        return subscription
+
+    def unsubscribe(self, subscription):
+        with self._lock:
+            subscribers = self._subscribers.get(subscription.key)
+            if subscribers and subscription in subscribers:
+                subscribers.discard(subscription)
+                self.metrics['subscribers'] -= 1
+                if not subscribers:
+                    del self._subscribers[subscription.key]
+
+    # Publishing
+
+    def notify(self, key, message):
+        """
+        Announce a flushed, not yet committed message to the other workers
+
+        Call before the commit: the NOTIFY rides on the same transaction, so it is only
+        delivered if the message is.
+        """
+        if not self._uses_notify():
+            return
+
+        import models
+        from sqlalchemy import text
+
+        payload = json.dumps({'key': key, 'message': message}, separators=(',', ':'))
+        if len(payload.encode('utf-8')) > MAX_NOTIFY_PAYLOAD:
+            payload = json.dumps({'key': key, 'message': {'id': message['id']}, 'truncated': True})
+        models.db.session.execute(text('SELECT pg_notify(:channel, :payload)'),
+                                  {'channel': NOTIFY_CHANNEL, 'payload': payload})
+
+    def publish(self, key, message, truncated=False):
+        """Deliver a committed message to this process's subscribers"""
+        with self._lock:
+            for subscription in self._subscribers.get(key, ()):
+                # The NOTIFY for a message sent from this process arrives after the direct
+                # publish. Ids are not published in order across workers (they are assigned
+                # at flush, not at commit), so duplicates are recognised by id, not by a high-water mark
+                if not subscription.first_sight(message['id']):
+                    continue
+                try:
+                    subscription.queue.put_nowait((message, truncated))
+                except queue.Full:
+                    subscription.overflowed = True
+                    self.metrics['dropped_slow_clients'] += 1
+
+            self.metrics['published'] += 1
+
+    # Streaming
+
+    def stream(self, subscription, backlog=(), backlog_complete=True):
+        """
+        Server-Sent Events for one subscription, starting with `backlog` (already serialized messages)
+
+        When the backlog is only the first page of what the client missed
+        (backlog_complete=False), it is followed by a resync event and the stream
+        ends; the client reconnects with the Last-Event-ID of the page and gets the next.
+        Touches no database; runs until the client disconnects or falls too far behind.
+        """
+        try:
+            yield f'retry: {RECONNECT_DELAY_MS}\n\n'
+            sent = set()
+            for message in backlog:
+                yield self._event(message)
+                sent.add(message['id'])
+            if not backlog_complete:
+                yield 'event: resync\ndata: {}\n\n'
+                return
+
+            while True:
+                if subscription.overflowed:
+                    yield 'event: resync\ndata: {}\n\n'
+                    return
+                try:
+                    item = subscription.queue.get(timeout=HEARTBEAT_INTERVAL)
+                except queue.Empty:
+                    yield ': heartbeat\n\n'
+                    continue
+                message, truncated = item
+                # Published while the backlog was being read
+                if message['id'] in sent:
+                    continue
+                if truncated:
+                    yield f'id: {message["id"]}\nevent: resync\ndata: {{}}\n\n'
+                else:
+                    yield self._event(message)
+        finally:
+            self.unsubscribe(subscription)
+
+    @staticmethod
+    def _event(message):
+        return f'id: {message["id"]}\nevent: message\ndata: {json.dumps(message, separators=(",", ":"))}\n\n'
+
+    # Cross-worker relay
+
+    def _ensure_listener(self):
+        with self._lock:
+            if self._listener and self._listener.is_alive():
+                return
+            self._listener = threading.Thread(target=self._listen, name='chat-hub-listener', daemon=True)
+            self._listener.start()
+
+    def _listen(self):
+        """Relay NOTIFY payloads from other workers to local subscribers"""
+        import select
+        import models
+
+        while True:
+            raw = None
+            try:
+                with self.app.app_context():
+                    raw = models.db.engine.raw_connection()
+                # Keep the autocommit LISTEN connection out of the pool
+                raw.detach()
+                connection = raw.driver_connection
+                connection.autocommit = True
+                connection.cursor().execute(f'LISTEN {NOTIFY_CHANNEL}')
+                self.metrics['listener_connected'] = True
+
+                while True:
+                    if select.select([connection], [], [], HEARTBEAT_INTERVAL) == ([], [], []):
+                        continue
+                    connection.poll()
+                    while connection.notifies:
+                        self._relay(connection.notifies.pop(0).payload)
+            except Exception as e:
+                self.metrics['last_error'] = str(e)
+                print(f"❌ Chat hub listener error: {str(e)}")
+                time.sleep(LISTENER_RETRY_DELAY)
+            finally:
+                self.metrics['listener_connected'] = False
+                if raw is not None:
+                    try:
+                        raw.close()
+                    except Exception:
+                        pass
+
+    def _relay(self, payload):
+        try:
+            data = json.loads(payload)
+        except ValueError:
+            return
+        self.metrics['relayed'] += 1
+        self.publish(data['key'], data['message'], truncated=data.get('truncated', False))
+
+
+# Shared hub for the application
+chat_hub = ChatHub()
@@ -0,0 +1,108 @@
+"""
+Chat inbox summaries
+
+One chat_conversations row per conversation_key holds the last message (id,
+time, preview) and an unread counter for each side. It is upserted in the same
+transaction as every Message insert, so the admin inbox is a keyset page over
+(admin_id, last_message_at) and an unread badge is read straight off the row
+instead of scanning the message history or the user table.
+"""
+
+# Characters of the last message kept for the inbox list
+PREVIEW_LENGTH = 120
+
+
+class ChatInbox:
+    """Maintains and reads chat_conversations"""
+
+    @staticmethod
+    def record_message(message, user_party_id, admin_party_id):
+        """
+        Stage the summary update for a flushed message (committed with it)
+
+        Args:
+            message: The new Message, flushed so it has an id
+            user_party_id (int): Id of the non-admin party
+            admin_party_id (int): Id of the admin party
+        """
+        import models
+
+        db = models.db
+        table = models.ChatConversation.__table__
+        from_admin = bool(message.is_from_admin)
+        values = {
+            'conversation_key': message.conversation_key,
+            'user_id': int(user_party_id),
+            'admin_id': int(admin_party_id),
+            'last_message_id': message.id,
+            'last_message_at': message.timestamp,
+            'last_message_preview': (message.content or '')[:PREVIEW_LENGTH],
+            'last_message_from_admin': from_admin,
+            'user_unread': 1 if from_admin else 0,
+            'admin_unread': 0 if from_admin else 1
+        }
+
+        dialect = db.engine.dialect.name
+        if dialect == 'postgresql':
+            from sqlalchemy.dialects.postgresql import insert
+        elif dialect == 'sqlite':
+            from sqlalchemy.dialects.sqlite import insert
+        else:
+            insert = None
+
+        if insert is None:
+            conversation = db.session.get(models.ChatConversation, message.conversation_key)
+            if conversation is None:
+                db.session.add(models.ChatConversation(**values))
+                return
+            for key in ('last_message_id', 'last_message_at', 'last_message_preview', 'last_message_from_admin'):
+                setattr(conversation, key, values[key])
+            conversation.user_unread = (conversation.user_unread or 0) + values['user_unread']
+            conversation.admin_unread = (conversation.admin_unread or 0) + values['admin_unread']
+            return
+
+        stmt = insert(table).values(**values)
+        stmt = stmt.on_conflict_do_update(
+            index_elements=['conversation_key'],
+            set_={
+                'last_message_id': stmt.excluded.last_message_id,
+                'last_message_at': stmt.excluded.last_message_at,
+                'last_message_preview': stmt.excluded.last_message_preview,
+                'last_message_from_admin': stmt.excluded.last_message_from_admin,
+                'user_unread': table.c.user_unread + stmt.excluded.user_unread,
+                'admin_unread': table.c.admin_unread + stmt.excluded.admin_unread
+            }
+        )
+        db.session.execute(stmt)
+
+    @staticmethod
+    def mark_read(key, side):
+        """Zero one side's unread counter; side is 'admin' or 'user'. Commits."""
+        import models
+
+        column = 'admin_unread' if side == 'admin' else 'user_unread'
+        ChatConversation = models.ChatConversation
+        updated = ChatConversation.query.filter(
+            ChatConversation.conversation_key == key,
+            getattr(ChatConversation, column) > 0
+        ).update({column: 0}, synchronize_session=False)
+        if updated:
+            models.db.session.commit()
+        return updated
+
+    @staticmethod
+    def unread_total(admin_id=None, user_id=None):
+        """Unread messages across one admin's (or one user's) conversations"""
+        import models
+        from sqlalchemy import func
+
+        ChatConversation = models.ChatConversation
+        if admin_id is not None:
+            query = models.db.session.query(func.sum(ChatConversation.admin_unread)).filter(
+                ChatConversation.admin_id == admin_id, ChatConversation.admin_unread > 0
+            )
+        else:
+            query = models.db.session.query(func.sum(ChatConversation.user_unread)).filter(
+                ChatConversation.user_id == user_id, ChatConversation.user_unread > 0
+            )
+        return query.scalar() or 0
@@ -0,0 +1,77 @@
+"""
+Incremental chat history
+
+Every Message carries a conversation_key ("<lower id>:<higher id>" of the two
+parties) indexed together with id, so a conversation is read with one index
+range scan: the newest CHAT_PAGE_SIZE messages for a first load, since_id for
+polls and before_id for scrolling back. A poll sends If-None-Match with the
+ETag of the conversation's last message id and gets a 304 when nothing is new.
+"""
+
+# Messages returned by a first load or one step of scrolling back
+CHAT_PAGE_SIZE = 50
+MAX_CHAT_PAGE_SIZE = 200
+
+
+def conversation_key(first_id, second_id):
+    """Same key whichever party is the sender"""
+    first_id, second_id = int(first_id), int(second_id)
+    return f'{min(first_id, second_id)}:{max(first_id, second_id)}'
+
+
+def serialize(message):
+    return {
+        'id': message.id,
+        'content': message.content,
+        'timestamp': message.timestamp.strftime('%Y-%m-%d %H:%M:%S'),
+        'is_from_admin': message.is_from_admin
+    }
+
+
+class ChatHistory:
+    """Cursor-based reads of one conversation"""
+
+    @staticmethod
+    def latest_id(key):
+        """Id of the newest message in the conversation, 0 when it is empty"""
+        import models
+        from sqlalchemy import func
+        Message = models.Message
+        return models.db.session.query(func.max(Message.id)).filter(
+            Message.conversation_key == key
+        ).scalar() or 0
+
+    @staticmethod
+    def page(key, since_id=None, before_id=None, limit=CHAT_PAGE_SIZE):
+        """
+        Read part of a conversation, oldest message first
+
+        Args:
+            key (str): conversation_key()
+            since_id (int): Only messages newer than this (polling)
+            before_id (int): Only messages older than this (scrolling back)
+            limit (int): Maximum messages returned
+
+        Returns:
+            tuple: (messages, has_more) where has_more means older (or, with since_id, newer)
+                   messages exist beyond this page
+        """
+        import models
+        Message = models.Message
+
+        limit = max(1, min(limit or CHAT_PAGE_SIZE, MAX_CHAT_PAGE_SIZE))
+        query = Message.query.filter(Message.conversation_key == key)
+
+        if since_id is not None:
+            messages = query.filter(Message.id > since_id).order_by(Message.id).limit(limit + 1).all()
+            return messages[:limit], len(messages) > limit
+
+        if before_id is not None:
+            query = query.filter(Message.id < before_id)
+        messages = query.order_by(Message.id.desc()).limit(limit + 1).all()
+        has_more = len(messages) > limit
+        return list(reversed(messages[:limit])), has_more
+
+    @staticmethod
+    def etag(key, latest_id):
+        return f'chat-{key}-{latest_id}'
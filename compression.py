@@ -0,0 +1,142 @@
+"""
+Response compression
+
+HTML pages and JSON responses went out uncompressed. The after_request hook
+registered by init_app() compresses them with Brotli when the client accepts
+it and the brotli package is installed, and with gzip otherwise:
+
+- responses smaller than COMPRESSION_MIN_SIZE are left alone, the framing
+  would cost more than it saves;
+- only text types are compressed; files sent with send_file (images, PDFs,
+  video) and responses that are already encoded (the page cache's gzip copy,
+  the precompressed static bundles) pass through untouched;
+- a streamed response is compressed chunk by chunk and flushed after each
+  one, so the client still receives every chunk as soon as it is produced.
+  Server-sent event streams are skipped: their events are tiny and proxies
+  buffer compressed streams.
+"""
+import gzip
+import zlib
+
+try:
+    import brotli
+except ImportError:
+    # gzip only; every browser that sends br also accepts gzip
+    brotli = None
+
+# Below this the encoded response is barely smaller, if at all
+COMPRESSION_MIN_SIZE = 500  # bytes
+
+# Per-request levels favour speed; static bundles are compressed at maximum level once, at build time
+GZIP_LEVEL = 6
+BROTLI_QUALITY = 5
+
+COMPRESSIBLE_MIMETYPES = {
+    'text/html',
+    'text/css',
+    'text/plain',
+    'text/xml',
+    'text/csv',
+    'text/javascript',
+    'application/javascript',
+    'application/json',
+    'application/xml',
+    'application/rss+xml',
+    'image/svg+xml',
+}
+
+
+class ResponseCompressor:
+    """Negotiates and applies Content-Encoding to outgoing responses"""
+
+    def __init__(self):
+        self.metrics = {
+            'compressed': 0,
+            'streamed': 0,
+            'skipped_small': 0,
+            'bytes_in': 0,
+            'bytes_out': 0
+        }
+
+    def init_app(self, app):
+        """Compress every response of the app on its way out"""
+        app.after_request(self.compress)
+
+    @staticmethod
+    def available_encodings():
+        return ['br', 'gzip'] if brotli is not None else ['gzip']
+
+    @staticmethod
+    def _compressible(response):
+        from flask import request
+
+        if request.method == 'HEAD' or response.status_code < 200 or response.status_code in (204, 206, 304):
+            return False
+        if response.direct_passthrough or 'Content-Encoding' in response.headers:
+            return False
+        if 'no-transform' in response.headers.get('Cache-Control', ''):
+            return False
+        return response.mimetype in COMPRESSIBLE_MIMETYPES
+
+    def compress(self, response):
+        """after_request hook"""
+        from flask import request
+
+        if not self._compressible(response):
+            return response
+
+        # The body differs by Accept-Encoding even when this client gets it uncompressed
+        response.vary.add('Accept-Encoding')
+        coding = request.accept_encodings.best_match(self.available_encodings())
+        if coding is None:
+            return response
+
+        if response.is_streamed:
+            self._compress_stream(response, coding)
+        else:
+            data = response.get_data()
+            if len(data) < COMPRESSION_MIN_SIZE:
+                self.metrics['skipped_small'] += 1
+                return response
+            encoded = brotli.compress(data, quality=BROTLI_QUALITY) if coding == 'br' else gzip.compress(data, compresslevel=GZIP_LEVEL)
+            response.set_data(encoded)
+            self.metrics['bytes_in'] += len(data)
+            self.metrics['bytes_out'] += len(encoded)
+
+        response.headers['Content-Encoding'] = coding
+        # The encoded body is not byte-identical to the original any more
+        etag, weak = response.get_etag()
+        if etag and not weak:
+            response.set_etag(etag, weak=True)
+        self.metrics['compressed'] += 1
+        return response
+
+    def _compress_stream(self, response, coding):
+        chunks = response.iter_encoded()
+        original = response.response
+        if hasattr(original, 'close'):
+            response.call_on_close(original.close)
+
+        def generate():
+            if coding == 'br':
+                compressor = brotli.Compressor(quality=BROTLI_QUALITY)
+                for chunk in chunks:
+                    data = compressor.process(chunk) + compressor.flush()
+                    if data:
+                        yield data
+                yield compressor.finish()
+            else:
+                compressor = zlib.compressobj(GZIP_LEVEL, zlib.DEFLATED, 16 + zlib.MAX_WBITS)
+                for chunk in chunks:
+                    data = compressor.compress(chunk) + compressor.flush(zlib.Z_SYNC_FLUSH)
+                    if data:
+                        yield data
+                yield compressor.flush()
+
+        response.response = generate()
+        response.headers.pop('Content-Length', None)
+        self.metrics['streamed'] += 1
+
+
+# Shared compressor for the application
+response_compressor = ResponseCompressor()
@@ -0,0 +1,212 @@
+"""
+Contact message administration
+
+Listing, search and bulk triage of contact form submissions. A selection is
+either a list of ids or the same filter the list is showing (read status,
+workflow status, search text), and every bulk action on it is a single UPDATE
+or DELETE statement, so clearing a spam wave of thousands of submissions is
+one round-trip no matter how many rows match.
+
+Search uses Postgres full-text search over the sender, subject and message
+(backed by the ix_contact_message_search GIN index) and falls back to LIKE on
+SQLite. The unread count shown in the admin navigation is cached for
+UNREAD_COUNT_TTL seconds and dropped whenever a write goes through here.
+"""
+import threading
+import time
+
+from text_search import prefix_tsquery, search_terms
+
+# Unread badge is recomputed at most this often
+UNREAD_COUNT_TTL = 30  # 30 seconds
+
+# Workflow statuses of ContactMessage.status
+STATUSES = ('new', 'replied', 'resolved')
+
+# Text searched by full-text search; the migration's GIN index is built on the same expression
+SEARCH_DOCUMENT = (
+    "coalesce(first_name, '') || ' ' || coalesce(last_name, '') || ' ' || coalesce(email, '') || ' ' || "
+    "coalesce(subject, '') || ' ' || coalesce(message, '')"
+)
+
+
+class ContactInbox:
+    """Set-based reads and writes of ContactMessage"""
+
+    def __init__(self):
+        self._unread = None  # (expires_at, count)
+        self._lock = threading.Lock()
+        self.metrics = {
+            'bulk_updates': 0,
+            'bulk_deletes': 0,
+            'rows_updated': 0,
+            'rows_deleted': 0
+        }
+
+    # Selection
+
+    def filtered(self, read=None, status=None, search=None):
+        """
+        ContactMessage query for a list filter
+
+        Args:
+            read (str): 'read' or 'unread', anything else means both
+            status (str): One of STATUSES
+            search (str): Words that must all appear in the sender, subject or message
+        """
+        import models
+        ContactMessage = models.ContactMessage
+
+        query = ContactMessage.query
+        if read == 'unread':
+            query = query.filter(ContactMessage.is_read == False)
+        elif read == 'read':
+            query = query.filter(ContactMessage.is_read == True)
+
+        if status in STATUSES:
+            query = query.filter(ContactMessage.status == status)
+
+        terms = search_terms(search)
+        if terms:
+            query = query.filter(self._search_clause(terms))
+        return query
+
+    def _search_clause(self, terms):
+        import models
+        from sqlalchemy import text
+
+        ContactMessage = models.ContactMessage
+        if models.db.engine.dialect.name == 'postgresql':
+            # Prefix match on every word, e.g. "refund pay" finds "payment refund request"
+            return text(
+                f"to_tsvector('simple', {SEARCH_DOCUMENT}) @@ to_tsquery('simple', :contact_search)"
+            ).bindparams(contact_search=prefix_tsquery(terms))
+
+        return models.db.and_(*[
+            models.db.or_(
+                ContactMessage.first_name.ilike(f'%{term}%'),
+                ContactMessage.last_name.ilike(f'%{term}%'),
+                ContactMessage.email.ilike(f'%{term}%'),
+                ContactMessage.subject.ilike(f'%{term}%'),
+                ContactMessage.message.ilike(f'%{term}%')
+            )
+            for term in terms
+        ])
+
+    def selection(self, message_ids=None, filters=None):
+        """
+        Query for the messages a bulk action applies to
+
+        Args:
+            message_ids (list): Explicit ids, takes precedence over filters
+            filters (dict): {'read', 'status', 'q'} as used by the list, for "all matching"
+
+        Returns:
+            Query, or None when nothing was selected or the filter matches every message
+        """
+        import models
+        ContactMessage = models.ContactMessage
+
+        if message_ids:
+            ids = []
+            for message_id in message_ids:
+                try:
+                    ids.append(int(message_id))
+                except (TypeError, ValueError):
+                    continue
+            return ContactMessage.query.filter(ContactMessage.id.in_(ids)) if ids else None
+
+        if not isinstance(filters, dict):
+            return None
+
+        read, status, search = filters.get('read'), filters.get('status'), filters.get('q')
+        # "All matching" must narrow the list: an empty filter, or search text without
+        # a single word (e.g. "!!!"), would otherwise select every message
+        if read not in ('read', 'unread') and status not in STATUSES and not search_terms(search):
+            return None
+        return self.filtered(read, status, search)
+
+    # Bulk writes (commit)
+
+    def bulk_update(self, query, is_read=None, status=None):
+        """
+        One UPDATE over the selection
+
+        Returns:
+            int: Rows changed
+        """
+        import models
+        ContactMessage = models.ContactMessage
+
+        values = {}
+        if is_read is not None:
+            values['is_read'] = bool(is_read)
+        if status in STATUSES:
+            values['status'] = status
+        if not values:
+            return 0
+
+        # Only touch rows that change, so the count reported back is meaningful
+        if list(values) == ['is_read']:
+            if is_read:
+                query = query.filter(models.db.or_(ContactMessage.is_read == False, ContactMessage.is_read.is_(None)))
+            else:
+                query = query.filter(ContactMessage.is_read == True)
+
+        updated = query.update(values, synchronize_session=False)
+        models.db.session.commit()
+
+        self.metrics['bulk_updates'] += 1
+        self.metrics['rows_updated'] += updated
+        self.invalidate()
+        return updated
+
+    def bulk_delete(self, query):
+        """
+        One DELETE over the selection
+
+        Returns:
+            int: Rows deleted
+        """
+        import models
+
+        deleted = query.delete(synchronize_session=False)
+        models.db.session.commit()
+
+        self.metrics['bulk_deletes'] += 1
+        self.metrics['rows_deleted'] += deleted
+        self.invalidate()
+        return deleted
+
+    # Unread badge
+
+    def unread_count(self):
+        """Unread messages, at most UNREAD_COUNT_TTL seconds old"""
+        now = time.monotonic()
+        with self._lock:
+            cached = self._unread
+        if cached and cached[0] > now:
+            return cached[1]
+
+        import models
+        from sqlalchemy import func
+        ContactMessage = models.ContactMessage
+        count = models.db.session.query(func.count(ContactMessage.id)).filter(
+            ContactMessage.is_read == False
+        ).scalar() or 0
+
+        with self._lock:
+            self._unread = (now + UNREAD_COUNT_TTL, count)
+        return count
+
+    def invalidate(self):
+        """Drop the cached counters after messages are added, read or deleted"""
+        with self._lock:
+            self._unread = None
+
+        from admin_panels import dashboard_stats
+        dashboard_stats.invalidate()
+
+
+# Shared contact inbox for the application
+contact_inbox = ContactInbox()
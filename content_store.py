@@ -0,0 +1,160 @@
+"""
+Cached About page and policy content
+
+/about ran three AboutPageContent queries per view and each policy page loaded
+its PolicyContent row, for content that changes a few times a year; the page
+cache only spares that for anonymous visitors. content_store keeps it in memory:
+
+- the About sections are read with one query (the newest active row of each
+  section, the defaults for sections without one) and the markup below the
+  header is rendered once from about_sections.html into a fragment;
+- all policies are read with one query and kept with their HTML as Markup;
+- every entry remembers the version it was loaded under: when its page cache
+  tag ('about', 'policy:<type>') was last purged. The save/reset endpoints purge
+  those tags after they commit, so the next view in every worker sees a new
+  version and reloads; invalidate() drops the entry in the worker that saved.
+
+In steady state a view costs a stat() of the tag files and no query.
+"""
+import threading
+import time
+
+from markupsafe import Markup
+
+# Safety net for changes made outside the admin endpoints
+CONTENT_TTL = 60 * 60  # 1 hour in seconds
+
+# Fields of each About section, as the templates and the admin editor use them
+ABOUT_SECTIONS = {
+    'main_about': ('main_about_title', 'main_about_subtitle', 'main_about_content',
+                   'main_about_images', 'main_about_features'),
+    'mission': ('mission_title', 'mission_content', 'mission_vision_title',
+                'mission_vision_content', 'mission_points', 'vision_points'),
+    'team': ('team_title', 'team_subtitle', 'team_members'),
+}
+
+POLICY_TYPES = ('privacy_policy', 'terms_of_service', 'refund_policy', 'cookie_policy')
+
+
+def about_sections():
+    """
+    Fields of the active row of each About section, in one query
+
+    Returns:
+        dict: Section name -> field dict, or None when the section has no active row
+    """
+    import models
+
+    AboutPageContent = models.AboutPageContent
+    sections = dict.fromkeys(ABOUT_SECTIONS)
+    rows = AboutPageContent.query.filter_by(is_active=True).order_by(AboutPageContent.id.desc()).all()
+    for row in rows:
+        fields = ABOUT_SECTIONS.get(row.section_name)
+        # Newest first; save_about_content deactivates the previous row anyway
+        if fields and sections[row.section_name] is None:
+            sections[row.section_name] = {field: getattr(row, field) for field in fields}
+    return sections
+
+
+class PolicySnapshot:
+    """Read-only copy of a PolicyContent row for the policy pages"""
+
+    __slots__ = ('policy_type', 'title', 'last_updated', 'content', 'updated_at')
+
+    def __init__(self, policy):
+        self.policy_type = policy.policy_type
+        self.title = policy.title
+        self.last_updated = policy.last_updated
+        self.content = Markup(policy.content or '')
+        self.updated_at = policy.updated_at
+
+    def __repr__(self):
+        return f'<PolicySnapshot {self.policy_type}>'
+
+
+class ContentStore:
+    """Versioned in-process cache of the About page and the policies"""
+
+    def __init__(self):
+        self._entries = {}  # key -> (version, expires_at, value)
+        self._lock = threading.Lock()
+        self.metrics = {
+            'hits': 0,
+            'loads': 0
+        }
+
+    def _cached(self, key, version, loader):
+        now = time.time()
+        with self._lock:
+            entry = self._entries.get(key)
+        if entry and entry[0] == version and entry[1] > now:
+            self.metrics['hits'] += 1
+            return entry[2]
+
+        # The version is read before loading, so a save committed meanwhile triggers another load
+        value = loader()
+        with self._lock:
+            self._entries[key] = (version, now + CONTENT_TTL, value)
+        self.metrics['loads'] += 1
+        return value
+
+    def invalidate(self, key=None):
+        """Drop 'about', 'policies', or every entry of this worker"""
+        with self._lock:
+            if key is None:
+                self._entries.clear()
+            else:
+                self._entries.pop(key, None)
+
+    # About page
+
+    def about(self):
+        """{'main_about_data', 'mission_data', 'team_data', 'sections_html'} of the About page"""
+        from page_cache import page_cache
+
+        return self._cached('about', page_cache.purged_at('about'), self._load_about)
+
+    @staticmethod
+    def _load_about():
+        from flask import current_app
+        import models
+
+        data = {}
+        for section, fields in about_sections().items():
+            if fields is None:
+                fields = getattr(models.AboutPageContent, f'get_default_{section}_content')()
+            data[f'{section}_data'] = fields
+
+        template = current_app.jinja_env.get_template('about_sections.html')
+        data['sections_html'] = Markup(template.render(**data))
+        return data
+
+    # Policies
+
+    def policy(self, policy_type):
+        """PolicySnapshot of a policy, or None when it does not exist and no default could be created"""
+        from page_cache import page_cache
+
+        version = tuple(page_cache.purged_at(f'policy:{name}') for name in POLICY_TYPES)
+        return self._cached('policies', version, self._load_policies).get(policy_type)
+
+    @staticmethod
+    def _load_policies():
+        import models
+
+        PolicyContent = models.PolicyContent
+        policies = {
+            policy.policy_type: PolicySnapshot(policy)
+            for policy in PolicyContent.query.filter(PolicyContent.policy_type.in_(POLICY_TYPES)).all()
+        }
+        for policy_type in POLICY_TYPES:
+            if policy_type not in policies:
+                # First view of a policy that was never saved stores its default, as before
+                policy = PolicyContent.get_or_create_default(policy_type)
+                if policy:
+                    policies[policy_type] = PolicySnapshot(policy)
+        return policies
+
+
+# Shared content store for the application
+content_store = ContentStore()
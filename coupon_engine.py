@@ -0,0 +1,191 @@
+"""
+Coupon validation and redemption
+
+Validation is served from a per-process index of each item's coupons, keyed by
+(item_type, item_id, code) and reloaded after a short TTL, so checking a code
+as the customer types costs no queries once the item has been loaded.
+
+Redemption never trusts the index: it is a single conditional
+UPDATE ... SET used_count = used_count + 1 WHERE <still valid> RETURNING used_count,
+so concurrent redemptions can't overshoot usage_limit or lose an increment.
+"""
+import threading
+import time
+from collections import OrderedDict
+from datetime import datetime
+
+# How long an item's coupons are served from memory before being reloaded
+COUPON_INDEX_TTL = 30  # 30 seconds
+
+# Items kept in the index (least recently used are dropped first)
+COUPON_INDEX_SIZE = 2000
+
+ITEM_TYPES = ('course', 'ebook')
+
+
+class CouponEngine:
+    """Validates coupons from an in-process index and redeems them atomically"""
+
+    _index = OrderedDict()  # (item_type, item_id) -> {'loaded_at', 'price', 'coupons': {code: coupon}}
+    _index_lock = threading.Lock()
+
+    @staticmethod
+    def _models(item_type):
+        """Return (coupon model, item model, coupon foreign key column name)"""
+        import models
+        if item_type == 'course':
+            return models.CourseCoupon, models.Course, 'course_id'
+        return models.EbookCoupon, models.Ebook, 'ebook_id'
+
+    @staticmethod
+    def _snapshot(coupon):
+        return {
+            'id': coupon.id,
+            'code': coupon.code,
+            'discount_percent': coupon.discount_percent,
+            'is_active': coupon.is_active,
+            'usage_limit': coupon.usage_limit,
+            'used_count': coupon.used_count or 0,
+            'valid_from': coupon.valid_from,
+            'valid_until': coupon.valid_until
+        }
+
+    @staticmethod
+    def _load(item_type, item_id):
+        """Read an item's price and all of its coupons"""
+        import models
+        coupon_model, item_model, foreign_key = CouponEngine._models(item_type)
+
+        price = models.db.session.query(item_model.price).filter(item_model.id == item_id).scalar()
+        coupons = {}
+        if price is not None:
+            for coupon in coupon_model.query.filter(getattr(coupon_model, foreign_key) == item_id).all():
+                coupons[coupon.code.upper()] = CouponEngine._snapshot(coupon)
+
+        return {'loaded_at': time.monotonic(), 'price': price, 'coupons': coupons}
+
+    @staticmethod
+    def get_item(item_type, item_id):
+        """Return the indexed entry for an item, loading it if missing or older than COUPON_INDEX_TTL"""
+        key = (item_type, item_id)
+        with CouponEngine._index_lock:
+            entry = CouponEngine._index.get(key)
+            if entry and time.monotonic() - entry['loaded_at'] < COUPON_INDEX_TTL:
+                CouponEngine._index.move_to_end(key)
+                return entry
+
+        entry = CouponEngine._load(item_type, item_id)
+        with CouponEngine._index_lock:
+            CouponEngine._index[key] = entry
+            CouponEngine._index.move_to_end(key)
+            while len(CouponEngine._index) > COUPON_INDEX_SIZE:
+                CouponEngine._index.popitem(last=False)
+        return entry
+
+    @staticmethod
+    def lookup(item_type, item_id, code):
+        """
+        Find a coupon for an item
+
+        Returns:
+            tuple: (coupon dict or None, item price or None if the item doesn't exist)
+        """
+        entry = CouponEngine.get_item(item_type, item_id)
+        return entry['coupons'].get(code.upper().strip()), entry['price']
+
+    @staticmethod
+    def invalidate(item_type=None, item_id=None):
+        """Drop one item from the index, or everything when no item is given"""
+        with CouponEngine._index_lock:
+            if item_type is None:
+                CouponEngine._index.clear()
+            else:
+                CouponEngine._index.pop((item_type, int(item_id)), None)
+
+    @staticmethod
+    def check(coupon):
+        """Same rules as CourseCoupon.is_valid(), for an indexed coupon"""
+        now = datetime.utcnow()
+
+        if not coupon['is_active']:
+            return False, "Coupon is not active"
+
+        if coupon['valid_from'] and now < coupon['valid_from']:
+            return False, "Coupon is not yet valid"
+
+        if coupon['valid_until'] and now > coupon['valid_until']:
+            return False, "Coupon has expired"
+
+        if coupon['usage_limit'] and coupon['used_count'] >= coupon['usage_limit']:
+            return False, "Coupon usage limit reached"
+
+        return True, "Valid"
+
+    @staticmethod
+    def apply_discount(coupon, original_price):
+        """Same calculation as CourseCoupon.apply_discount(), for an indexed coupon"""
+        discount_amount = original_price * (coupon['discount_percent'] / 100)
+        return {
+            'original_price': original_price,
+            'discount_percent': coupon['discount_percent'],
+            'discount_amount': discount_amount,
+            'final_price': original_price - discount_amount
+        }
+
+    @staticmethod
+    def redeem(item_type, item_id, code):
+        """
+        Count one use of a coupon if it is still valid
+
+        Returns:
+            dict: success, message and the new used_count on success
+        """
+        import models
+        from sqlalchemy import and_, or_, func, select
+
+        db = models.db
+        code = code.upper().strip()
+        coupon_model, _, foreign_key = CouponEngine._models(item_type)
+        table = coupon_model.__table__
+        now = datetime.utcnow()
+
+        stmt = table.update().where(
+            table.c[foreign_key] == item_id,
+            table.c.code == code,
+            table.c.is_active.is_(True),
+            or_(table.c.valid_from.is_(None), table.c.valid_from <= now),
+            or_(table.c.valid_until.is_(None), table.c.valid_until >= now),
+            # usage_limit NULL or 0 means unlimited, matching is_valid()
+            or_(table.c.usage_limit.is_(None), table.c.usage_limit == 0,
+                func.coalesce(table.c.used_count, 0) < table.c.usage_limit)
+        ).values(used_count=func.coalesce(table.c.used_count, 0) + 1)
+
+        try:
+            if db.engine.dialect.update_returning:
+                used_count = db.session.execute(stmt.returning(table.c.used_count)).scalar()
+            else:
+                updated = db.session.execute(stmt).rowcount
+                used_count = db.session.execute(
+                    select(table.c.used_count).where(
+                        and_(table.c[foreign_key] == item_id, table.c.code == code)
+                    )
+                ).scalar() if updated else None
+            db.session.commit()
+        except Exception:
+            db.session.rollback()
+            raise
+
+        if used_count is not None:
+            with CouponEngine._index_lock:
+                entry = CouponEngine._index.get((item_type, item_id))
+                if entry and code in entry['coupons']:
+                    entry['coupons'][code]['used_count'] = used_count
+            return {'success': True, 'message': 'Coupon applied successfully', 'used_count': used_count}
+
+        # Nothing matched: reload from the database to report why
+        CouponEngine.invalidate(item_type, item_id)
+        coupon, _ = CouponEngine.lookup(item_type, item_id, code)
+        if not coupon:
+            return {'success': False, 'message': 'Invalid coupon code'}
+        is_valid, message = CouponEngine.check(coupon)
+        return {'success': False, 'message': message if not is_valid else 'Coupon usage limit reached'}
@@ -0,0 +1,436 @@
+"""
+Responsive image variants for uploaded images
+
+Uploaded homepage, about, site, profile and course/ebook cover images used to
+be stored exactly as received, often multi-megabyte phone photos with EXIF
+(including GPS) data, and the homepage served them at full size. optimize()
+now runs every upload through a process pool that decodes the image once and
+produces:
+
+- the stored copy: same format, EXIF orientation applied, metadata stripped,
+  at most MAX_STORED_WIDTH wide;
+- variants at each width in the widths list (capped at the image's own width)
+  as AVIF (when Pillow has the encoder), WebP and JPEG, or PNG for images with
+  transparency.
+
+The variants are uploaded to Bunny concurrently next to the stored copy, under
+<directory>/variants/, and recorded in image_assets. Templates use
+responsive_image()/responsive_background() to emit <picture>/srcset markup for
+a recorded image and fall back to the plain URL otherwise. Animated images and
+files Pillow cannot decode are stored as received, and so is everything while
+the pool is unavailable: it is forked by start_workers() at the top of app.py,
+before any thread starts, and not replaced once broken.
+"""
+import io
+import multiprocessing
+import os
+import threading
+import time
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor, wait
+from concurrent.futures.process import BrokenProcessPool
+from datetime import datetime
+from urllib.parse import quote
+
+from markupsafe import Markup, escape
+
+# Widths generated for page images (hero slides, cards, about images)
+VARIANT_WIDTHS = (320, 640, 960, 1280, 1920)
+
+# Widths generated for avatars
+PROFILE_WIDTHS = (96, 192, 384)
+
+# The stored copy is scaled down to this width
+MAX_STORED_WIDTH = 2560
+
+# Decompression bomb guard; Pillow refuses images over twice this many pixels
+MAX_SOURCE_PIXELS = 50_000_000
+
+# Encoder settings; AVIF and WebP reach JPEG's visual quality at lower settings
+AVIF_QUALITY = 55
+# 0 (slowest, smallest) to 10; at the default of 6 a large upload waits seconds per variant
+AVIF_SPEED = 8
+WEBP_QUALITY = 78
+JPEG_QUALITY = 80
+
+# Processes decoding/encoding images; encoding is CPU bound and would hold the GIL in a thread
+IMAGE_WORKERS = 2
+
+# Variant uploads in flight at once
+UPLOAD_CONCURRENCY = 8
+
+PROCESS_TIMEOUT = 60  # seconds
+
+# A path without variants is looked up again after this
+NEGATIVE_TTL = 60  # 1 minute in seconds
+
+# Records held in memory; they never change, so the cache is only cleared when full
+MAX_CACHED_RECORDS = 5000
+
+# Order of <source> elements: best compression first
+MODERN_FORMATS = ('avif', 'webp')
+
+EXTENSIONS = {'avif': 'avif', 'webp': 'webp', 'jpeg': 'jpg', 'png': 'png'}
+MIMETYPES = {'avif': 'image/avif', 'webp': 'image/webp', 'jpeg': 'image/jpeg', 'png': 'image/png'}
+
+# Stored copies keep the uploaded format; anything else (GIF, BMP, ...) is stored as received
+STORED_FORMATS = {'JPEG': 'jpeg', 'PNG': 'png', 'WEBP': 'webp'}
+
+
+def _encode(image, image_format, icc_profile):
+    buffer = io.BytesIO()
+    # Only the colour profile is carried over; EXIF/XMP are dropped by not passing them
+    options = {'icc_profile': icc_profile} if icc_profile else {}
+    if image_format == 'avif':
+        image.save(buffer, 'AVIF', quality=AVIF_QUALITY, speed=AVIF_SPEED, **options)
+    elif image_format == 'webp':
+        image.save(buffer, 'WEBP', quality=WEBP_QUALITY, method=4, **options)
+    elif image_format == 'jpeg':
+        image.save(buffer, 'JPEG', quality=JPEG_QUALITY, optimize=True, progressive=True, **options)
+    else:
+        image.save(buffer, 'PNG', optimize=True, **options)
+    return buffer.getvalue()
+
+
+def _resized(image, width):
+    from PIL import Image
+
+    if image.width <= width:
+        return image
+    height = max(1, round(image.height * width / image.width))
+    return image.resize((width, height), Image.LANCZOS)
+
+
+def render_variants(data, widths):
+    """
+    Decode an image once and encode the stored copy and all variants (runs in a worker process)
+
+    Returns:
+        dict: {'stored': bytes, 'width', 'height', 'formats': [...], 'variants': [(format, width, bytes)]}
+        or None when the image is left as uploaded
+    """
+    from PIL import Image, ImageOps, features
+
+    Image.MAX_IMAGE_PIXELS = MAX_SOURCE_PIXELS
+    try:
+        image = Image.open(io.BytesIO(data))
+        stored_format = STORED_FORMATS.get(image.format)
+        if stored_format is None or getattr(image, 'is_animated', False):
+            return None
+        icc_profile = image.info.get('icc_profile')
+        image = ImageOps.exif_transpose(image)
+    except (OSError, ValueError, Image.DecompressionBombError):
+        return None
+
+    has_alpha = image.mode in ('RGBA', 'LA', 'PA') or (image.mode == 'P' and 'transparency' in image.info)
+    image = image.convert('RGBA' if has_alpha else 'RGB')
+
+    stored_image = _resized(image, MAX_STORED_WIDTH)
+    stored = _encode(stored_image, stored_format, icc_profile)
+
+    formats = []
+    try:
+        if features.check('avif'):
+            formats.append('avif')
+    except ValueError:
+        # Pillow without the AVIF plugin
+        pass
+    formats.append('webp')
+    formats.append('png' if has_alpha else 'jpeg')
+
+    variant_widths = sorted({min(width, image.width) for width in widths})
+    variants = []
+    # Each width is resized from the previous, larger one: cheaper than from the full image every time
+    source = stored_image
+    for width in reversed(variant_widths):
+        source = _resized(source, width)
+        for image_format in formats:
+            variants.append((image_format, width, _encode(source, image_format, icc_profile)))
+
+    return {
+        'stored': stored,
+        'width': stored_image.width,
+        'height': stored_image.height,
+        'formats': formats,
+        'variants': variants
+    }
+
+
+def variant_path(directory, filename, width, image_format):
+    """Storage path of one variant, e.g. static/images/variants/photo-640w.webp"""
+    stem = os.path.splitext(filename)[0]
+    return f'{directory}/variants/{stem}-{width}w.{EXTENSIONS[image_format]}'
+
+
+class ImageRecord:
+    """Read-only snapshot of an ImageAsset row"""
+
+    __slots__ = ('path', 'width', 'height', 'widths', 'formats')
+
+    def __init__(self, path, width, height, widths, formats):
+        self.path = path
+        self.width = width
+        self.height = height
+        self.widths = widths
+        self.formats = formats
+
+    def __repr__(self):
+        return f'<ImageRecord {self.path} {self.widths} {self.formats}>'
+
+
+class ImageVariants:
+    """Process pool for image encoding, concurrent variant upload and srcset markup"""
+
+    def __init__(self):
+        self.app = None
+        self._pool = None
+        self._pool_pid = None
+        self._uploader = ThreadPoolExecutor(max_workers=UPLOAD_CONCURRENCY, thread_name_prefix='image-upload')
+        self._records = {}  # path -> ImageRecord, or expires_at for a path without variants
+        self._lock = threading.Lock()
+        self.metrics = {
+            'processed': 0,
+            'skipped': 0,
+            'failed': 0,
+            'bytes_in': 0,
+            'bytes_stored': 0,
+            'variants_uploaded': 0,
+            'last_error': None
+        }
+
+    def init_app(self, app):
+        """Bind to the Flask app, whose BUNNY_CDN_HOSTNAME serves the variants"""
+        self.app = app
+
+    def start_workers(self):
+        """
+        Fork the encoding processes; app.py calls this first thing, before any thread exists
+
+        A process forked while another thread holds a lock (logging, the DB pool, a
+        queue) can deadlock on it, and by the time the first upload arrives the app
+        runs several background threads. Forking keeps the workers from re-importing
+        the app, which spawn and forkserver would do with the launching __main__.
+        """
+        with self._lock:
+            if self._pool is None and threading.active_count() == 1:
+                self._pool = ProcessPoolExecutor(max_workers=IMAGE_WORKERS,
+                                                 mp_context=multiprocessing.get_context('fork'))
+                self._pool_pid = os.getpid()
+                # With fork, every worker is forked on the first submit
+                self._pool.submit(os.getpid)
+
+    def _executor(self):
+        """The pool started by start_workers(), None if it is missing, broken or belongs to a parent process"""
+        with self._lock:
+            if self._pool is not None and self._pool_pid == os.getpid():
+                return self._pool
+        # Forking a replacement now could deadlock; uploads are stored as received until a restart
+        self.start_workers()
+        with self._lock:
+            return self._pool if self._pool_pid == os.getpid() else None
+
+    # Upload pipeline
+
+    def optimize(self, data, path, widths=VARIANT_WIDTHS):
+        """
+        Process an uploaded image and publish its variants
+
+        Args:
+            data (bytes): The uploaded file
+            path (str): Storage path the caller will store the returned bytes at, e.g. 'static/images/x.jpg'
+            widths (tuple): Variant widths
+
+        Returns:
+            bytes: What to store at `path`, the metadata-stripped copy or `data` unchanged
+        """
+        started = time.monotonic()
+        executor = self._executor()
+        if executor is None:
+            return self._failed(data, path, RuntimeError('image workers are not running'))
+        try:
+            result = executor.submit(render_variants, data, widths).result(timeout=PROCESS_TIMEOUT)
+        except BrokenProcessPool as e:
+            with self._lock:
+                self._pool = None
+            return self._failed(data, path, e)
+        except Exception as e:
+            return self._failed(data, path, e)
+
+        if result is None:
+            self.metrics['skipped'] += 1
+            return data
+
+        directory, filename = os.path.split(path)
+        if self._upload_variants(directory, filename, result['variants']):
+            try:
+                self._record(path, result)
+            except Exception as e:
+                # Pages fall back to the stored copy; the upload itself must not fail
+                self.metrics['last_error'] = str(e)
+                print(f"❌ Could not record the variants of {path}: {str(e)}")
+
+        self.metrics['processed'] += 1
+        self.metrics['bytes_in'] += len(data)
+        self.metrics['bytes_stored'] += len(result['stored'])
+        print(f"🖼️ Optimized {path}: {len(data) // 1024}KB -> {len(result['stored']) // 1024}KB, "
+              f"{len(result['variants'])} variants in {time.monotonic() - started:.1f}s")
+        return result['stored']
+
+    def _failed(self, data, path, error):
+        self.metrics['failed'] += 1
+        self.metrics['last_error'] = str(error)
+        print(f"❌ Image optimization failed for {path}, storing it as uploaded: {str(error)}")
+        return data
+
+    def _upload_variants(self, directory, filename, variants):
+        """PUT all variants concurrently, True only if every one was stored"""
+        from bunny_cdn import bunny_cdn
+
+        futures = [
+            self._uploader.submit(bunny_cdn.upload_bytes, content, variant_path(directory, filename, width, image_format),
+                                  MIMETYPES[image_format])
+            for image_format, width, content in variants
+        ]
+        wait(futures)
+
+        failed = [future.result()['error'] for future in futures if not future.result()['success']]
+        self.metrics['variants_uploaded'] += len(futures) - len(failed)
+        if failed:
+            # A partial set would leave holes in srcset; the page falls back to the stored copy
+            self.metrics['last_error'] = failed[0]
+            print(f"❌ {len(failed)} of {len(futures)} variants of {filename} failed to upload: {failed[0]}")
+            return False
+        return True
+
+    def _record(self, path, result):
+        import models
+
+        widths = sorted({width for _, width, _ in result['variants']})
+        values = {
+            'path': path,
+            'width': result['width'],
+            'height': result['height'],
+            'widths': ','.join(str(width) for width in widths),
+            'formats': ','.join(result['formats']),
+            'created_at': datetime.utcnow()
+        }
+        # Own connection: callers may still have uncommitted changes in the session
+        with models.db.engine.begin() as conn:
+            conn.execute(models.ImageAsset.__table__.insert().values(**values))
+
+        record = ImageRecord(path, result['width'], result['height'], widths, result['formats'])
+        with self._lock:
+            self._records[path] = record
+
+    # Lookup
+
+    def get(self, path):
+        """ImageRecord for a storage path, or None when it has no variants"""
+        if not path:
+            return None
+
+        now = time.monotonic()
+        with self._lock:
+            cached = self._records.get(path)
+        if isinstance(cached, ImageRecord):
+            return cached
+        if cached is not None and cached > now:
+            return None
+
+        import models
+        row = models.ImageAsset.query.filter_by(path=path).first()
+        record = ImageRecord(
+            row.path, row.width, row.height,
+            [int(width) for width in row.widths.split(',')], row.formats.split(',')
+        ) if row else None
+
+        with self._lock:
+            if len(self._records) >= MAX_CACHED_RECORDS:
+                self._records.clear()
+            self._records[path] = record if record else now + NEGATIVE_TTL
+        return record
+
+    # Markup
+
+    def _url(self, path):
+        return f"https://{self.app.config['BUNNY_CDN_HOSTNAME']}/{quote(path)}"
+
+    def _srcset(self, record, image_format):
+        directory, filename = os.path.split(record.path)
+        return ', '.join(
+            f'{self._url(variant_path(directory, filename, width, image_format))} {width}w'
+            for width in record.widths
+        )
+
+    def responsive_image(self, path, alt='', sizes='100vw', fallback=None, **attrs):
+        """
+        <picture> with AVIF/WebP/JPEG srcsets for a recorded image, a plain <img> otherwise
+
+        Args:
+            path (str): Storage path, e.g. 'static/images/homepage_x.jpg', or None to show `fallback`
+            alt (str): Alternative text
+            sizes (str): The sizes attribute, how wide the image is rendered
+            fallback (str): URL used when `path` is empty
+            attrs: Extra <img> attributes; class_ becomes class, underscores become dashes
+        """
+        attrs.setdefault('decoding', 'async')
+        attributes = ''.join(
+            f' {name.rstrip("_").replace("_", "-")}="{escape(value)}"'
+            for name, value in attrs.items() if value is not None
+        )
+
+        record = self.get(path)
+        if record is None:
+            src = self._url(path) if path else fallback
+            return Markup(f'<img src="{escape(src or "")}" alt="{escape(alt)}"{attributes}>')
+
+        fallback_format = record.formats[-1]
+        directory, filename = os.path.split(record.path)
+        largest = variant_path(directory, filename, record.widths[-1], fallback_format)
+        sources = ''.join(
+            f'<source type="{MIMETYPES[image_format]}" srcset="{escape(self._srcset(record, image_format))}" sizes="{escape(sizes)}">'
+            for image_format in record.formats if image_format in MODERN_FORMATS
+        )
+        # display: contents keeps the <img> laid out as a direct child of the surrounding element
+        return Markup(
+            f'<picture style="display: contents">{sources}'
+            f'<img src="{escape(self._url(largest))}" srcset="{escape(self._srcset(record, fallback_format))}" '
+            f'sizes="{escape(sizes)}" width="{record.width}" height="{record.height}" alt="{escape(alt)}"{attributes}>'
+            f'</picture>'
+        )
+
+    def responsive_background(self, path, selector):
+        """
+        <style> giving `selector` a background sized to the viewport, or '' without variants
+
+        CSS backgrounds cannot use srcset, so each width gets a media query and the
+        format is negotiated with image-set(); browsers without image-set(type())
+        keep the plain declaration before it.
+        """
+        record = self.get(path)
+        if record is None:
+            return Markup('')
+
+        directory, filename = os.path.split(record.path)
+        fallback_format = record.formats[-1]
+        rules = []
+        previous = None
+        for width in record.widths:
+            candidates = ', '.join(
+                f'url("{self._url(variant_path(directory, filename, width, image_format))}") type("{MIMETYPES[image_format]}")'
+                for image_format in record.formats
+            )
+            declarations = (
+                f'background-image: url("{self._url(variant_path(directory, filename, width, fallback_format))}"); '
+                f'background-image: image-set({candidates});'
+            )
+            if previous is None:
+                rules.append(f'{selector} {{ {declarations} }}')
+            else:
+                rules.append(f'@media (min-width: {previous + 1}px) {{ {selector} {{ {declarations} }} }}')
+            previous = width
+        # URLs are percent-encoded by _url and the selector comes from the template
+        return Markup(f'<style>{" ".join(rules)}</style>')
+
+
+# Shared image pipeline for the application
+image_variants = ImageVariants()
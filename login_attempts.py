@@ -0,0 +1,126 @@
+"""
+Buffered login-attempt recording
+
+Attempts are appended to an in-memory buffer and written to the login_attempt
+table in batches by a background thread (see batched_writer), so signin never
+waits on a commit. The recorder also keeps sliding-window failure counters per
+IP and per user, which lets join_signin make lockout decisions without
+touching the database.
+"""
+import time
+import threading
+from collections import deque, defaultdict
+from datetime import datetime
+
+from batched_writer import BatchedTableWriter
+
+# Lockout policy: failures inside the window before further attempts are blocked
+FAILURE_WINDOW = 15 * 60  # 15 minutes in seconds
+MAX_FAILURES_PER_IP = 20
+MAX_FAILURES_PER_USER = 5
+
+# Flush the buffer every FLUSH_INTERVAL seconds or once it holds BATCH_SIZE rows
+FLUSH_INTERVAL = 2
+BATCH_SIZE = 200
+
+# Retention for the login_attempt table
+RETENTION_DAYS = 90
+PRUNE_BATCH_SIZE = 5000
+PRUNE_INTERVAL = 24 * 60 * 60  # once a day
+
+
+class SlidingWindowCounter:
+    """Counts events per key over the last `window` seconds"""
+
+    def __init__(self, window):
+        self.window = window
+        self._events = defaultdict(deque)
+        self._lock = threading.Lock()
+
+    def _trim(self, events, now):
+        cutoff = now - self.window
+        while events and events[0] < cutoff:
+            events.popleft()
+
+    def add(self, key, now=None):
+        now = now or time.monotonic()
+        with self._lock:
+            events = self._events[key]
+            self._trim(events, now)
+            events.append(now)
+
+    def count(self, key, now=None):
+        now = now or time.monotonic()
+        with self._lock:
+            events = self._events.get(key)
+            if not events:
+                return 0
+            self._trim(events, now)
+            if not events:
+                del self._events[key]
+                return 0
+            return len(events)
+
+    def reset(self, key):
+        with self._lock:
+            self._events.pop(key, None)
+
+    def purge(self, now=None):
+        """Drop keys whose events have all fallen out of the window"""
+        now = now or time.monotonic()
+        with self._lock:
+            for key in list(self._events):
+                self._trim(self._events[key], now)
+                if not self._events[key]:
+                    del self._events[key]
+
+
+class LoginAttemptRecorder(BatchedTableWriter):
+    """Append-only, batched writer for LoginAttempt rows"""
+
+    model_name = 'LoginAttempt'
+    label = 'login attempts'
+    thread_name = 'login-attempt-writer'
+    flush_interval = FLUSH_INTERVAL
+    batch_size = BATCH_SIZE
+    retention_days = RETENTION_DAYS
+    prune_batch_size = PRUNE_BATCH_SIZE
+    prune_interval = PRUNE_INTERVAL
+
+    def __init__(self):
+        super().__init__()
+        self.ip_failures = SlidingWindowCounter(FAILURE_WINDOW)
+        self.user_failures = SlidingWindowCounter(FAILURE_WINDOW)
+
+    def is_locked_out(self, ip_address, user_id=None):
+        """Check the in-memory failure counters for this IP and user"""
+        if self.ip_failures.count(ip_address) >= MAX_FAILURES_PER_IP:
+            return True
+        if user_id and self.user_failures.count(user_id) >= MAX_FAILURES_PER_USER:
+            return True
+        return False
+
+    def record(self, ip_address, status, user_id=None, user_agent=None):
+        """Queue a login attempt with its final status ('success', 'failed' or 'blocked')"""
+        if status == 'failed':
+            self.ip_failures.add(ip_address)
+            if user_id:
+                self.user_failures.add(user_id)
+        elif status == 'success' and user_id:
+            self.user_failures.reset(user_id)
+
+        self._enqueue([{
+            'user_id': user_id,
+            'ip_address': ip_address,
+            'user_agent': (user_agent or '')[:512],
+            'status': status,
+            'timestamp': datetime.utcnow()
+        }])
+
+    def _maintain(self):
+        self.ip_failures.purge()
+        self.user_failures.purge()
+
+
+# Shared recorder for the application
+login_attempt_recorder = LoginAttemptRecorder()
@@ -29,6 +29,92 @@ class LessonProgress(object):
     """Model for tracking individual lesson progress"""
     pass
 
+class EbookPurchase(object):
+    """Model for eBook purchases"""
+    pass
+
+# Payment Models
+class PaymentTransaction(object):
+    """Model for SSLCommerz payment transactions"""
+    pass
+
+class PaymentLog(object):
+    """Model for payment audit log entries"""
+    pass
+
+class PaymentIdempotencyKey(object):
+    """Model for already-handled payment callbacks"""
+    pass
+
+class DailyRollup(object):
+    """Model for daily analytics counters"""
+    pass
+
+class User(object):
+    """Model for users"""
+    pass
+
+class Enrollment(object):
+    """Model for legacy course enrollments"""
+    pass
+
+class Message(object):
+    """Model for user/admin chat messages"""
+    pass
+
+class ChatConversation(object):
+    """Model for chat inbox summaries"""
+    pass
+
+# Catalog and Coupon Models
+class Course(object):
+    """Model for courses"""
+    pass
+
+class Ebook(object):
+    """Model for eBooks"""
+    pass
+
+class CourseCoupon(object):
+    """Model for course coupons"""
+    pass
+
+class EbookCoupon(object):
+    """Model for eBook coupons"""
+    pass
+
+class ContactMessage(object):
+    """Model for contact form submissions"""
+    pass
+
+class Blog(object):
+    """Model for blog posts"""
+    pass
+
+class BlogTag(object):
+    """Model for distinct blog tags with post counts"""
+    pass
+
+class BlogTagLink(object):
+    """Model for blog post to tag links"""
+    pass
+
 class HomepageContent(object):
     """Model for storing homepage section content - will be replaced when db is available"""
     pass
+
+class ImageAsset(object):
+    """Model for responsive variants of uploaded images"""
+    pass
+
+class AboutPageContent(object):
+    """Model for about page section content"""
+    pass
+
+class PolicyContent(object):
+    """Model for policy pages content"""
+    pass
+
+class SecurityEvent(object):
+    """Model for client security events"""
+    pass
@@ -0,0 +1,418 @@
+"""
+Full-page cache for anonymous visitors
+
+The public pages (home, catalog, blog, about, policies) only change when an
+admin saves something, yet every hit re-rendered a large Jinja template. Views
+decorated with page_cache.cached() are served from a stored copy for visitors
+who are not logged in:
+
+- entries are keyed by path, query string and primary Accept-Language tag and
+  stored gzip-compressed, in a per-process LRU (PAGE_CACHE_MAX_MEMORY bytes)
+  and in PAGE_CACHE_DIR, which all workers on the host share (it must belong
+  to the app's user and is kept at mode 0700);
+- every entry carries dependency tags (course:<id>, blog:<id>, homepage,
+  settings, ...). The admin save/publish endpoints call purge(tag) after they
+  commit, which records the purge time in PAGE_CACHE_TAGS_DIR, so entries
+  rendered before it stop being served by every worker. Pages rendered within
+  PURGE_SETTLE_TIME of a purge are not stored, since other workers' catalog and
+  alert copies may not have caught up yet;
+- responses carry a weak ETag and Last-Modified, so a revalidating browser
+  gets a 304 without the page being read at all.
+
+A logged-in session, pending flash messages, or a response that sets a cookie
+bypasses the cache. PAGE_CACHE_TTL bounds how stale a page can get from changes
+that are not purged explicitly (e.g. enrollment counts). Setting
+PAGE_CACHE_ENABLED to False in the app config turns the cache off.
+
+Purge times are kept apart from the stored pages (by default in the app's
+instance folder) because content_store and blog_index version their own
+per-worker caches with purged_at(), which must keep working when page storage
+is disabled. If the tags directory itself is unusable, every tag reads as just
+purged, so those caches reload instead of serving stale content.
+"""
+import gzip
+import hashlib
+import json
+import os
+import re
+import stat
+import tempfile
+import threading
+import time
+from collections import OrderedDict
+from functools import wraps
+
+from catalog import CATALOG_REFRESH_INTERVAL
+from site_alert import ALERT_REFRESH_INTERVAL
+
+# Safety net for changes that are not purged by tag
+PAGE_CACHE_TTL = 10 * 60  # 10 minutes in seconds
+
+# Compressed bytes held in memory per process
+PAGE_CACHE_MAX_MEMORY = 64 * 1024 * 1024  # 64 MB
+
+# Entries kept on disk; the oldest are swept beyond this
+PAGE_CACHE_MAX_DISK_ENTRIES = 5000
+
+# Disk sweep runs once per this many stores
+SWEEP_EVERY = 200
+
+# Longer query strings (e.g. pasted search text) are not cached
+MAX_CACHED_QUERY_LENGTH = 200
+
+# Tags every page depends on: the header/footer settings and the alert banner
+GLOBAL_TAGS = ('settings', 'alert')
+
+# Other workers render from catalog and site_alert, which pick up a change this much
+# later; pages rendered within this long after a purge of one of their tags are not stored
+PURGE_SETTLE_TIME = max(CATALOG_REFRESH_INTERVAL, ALERT_REFRESH_INTERVAL)
+
+PAGE_CACHE_DIR = os.environ.get('PAGE_CACHE_DIR', os.path.join(tempfile.gettempdir(), f'skillfinesse_pages-{os.getuid()}'))
+
+# Where purge times are recorded; None means <instance folder>/cache_tags
+PAGE_CACHE_TAGS_DIR = os.environ.get('PAGE_CACHE_TAGS_DIR')
+
+
+def private_directory(path):
+    """
+    Create `path` accessible only to this user, or make sure an existing one is
+
+    Cached pages and template bytecode are read back from these directories, so
+    one created in a shared location (e.g. /tmp) by another user must not be used.
+
+    Raises:
+        OSError: `path` is not a directory or belongs to another user
+    """
+    os.makedirs(path, mode=0o700, exist_ok=True)
+    info = os.lstat(path)
+    if not stat.S_ISDIR(info.st_mode) or info.st_uid != os.getuid():
+        raise OSError(f'{path} is not a directory owned by this user')
+    if stat.S_IMODE(info.st_mode) != 0o700:
+        os.chmod(path, 0o700)
+    return path
+
+
+class PageEntry:
+    """One cached response"""
+
+    __slots__ = ('body', 'etag', 'last_modified', 'content_type', 'tags', 'created_at', 'expires_at')
+
+    def __init__(self, body, etag, last_modified, content_type, tags, created_at, expires_at):
+        self.body = body  # gzip-compressed
+        self.etag = etag
+        self.last_modified = last_modified
+        self.content_type = content_type
+        self.tags = tags
+        self.created_at = created_at
+        self.expires_at = expires_at
+
+    def meta(self):
+        return {field: getattr(self, field) for field in PageEntry.__slots__ if field != 'body'}
+
+
+class PageCache:
+    """Two-tier (memory, shared disk) cache of rendered pages with tag purging"""
+
+    def __init__(self, directory=PAGE_CACHE_DIR, tags_directory=PAGE_CACHE_TAGS_DIR):
+        self.directory = directory
+        self.tags_directory = tags_directory
+        self._tags_usable = False  # set by init_app
+        self._entries = OrderedDict()  # key -> PageEntry, least recently used first
+        self._memory_bytes = 0
+        self._stores = 0
+        self._lock = threading.Lock()
+        self.metrics = {
+            'memory_hits': 0,
+            'disk_hits': 0,
+            'misses': 0,
+            'bypassed': 0,
+            'stores': 0,
+            'purges': 0,
+            'unsettled': 0,
+            'memory_bytes': 0,
+            'last_error': None
+        }
+
+    def init_app(self, app):
+        """Create the shared directories; PAGE_CACHE_DIR and PAGE_CACHE_TAGS_DIR can be set in the app config"""
+        self.directory = app.config.get('PAGE_CACHE_DIR', self.directory)
+        self.tags_directory = app.config.get('PAGE_CACHE_TAGS_DIR') or self.tags_directory or \
+            os.path.join(app.instance_path, 'cache_tags')
+        try:
+            private_directory(self.tags_directory)
+            self._tags_usable = True
+        except OSError as e:
+            self._tags_usable = False
+            self.metrics['last_error'] = str(e)
+            print(f"⚠️ Cache purge times unavailable, tagged caches will reload on every use: {str(e)}")
+
+        try:
+            if not self._tags_usable:
+                raise OSError('the tags directory is unusable')
+            private_directory(self.directory)
+            os.makedirs(os.path.join(self.directory, 'entries'), exist_ok=True)
+        except OSError as e:
+            # Pages are then rendered on every request, as before
+            self.metrics['last_error'] = str(e)
+            app.config['PAGE_CACHE_ENABLED'] = False
+            print(f"⚠️ Page cache disabled: {str(e)}")
+
+    # Paths
+
+    def _entry_paths(self, key):
+        base = os.path.join(self.directory, 'entries', key)
+        return base + '.gz', base + '.json'
+
+    def _tag_path(self, tag):
+        return os.path.join(self.tags_directory, re.sub(r'[^A-Za-z0-9_-]', '-', tag))
+
+    # Purging
+
+    def purge(self, *tags):
+        """Invalidate every page that depends on any of `tags`, in all workers"""
+        now = time.time()
+        for tag in tags if self._tags_usable else ():
+            path = self._tag_path(tag)
+            try:
+                with open(path, 'a'):
+                    pass
+                os.utime(path, (now, now))
+            except OSError as e:
+                self.metrics['last_error'] = str(e)
+
+        with self._lock:
+            for key in [key for key, entry in self._entries.items() if set(entry.tags) & set(tags)]:
+                self._drop(key)
+        self.metrics['purges'] += 1
+
+    def clear(self):
+        """Drop every cached page"""
+        with self._lock:
+            self._entries.clear()
+            self._memory_bytes = 0
+            self.metrics['memory_bytes'] = 0
+        entries_dir = os.path.join(self.directory, 'entries')
+        for name in os.listdir(entries_dir) if os.path.isdir(entries_dir) else ():
+            try:
+                os.remove(os.path.join(entries_dir, name))
+            except OSError:
+                pass
+
+    def purged_at(self, tag):
+        """When `tag` was last purged by any worker (0 if never, now if purge times are unavailable)"""
+        if not self._tags_usable:
+            return time.time()
+        try:
+            return os.stat(self._tag_path(tag)).st_mtime
+        except OSError:
+            return 0
+
+    def _settled(self, tags, started):
+        """Whether every tag was purged long enough before `started` for all workers to see the change"""
+        return all(started - self.purged_at(tag) >= PURGE_SETTLE_TIME for tag in tags)
+
+    def _valid(self, entry):
+        if entry.expires_at <= time.time():
+            return False
+        return all(self.purged_at(tag) < entry.created_at for tag in entry.tags)
+
+    # Memory tier
+
+    def _drop(self, key):
+        entry = self._entries.pop(key, None)
+        if entry is not None:
+            self._memory_bytes -= len(entry.body)
+            self.metrics['memory_bytes'] = self._memory_bytes
+
+    def _remember(self, key, entry):
+        with self._lock:
+            self._drop(key)
+            self._entries[key] = entry
+            self._memory_bytes += len(entry.body)
+            while self._memory_bytes > PAGE_CACHE_MAX_MEMORY and self._entries:
+                self._drop(next(iter(self._entries)))
+            self.metrics['memory_bytes'] = self._memory_bytes
+
+    # Lookup and store
+
+    def get(self, key):
+        """A valid entry for `key` from memory or disk, or None"""
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None:
+                self._entries.move_to_end(key)
+
+        if entry is not None:
+            if self._valid(entry):
+                self.metrics['memory_hits'] += 1
+                return entry
+            with self._lock:
+                self._drop(key)
+
+        body_path, meta_path = self._entry_paths(key)
+        try:
+            with open(meta_path) as f:
+                meta = json.load(f)
+            with open(body_path, 'rb') as f:
+                entry = PageEntry(body=f.read(), **meta)
+        except (OSError, ValueError, TypeError):
+            return None
+
+        if not self._valid(entry):
+            self._remove_files(key)
+            return None
+
+        self._remember(key, entry)
+        self.metrics['disk_hits'] += 1
+        return entry
+
+    def store(self, key, html, content_type, tags, created_at):
+        """Compress and keep a rendered page; created_at is when rendering started"""
+        body = gzip.compress(html, compresslevel=6)
+        entry = PageEntry(
+            body=body,
+            etag=hashlib.sha1(html).hexdigest()[:20],
+            last_modified=int(created_at),
+            content_type=content_type,
+            tags=list(tags),
+            created_at=created_at,
+            expires_at=created_at + PAGE_CACHE_TTL
+        )
+        self._remember(key, entry)
+
+        body_path, meta_path = self._entry_paths(key)
+        try:
+            self._write_atomic(body_path, body, 'wb')
+            self._write_atomic(meta_path, json.dumps(entry.meta()), 'w')
+        except OSError as e:
+            self.metrics['last_error'] = str(e)
+
+        self.metrics['stores'] += 1
+        self._stores += 1
+        if self._stores % SWEEP_EVERY == 0:
+            self.sweep()
+        return entry
+
+    @staticmethod
+    def _write_atomic(path, data, mode):
+        tmp_path = f'{path}.{os.getpid()}.{threading.get_ident()}.tmp'
+        with open(tmp_path, mode) as f:
+            f.write(data)
+        os.replace(tmp_path, path)
+
+    def _remove_files(self, key):
+        for path in self._entry_paths(key):
+            try:
+                os.remove(path)
+            except OSError:
+                pass
+
+    def sweep(self):
+        """Delete expired disk entries and the oldest ones beyond PAGE_CACHE_MAX_DISK_ENTRIES"""
+        entries_dir = os.path.join(self.directory, 'entries')
+        try:
+            metas = [name for name in os.listdir(entries_dir) if name.endswith('.json')]
+        except OSError:
+            return
+
+        now = time.time()
+        ages = []
+        for name in metas:
+            key = name[:-len('.json')]
+            try:
+                modified = os.stat(os.path.join(entries_dir, name)).st_mtime
+            except OSError:
+                continue
+            if modified + PAGE_CACHE_TTL <= now:
+                self._remove_files(key)
+            else:
+                ages.append((modified, key))
+
+        ages.sort()
+        for _, key in ages[:max(0, len(ages) - PAGE_CACHE_MAX_DISK_ENTRIES)]:
+            self._remove_files(key)
+
+    # Request handling
+
+    @staticmethod
+    def _cacheable_request():
+        from flask import current_app, request, session
+
+        if not current_app.config.get('PAGE_CACHE_ENABLED', True):
+            return False
+        if request.method not in ('GET', 'HEAD'):
+            return False
+        if session.get('user_id') or session.get('_flashes') or request.authorization:
+            return False
+        return len(request.query_string) <= MAX_CACHED_QUERY_LENGTH
+
+    @staticmethod
+    def _key():
+        from flask import request
+
+        locale = (request.accept_languages.best or '')[:2].lower()
+        raw = f"{request.path}?{request.query_string.decode('latin-1')}|{locale}"
+        return hashlib.sha1(raw.encode('utf-8')).hexdigest()
+
+    @staticmethod
+    def _respond(entry, state):
+        from flask import Response, request
+
+        if 'gzip' in request.headers.get('Accept-Encoding', ''):
+            response = Response(entry.body, content_type=entry.content_type)
+            response.headers['Content-Encoding'] = 'gzip'
+        else:
+            response = Response(gzip.decompress(entry.body), content_type=entry.content_type)
+
+        response.set_etag(entry.etag, weak=True)
+        response.last_modified = entry.last_modified
+        # Logged-in visitors get a different page at the same URL, so shared caches must revalidate
+        response.headers['Cache-Control'] = 'no-cache'
+        response.vary.add('Accept-Encoding')
+        response.vary.add('Cookie')
+        response.headers['X-Page-Cache'] = state
+        return response.make_conditional(request)
+
+    def cached(self, tags=()):
+        """
+        Decorator for a public view
+
+        Args:
+            tags: Dependency tags, or a callable taking the view's keyword arguments and returning them
+        """
+        def decorator(view):
+            @wraps(view)
+            def wrapper(*args, **kwargs):
+                from flask import make_response, session
+
+                if not self._cacheable_request():
+                    self.metrics['bypassed'] += 1
+                    return view(*args, **kwargs)
+
+                key = self._key()
+                entry = self.get(key)
+                if entry is not None:
+                    return self._respond(entry, 'HIT')
+
+                self.metrics['misses'] += 1
+                started = time.time()
+                response = make_response(view(*args, **kwargs))
+
+                if (response.status_code != 200 or response.mimetype != 'text/html' or response.direct_passthrough
+                        or session.modified or 'Set-Cookie' in response.headers):
+                    return response
+
+                page_tags = list(tags(**kwargs) if callable(tags) else tags) + list(GLOBAL_TAGS)
+                if not self._settled(page_tags, started):
+                    # Possibly rendered from another worker's pre-purge copy; storing it
+                    # would serve the stale page until PAGE_CACHE_TTL
+                    self.metrics['unsettled'] += 1
+                    return response
+                entry = self.store(key, response.get_data(), response.content_type, page_tags, started)
+                return self._respond(entry, 'MISS')
+            return wrapper
+        return decorator
+
+
+# Shared page cache for the application
+page_cache = PageCache()
@@ -0,0 +1,567 @@
+"""
+Revenue and funnel analytics over a local payment snapshot
+
+PaymentTransaction, PaymentLog, CourseEnrollment and EbookPurchase are copied
+into a column-oriented snapshot on local disk and every report is computed from
+that copy, so the admin analytics API never queries the OLTP database.
+
+Extraction is incremental: each refresh reads only rows past the stored
+watermarks ((updated_at, id) for transactions, id for the append-only tables),
+re-reading a small overlap so rows committed late aren't missed, and appends
+them as a new gzipped JSON segment. Segments are merged into a base file every
+SEGMENT_COMPACT_AFTER refreshes. One worker process extracts at a time (flock
+on the snapshot directory); the others just load the segments it writes.
+
+Set ANALYTICS_DATABASE_URL to extract from a read replica instead of the
+primary database.
+"""
+import glob
+import gzip
+import json
+import os
+import re
+import tempfile
+import threading
+import time
+from collections import defaultdict
+from datetime import datetime, timedelta
+
+try:
+    import fcntl
+except ImportError:  # Windows development machines
+    fcntl = None
+
+# How often the background thread extracts new rows
+SNAPSHOT_REFRESH_INTERVAL = 60  # 1 minute in seconds
+
+# Rows re-read behind each watermark to catch transactions that committed late
+WATERMARK_OVERLAP = 5 * 60  # 5 minutes in seconds
+ID_OVERLAP = 1000
+
+# Rows fetched per extraction query
+EXTRACT_BATCH_SIZE = 5000
+
+# Segments appended before they are merged into a new base file
+SEGMENT_COMPACT_AFTER = 50
+
+# Report results kept per snapshot version
+REPORT_CACHE_SIZE = 32
+
+DEFAULT_REPORT_DAYS = 30
+
+SECONDS_PER_DAY = 24 * 60 * 60
+EPOCH = datetime(1970, 1, 1)
+
+# Log actions that mean the gateway reported back on a transaction
+CALLBACK_ACTIONS = frozenset((
+    'ipn_received', 'success_callback_fallback', 'success_callback_validation',
+    'reconciliation_checked', 'manual_validation', 'payment_failed', 'payment_cancelled'
+))
+
+FUNNEL_STAGES = ('created', 'session_created', 'ipn_received', 'validated')
+
+# Snapshot tables: name -> (source model, key column, columns)
+TABLES = {
+    'transactions': ('PaymentTransaction', 'id', (
+        'id', 'transaction_id', 'purchase_type', 'course_id', 'ebook_id', 'status',
+        'amount', 'discount_amount', 'total_amount', 'coupon_code', 'created_at', 'updated_at'
+    )),
+    'logs': ('PaymentLog', 'id', ('id', 'transaction_id', 'action', 'created_at')),
+    'enrollments': ('CourseEnrollment', 'id', ('id', 'course_id', 'enrolled_at')),
+    'purchases': ('EbookPurchase', 'id', ('id', 'ebook_id', 'total_paid', 'coupon_used', 'purchased_at'))
+}
+
+_SEGMENT_RE = re.compile(r'(base|segment)-(\d+)\.json\.gz$')
+
+
+def _timestamp(value):
+    """Naive UTC datetime -> seconds since the epoch (None stays None)"""
+    if value is None:
+        return None
+    return (value - EPOCH).total_seconds()
+
+
+def _day(timestamp):
+    return int(timestamp // SECONDS_PER_DAY) if timestamp is not None else None
+
+
+def _day_label(day):
+    return (EPOCH + timedelta(days=day)).date().isoformat()
+
+
+class ColumnTable:
+    """Rows stored as one list per column, upserted by a unique key column"""
+
+    def __init__(self, columns, key):
+        self.names = columns
+        self.key = key
+        self.columns = {name: [] for name in columns}
+        self.position = {}
+
+    def __len__(self):
+        return len(self.position)
+
+    def upsert(self, columns):
+        """Insert or replace rows given as {column: [values...]}"""
+        keys = columns[self.key]
+        for index, key in enumerate(keys):
+            position = self.position.get(key)
+            if position is None:
+                self.position[key] = len(self.position)
+                for name in self.names:
+                    self.columns[name].append(columns[name][index])
+            else:
+                for name in self.names:
+                    self.columns[name][position] = columns[name][index]
+
+    def changed(self, columns, version_column=None):
+        """
+        Drop rows that are already stored unchanged
+
+        Append-only tables pass no version_column, so any key already present is dropped.
+        """
+        keep = []
+        for index, key in enumerate(columns[self.key]):
+            position = self.position.get(key)
+            if position is None:
+                keep.append(index)
+            elif version_column and self.columns[version_column][position] != columns[version_column][index]:
+                keep.append(index)
+        return {name: [values[index] for index in keep] for name, values in columns.items()}
+
+    def to_dict(self):
+        return self.columns
+
+
+class PaymentAnalytics:
+    """Keeps the local payment snapshot current and computes reports from it"""
+
+    def __init__(self):
+        self.app = None
+        self.directory = None
+        self._engine = None
+        self._lock = threading.RLock()
+        self._reports = {}
+        self._reset()
+        self.metrics = {
+            'refreshes': 0,
+            'last_refresh_at': None,
+            'last_refresh_duration': None,
+            'last_refresh_rows': 0,
+            'last_error': None
+        }
+
+    def _reset(self):
+        self.tables = {name: ColumnTable(columns, key) for name, (_, key, columns) in TABLES.items()}
+        self.watermarks = {'transactions': None, 'logs': 0, 'enrollments': 0, 'purchases': 0}
+        self.sequence = 0
+        self.version = 0
+
+    def init_app(self, app):
+        """Bind to the Flask app, load the snapshot from disk and keep it refreshed in the background"""
+        self.app = app
+        self.directory = app.config.get('ANALYTICS_SNAPSHOT_DIR') or os.path.join(
+            tempfile.gettempdir(), 'skillfinesse_analytics'
+        )
+        if fcntl is None:
+            # Without file locks each process keeps its own snapshot
+            self.directory = os.path.join(self.directory, str(os.getpid()))
+        os.makedirs(self.directory, exist_ok=True)
+
+        replica_url = app.config.get('ANALYTICS_DATABASE_URL') or os.environ.get('ANALYTICS_DATABASE_URL')
+        if replica_url:
+            from sqlalchemy import create_engine
+            self._engine = create_engine(replica_url, pool_size=1, max_overflow=0, pool_pre_ping=True)
+
+        try:
+            self._sync_from_disk()
+        except Exception as e:
+            print(f"❌ Payment analytics snapshot load failed: {str(e)}")
+            self._reset()
+
+        if app.config.get('BACKGROUND_WORKERS', True):
+            threading.Thread(target=self._run, name='payment-analytics', daemon=True).start()
+
+    def _run(self):
+        while True:
+            with self.app.app_context():
+                try:
+                    self.refresh()
+                except Exception as e:
+                    self.metrics['last_error'] = str(e)
+                    print(f"❌ Payment analytics refresh error: {str(e)}")
+                finally:
+                    import models
+                    models.db.session.remove()
+            time.sleep(SNAPSHOT_REFRESH_INTERVAL)
+
+    # Snapshot files
+
+    def _files(self):
+        """{'base': [(sequence, path)], 'segment': [(sequence, path)]} sorted by sequence"""
+        files = {'base': [], 'segment': []}
+        for path in glob.glob(os.path.join(self.directory, '*.json.gz')):
+            match = _SEGMENT_RE.search(os.path.basename(path))
+            if match:
+                files[match.group(1)].append((int(match.group(2)), path))
+        for entries in files.values():
+            entries.sort()
+        return files
+
+    def _write(self, kind, sequence, payload):
+        path = os.path.join(self.directory, f'{kind}-{sequence:010d}.json.gz')
+        temp_path = f'{path}.{os.getpid()}.tmp'
+        with gzip.open(temp_path, 'wt', encoding='utf-8') as handle:
+            json.dump(payload, handle, separators=(',', ':'))
+        os.replace(temp_path, path)
+
+    @staticmethod
+    def _read(path):
+        with gzip.open(path, 'rt', encoding='utf-8') as handle:
+            return json.load(handle)
+
+    def _apply(self, payload):
+        for name, columns in payload['tables'].items():
+            if columns and columns.get(TABLES[name][1]):
+                self.tables[name].upsert(columns)
+        self.watermarks = payload['watermarks']
+        self.sequence = payload['sequence']
+
+    def _sync_from_disk(self):
+        """Apply segments written since this process last looked, reloading the base if they were compacted"""
+        files = self._files()
+        pending = [(sequence, path) for sequence, path in files['segment'] if sequence > self.sequence]
+        latest_base = files['base'][-1] if files['base'] else None
+
+        changed = False
+        with self._lock:
+            expected = self.sequence + 1
+            if latest_base and latest_base[0] > self.sequence and (not pending or pending[0][0] != expected):
+                self._reset()
+                self._apply(self._read(latest_base[1]))
+                pending = [(sequence, path) for sequence, path in pending if sequence > self.sequence]
+                changed = True
+
+            for sequence, path in pending:
+                self._apply(self._read(path))
+                changed = True
+
+            if changed:
+                self.version += 1
+                self._reports.clear()
+
+    def _compact(self):
+        """Merge everything into one base file and drop the older files"""
+        with self._lock:
+            payload = {
+                'sequence': self.sequence,
+                'watermarks': self.watermarks,
+                'tables': {name: table.to_dict() for name, table in self.tables.items()}
+            }
+        self._write('base', self.sequence, payload)
+        files = self._files()
+        stale = [path for sequence, path in files['segment'] if sequence <= payload['sequence']]
+        stale += [path for sequence, path in files['base'] if sequence < payload['sequence']]
+        for path in stale:
+            os.remove(path)
+
+    # Extraction
+
+    def _connect(self):
+        import models
+        return (self._engine or models.db.engine).connect()
+
+    def _extract_by_id(self, conn, name):
+        """New rows of an append-only table past the id watermark"""
+        import models
+        from sqlalchemy import select
+
+        model_name, key, columns = TABLES[name]
+        table = getattr(models, model_name).__table__
+        last_id = max((self.watermarks[name] or 0) - ID_OVERLAP, 0)
+        rows = {column: [] for column in columns}
+
+        while True:
+            batch = conn.execute(
+                select(*[table.c[column] for column in columns])
+                .where(table.c[key] > last_id)
+                .order_by(table.c[key])
+                .limit(EXTRACT_BATCH_SIZE)
+            ).all()
+            for row in batch:
+                for column, value in zip(columns, row):
+                    rows[column].append(_timestamp(value) if isinstance(value, datetime) else value)
+            if len(batch) < EXTRACT_BATCH_SIZE:
+                break
+            last_id = batch[-1][0]
+
+        watermark = max(rows[key]) if rows[key] else self.watermarks[name]
+        return rows, max(watermark or 0, self.watermarks[name] or 0)
+
+    def _extract_transactions(self, conn):
+        """Transactions created or updated past the (updated_at, id) watermark"""
+        import models
+        from sqlalchemy import select, tuple_
+
+        _, key, columns = TABLES['transactions']
+        table = models.PaymentTransaction.__table__
+        rows = {column: [] for column in columns}
+
+        watermark = self.watermarks['transactions']
+        cursor = None
+        if watermark:
+            cursor = (EPOCH + timedelta(seconds=watermark - WATERMARK_OVERLAP), 0)
+
+        newest = watermark
+        while True:
+            query = select(*[table.c[column] for column in columns]).order_by(table.c.updated_at, table.c.id)
+            if cursor:
+                query = query.where(tuple_(table.c.updated_at, table.c.id) > tuple_(*cursor))
+            batch = conn.execute(query.limit(EXTRACT_BATCH_SIZE)).all()
+            for row in batch:
+                for column, value in zip(columns, row):
+                    rows[column].append(_timestamp(value) if isinstance(value, datetime) else value)
+            if batch:
+                last = batch[-1]._mapping
+                cursor = (last['updated_at'], last['id'])
+                if last['updated_at']:
+                    newest = max(newest or 0, _timestamp(last['updated_at']))
+            if len(batch) < EXTRACT_BATCH_SIZE:
+                break
+
+        return rows, newest
+
+    def refresh(self):
+        """
+        Extract rows past the watermarks into a new segment; call inside an app context
+
+        Returns:
+            int: Rows extracted by this call (0 when another process holds the extraction lock)
+        """
+        lock_handle = open(os.path.join(self.directory, 'extract.lock'), 'w')
+        try:
+            if fcntl is not None:
+                try:
+                    fcntl.flock(lock_handle, fcntl.LOCK_EX | fcntl.LOCK_NB)
+                except OSError:
+                    # Another worker is extracting; pick up what it has written so far
+                    self._sync_from_disk()
+                    return 0
+
+            self._sync_from_disk()
+
+            started = time.monotonic()
+            tables, watermarks = {}, dict(self.watermarks)
+            with self._connect() as conn:
+                tables['transactions'], watermarks['transactions'] = self._extract_transactions(conn)
+                for name in ('logs', 'enrollments', 'purchases'):
+                    tables[name], watermarks[name] = self._extract_by_id(conn, name)
+                conn.rollback()
+
+            # Rows re-read inside the overlap are only kept if they changed
+            with self._lock:
+                for name, columns in tables.items():
+                    tables[name] = self.tables[name].changed(
+                        columns, 'updated_at' if name == 'transactions' else None
+                    )
+
+            extracted = sum(len(columns[TABLES[name][1]]) for name, columns in tables.items())
+            if extracted or watermarks != self.watermarks:
+                payload = {'sequence': self.sequence + 1, 'watermarks': watermarks, 'tables': tables}
+                self._write('segment', payload['sequence'], payload)
+
+                with self._lock:
+                    self._apply(payload)
+                    self.version += 1
+                    self._reports.clear()
+
+                if len(self._files()['segment']) >= SEGMENT_COMPACT_AFTER:
+                    self._compact()
+
+            self.metrics.update({
+                'refreshes': self.metrics['refreshes'] + 1,
+                'last_refresh_at': datetime.utcnow().isoformat(),
+                'last_refresh_duration': round(time.monotonic() - started, 3),
+                'last_refresh_rows': extracted,
+                'last_error': None
+            })
+            return extracted
+        finally:
+            lock_handle.close()
+
+    # Reports
+
+    def report(self, days=DEFAULT_REPORT_DAYS):
+        """
+        Funnel, revenue and failure-rate report for the last `days` days (UTC), from the snapshot only
+
+        Returns:
+            dict: funnel, revenue_by_day, revenue_by_item, revenue_by_coupon, rates and snapshot info
+        """
+        with self._lock:
+            cache_key = (self.version, days)
+            cached = self._reports.get(cache_key)
+            if cached is not None:
+                return cached
+
+            end_day = _day(_timestamp(datetime.utcnow()))
+            start_day = end_day - days + 1
+            result = {
+                'days': days,
+                'start': _day_label(start_day),
+                'end': _day_label(end_day),
+                'funnel': self._funnel(start_day),
+                'revenue_by_day': self._revenue_by_day(start_day, end_day),
+                'revenue_by_item': self._revenue_by_item(start_day),
+                'revenue_by_coupon': self._revenue_by_coupon(start_day),
+                'rates': self._rates(start_day),
+                'snapshot': self.info()
+            }
+
+            if len(self._reports) >= REPORT_CACHE_SIZE:
+                self._reports.clear()
+            self._reports[cache_key] = result
+            return result
+
+    def info(self):
+        """Snapshot size and freshness"""
+        watermark = self.watermarks.get('transactions')
+        return {
+            'rows': {name: len(table) for name, table in self.tables.items()},
+            'sequence': self.sequence,
+            'transactions_watermark': (EPOCH + timedelta(seconds=watermark)).isoformat() if watermark else None,
+            'last_refresh_at': self.metrics['last_refresh_at']
+        }
+
+    def _window(self, start_day):
+        """Column tuples of the transactions created on or after start_day"""
+        columns = self.tables['transactions'].columns
+        return [row for row in zip(
+            columns['transaction_id'], columns['status'], columns['purchase_type'],
+            columns['course_id'], columns['ebook_id'], columns['total_amount'],
+            columns['discount_amount'], columns['coupon_code'],
+            columns['created_at'], columns['updated_at']
+        ) if row[8] is not None and _day(row[8]) >= start_day]
+
+    def _log_stages(self):
+        """transaction_id -> set of funnel stages reached according to the payment logs"""
+        stages = defaultdict(set)
+        columns = self.tables['logs'].columns
+        for transaction_id, action in zip(columns['transaction_id'], columns['action']):
+            if action == 'session_created':
+                stages[transaction_id].add('session_created')
+            elif action in CALLBACK_ACTIONS:
+                stages[transaction_id].add('ipn_received')
+        return stages
+
+    def _funnel(self, start_day):
+        stages = self._log_stages()
+        counts = dict.fromkeys(FUNNEL_STAGES, 0)
+        for transaction_id, status, *_ in self._window(start_day):
+            reached = stages.get(transaction_id, ())
+            validated = status == 'VALIDATED'
+            counts['created'] += 1
+            # A validated transaction has been through every earlier stage even if its log rows are missing
+            counts['session_created'] += 1 if validated or 'session_created' in reached else 0
+            counts['ipn_received'] += 1 if validated or 'ipn_received' in reached else 0
+            counts['validated'] += 1 if validated else 0
+
+        funnel = []
+        previous = None
+        for stage in FUNNEL_STAGES:
+            funnel.append({
+                'stage': stage,
+                'count': counts[stage],
+                'conversion': round(counts[stage] / previous, 4) if previous else None
+            })
+            previous = counts[stage]
+        return funnel
+
+    def _revenue_by_day(self, start_day, end_day):
+        revenue = defaultdict(float)
+        payments = defaultdict(int)
+        columns = self.tables['transactions'].columns
+        for status, total_amount, updated_at in zip(columns['status'], columns['total_amount'], columns['updated_at']):
+            if status != 'VALIDATED' or updated_at is None:
+                continue
+            day = _day(updated_at)
+            if start_day <= day <= end_day:
+                revenue[day] += total_amount or 0.0
+                payments[day] += 1
+
+        return [{
+            'date': _day_label(day),
+            'revenue': round(revenue[day], 2),
+            'payments': payments[day]
+        } for day in range(start_day, end_day + 1)]
+
+    def _revenue_by_item(self, start_day):
+        items = defaultdict(lambda: {'transactions': 0, 'payments': 0, 'revenue': 0.0, 'fulfilled': 0})
+        for _, status, purchase_type, course_id, ebook_id, total_amount, *_ in self._window(start_day):
+            item = items[(purchase_type, course_id if purchase_type == 'course' else ebook_id)]
+            item['transactions'] += 1
+            if status == 'VALIDATED':
+                item['payments'] += 1
+                item['revenue'] += total_amount or 0.0
+
+        # Fulfilled counts include enrollments/purchases granted by admins
+        enrollments = self.tables['enrollments'].columns
+        for course_id, enrolled_at in zip(enrollments['course_id'], enrollments['enrolled_at']):
+            if enrolled_at is not None and _day(enrolled_at) >= start_day:
+                items[('course', course_id)]['fulfilled'] += 1
+        purchases = self.tables['purchases'].columns
+        for ebook_id, purchased_at in zip(purchases['ebook_id'], purchases['purchased_at']):
+            if purchased_at is not None and _day(purchased_at) >= start_day:
+                items[('ebook', ebook_id)]['fulfilled'] += 1
+
+        result = [dict(values, item_type=item_type, item_id=item_id, revenue=round(values['revenue'], 2))
+                  for (item_type, item_id), values in items.items()]
+        result.sort(key=lambda item: item['revenue'], reverse=True)
+        return result
+
+    def _revenue_by_coupon(self, start_day):
+        coupons = defaultdict(lambda: {'transactions': 0, 'payments': 0, 'revenue': 0.0, 'discount_given': 0.0})
+        for _, status, _, _, _, total_amount, discount_amount, coupon_code, *_ in self._window(start_day):
+            if not coupon_code:
+                continue
+            coupon = coupons[coupon_code.upper()]
+            coupon['transactions'] += 1
+            if status == 'VALIDATED':
+                coupon['payments'] += 1
+                coupon['revenue'] += total_amount or 0.0
+                coupon['discount_given'] += discount_amount or 0.0
+
+        result = [{
+            'code': code,
+            'transactions': values['transactions'],
+            'payments': values['payments'],
+            'conversion': round(values['payments'] / values['transactions'], 4),
+            'revenue': round(values['revenue'], 2),
+            'discount_given': round(values['discount_given'], 2)
+        } for code, values in coupons.items()]
+        result.sort(key=lambda coupon: coupon['payments'], reverse=True)
+        return result
+
+    def _rates(self, start_day):
+        statuses = defaultdict(int)
+        for _, status, *_ in self._window(start_day):
+            statuses[status or 'PENDING'] += 1
+
+        total = sum(statuses.values())
+
+        def rate(*names):
+            return round(sum(statuses[name] for name in names) / total, 4) if total else None
+
+        return {
+            'transactions': total,
+            'by_status': dict(statuses),
+            'success_rate': rate('VALIDATED'),
+            'failure_rate': rate('FAILED'),
+            'cancellation_rate': rate('CANCELLED'),
+            'held_rate': rate('VALID'),  # paid but held for review
+            'open_rate': rate('PENDING', 'PROCESSING')
+        }
+
+
+# Shared analytics snapshot for the application
+payment_analytics = PaymentAnalytics()
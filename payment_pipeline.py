@@ -0,0 +1,329 @@
+"""
+Idempotent payment state machine
+
+Every callback that can move a PaymentTransaction forward (IPN, success
+redirect, failure/cancel redirects, admin validation, stuck-payment processing)
+goes through PaymentPipeline.transition. It locks the transaction row with
+SELECT ... FOR UPDATE SKIP LOCKED, applies the status change, creates the
+enrollment/purchase and writes the payment logs in a single commit, and records
+an idempotency key so a duplicate callback is answered without redoing any of it.
+The daily analytics rollups are updated in the same commit.
+"""
+import threading
+from collections import OrderedDict
+from datetime import datetime
+
+from analytics_rollup import analytics_rollup
+
+# Once a transaction reaches this status it is never transitioned again
+FULFILLED_STATUS = 'VALIDATED'
+
+# Statuses of a transaction still waiting for the gateway; transition_many only moves these
+OPEN_STATUSES = ('PENDING', 'PROCESSING')
+
+# Outcomes returned by PaymentPipeline.transition
+OUTCOME_PROCESSED = 'processed'  # transition applied by this call
+OUTCOME_DUPLICATE = 'duplicate'  # callback already handled, or transaction already fulfilled
+OUTCOME_BUSY = 'busy'            # another worker currently holds the row lock
+OUTCOME_SKIPPED = 'skipped'      # the row left OPEN_STATUSES after the batch was planned
+OUTCOME_NOT_FOUND = 'not_found'
+OUTCOME_ERROR = 'error'
+
+# Recently handled idempotency keys kept in-process to skip the lookup query
+IDEMPOTENCY_CACHE_SIZE = 5000
+
+
+class PaymentPipeline:
+    """Single entry point for payment status transitions and fulfilment"""
+
+    _recent_results = OrderedDict()
+    _recent_lock = threading.Lock()
+
+    @staticmethod
+    def _remember(idempotency_key, result):
+        with PaymentPipeline._recent_lock:
+            PaymentPipeline._recent_results[idempotency_key] = result
+            PaymentPipeline._recent_results.move_to_end(idempotency_key)
+            while len(PaymentPipeline._recent_results) > IDEMPOTENCY_CACHE_SIZE:
+                PaymentPipeline._recent_results.popitem(last=False)
+
+    @staticmethod
+    def get_recorded_result(idempotency_key):
+        """Return the stored result for an already-handled callback, or None"""
+        if not idempotency_key:
+            return None
+
+        with PaymentPipeline._recent_lock:
+            cached = PaymentPipeline._recent_results.get(idempotency_key)
+        if cached:
+            return cached
+
+        import models
+        record = models.db.session.get(models.PaymentIdempotencyKey, idempotency_key)
+        if not record:
+            return None
+
+        result = {
+            'outcome': OUTCOME_DUPLICATE,
+            'status': record.status,
+            'fulfilled': record.status == FULFILLED_STATUS
+        }
+        PaymentPipeline._remember(idempotency_key, result)
+        return result
+
+    @staticmethod
+    def lock_transaction(transaction_id):
+        """Lock the transaction row, returning None if another worker holds it (or it doesn't exist)"""
+        import models
+        return models.PaymentTransaction.query.filter_by(
+            transaction_id=transaction_id
+        ).with_for_update(skip_locked=True).first()
+
+    @staticmethod
+    def _fulfil(payment_transaction, logs):
+        """Create the enrollment/purchase for a locked transaction unless it already exists"""
+        import models
+
+        if payment_transaction.purchase_type == 'course':
+            existing = models.CourseEnrollment.query.filter_by(
+                user_id=payment_transaction.user_id,
+                course_id=payment_transaction.course_id
+            ).first()
+            if not existing:
+                models.db.session.add(models.CourseEnrollment(
+                    user_id=payment_transaction.user_id,
+                    course_id=payment_transaction.course_id,
+                    enrolled_at=datetime.utcnow()
+                ))
+                logs.append({
+                    'action': 'enrollment_created',
+                    'status': 'SUCCESS',
+                    'message': 'Course enrollment created successfully'
+                })
+            analytics_rollup.record(
+                'course', payment_transaction.course_id,
+                enrollments=0 if existing else 1,
+                revenue=payment_transaction.total_amount or 0.0
+            )
+
+        elif payment_transaction.purchase_type == 'ebook':
+            existing = models.EbookPurchase.query.filter_by(
+                user_id=payment_transaction.user_id,
+                ebook_id=payment_transaction.ebook_id
+            ).first()
+            if not existing:
+                models.db.session.add(models.EbookPurchase(
+                    user_id=payment_transaction.user_id,
+                    ebook_id=payment_transaction.ebook_id,
+                    purchased_at=datetime.utcnow(),
+                    coupon_used=payment_transaction.coupon_code,
+                    discount_amount=payment_transaction.discount_amount,
+                    total_paid=payment_transaction.total_amount
+                ))
+                logs.append({
+                    'action': 'purchase_created',
+                    'status': 'SUCCESS',
+                    'message': 'eBook purchase created successfully'
+                })
+            analytics_rollup.record(
+                'ebook', payment_transaction.ebook_id,
+                purchases=0 if existing else 1,
+                revenue=payment_transaction.total_amount or 0.0
+            )
+
+        payment_transaction.update_status(FULFILLED_STATUS, commit=False)
+
+    @staticmethod
+    def _apply(payment_transaction, new_status, gateway_data, logs, fulfil, idempotency_key, request_obj):
+        """Stage a transition on a locked transaction without committing, returns the new status"""
+        import models
+
+        logs = list(logs or [])
+
+        if new_status:
+            payment_transaction.update_status(new_status, gateway_data, commit=False)
+
+        if fulfil:
+            PaymentPipeline._fulfil(payment_transaction, logs)
+
+        for entry in logs:
+            models.PaymentLog.log_action(
+                transaction_id=payment_transaction.transaction_id,
+                action=entry['action'],
+                status=entry['status'],
+                message=entry.get('message'),
+                data=entry.get('data'),
+                request_obj=request_obj,
+                commit=False
+            )
+
+        if idempotency_key:
+            models.db.session.add(models.PaymentIdempotencyKey(
+                key=idempotency_key,
+                transaction_id=payment_transaction.transaction_id,
+                outcome=OUTCOME_PROCESSED,
+                status=payment_transaction.status
+            ))
+
+        return payment_transaction.status
+
+    @staticmethod
+    def transition(transaction_id, new_status=None, gateway_data=None, logs=None,
+                   fulfil=False, idempotency_key=None, request_obj=None, from_statuses=None):
+        """
+        Apply a status change (and optionally fulfil the purchase) in one transaction
+
+        Args:
+            transaction_id (str): SSLCommerz tran_id
+            new_status (str): Status to set, or None to leave it unchanged
+            gateway_data (dict): Gateway response stored on the transaction
+            logs (list): PaymentLog entries as dicts with action/status/message/data
+            fulfil (bool): Create the enrollment/purchase and mark the transaction VALIDATED
+            idempotency_key (str): Identity of the callback, e.g. 'ipn:<tran_id>:<val_id>'
+            request_obj: Flask request used for log IP/user agent
+            from_statuses (tuple): Only transition a row currently in one of these, else report it skipped
+
+        Returns:
+            dict: outcome, resulting status and whether the purchase is fulfilled
+        """
+        import models
+        db = models.db
+
+        recorded = PaymentPipeline.get_recorded_result(idempotency_key)
+        if recorded:
+            return recorded
+
+        try:
+            payment_transaction = PaymentPipeline.lock_transaction(transaction_id)
+
+            if payment_transaction is None:
+                db.session.rollback()
+                exists = db.session.query(models.PaymentTransaction.id).filter_by(
+                    transaction_id=transaction_id
+                ).first()
+                return {
+                    'outcome': OUTCOME_BUSY if exists else OUTCOME_NOT_FOUND,
+                    'status': None,
+                    'fulfilled': False
+                }
+
+            if payment_transaction.status == FULFILLED_STATUS:
+                db.session.rollback()
+                return {'outcome': OUTCOME_DUPLICATE, 'status': FULFILLED_STATUS, 'fulfilled': True}
+            if from_statuses and payment_transaction.status not in from_statuses:
+                status = payment_transaction.status
+                db.session.rollback()
+                return {'outcome': OUTCOME_SKIPPED, 'status': status, 'fulfilled': False}
+
+            status = PaymentPipeline._apply(
+                payment_transaction, new_status, gateway_data, logs, fulfil, idempotency_key, request_obj
+            )
+
+            db.session.commit()
+
+        except Exception as e:
+            db.session.rollback()
+
+            # A concurrent callback with the same key committed first
+            recorded = PaymentPipeline.get_recorded_result(idempotency_key)
+            if recorded:
+                return recorded
+
+            print(f"❌ PAYMENT TRANSITION FAILED: {transaction_id} - {str(e)}")
+            try:
+                models.PaymentLog.log_action(
+                    transaction_id=transaction_id,
+                    action='processing_error',
+                    status='ERROR',
+                    message=f'Error processing payment transition: {str(e)}',
+                    data={'error': str(e)}
+                )
+            except Exception:
+                db.session.rollback()
+            return {'outcome': OUTCOME_ERROR, 'status': None, 'fulfilled': False, 'error': str(e)}
+
+        result = {'outcome': OUTCOME_PROCESSED, 'status': status, 'fulfilled': status == FULFILLED_STATUS}
+        if idempotency_key:
+            PaymentPipeline._remember(idempotency_key, dict(result, outcome=OUTCOME_DUPLICATE))
+        return result
+
+    @staticmethod
+    def transition_many(items, request_obj=None):
+        """
+        Apply several transitions under one lock query and one commit
+
+        The items are planned from an earlier, unlocked read, so a transaction is
+        only moved if it is still in OPEN_STATUSES once locked; one a callback
+        cancelled, failed or held for review meanwhile is reported as skipped.
+
+        Args:
+            items (list): dicts with transaction_id and the keyword arguments of transition()
+
+        Returns:
+            dict: transaction_id -> result as returned by transition()
+        """
+        import models
+        db = models.db
+
+        if not items:
+            return {}
+
+        results = {}
+        try:
+            transaction_ids = [item['transaction_id'] for item in items]
+            locked = {
+                payment_transaction.transaction_id: payment_transaction
+                for payment_transaction in models.PaymentTransaction.query.filter(
+                    models.PaymentTransaction.transaction_id.in_(transaction_ids)
+                ).with_for_update(skip_locked=True).all()
+            }
+
+            for item in items:
+                transaction_id = item['transaction_id']
+                payment_transaction = locked.get(transaction_id)
+
+                if payment_transaction is None:
+                    results[transaction_id] = {'outcome': OUTCOME_BUSY, 'status': None, 'fulfilled': False}
+                    continue
+                if payment_transaction.status == FULFILLED_STATUS:
+                    results[transaction_id] = {'outcome': OUTCOME_DUPLICATE, 'status': FULFILLED_STATUS, 'fulfilled': True}
+                    continue
+                if payment_transaction.status not in OPEN_STATUSES:
+                    results[transaction_id] = {'outcome': OUTCOME_SKIPPED, 'status': payment_transaction.status, 'fulfilled': False}
+                    continue
+
+                status = PaymentPipeline._apply(
+                    payment_transaction,
+                    item.get('new_status'),
+                    item.get('gateway_data'),
+                    item.get('logs'),
+                    item.get('fulfil', False),
+                    item.get('idempotency_key'),
+                    request_obj
+                )
+                results[transaction_id] = {
+                    'outcome': OUTCOME_PROCESSED,
+                    'status': status,
+                    'fulfilled': status == FULFILLED_STATUS
+                }
+
+            db.session.commit()
+
+        except Exception as e:
+            db.session.rollback()
+            print(f"⚠️ Batched payment transition failed, retrying one by one: {str(e)}")
+            return {
+                item['transaction_id']: PaymentPipeline.transition(
+                    item['transaction_id'],
+                    new_status=item.get('new_status'),
+                    gateway_data=item.get('gateway_data'),
+                    logs=item.get('logs'),
+                    fulfil=item.get('fulfil', False),
+                    idempotency_key=item.get('idempotency_key'),
+                    request_obj=request_obj,
+                    from_statuses=OPEN_STATUSES
+                )
+                for item in items
+            }
+
+        return results
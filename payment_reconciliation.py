@@ -0,0 +1,332 @@
+"""
+Background reconciliation of stuck SSLCommerz payments
+
+PENDING/PROCESSING transactions older than a grace period are paged through by
+(created_at, id), checked against SSLCommerz with a bounded thread pool sharing
+one keep-alive session, and the results are applied one page at a time through
+PaymentPipeline.transition_many (one lock query and one commit per page).
+"""
+import time
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime, timedelta
+
+import requests
+from requests.adapters import HTTPAdapter
+
+from payment_pipeline import PaymentPipeline, OPEN_STATUSES, OUTCOME_PROCESSED
+
+# Give the IPN time to arrive before reconciling a transaction
+RECONCILE_MIN_AGE = 10 * 60  # 10 minutes in seconds
+
+# Transactions the gateway never saw (or never completed) are cancelled after this
+ABANDON_AFTER = 24 * 60 * 60  # 24 hours in seconds
+
+PAGE_SIZE = 200
+MAX_CONCURRENCY = 16
+CONNECT_TIMEOUT = 3
+READ_TIMEOUT = 10
+
+# How often the background loop runs
+RECONCILE_INTERVAL = 10 * 60  # 10 minutes in seconds
+
+# pg_try_advisory_lock key so only one worker reconciles at a time
+RECONCILE_LOCK_KEY = 724918302
+
+# Gateway statuses that mean the customer paid
+PAID_STATUSES = ('VALID', 'VALIDATED')
+
+
+class PaymentReconciler:
+    """Pages through stuck transactions and settles them against SSLCommerz"""
+
+    def __init__(self):
+        self.app = None
+        self.session = None
+        self._run_lock = threading.Lock()
+        self._thread = None
+        self.metrics = {
+            'running': False,
+            'runs': 0,
+            'last_run_started_at': None,
+            'last_run_finished_at': None,
+            'last_run_duration': None,
+            'last_run_checked': 0,
+            'last_run_throughput': None,  # transactions per second
+            'last_error': None,
+            'total_checked': 0,
+            'total_fulfilled': 0,
+            'total_held': 0,
+            'total_failed': 0,
+            'total_cancelled': 0,
+            'total_unchanged': 0,
+            'total_errors': 0,
+            'backlog': None
+        }
+
+    def init_app(self, app):
+        """Bind to the Flask app; gateway URLs and credentials come from app.config"""
+        self.app = app
+        self.session = requests.Session()
+        adapter = HTTPAdapter(pool_connections=1, pool_maxsize=MAX_CONCURRENCY)
+        self.session.mount('https://', adapter)
+        self.session.mount('http://', adapter)
+
+    # Gateway lookups (run in the thread pool, no app context needed)
+
+    def _query_gateway(self, transaction, config):
+        """Return the gateway's view of one transaction as a dict, or {'error': ...}"""
+        timeout = (CONNECT_TIMEOUT, READ_TIMEOUT)
+        try:
+            if transaction['val_id']:
+                response = self.session.get(config['SSLCOMMERZ_VALIDATION_API'], params={
+                    'val_id': transaction['val_id'],
+                    'store_id': config['SSLCOMMERZ_STORE_ID'],
+                    'store_passwd': config['SSLCOMMERZ_STORE_PASSWORD'],
+                    'v': 1,
+                    'format': 'json'
+                }, timeout=timeout)
+                response.raise_for_status()
+                return response.json()
+
+            # No val_id yet (IPN never arrived): look the transaction up by tran_id
+            response = self.session.get(config['SSLCOMMERZ_TRANSACTION_QUERY_API'], params={
+                'tran_id': transaction['transaction_id'],
+                'store_id': config['SSLCOMMERZ_STORE_ID'],
+                'store_passwd': config['SSLCOMMERZ_STORE_PASSWORD'],
+                'format': 'json'
+            }, timeout=timeout)
+            response.raise_for_status()
+            result = response.json()
+            elements = result.get('element') or []
+            if not elements:
+                return {'status': 'NOT_FOUND'}
+
+            # Prefer a paid attempt if the customer tried more than once
+            for element in elements:
+                if element.get('status') in PAID_STATUSES:
+                    return element
+            return elements[0]
+
+        except Exception as e:
+            return {'error': str(e)}
+
+    # Decision logic
+
+    @staticmethod
+    def _plan(transaction, gateway_data, now):
+        """Turn a gateway response into a transition item, or None to leave it alone"""
+        if 'error' in gateway_data:
+            return None
+
+        gateway_status = gateway_data.get('status')
+        abandoned = (now - transaction['created_at']).total_seconds() > ABANDON_AFTER
+        logs = [{
+            'action': 'reconciliation_checked',
+            'status': gateway_status or 'UNKNOWN',
+            'message': f'Reconciliation found gateway status: {gateway_status}',
+            'data': gateway_data
+        }]
+
+        if gateway_status in PAID_STATUSES:
+            risk_level = int(gateway_data.get('risk_level', 0) or 0)
+            if risk_level != 0:
+                logs.append({
+                    'action': 'high_risk_hold',
+                    'status': 'HOLD',
+                    'message': f'Transaction held for review due to risk level: {risk_level}',
+                    'data': {'risk_level': risk_level, 'risk_title': gateway_data.get('risk_title')}
+                })
+            return {
+                'transaction_id': transaction['transaction_id'],
+                'new_status': 'VALID',
+                'gateway_data': gateway_data,
+                'logs': logs,
+                'fulfil': risk_level == 0
+            }
+
+        if gateway_status in ('FAILED', 'INVALID_TRANSACTION'):
+            return {'transaction_id': transaction['transaction_id'], 'new_status': 'FAILED',
+                    'gateway_data': gateway_data, 'logs': logs}
+
+        if gateway_status in ('CANCELLED', 'EXPIRED') or abandoned:
+            return {'transaction_id': transaction['transaction_id'], 'new_status': 'CANCELLED',
+                    'gateway_data': gateway_data, 'logs': logs}
+
+        # Still in progress on the gateway side (PENDING, UNATTEMPTED, NOT_FOUND)
+        return None
+
+    # Run loop
+
+    def _pages(self, cutoff):
+        """Yield pages of stuck transactions ordered by (created_at, id) using keyset pagination"""
+        import models
+        PaymentTransaction = models.PaymentTransaction
+
+        last_created_at, last_id = None, 0
+        while True:
+            query = models.db.session.query(
+                PaymentTransaction.id,
+                PaymentTransaction.transaction_id,
+                PaymentTransaction.val_id,
+                PaymentTransaction.created_at
+            ).filter(
+                PaymentTransaction.status.in_(OPEN_STATUSES),
+                PaymentTransaction.created_at < cutoff
+            )
+            if last_created_at is not None:
+                query = query.filter(models.db.or_(
+                    PaymentTransaction.created_at > last_created_at,
+                    models.db.and_(PaymentTransaction.created_at == last_created_at,
+                                   PaymentTransaction.id > last_id)
+                ))
+            rows = query.order_by(PaymentTransaction.created_at, PaymentTransaction.id).limit(PAGE_SIZE).all()
+            models.db.session.rollback()
+            if not rows:
+                return
+
+            yield [{'id': row.id, 'transaction_id': row.transaction_id,
+                    'val_id': row.val_id, 'created_at': row.created_at} for row in rows]
+
+            last_created_at, last_id = rows[-1].created_at, rows[-1].id
+            if len(rows) < PAGE_SIZE:
+                return
+
+    def backlog(self):
+        """Number of transactions still PENDING/PROCESSING"""
+        import models
+        count = models.PaymentTransaction.query.filter(
+            models.PaymentTransaction.status.in_(OPEN_STATUSES)
+        ).count()
+        self.metrics['backlog'] = count
+        return count
+
+    def _try_lock(self, conn):
+        if conn.dialect.name != 'postgresql':
+            return True
+        from sqlalchemy import text
+        return bool(conn.execute(text('SELECT pg_try_advisory_lock(:key)'), {'key': RECONCILE_LOCK_KEY}).scalar())
+
+    def _unlock(self, conn):
+        if conn.dialect.name == 'postgresql':
+            from sqlalchemy import text
+            conn.execute(text('SELECT pg_advisory_unlock(:key)'), {'key': RECONCILE_LOCK_KEY})
+
+    def run_once(self, min_age=RECONCILE_MIN_AGE):
+        """Reconcile every stuck transaction older than min_age seconds; call inside an app context"""
+        import models
+
+        if not self._run_lock.acquire(blocking=False):
+            return self.metrics
+
+        conn = models.db.engine.connect()
+        try:
+            if not self._try_lock(conn):
+                return self.metrics
+
+            started = time.monotonic()
+            now = datetime.utcnow()
+            config = {key: self.app.config[key] for key in (
+                'SSLCOMMERZ_STORE_ID', 'SSLCOMMERZ_STORE_PASSWORD',
+                'SSLCOMMERZ_VALIDATION_API', 'SSLCOMMERZ_TRANSACTION_QUERY_API'
+            )}
+            self.metrics.update({
+                'running': True,
+                'last_run_started_at': now.isoformat(),
+                'last_run_checked': 0,
+                'last_error': None
+            })
+
+            checked = 0
+            with ThreadPoolExecutor(max_workers=MAX_CONCURRENCY, thread_name_prefix='reconcile') as pool:
+                for page in self._pages(now - timedelta(seconds=min_age)):
+                    responses = list(pool.map(lambda txn: self._query_gateway(txn, config), page))
+
+                    items = []
+                    for transaction, gateway_data in zip(page, responses):
+                        if 'error' in gateway_data:
+                            self.metrics['total_errors'] += 1
+                            self.metrics['last_error'] = gateway_data['error']
+                            continue
+                        item = self._plan(transaction, gateway_data, now)
+                        if item is None:
+                            self.metrics['total_unchanged'] += 1
+                        else:
+                            items.append(item)
+
+                    results = PaymentPipeline.transition_many(items)
+                    for item in items:
+                        result = results.get(item['transaction_id'], {})
+                        if result.get('outcome') != OUTCOME_PROCESSED:
+                            self.metrics['total_unchanged'] += 1
+                        elif result.get('fulfilled'):
+                            self.metrics['total_fulfilled'] += 1
+                        elif result.get('status') == 'VALID':
+                            self.metrics['total_held'] += 1
+                        elif result.get('status') == 'FAILED':
+                            self.metrics['total_failed'] += 1
+                        else:
+                            self.metrics['total_cancelled'] += 1
+
+                    checked += len(page)
+                    self.metrics['last_run_checked'] = checked
+                    self.metrics['total_checked'] += len(page)
+
+            duration = time.monotonic() - started
+            self.metrics.update({
+                'runs': self.metrics['runs'] + 1,
+                'last_run_finished_at': datetime.utcnow().isoformat(),
+                'last_run_duration': round(duration, 3),
+                'last_run_throughput': round(checked / duration, 1) if duration > 0 else None
+            })
+            self.backlog()
+            print(f"💳 Reconciled {checked} stuck payments in {duration:.2f}s")
+        except Exception as e:
+            models.db.session.rollback()
+            self.metrics['last_error'] = str(e)
+            print(f"❌ Payment reconciliation error: {str(e)}")
+        finally:
+            self.metrics['running'] = False
+            try:
+                self._unlock(conn)
+                conn.commit()
+            finally:
+                conn.close()
+            self._run_lock.release()
+
+        return self.metrics
+
+    def start(self, min_age=RECONCILE_MIN_AGE):
+        """Run one reconciliation pass in a background thread, returns False if one is already running"""
+        if self.metrics['running'] or (self._thread and self._thread.is_alive()):
+            return False
+
+        def worker():
+            with self.app.app_context():
+                try:
+                    self.run_once(min_age)
+                finally:
+                    import models
+                    models.db.session.remove()
+
+        self._thread = threading.Thread(target=worker, name='payment-reconciler', daemon=True)
+        self._thread.start()
+        return True
+
+    def start_periodic(self, interval=RECONCILE_INTERVAL):
+        """Reconcile every `interval` seconds for the lifetime of the process"""
+        def loop():
+            while True:
+                time.sleep(interval)
+                with self.app.app_context():
+                    try:
+                        self.run_once()
+                    finally:
+                        import models
+                        models.db.session.remove()
+
+        threading.Thread(target=loop, name='payment-reconciler-periodic', daemon=True).start()
+
+
+# Shared reconciler for the application
+payment_reconciler = PaymentReconciler()
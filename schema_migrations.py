@@ -0,0 +1,370 @@
+"""
+Versioned schema migrations
+
+Each entry in MIGRATIONS is applied once, in order, inside its own transaction.
+The applied version is recorded in the schema_version table so that a booting
+worker only needs a single SELECT to find out there is nothing to do.
+"""
+from datetime import datetime
+from sqlalchemy import text, inspect
+
+# Arbitrary application-wide key for pg_advisory_lock
+MIGRATION_LOCK_KEY = 724918301
+
+SCHEMA_VERSION_DDL = """
+    CREATE TABLE IF NOT EXISTS schema_version (
+        version INTEGER PRIMARY KEY,
+        description VARCHAR(200) NOT NULL,
+        applied_at TIMESTAMP NOT NULL
+    )
+"""
+
+
+def add_column(conn, table, column, column_type):
+    """Add a column if the table does not already have it"""
+    if conn.dialect.name == 'postgresql':
+        conn.execute(text(f'ALTER TABLE {table} ADD COLUMN IF NOT EXISTS {column} {column_type}'))
+        return
+
+    existing = [col['name'] for col in inspect(conn).get_columns(table.strip('"'))]
+    if column not in existing:
+        conn.execute(text(f'ALTER TABLE {table} ADD COLUMN {column} {column_type}'))
+
+
+def create_index(conn, name, table, columns, unique=False):
+    """Create an index if it does not already exist"""
+    unique_sql = 'UNIQUE ' if unique else ''
+    conn.execute(text(f'CREATE {unique_sql}INDEX IF NOT EXISTS {name} ON {table} ({columns})'))
+
+
+# Version 1: columns previously added one ALTER at a time by migrate_database()
+def _v1_baseline_columns(conn):
+    add_column(conn, 'course', 'discount_percent', 'FLOAT')
+    add_column(conn, 'course', 'discounted_price', 'FLOAT')
+    add_column(conn, 'ebook', 'discount_percent', 'FLOAT')
+    add_column(conn, 'ebook', 'discounted_price', 'FLOAT')
+
+    video_lesson_columns = [
+        ('video_url', 'VARCHAR(500)'),
+        ('bunny_video_id', 'VARCHAR(100)'),
+        ('storage_path', 'VARCHAR(500)'),
+        ('duration', 'INTEGER'),
+        ('is_preview', 'BOOLEAN DEFAULT FALSE'),
+        ('instructions', 'TEXT'),
+        ('external_links', 'TEXT'),
+        ('created_at', 'TIMESTAMP'),
+        ('updated_at', 'TIMESTAMP')
+    ]
+    for column_name, column_type in video_lesson_columns:
+        add_column(conn, 'video_lesson', column_name, column_type)
+
+    lesson_progress_columns = [
+        ('user_id', 'INTEGER'),
+        ('lesson_id', 'INTEGER'),
+        ('watched_duration', 'INTEGER DEFAULT 0'),
+        ('is_completed', 'BOOLEAN DEFAULT FALSE'),
+        ('last_watched_at', 'TIMESTAMP'),
+        ('completion_percentage', 'FLOAT DEFAULT 0.0')
+    ]
+    for column_name, column_type in lesson_progress_columns:
+        add_column(conn, 'lesson_progress', column_name, column_type)
+
+    add_column(conn, '"user"', 'email_verified', 'BOOLEAN')
+
+
+# Version 2: legacy SQLite databases created bunny_video_id as NOT NULL
+def _v2_nullable_bunny_video_id(conn):
+    if conn.dialect.name == 'postgresql':
+        conn.execute(text('ALTER TABLE video_lesson ALTER COLUMN bunny_video_id DROP NOT NULL'))
+        return
+
+    columns = conn.execute(text("PRAGMA table_info(video_lesson)")).fetchall()
+    bunny_video_id_info = next((col for col in columns if col[1] == 'bunny_video_id'), None)
+    if not bunny_video_id_info or bunny_video_id_info[3] != 1:  # col[3] is notnull flag
+        return
+
+    conn.execute(text("""
+        CREATE TABLE video_lesson_new (
+            id INTEGER PRIMARY KEY,
+            course_id INTEGER NOT NULL,
+            title VARCHAR(200) NOT NULL,
+            description TEXT,
+            video_url VARCHAR(500),
+            bunny_video_id VARCHAR(100),
+            order_index INTEGER DEFAULT 0,
+            duration INTEGER,
+            is_preview BOOLEAN DEFAULT FALSE,
+            instructions TEXT,
+            external_links TEXT,
+            created_at DATETIME,
+            updated_at DATETIME,
+            FOREIGN KEY (course_id) REFERENCES course (id)
+        )
+    """))
+    conn.execute(text("""
+        INSERT INTO video_lesson_new
+        SELECT id, course_id, title, description, video_url, bunny_video_id,
+               order_index, duration, is_preview, instructions, external_links,
+               created_at, updated_at
+        FROM video_lesson
+    """))
+    conn.execute(text("DROP TABLE video_lesson"))
+    conn.execute(text("ALTER TABLE video_lesson_new RENAME TO video_lesson"))
+
+
+# Version 3: default values for rows that predate the new columns
+def _v3_backfill_defaults(conn):
+    conn.execute(text('UPDATE course SET discount_percent = 0.0 WHERE discount_percent IS NULL'))
+    conn.execute(text('UPDATE ebook SET discount_percent = 0.0 WHERE discount_percent IS NULL'))
+    conn.execute(text('UPDATE video_lesson SET is_preview = FALSE WHERE is_preview IS NULL'))
+    conn.execute(text('UPDATE video_lesson SET created_at = CURRENT_TIMESTAMP WHERE created_at IS NULL'))
+    conn.execute(text('UPDATE video_lesson SET updated_at = CURRENT_TIMESTAMP WHERE updated_at IS NULL'))
+    # Existing users need to verify their email
+    conn.execute(text('UPDATE "user" SET email_verified = FALSE WHERE email_verified IS NULL'))
+
+
+# Version 4: brute-force lookups and retention pruning on login_attempt
+def _v4_login_attempt_indexes(conn):
+    create_index(conn, 'ix_login_attempt_ip_timestamp', 'login_attempt', 'ip_address, timestamp')
+    create_index(conn, 'ix_login_attempt_user_timestamp', 'login_attempt', 'user_id, timestamp')
+    create_index(conn, 'ix_login_attempt_timestamp', 'login_attempt', 'timestamp')
+
+
+# Version 5: one trusted_device row per (user_id, fingerprint)
+def _v5_dedupe_trusted_devices(conn):
+    conn.execute(text("""
+        DELETE FROM trusted_device
+        WHERE id NOT IN (
+            SELECT keep_id FROM (
+                SELECT MAX(id) AS keep_id FROM trusted_device GROUP BY user_id, fingerprint
+            ) AS latest
+        )
+    """))
+    create_index(conn, 'unique_user_device_fingerprint', 'trusted_device', 'user_id, fingerprint', unique=True)
+    create_index(conn, 'ix_trusted_device_last_used', 'trusted_device', 'last_used')
+
+
+# Version 6: stuck-payment reconciliation pages by (status, created_at, id)
+def _v6_payment_transaction_status_index(conn):
+    create_index(conn, 'ix_payment_transactions_status_created', 'payment_transactions', 'status, created_at, id')
+
+
+# Version 7: daily_rollups (created by db.create_all) is filled by
+# analytics_rollup.backfill() once this version is applied; the recent
+# registrations list reads "user" by created_at
+def _v7_user_created_at_index(conn):
+    create_index(conn, 'ix_user_created_at', '"user"', 'created_at')
+
+
+# Version 8: the payment analytics snapshot extracts transactions by (updated_at, id)
+def _v8_payment_transaction_updated_index(conn):
+    create_index(conn, 'ix_payment_transactions_updated', 'payment_transactions', 'updated_at, id')
+
+
+# Version 9: chat messages are read by conversation instead of an OR of both directions
+def _v9_message_conversation_key(conn):
+    add_column(conn, 'message', 'conversation_key', 'VARCHAR(32)')
+    conn.execute(text("""
+        UPDATE message SET conversation_key = CASE
+            WHEN user_id < admin_id THEN CAST(user_id AS VARCHAR(16)) || ':' || CAST(admin_id AS VARCHAR(16))
+            ELSE CAST(admin_id AS VARCHAR(16)) || ':' || CAST(user_id AS VARCHAR(16))
+        END
+        WHERE conversation_key IS NULL AND admin_id IS NOT NULL
+    """))
+    create_index(conn, 'ix_message_conversation_id', 'message', 'conversation_key, id')
+
+
+# Version 10: seed chat_conversations (created by db.create_all) from the existing messages.
+# History counts as read, so both unread counters start at zero.
+def _v10_chat_conversations(conn):
+    conn.execute(text("""
+        INSERT INTO chat_conversations (conversation_key, user_id, admin_id, last_message_id, last_message_at,
+                                        last_message_preview, last_message_from_admin, user_unread, admin_unread)
+        SELECT summary.conversation_key, summary.user_party, summary.admin_party, last.id, last.timestamp,
+               SUBSTR(last.content, 1, 120), last.is_from_admin, 0, 0
+        FROM (
+            SELECT conversation_key,
+                   MAX(CASE WHEN is_from_admin THEN admin_id ELSE user_id END) AS user_party,
+                   MAX(CASE WHEN is_from_admin THEN user_id ELSE admin_id END) AS admin_party,
+                   MAX(id) AS last_id
+            FROM message
+            WHERE conversation_key IS NOT NULL
+            GROUP BY conversation_key
+        ) AS summary
+        JOIN message AS last ON last.id = summary.last_id
+        WHERE summary.user_party IS NOT NULL AND summary.admin_party IS NOT NULL
+          AND NOT EXISTS (
+            SELECT 1 FROM chat_conversations AS existing WHERE existing.conversation_key = summary.conversation_key
+          )
+    """))
+
+
+# Version 11: contact message triage by read state and date, and full-text search
+def _v11_contact_message_indexes(conn):
+    # Keyset pages order by (submitted_at, id); the contact form always sets it
+    conn.execute(text('UPDATE contact_message SET submitted_at = CURRENT_TIMESTAMP WHERE submitted_at IS NULL'))
+    create_index(conn, 'ix_contact_message_read_submitted', 'contact_message', 'is_read, submitted_at')
+
+    if conn.dialect.name == 'postgresql':
+        # Same expression as contact_messages.SEARCH_DOCUMENT, or the planner will not use it
+        conn.execute(text("""
+            CREATE INDEX IF NOT EXISTS ix_contact_message_search ON contact_message USING GIN (
+                to_tsvector('simple', coalesce(first_name, '') || ' ' || coalesce(last_name, '') || ' ' ||
+                                      coalesce(email, '') || ' ' || coalesce(subject, '') || ' ' || coalesce(message, ''))
+            )
+        """))
+
+
+# Version 12: blog tags normalized into blog_tag/blog_tag_link (created by db.create_all),
+# listing indexes and full-text search over title, summary and content
+def _v12_blog_tags_and_search(conn):
+    from blog_index import parse_tags, tag_slug
+
+    create_index(conn, 'ix_blog_category_date', 'blog', 'category, date')
+    create_index(conn, 'ix_blog_date', 'blog', 'date')
+
+    if not conn.execute(text('SELECT 1 FROM blog_tag LIMIT 1')).first():
+        tag_ids = {}
+        for blog_id, tags in conn.execute(text('SELECT id, tags FROM blog ORDER BY id')).all():
+            for name in parse_tags(tags):
+                slug = tag_slug(name)
+                if slug not in tag_ids:
+                    conn.execute(text('INSERT INTO blog_tag (name, slug, post_count) VALUES (:name, :slug, 0)'),
+                                 {'name': name, 'slug': slug})
+                    tag_ids[slug] = conn.execute(text('SELECT id FROM blog_tag WHERE slug = :slug'),
+                                                 {'slug': slug}).scalar()
+                conn.execute(text('INSERT INTO blog_tag_link (blog_id, tag_id) VALUES (:blog_id, :tag_id)'),
+                             {'blog_id': blog_id, 'tag_id': tag_ids[slug]})
+        conn.execute(text("""
+            UPDATE blog_tag SET post_count = (SELECT COUNT(*) FROM blog_tag_link WHERE blog_tag_link.tag_id = blog_tag.id)
+        """))
+
+    if conn.dialect.name == 'postgresql':
+        # Same expression as blog_index.SEARCH_VECTOR, or the planner will not use it
+        conn.execute(text("""
+            CREATE INDEX IF NOT EXISTS ix_blog_search ON blog USING GIN ((
+                setweight(to_tsvector('english', coalesce(title, '')), 'A') ||
+                setweight(to_tsvector('english', coalesce(summary, '')), 'B') ||
+                setweight(to_tsvector('english', coalesce(content, '')), 'C')
+            ))
+        """))
+        return
+
+    if conn.dialect.name == 'sqlite':
+        _create_blog_fts(conn)
+
+
+def _create_blog_fts(conn):
+    """FTS5 index of blog posts kept current by triggers; skipped if SQLite lacks FTS5"""
+    try:
+        conn.execute(text("""
+            CREATE VIRTUAL TABLE IF NOT EXISTS blog_fts USING fts5(
+                title, summary, content, content='blog', content_rowid='id'
+            )
+        """))
+    except Exception as e:
+        print(f"SQLite FTS5 unavailable, blog search falls back to LIKE: {e}")
+        return
+
+    conn.execute(text("""
+        CREATE TRIGGER IF NOT EXISTS blog_fts_insert AFTER INSERT ON blog BEGIN
+            INSERT INTO blog_fts (rowid, title, summary, content) VALUES (new.id, new.title, new.summary, new.content);
+        END
+    """))
+    conn.execute(text("""
+        CREATE TRIGGER IF NOT EXISTS blog_fts_delete AFTER DELETE ON blog BEGIN
+            INSERT INTO blog_fts (blog_fts, rowid, title, summary, content)
+            VALUES ('delete', old.id, old.title, old.summary, old.content);
+        END
+    """))
+    conn.execute(text("""
+        CREATE TRIGGER IF NOT EXISTS blog_fts_update AFTER UPDATE ON blog BEGIN
+            INSERT INTO blog_fts (blog_fts, rowid, title, summary, content)
+            VALUES ('delete', old.id, old.title, old.summary, old.content);
+            INSERT INTO blog_fts (rowid, title, summary, content) VALUES (new.id, new.title, new.summary, new.content);
+        END
+    """))
+    conn.execute(text("INSERT INTO blog_fts (blog_fts) VALUES ('rebuild')"))
+
+
+# Ordered list of (version, description, callable). Append only - never renumber.
+MIGRATIONS = [
+    (1, 'Baseline discount, video lesson, progress and email_verified columns', _v1_baseline_columns),
+    (2, 'Allow NULL bunny_video_id on video_lesson', _v2_nullable_bunny_video_id),
+    (3, 'Backfill defaults for pre-existing rows', _v3_backfill_defaults),
+    (4, 'Composite indexes on login_attempt', _v4_login_attempt_indexes),
+    (5, 'Deduplicate trusted_device and add unique (user_id, fingerprint)', _v5_dedupe_trusted_devices),
+    (6, 'Index payment_transactions on (status, created_at, id)', _v6_payment_transaction_status_index),
+    (7, 'Index user on created_at for analytics rollups', _v7_user_created_at_index),
+    (8, 'Index payment_transactions on (updated_at, id)', _v8_payment_transaction_updated_index),
+    (9, 'Add message.conversation_key and index (conversation_key, id)', _v9_message_conversation_key),
+    (10, 'Seed chat_conversations from existing messages', _v10_chat_conversations),
+    (11, 'Add contact_message (is_read, submitted_at) and full-text search indexes', _v11_contact_message_indexes),
+    (12, 'Backfill blog tags, add blog listing and full-text search indexes', _v12_blog_tags_and_search),
+]
+
+LATEST_VERSION = MIGRATIONS[-1][0]
+
+
+def get_current_version(conn):
+    """Return the highest applied version, or 0 if nothing has been applied"""
+    try:
+        return conn.execute(text('SELECT MAX(version) FROM schema_version')).scalar() or 0
+    except Exception:
+        conn.rollback()
+        return 0
+
+
+def _acquire_lock(conn):
+    if conn.dialect.name == 'postgresql':
+        conn.execute(text('SELECT pg_advisory_lock(:key)'), {'key': MIGRATION_LOCK_KEY})
+        conn.commit()
+
+
+def _release_lock(conn):
+    if conn.dialect.name == 'postgresql':
+        conn.execute(text('SELECT pg_advisory_unlock(:key)'), {'key': MIGRATION_LOCK_KEY})
+        conn.commit()
+
+
+def run_migrations(engine):
+    """
+    Bring the database schema up to LATEST_VERSION
+
+    Returns:
+        list: Versions applied by this call (empty when already up to date)
+    """
+    applied = []
+
+    with engine.connect() as conn:
+        # Fast path: one round-trip when the schema is current
+        if get_current_version(conn) >= LATEST_VERSION:
+            conn.rollback()
+            return applied
+
+        # Only one worker migrates; the others wait here and then find nothing to do
+        _acquire_lock(conn)
+        try:
+            with conn.begin():
+                conn.execute(text(SCHEMA_VERSION_DDL))
+
+            current_version = get_current_version(conn)
+            conn.rollback()
+
+            for version, description, migration in MIGRATIONS:
+                if version <= current_version:
+                    continue
+
+                with conn.begin():
+                    migration(conn)
+                    conn.execute(
+                        text('INSERT INTO schema_version (version, description, applied_at) '
+                             'VALUES (:version, :description, :applied_at)'),
+                        {'version': version, 'description': description, 'applied_at': datetime.utcnow()}
+                    )
+                applied.append(version)
+                print(f"Applied schema migration {version}: {description}")
+        finally:
+            _release_lock(conn)
+
+    return applied
@@ -0,0 +1,202 @@
+"""
+Batched client security telemetry
+
+The course player and the eBook reader run detectors (devtools, automation,
+download and screen-recording attempts) that used to POST every hit to its own
+endpoint, where it was printed to stdout and lost. The pages now queue events
+in security-telemetry.js, which merges repeats and sends them as one array to
+/api/security-events every few seconds or when the page is hidden.
+
+On the server, each user has a token bucket per worker: a reader whose
+detectors misfire in a loop costs a few dozen rows, and the events beyond the
+bucket are only counted, as one 'rate_limited' row per flush. Accepted events
+are buffered in memory and written to the security_event table by a
+background thread in batched INSERTs (batched_writer, shared with login
+attempts); rows older than RETENTION_DAYS are pruned in batches once a day.
+"""
+import json
+import re
+import threading
+import time
+from datetime import datetime, timezone
+
+from batched_writer import BatchedTableWriter
+
+# Per-user token bucket: BUCKET_CAPACITY events at once, refilled at EVENT_RATE per second
+BUCKET_CAPACITY = 30
+EVENT_RATE = 10 / 60  # 10 events a minute
+
+# Events accepted from one request; the client sends at most this many per batch
+MAX_BATCH_EVENTS = 50
+
+# Repeats of one event merged by the client count as one token, up to this count
+MAX_EVENT_COUNT = 1000
+
+# Flush the buffer every FLUSH_INTERVAL seconds or once it holds BATCH_SIZE rows
+FLUSH_INTERVAL = 5
+BATCH_SIZE = 500
+
+# Events buffered beyond this are dropped (the database is unreachable)
+MAX_BUFFERED_EVENTS = 20000
+
+# Retention for the security_event table
+RETENTION_DAYS = 90
+PRUNE_BATCH_SIZE = 5000
+PRUNE_INTERVAL = 24 * 60 * 60  # once a day
+
+# Client fields stored in their own columns; everything else goes to details as JSON
+ID_FIELDS = ('course_id', 'video_id', 'ebook_id')
+MAX_DETAILS_LENGTH = 2000
+EVENT_TYPE_PATTERN = re.compile(r'^[a-z0-9_]{1,64}$')
+
+
+class TokenBucket:
+    """Token buckets per key, refilled continuously at `rate` tokens per second"""
+
+    def __init__(self, rate, capacity):
+        self.rate = rate
+        self.capacity = capacity
+        self._buckets = {}  # key -> (tokens, updated_at)
+        self._lock = threading.Lock()
+
+    def take(self, key, wanted, now=None):
+        """Take up to `wanted` tokens, returns how many were granted"""
+        now = now or time.monotonic()
+        with self._lock:
+            tokens, updated_at = self._buckets.get(key, (self.capacity, now))
+            tokens = min(self.capacity, tokens + (now - updated_at) * self.rate)
+            granted = min(wanted, int(tokens))
+            self._buckets[key] = (tokens - granted, now)
+        return granted
+
+    def purge(self, now=None):
+        """Drop buckets that have refilled completely; they are recreated full"""
+        now = now or time.monotonic()
+        with self._lock:
+            for key, (tokens, updated_at) in list(self._buckets.items()):
+                if tokens + (now - updated_at) * self.rate >= self.capacity:
+                    del self._buckets[key]
+
+
+def _client_time(value):
+    """Datetime of an ISO timestamp sent by the browser, None if it is not one"""
+    if not isinstance(value, str):
+        return None
+    try:
+        parsed = datetime.fromisoformat(value.replace('Z', '+00:00'))
+    except ValueError:
+        return None
+    if parsed.tzinfo is not None:
+        # Stored as naive UTC like every other timestamp
+        parsed = parsed.astimezone(timezone.utc).replace(tzinfo=None)
+    return parsed
+
+
+def _int_or_none(value):
+    try:
+        return int(value) if value is not None else None
+    except (TypeError, ValueError):
+        return None
+
+
+class SecurityEventRecorder(BatchedTableWriter):
+    """Rate-limited, append-only, batched writer for SecurityEvent rows"""
+
+    model_name = 'SecurityEvent'
+    label = 'security events'
+    thread_name = 'security-event-writer'
+    flush_interval = FLUSH_INTERVAL
+    batch_size = BATCH_SIZE
+    max_buffered = MAX_BUFFERED_EVENTS
+    retention_days = RETENTION_DAYS
+    prune_batch_size = PRUNE_BATCH_SIZE
+    prune_interval = PRUNE_INTERVAL
+
+    def __init__(self):
+        super().__init__()
+        self._dropped = {}  # user_id -> events refused by the bucket since the last flush
+        self._lock = threading.Lock()
+        self.buckets = TokenBucket(EVENT_RATE, BUCKET_CAPACITY)
+        self.metrics.update({
+            'accepted': 0,
+            'rate_limited': 0,
+            'invalid': 0
+        })
+
+    @staticmethod
+    def _row(user_id, event, ip_address, user_agent, received_at, default_type):
+        """security_event row of one client event, None if it is malformed"""
+        if not isinstance(event, dict):
+            return None
+        event_type = str(event.get('event_type') or event.get('type') or default_type or '')
+        if not EVENT_TYPE_PATTERN.match(event_type):
+            return None
+
+        count = _int_or_none(event.get('count')) or 1
+        known = {'event_type', 'type', 'count', 'timestamp', 'page_url', 'url', 'user_agent', *ID_FIELDS}
+        details = {key: value for key, value in event.items() if key not in known}
+        details = json.dumps(details, default=str)[:MAX_DETAILS_LENGTH] if details else None
+
+        row = {
+            'user_id': user_id,
+            'event_type': event_type,
+            'count': max(1, min(count, MAX_EVENT_COUNT)),
+            'page_url': str(event.get('page_url') or event.get('url') or '')[:500] or None,
+            'ip_address': (ip_address or '')[:45],
+            'user_agent': (user_agent or '')[:512],
+            'details': details,
+            'occurred_at': _client_time(event.get('timestamp')) or received_at,
+            'timestamp': received_at
+        }
+        for field in ID_FIELDS:
+            row[field] = _int_or_none(event.get(field))
+        return row
+
+    def record(self, user_id, events, ip_address=None, user_agent=None, default_type=None):
+        """
+        Queue a batch of client events for a user
+
+        Args:
+            default_type: event_type of events that do not name one (the single-event endpoints)
+
+        Returns:
+            tuple: (accepted, dropped) event counts
+        """
+        received_at = datetime.utcnow()
+        rows = []
+        for event in events[:MAX_BATCH_EVENTS]:
+            row = self._row(user_id, event, ip_address, user_agent, received_at, default_type)
+            if row is None:
+                self.metrics['invalid'] += 1
+            else:
+                rows.append(row)
+
+        granted = self.buckets.take(user_id, len(rows)) if rows else 0
+        dropped = len(rows) - granted + max(0, len(events) - MAX_BATCH_EVENTS)
+        if dropped:
+            with self._lock:
+                self._dropped[user_id] = self._dropped.get(user_id, 0) + dropped
+            self.metrics['rate_limited'] += dropped
+
+        self._enqueue(rows[:granted])
+        self.metrics['accepted'] += granted
+        return granted, dropped
+
+    def _extra_rows(self):
+        """One 'rate_limited' row per user with the number of events refused since the last flush"""
+        with self._lock:
+            dropped, self._dropped = self._dropped, {}
+        now = datetime.utcnow()
+        return [{
+            'user_id': user_id, 'event_type': 'rate_limited', 'count': count,
+            'page_url': None, 'ip_address': None, 'user_agent': None, 'details': None,
+            'course_id': None, 'video_id': None, 'ebook_id': None,
+            'occurred_at': now, 'timestamp': now
+        } for user_id, count in dropped.items()]
+
+    def _maintain(self):
+        self.buckets.purge()
+
+
+# Shared recorder for the application
+security_event_recorder = SecurityEventRecorder()
@@ -0,0 +1,148 @@
+"""
+Signed, expiring Bunny CDN URLs for lesson videos and attachments
+
+Lessons and attachments were linked with their permanent pull zone URLs, so a
+copied link played for anyone and hot-linking was billed to us. With Token
+Authentication enabled on a pull zone, Bunny only serves requests carrying a
+valid token, which url_signer computes locally with Bunny's scheme:
+
+    token = base64url(sha256(security_key + signed_path + expires + [ip] + sorted_params))
+
+- every token expires SIGNED_URL_TTL seconds after signing;
+- a path prefix can be signed instead of the exact file (token_path), so one
+  token covers everything below it;
+- with BUNNY_TOKEN_BIND_IP the token is only valid from the viewer's IP (the
+  app must then see the real client address, not a proxy's).
+
+Token authentication applies to a whole pull zone, and the static images share
+BUNNY_CDN_HOSTNAME, so the protected zone is configured separately as
+BUNNY_TOKEN_HOSTNAME (a second pull zone on the same storage zone) and signed
+URLs are rewritten to it; an edge rule on the public zone should then block
+the courses/ paths, or the old links keep working there. Without
+BUNNY_TOKEN_KEY, URLs pass through unchanged.
+
+for_user() caches signed URLs per (user, lesson or attachment) and hands the
+same one out until less than SIGNED_URL_MIN_REMAINING of its lifetime is left,
+so the player sees one stable URL per lesson and the browser cache keeps working.
+"""
+import base64
+import hashlib
+import threading
+import time
+from collections import OrderedDict
+from urllib.parse import parse_qsl, quote, unquote, urlsplit
+
+# Long enough to watch a lesson and keep seeking in it (each range request is checked)
+SIGNED_URL_TTL = 4 * 60 * 60  # 4 hours in seconds
+
+# A cached URL is handed out again while at least this much lifetime is left
+SIGNED_URL_MIN_REMAINING = 2 * 60 * 60  # 2 hours in seconds
+
+MAX_CACHED_URLS = 20000
+
+# Query parameters set by the signer itself
+TOKEN_PARAMETERS = ('token', 'expires', 'token_path')
+
+
+class BunnyUrlSigner:
+    """Bunny token authentication, computed locally, with a per-viewer cache"""
+
+    def __init__(self):
+        self.security_key = None
+        self.cdn_hostname = None
+        self.token_hostname = None
+        self.bind_ip = False
+        self._cache = OrderedDict()  # (user_id, kind, object_id, url, ip) -> (signed_url, expires)
+        self._lock = threading.Lock()
+        self.metrics = {
+            'signed': 0,
+            'cache_hits': 0,
+            'passthrough': 0
+        }
+
+    def init_app(self, app):
+        """Read BUNNY_TOKEN_KEY, BUNNY_TOKEN_HOSTNAME and BUNNY_TOKEN_BIND_IP from the app config"""
+        self.security_key = app.config.get('BUNNY_TOKEN_KEY') or None
+        self.cdn_hostname = app.config.get('BUNNY_CDN_HOSTNAME')
+        self.token_hostname = app.config.get('BUNNY_TOKEN_HOSTNAME') or self.cdn_hostname
+        self.bind_ip = bool(app.config.get('BUNNY_TOKEN_BIND_IP'))
+
+    @property
+    def enabled(self):
+        return self.security_key is not None
+
+    def sign(self, url, expires=None, path_prefix=None, ip_address=None):
+        """
+        Token-signed copy of a pull zone URL
+
+        Args:
+            url: URL on BUNNY_CDN_HOSTNAME or BUNNY_TOKEN_HOSTNAME; other URLs are returned unchanged
+            expires: Unix time the token stops working (default: SIGNED_URL_TTL from now)
+            path_prefix: Sign this path prefix (e.g. '/courses/python/') instead of the exact path
+            ip_address: Only accept the token from this address
+        """
+        if not url or not self.enabled:
+            self.metrics['passthrough'] += 1
+            return url
+
+        parts = urlsplit(url)
+        if parts.hostname not in (self.cdn_hostname, self.token_hostname):
+            self.metrics['passthrough'] += 1
+            return url
+
+        expires = int(expires or time.time() + SIGNED_URL_TTL)
+        parameters = {key: value for key, value in parse_qsl(parts.query, keep_blank_values=True)
+                      if key not in TOKEN_PARAMETERS}
+        if path_prefix:
+            parameters['token_path'] = path_prefix
+        signed_path = path_prefix or unquote(parts.path)
+
+        names = sorted(parameters)
+        hashable = (self.security_key + signed_path + str(expires) + (ip_address or '')
+                    + '&'.join(f'{name}={parameters[name]}' for name in names))
+        token = base64.b64encode(hashlib.sha256(hashable.encode('utf-8')).digest()).decode('ascii')
+        token = token.replace('+', '-').replace('/', '_').replace('=', '')
+
+        query = ''.join(f'&{name}={quote(parameters[name], safe="")}' for name in names)
+        self.metrics['signed'] += 1
+        return f'{parts.scheme}://{self.token_hostname}{quote(unquote(parts.path))}?token={token}{query}&expires={expires}'
+
+    def for_user(self, user_id, kind, object_id, url, path_prefix=None):
+        """
+        Signed URL of a lesson video or attachment for one viewer, reused while it has lifetime left
+
+        Args:
+            user_id: Viewer (None for public previews, which share one URL)
+            kind: 'lesson' or 'attachment'
+            object_id: VideoLesson or LessonAttachment id
+        """
+        if not url or not self.enabled:
+            self.metrics['passthrough'] += 1
+            return url
+
+        ip_address = None
+        if self.bind_ip:
+            from flask import request
+            ip_address = request.remote_addr
+
+        key = (user_id, kind, object_id, url, ip_address)
+        now = time.time()
+        with self._lock:
+            entry = self._cache.get(key)
+            if entry is not None:
+                self._cache.move_to_end(key)
+        if entry is not None and entry[1] - now >= SIGNED_URL_MIN_REMAINING:
+            self.metrics['cache_hits'] += 1
+            return entry[0]
+
+        expires = int(now + SIGNED_URL_TTL)
+        signed = self.sign(url, expires=expires, path_prefix=path_prefix, ip_address=ip_address)
+        with self._lock:
+            self._cache[key] = (signed, expires)
+            while len(self._cache) > MAX_CACHED_URLS:
+                self._cache.popitem(last=False)
+        return signed
+
+
+# Shared URL signer for the application
+url_signer = BunnyUrlSigner()
@@ -0,0 +1,91 @@
+"""
+Cached site-wide alert banner
+
+The active Alert is shown on every public page. It is held in memory and
+rendered into header.html by a context processor, so a page view no longer
+needs a follow-up request to /api/get-active-alert or an Alert query.
+save_alert/clear_alert call changed() after they commit, which reloads it in
+this process; other worker processes reload it at most ALERT_REFRESH_INTERVAL
+seconds later.
+
+The ETag is a digest of the alert's content, so it is identical across
+workers and the public endpoint can be cached by browsers and the CDN.
+"""
+import hashlib
+import json
+import threading
+import time
+
+# How long another worker's change can take to show up here
+ALERT_REFRESH_INTERVAL = 30  # 30 seconds
+
+# Cache-Control of the public endpoint
+ALERT_MAX_AGE = 60  # 1 minute in seconds
+ALERT_STALE_WHILE_REVALIDATE = 5 * 60  # 5 minutes in seconds
+
+
+class SiteAlert:
+    """Process-local copy of the active alert"""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._alert = None
+        self._etag = None
+        self._body = None
+        self._loaded_at = None
+        self.metrics = {
+            'reloads': 0,
+            'last_error': None
+        }
+
+    def _load(self):
+        import models
+        Alert = models.Alert
+
+        alert = Alert.query.filter_by(is_active=True).order_by(Alert.updated_at.desc()).first()
+        data = {
+            'message': alert.message,
+            'background_color': alert.background_color,
+            'text_color': alert.text_color
+        } if alert else None
+
+        body = json.dumps({'success': data is not None, 'alert': data}, separators=(',', ':')).encode('utf-8')
+        etag = 'alert-' + hashlib.sha1(body).hexdigest()[:16]
+        with self._lock:
+            self._alert, self._body, self._etag = data, body, etag
+            self._loaded_at = time.monotonic()
+        self.metrics['reloads'] += 1
+
+    def _ensure_fresh(self):
+        loaded_at = self._loaded_at
+        if loaded_at is not None and time.monotonic() - loaded_at < ALERT_REFRESH_INTERVAL:
+            return
+        try:
+            self._load()
+        except Exception as e:
+            # Keep serving the last known alert (or none) if the database is unavailable
+            self.metrics['last_error'] = str(e)
+            with self._lock:
+                if self._body is None:
+                    self._body = b'{"success":false,"alert":null}'
+                    self._etag = 'alert-none'
+                self._loaded_at = time.monotonic()
+
+    def get(self):
+        """The active alert as {'message', 'background_color', 'text_color'}, or None"""
+        self._ensure_fresh()
+        return self._alert
+
+    def response_parts(self):
+        """(etag, JSON body bytes) for the public endpoint"""
+        self._ensure_fresh()
+        with self._lock:
+            return self._etag, self._body
+
+    def changed(self):
+        """Reload after an alert is saved or cleared"""
+        self._load()
+
+
+# Shared alert for the application
+site_alert = SiteAlert()
@@ -0,0 +1,60 @@
+"""
+Local SSLCommerz stand-in for exercising payment reconciliation
+
+Serves the two validator endpoints used by payment_reconciliation.py with
+canned responses, so a large backlog can be reconciled without touching the
+live gateway.
+
+Usage:
+    python sslcommerz_standin.py                      # every transaction is VALID
+    STANDIN_STATUS=FAILED STANDIN_LATENCY=0.2 python sslcommerz_standin.py
+
+Then start the app with SSLCOMMERZ_API_BASE=http://127.0.0.1:5055
+"""
+import os
+import time
+import uuid
+from flask import Flask, request, jsonify
+
+standin = Flask(__name__)
+
+STATUS = os.environ.get('STANDIN_STATUS', 'VALID')
+LATENCY = float(os.environ.get('STANDIN_LATENCY', '0'))
+RISK_LEVEL = os.environ.get('STANDIN_RISK_LEVEL', '0')
+
+
+def _element(tran_id, val_id=None):
+    return {
+        'status': STATUS,
+        'tran_id': tran_id,
+        'val_id': val_id or f'STANDIN{uuid.uuid4().hex[:12]}',
+        'amount': '100.00',
+        'store_amount': '97.50',
+        'card_type': 'BKASH-BKash',
+        'card_no': '',
+        'bank_tran_id': f'BT{uuid.uuid4().hex[:10]}',
+        'risk_level': RISK_LEVEL,
+        'risk_title': 'Safe' if RISK_LEVEL == '0' else 'Risky'
+    }
+
+
+@standin.route('/validator/api/validationserverAPI.php')
+def validation_api():
+    time.sleep(LATENCY)
+    val_id = request.args.get('val_id')
+    return jsonify(_element(request.args.get('tran_id', ''), val_id))
+
+
+@standin.route('/validator/api/merchantTransIDvalidationAPI.php')
+def transaction_query_api():
+    time.sleep(LATENCY)
+    tran_id = request.args.get('tran_id')
+    return jsonify({
+        'APIConnect': 'DONE',
+        'no_of_trans_found': 1,
+        'element': [_element(tran_id)]
+    })
+
+
+if __name__ == '__main__':
+    standin.run(host='127.0.0.1', port=int(os.environ.get('STANDIN_PORT', '5055')), threaded=True)
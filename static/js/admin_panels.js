@@ -0,0 +1,167 @@
+/**
+ * Admin dashboard panels
+ *
+ * Fills a dashboard table from one of the /admin/api/dashboard/* endpoints a
+ * page at a time. Search and filters are sent to the server; "Load more"
+ * follows the keyset cursor returned with each page.
+ */
+(function() {
+    function escapeHtml(value) {
+        if (value === null || value === undefined) {
+            return '';
+        }
+        return String(value)
+            .replace(/&/g, '&amp;')
+            .replace(/</g, '&lt;')
+            .replace(/>/g, '&gt;')
+            .replace(/"/g, '&quot;')
+            .replace(/'/g, '&#39;');
+    }
+
+    function debounce(fn, wait) {
+        let timer = null;
+        return function() {
+            const args = arguments;
+            clearTimeout(timer);
+            timer = setTimeout(() => fn.apply(this, args), wait);
+        };
+    }
+
+    /**
+     * options:
+     *   endpoint      JSON endpoint returning {success, items, next_cursor}
+     *   tbody         id of the <tbody> to fill
+     *   colspan       number of table columns, for the placeholder rows
+     *   renderRow     function(item) returning the <tr> markup for one item
+     *   emptyRow      markup shown inside the placeholder cell when nothing matches
+     *   search        id of the search <input> (optional)
+     *   filters       {queryParam: elementId} for <select> filters (optional)
+     *   onLoad        called after each page is rendered (optional)
+     */
+    function AdminPanel(options) {
+        this.options = options;
+        this.tbody = document.getElementById(options.tbody);
+        this.cursor = null;
+        this.loading = false;
+        this.loaded = false;
+        this.requestId = 0;
+
+        if (!this.tbody) {
+            return;
+        }
+
+        this.moreButton = document.createElement('button');
+        this.moreButton.type = 'button';
+        this.moreButton.className = 'btn btn-outline-secondary btn-sm d-block mx-auto my-3';
+        this.moreButton.innerHTML = '<i class="fas fa-chevron-down me-1"></i>Load more';
+        this.moreButton.style.display = 'none';
+        this.moreButton.addEventListener('click', () => this.load(false));
+        const container = this.tbody.closest('.table-responsive') || this.tbody.closest('table');
+        container.parentNode.insertBefore(this.moreButton, container.nextSibling);
+
+        const reload = debounce(() => this.reload(), 300);
+        if (options.search) {
+            const input = document.getElementById(options.search);
+            if (input) {
+                input.addEventListener('input', reload);
+            }
+        }
+        Object.keys(options.filters || {}).forEach(param => {
+            const element = document.getElementById(options.filters[param]);
+            if (element) {
+                element.addEventListener('change', () => this.reload());
+            }
+        });
+    }
+
+    AdminPanel.prototype.placeholder = function(content) {
+        return `<tr><td colspan="${this.options.colspan}" class="text-center py-4">${content}</td></tr>`;
+    };
+
+    AdminPanel.prototype.params = function() {
+        const params = new URLSearchParams();
+        if (this.options.search) {
+            const input = document.getElementById(this.options.search);
+            if (input && input.value.trim()) {
+                params.set('q', input.value.trim());
+            }
+        }
+        Object.keys(this.options.filters || {}).forEach(param => {
+            const element = document.getElementById(this.options.filters[param]);
+            if (element && element.value) {
+                params.set(param, element.value);
+            }
+        });
+        if (this.cursor) {
+            params.set('cursor', this.cursor);
+        }
+        return params;
+    };
+
+    AdminPanel.prototype.ensureLoaded = function() {
+        if (!this.loaded) {
+            this.loaded = true;
+            this.reload();
+        }
+    };
+
+    AdminPanel.prototype.reload = function() {
+        this.cursor = null;
+        return this.load(true);
+    };
+
+    AdminPanel.prototype.load = function(replace) {
+        if (!this.tbody) {
+            return Promise.resolve();
+        }
+        const requestId = ++this.requestId;
+        this.loading = true;
+        this.moreButton.disabled = true;
+        if (replace) {
+            this.tbody.innerHTML = this.placeholder('<i class="fas fa-spinner fa-spin me-2"></i>Loading...');
+        }
+
+        return fetch(`${this.options.endpoint}?${this.params().toString()}`, {
+            credentials: 'same-origin',
+            headers: {'Accept': 'application/json'}
+        })
+        .then(response => response.json())
+        .then(data => {
+            // A newer search has been started since this request was sent
+            if (requestId !== this.requestId) {
+                return;
+            }
+            if (!data.success) {
+                throw new Error(data.message || 'Failed to load');
+            }
+
+            const rows = data.items.map(item => this.options.renderRow(item)).join('');
+            if (replace) {
+                this.tbody.innerHTML = rows || this.placeholder(this.options.emptyRow || 'Nothing found');
+            } else {
+                this.tbody.insertAdjacentHTML('beforeend', rows);
+            }
+
+            this.cursor = data.next_cursor;
+            this.moreButton.style.display = this.cursor ? '' : 'none';
+            if (this.options.onLoad) {
+                this.options.onLoad(data);
+            }
+        })
+        .catch(error => {
+            console.error(`Error loading ${this.options.endpoint}:`, error);
+            if (replace) {
+                this.tbody.innerHTML = this.placeholder('<span class="text-danger">Failed to load. Please refresh.</span>');
+            }
+        })
+        .finally(() => {
+            if (requestId === this.requestId) {
+                this.loading = false;
+                this.moreButton.disabled = false;
+            }
+        });
+    };
+
+    window.AdminPanel = AdminPanel;
+    window.escapeHtml = window.escapeHtml || escapeHtml;
+})();
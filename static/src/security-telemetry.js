@@ -0,0 +1,90 @@
+// Batched security telemetry for the course player and eBook reader.
+// Detectors call SecurityTelemetry.record(type, data); events are queued,
+// repeats of the same event are merged into one with a count, and the queue
+// is sent to /api/security-events as one request every FLUSH_INTERVAL, when it
+// fills up, or with sendBeacon when the page is hidden or closed.
+(function() {
+    'use strict';
+
+    const ENDPOINT = '/api/security-events';
+    const FLUSH_INTERVAL = 15000;  // 15 seconds
+    const MAX_BATCH_EVENTS = 50;  // matches the server's per-request limit
+
+    let queue = [];
+    let flushTimer = null;
+
+    function eventKey(eventType, data) {
+        return eventType + '|' + JSON.stringify(data || {});
+    }
+
+    function record(eventType, data) {
+        const key = eventKey(eventType, data);
+        const existing = queue.find(event => event._key === key);
+        if (existing) {
+            existing.count += 1;
+            existing.last_seen = new Date().toISOString();
+            return;
+        }
+
+        queue.push(Object.assign({}, data, {
+            _key: key,
+            event_type: eventType,
+            count: 1,
+            timestamp: new Date().toISOString(),
+            page_url: window.location.href,
+            screen_resolution: `${screen.width}x${screen.height}`,
+            viewport_size: `${window.innerWidth}x${window.innerHeight}`
+        }));
+
+        if (queue.length >= MAX_BATCH_EVENTS) {
+            flush(false);
+        } else if (!flushTimer) {
+            flushTimer = setTimeout(() => flush(false), FLUSH_INTERVAL);
+        }
+    }
+
+    function flush(useBeacon) {
+        clearTimeout(flushTimer);
+        flushTimer = null;
+        if (!queue.length) {
+            return;
+        }
+
+        const events = queue.splice(0, MAX_BATCH_EVENTS).map(event => {
+            const copy = Object.assign({}, event);
+            delete copy._key;
+            return copy;
+        });
+        const body = JSON.stringify({ events: events });
+
+        if (useBeacon && navigator.sendBeacon &&
+            navigator.sendBeacon(ENDPOINT, new Blob([body], { type: 'application/json' }))) {
+            return;
+        }
+        fetch(ENDPOINT, {
+            method: 'POST',
+            headers: {
+                'Content-Type': 'application/json',
+                'X-Requested-With': 'XMLHttpRequest'
+            },
+            credentials: 'same-origin',
+            keepalive: true,
+            body: body
+        }).catch(() => {
+            // Telemetry is best effort
+        });
+
+        if (queue.length) {
+            flushTimer = setTimeout(() => flush(false), FLUSH_INTERVAL);
+        }
+    }
+
+    document.addEventListener('visibilitychange', function() {
+        if (document.visibilityState === 'hidden') {
+            flush(true);
+        }
+    });
+    window.addEventListener('pagehide', () => flush(true));
+
+    window.SecurityTelemetry = { record: record, flush: flush };
+})();
@@ -0,0 +1,130 @@
+let currentPage = 1;
+const totalPages = Number(document.body.dataset.totalPages);
+const ebookId = Number(document.body.dataset.ebookId);
+
+// Security measures
+document.addEventListener('contextmenu', function(e) {
+    e.preventDefault();
+    showSecurityMessage();
+    return false;
+});
+
+document.addEventListener('keydown', function(e) {
+    // Block save, print, copy shortcuts
+    if ((e.ctrlKey && ['s', 'p', 'a', 'c', 'u'].includes(e.key.toLowerCase())) || 
+        e.key === 'F12' || 
+        (e.ctrlKey && e.shiftKey && ['i', 'j', 'c'].includes(e.key.toLowerCase()))) {
+        e.preventDefault();
+        showSecurityMessage();
+        return false;
+    }
+
+    // Navigation shortcuts
+    if (e.key === 'ArrowRight' || e.key === 'PageDown') {
+        e.preventDefault();
+        nextPage();
+    } else if (e.key === 'ArrowLeft' || e.key === 'PageUp') {
+        e.preventDefault();
+        previousPage();
+    }
+});
+
+document.addEventListener('selectstart', function(e) {
+    e.preventDefault();
+    return false;
+});
+
+document.addEventListener('dragstart', function(e) {
+    e.preventDefault();
+    return false;
+});
+
+function showSecurityMessage() {
+    const overlay = document.getElementById('securityOverlay');
+    overlay.classList.add('show');
+    setTimeout(() => {
+        overlay.classList.remove('show');
+    }, 2000);
+}
+
+function loadPage(page) {
+    if (page < 1 || page > totalPages) return;
+
+    currentPage = page;
+    updateControls();
+
+    const loadingDiv = document.getElementById('loadingDiv');
+    const pageImage = document.getElementById('pageImage');
+    const errorDiv = document.getElementById('errorDiv');
+
+    // Show loading
+    loadingDiv.style.display = 'block';
+    pageImage.style.display = 'none';
+    errorDiv.style.display = 'none';
+
+    // Load page image
+    const imageUrl = `/pdf-page-stream/${ebookId}/${page}?t=${Date.now()}`;
+
+    pageImage.onload = function() {
+        loadingDiv.style.display = 'none';
+        pageImage.style.display = 'block';
+        errorDiv.style.display = 'none';
+    };
+
+    pageImage.onerror = function() {
+        loadingDiv.style.display = 'none';
+        pageImage.style.display = 'none';
+        errorDiv.style.display = 'block';
+        document.getElementById('errorMessage').textContent = `Failed to load page ${page}`;
+    };
+
+    pageImage.src = imageUrl;
+}
+
+function updateControls() {
+    document.getElementById('pageInput').value = currentPage;
+    document.getElementById('firstBtn').disabled = currentPage <= 1;
+    document.getElementById('prevBtn').disabled = currentPage <= 1;
+    document.getElementById('nextBtn').disabled = currentPage >= totalPages;
+    document.getElementById('lastBtn').disabled = currentPage >= totalPages;
+}
+
+function nextPage() {
+    if (currentPage < totalPages) {
+        loadPage(currentPage + 1);
+    }
+}
+
+function previousPage() {
+    if (currentPage > 1) {
+        loadPage(currentPage - 1);
+    }
+}
+
+function goToPage(page) {
+    loadPage(page);
+}
+
+function goToInputPage() {
+    const page = parseInt(document.getElementById('pageInput').value);
+    if (page >= 1 && page <= totalPages) {
+        loadPage(page);
+    } else {
+        document.getElementById('pageInput').value = currentPage;
+    }
+}
+
+function retryCurrentPage() {
+    loadPage(currentPage);
+}
+
+// Initialize
+document.addEventListener('DOMContentLoaded', function() {
+    loadPage(1);
+});
+
+// Prevent back button
+history.pushState(null, null, location.href);
+window.onpopstate = function () {
+    history.go(1);
+};
@@ -0,0 +1,114 @@
+// Disable right-click and keyboard shortcuts
+document.addEventListener('contextmenu', e => e.preventDefault());
+document.addEventListener('keydown', function(e) {
+    if (e.ctrlKey && (e.key === 's' || e.key === 'p' || e.key === 'u')) {
+        e.preventDefault();
+    }
+    if (e.key === 'F12') {
+        e.preventDefault();
+    }
+});
+
+// PDF.js setup
+pdfjsLib.GlobalWorkerOptions.workerSrc = 'https://cdnjs.cloudflare.com/ajax/libs/pdf.js/3.11.174/pdf.worker.min.js';
+
+let pdfDoc = null;
+let currentZoom = 1.0;
+let totalPages = 0;
+
+// Load and render PDF
+async function loadPDF() {
+    try {
+        const response = await fetch('/secure-pdf-data/' + document.body.dataset.ebookId);
+        const arrayBuffer = await response.arrayBuffer();
+
+        pdfDoc = await pdfjsLib.getDocument(arrayBuffer).promise;
+        totalPages = pdfDoc.numPages;
+
+        updatePageInfo();
+        renderAllPages();
+
+    } catch (error) {
+        console.error('Error loading PDF:', error);
+        document.getElementById('pdfContainer').innerHTML = '<div class="loading-container" style="color: #ff6b6b;">Error loading document</div>';
+    }
+}
+
+async function renderAllPages() {
+    const container = document.getElementById('pdfContainer');
+    container.innerHTML = '';
+
+    for (let pageNum = 1; pageNum <= totalPages; pageNum++) {
+        const pageContainer = document.createElement('div');
+        pageContainer.className = 'page-container';
+        pageContainer.id = `page-${pageNum}`;
+
+        const canvas = document.createElement('canvas');
+        canvas.className = 'page-canvas';
+        pageContainer.appendChild(canvas);
+
+        container.appendChild(pageContainer);
+
+        await renderPage(pageNum, canvas);
+    }
+}
+
+async function renderPage(pageNum, canvas) {
+    try {
+        const page = await pdfDoc.getPage(pageNum);
+        const viewport = page.getViewport({ scale: currentZoom });
+
+        canvas.height = viewport.height;
+        canvas.width = viewport.width;
+
+        const renderContext = {
+            canvasContext: canvas.getContext('2d'),
+            viewport: viewport
+        };
+
+        await page.render(renderContext).promise;
+
+        // Block canvas operations to prevent saving
+        const originalToDataURL = canvas.toDataURL;
+        canvas.toDataURL = function() {
+            return 'data:,';
+        };
+
+    } catch (error) {
+        console.error(`Error rendering page ${pageNum}:`, error);
+    }
+}
+
+function updatePageInfo() {
+    document.getElementById('pageInfo').textContent = `${totalPages} pages`;
+}
+
+function zoomIn() {
+    if (currentZoom < 2.0) {
+        currentZoom += 0.25;
+        updateZoom();
+    }
+}
+
+function zoomOut() {
+    if (currentZoom > 0.5) {
+        currentZoom -= 0.25;
+        updateZoom();
+    }
+}
+
+function updateZoom() {
+    document.getElementById('zoomLevel').textContent = Math.round(currentZoom * 100) + '%';
+    renderAllPages();
+}
+
+function toggleFullscreen() {
+    if (document.fullscreenElement) {
+        document.exitFullscreen();
+    } else {
+        document.documentElement.requestFullscreen();
+    }
+}
+
+// Load PDF when page is ready
+document.addEventListener('DOMContentLoaded', loadPDF);
@@ -0,0 +1,174 @@
+// Block all right-click attempts
+document.addEventListener('contextmenu', function(e) {
+    e.preventDefault();
+    e.stopPropagation();
+    return false;
+}, true);
+
+// Block all keyboard shortcuts
+document.addEventListener('keydown', function(e) {
+    // Block Ctrl+S, Ctrl+P, Ctrl+A, Ctrl+C, F12, etc.
+    if ((e.ctrlKey && ['s', 'p', 'a', 'c', 'u', 'r'].includes(e.key.toLowerCase())) || 
+        e.key === 'F12' || 
+        (e.ctrlKey && e.shiftKey && ['i', 'j', 'c'].includes(e.key.toLowerCase()))) {
+        e.preventDefault();
+        e.stopPropagation();
+        return false;
+    }
+}, true);
+
+// Advanced protection against devtools (disabled for better UX)
+function protectFromDevtools() {
+    // Disabled aggressive devtools detection to prevent false positives
+    // Users with different browser configurations were getting blocked
+    console.log('DevTools protection initialized but disabled for better user experience');
+}
+
+// Load PDF with enhanced security - multiple fallback methods
+function loadSecurePDF() {
+    try {
+        const pdfData = "data:application/pdf;base64," + document.body.dataset.pdf;
+        const embed = document.getElementById('pdfEmbed');
+        const object = document.getElementById('pdfObject');
+
+        console.log('Loading PDF data, size:', pdfData.length);
+
+        // Check if PDF data is valid
+        if (!pdfData || pdfData === "data:application/pdf;base64,") {
+            throw new Error('No PDF content available');
+        }
+
+        // Method 1: Try object element first (more reliable)
+        object.data = pdfData;
+        object.style.display = 'block';
+
+        // Method 2: Also set embed as fallback
+        embed.src = pdfData;
+
+        document.getElementById('loadingText').style.display = 'none';
+
+        // Add error handling
+        let loadTimeout = setTimeout(function() {
+            console.warn('PDF load timeout - trying alternative method');
+            // Fallback: try iframe instead
+            tryIframeMethod(pdfData);
+        }, 5000);
+
+        // Success handler
+        function onPDFLoadSuccess() {
+            clearTimeout(loadTimeout);
+            console.log('PDF loaded successfully');
+            document.getElementById('loadingText').style.display = 'none';
+            object.style.display = 'block';
+            setupSecurity();
+        }
+
+        // Error handler
+        function onPDFLoadError() {
+            clearTimeout(loadTimeout);
+            console.error('PDF load failed - trying iframe fallback');
+            tryIframeMethod(pdfData);
+        }
+
+        // Try to detect successful load
+        setTimeout(function() {
+            // Check if object has loaded content
+            try {
+                if (object.contentDocument || (object.offsetHeight > 100)) {
+                    onPDFLoadSuccess();
+                } else {
+                    onPDFLoadError();
+                }
+            } catch (e) {
+                // Cross-origin restrictions mean it's probably loaded
+                onPDFLoadSuccess();
+            }
+        }, 2000);
+
+    } catch (error) {
+        console.error('PDF loading error:', error);
+        document.getElementById('loadingText').textContent = 'Failed to load PDF: ' + error.message;
+        document.getElementById('loadingText').style.display = 'block';
+    }
+}
+
+// Fallback iframe method
+function tryIframeMethod(pdfData) {
+    console.log('Trying iframe fallback method');
+    const container = document.getElementById('pdfContainer');
+
+    // Remove object and create iframe
+    const object = document.getElementById('pdfObject');
+    if (object) object.style.display = 'none';
+
+    const iframe = document.createElement('iframe');
+    iframe.src = pdfData;
+    iframe.style.width = '100%';
+    iframe.style.height = '100%';
+    iframe.style.border = 'none';
+    iframe.style.background = 'white';
+    iframe.onload = function() {
+        console.log('PDF loaded via iframe');
+        document.getElementById('loadingText').style.display = 'none';
+        setupSecurity();
+    };
+    iframe.onerror = function() {
+        console.error('Iframe method also failed');
+        document.getElementById('loadingText').textContent = 'Unable to display PDF in this browser';
+    };
+
+    container.appendChild(iframe);
+}
+
+// Setup security overlay
+function setupSecurity() {
+    const overlay = document.getElementById('securityOverlay');
+
+    // Smart overlay management for scrolling
+    overlay.addEventListener('wheel', function(e) {
+        // Allow scroll but block right-clicks
+        overlay.style.pointerEvents = 'none';
+        setTimeout(() => {
+            overlay.style.pointerEvents = 'auto';
+        }, 100);
+    }, { passive: true });
+
+    overlay.addEventListener('mousedown', function(e) {
+        if (e.button === 2) {
+            e.preventDefault();
+            e.stopPropagation();
+            return false;
+        }
+        // Allow other interactions but re-enable protection quickly
+        overlay.style.pointerEvents = 'none';
+        setTimeout(() => {
+            overlay.style.pointerEvents = 'auto';
+        }, 50);
+    }, true);
+
+    overlay.style.pointerEvents = 'auto';
+}
+
+// Initialize everything
+document.addEventListener('DOMContentLoaded', function() {
+    protectFromDevtools();
+    setTimeout(loadSecurePDF, 500);
+});
+
+// Prevent print
+window.addEventListener('beforeprint', function(e) {
+    e.preventDefault();
+    return false;
+});
+
+// Block selection
+document.addEventListener('selectstart', function(e) {
+    e.preventDefault();
+    return false;
+});
+
+// Block drag
+document.addEventListener('dragstart', function(e) {
+    e.preventDefault();
+    return false;
+});
@@ -0,0 +1,191 @@
+"""
+Fingerprinted, precompressed static bundles
+
+The PDF viewers used to inline their CSS and JavaScript in every response.
+Those now live in static/src/ and are built into static/dist/ as
+<name>.<content hash>.<ext>, next to a .gz (and, when the brotli package is
+installed, a .br) copy compressed once at the highest level. Because the name
+changes whenever the content does, the files are served with a one-year
+immutable Cache-Control, and a reader downloads them once.
+
+Build with `python static_assets.py` as part of a deploy. init_app() also
+rebuilds when the manifest is missing or older than a source file, so a fresh
+checkout works without the extra step.
+"""
+import gzip
+import hashlib
+import json
+import mimetypes
+import os
+import threading
+
+try:
+    import brotli
+except ImportError:
+    # Brotli copies are optional; browsers fall back to the gzip copy
+    brotli = None
+
+STATIC_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'static')
+SOURCE_DIR = os.path.join(STATIC_DIR, 'src')
+DIST_DIR = os.path.join(STATIC_DIR, 'dist')
+MANIFEST_PATH = os.path.join(DIST_DIR, 'manifest.json')
+
+# Bundle name -> source files (relative to static/src), concatenated in order
+BUNDLES = {
+    'protected-pdf.css': ['viewers/protected-pdf.css'],
+    'protected-pdf.js': ['viewers/protected-pdf.js'],
+    'secure-pdf.css': ['viewers/secure-pdf.css'],
+    'secure-pdf.js': ['viewers/secure-pdf.js'],
+    'image-pdf.css': ['viewers/image-pdf.css'],
+    'image-pdf.js': ['viewers/image-pdf.js'],
+    'security-telemetry.js': ['security-telemetry.js'],
+}
+
+# Fingerprinted files never change, so browsers may keep them for good
+ASSET_MAX_AGE = 365 * 24 * 60 * 60  # 1 year in seconds
+
+FINGERPRINT_LENGTH = 10
+
+# Encodings of the precompressed copies, by file suffix
+ENCODING_SUFFIXES = {'br': '.br', 'gzip': '.gz'}
+
+
+def _fingerprinted(name, content):
+    stem, ext = os.path.splitext(name)
+    return f'{stem}.{hashlib.sha1(content).hexdigest()[:FINGERPRINT_LENGTH]}{ext}'
+
+
+def _write_atomic(path, data):
+    tmp_path = f'{path}.{os.getpid()}.tmp'
+    with open(tmp_path, 'wb') as f:
+        f.write(data)
+    os.replace(tmp_path, path)
+
+
+def build():
+    """
+    Build every bundle into static/dist and write the manifest
+
+    Returns:
+        dict: Bundle name -> fingerprinted file name
+    """
+    os.makedirs(DIST_DIR, exist_ok=True)
+    manifest = {}
+    for name, sources in BUNDLES.items():
+        parts = []
+        for source in sources:
+            with open(os.path.join(SOURCE_DIR, source), 'rb') as f:
+                parts.append(f.read())
+        content = b'\n'.join(parts)
+
+        filename = _fingerprinted(name, content)
+        path = os.path.join(DIST_DIR, filename)
+        if not os.path.exists(path):
+            _write_atomic(path + '.gz', gzip.compress(content, compresslevel=9, mtime=0))
+            if brotli is not None:
+                _write_atomic(path + '.br', brotli.compress(content, quality=11))
+            # The plain file goes last: its presence means the compressed copies exist
+            _write_atomic(path, content)
+        manifest[name] = filename
+
+    _write_atomic(MANIFEST_PATH, json.dumps(manifest, indent=2, sort_keys=True).encode('utf-8'))
+    return manifest
+
+
+class StaticAssets:
+    """Resolves bundle names to fingerprinted URLs and serves the built files"""
+
+    def __init__(self):
+        self._manifest = {}
+        self._lock = threading.Lock()
+        self.metrics = {
+            'served': 0,
+            'served_br': 0,
+            'served_gzip': 0,
+            'last_build_error': None
+        }
+
+    def init_app(self, app):
+        """Load the manifest, rebuilding it first if a source is newer"""
+        try:
+            if self._stale():
+                manifest = build()
+                print(f"📦 Built {len(manifest)} static bundles")
+        except OSError as e:
+            # A read-only deploy can still serve whatever was built before
+            self.metrics['last_build_error'] = str(e)
+            print(f"⚠️ Static bundle build failed: {str(e)}")
+        self.reload()
+
+    @staticmethod
+    def _stale():
+        try:
+            built_at = os.stat(MANIFEST_PATH).st_mtime
+            with open(MANIFEST_PATH) as f:
+                if set(json.load(f)) != set(BUNDLES):
+                    return True
+        except (OSError, ValueError):
+            return True
+
+        for sources in BUNDLES.values():
+            for source in sources:
+                if os.stat(os.path.join(SOURCE_DIR, source)).st_mtime > built_at:
+                    return True
+        return False
+
+    def reload(self):
+        """Read the manifest written by build()"""
+        try:
+            with open(MANIFEST_PATH) as f:
+                manifest = json.load(f)
+        except (OSError, ValueError):
+            manifest = {}
+        with self._lock:
+            self._manifest = manifest
+
+    def url(self, name):
+        """URL of a bundle, e.g. url('secure-pdf.js') -> /static/dist/secure-pdf.1a2b3c4d5e.js"""
+        from flask import url_for
+
+        filename = self._manifest.get(name)
+        if filename is None:
+            raise KeyError(f'Static bundle {name!r} has not been built (run python static_assets.py)')
+        return url_for('serve_static', filename=f'dist/{filename}')
+
+    def send(self, filename):
+        """
+        Response for static/dist/<filename>
+
+        Picks the smallest precompressed copy the client accepts; the copies were
+        compressed at build time, so nothing is compressed per request.
+        """
+        from flask import abort, request, send_from_directory
+
+        if os.path.basename(filename) != filename or not os.path.isfile(os.path.join(DIST_DIR, filename)):
+            abort(404)
+
+        available = [coding for coding, suffix in ENCODING_SUFFIXES.items()
+                     if os.path.isfile(os.path.join(DIST_DIR, filename + suffix))]
+        coding = request.accept_encodings.best_match(available) if available else None
+
+        mimetype = mimetypes.guess_type(filename)[0] or 'application/octet-stream'
+        served = filename + ENCODING_SUFFIXES[coding] if coding else filename
+        response = send_from_directory(DIST_DIR, served, mimetype=mimetype, max_age=ASSET_MAX_AGE)
+        if coding:
+            response.headers['Content-Encoding'] = coding
+            self.metrics[f'served_{coding}'] += 1
+        response.headers['Cache-Control'] = f'public, max-age={ASSET_MAX_AGE}, immutable'
+        response.vary.add('Accept-Encoding')
+        self.metrics['served'] += 1
+        return response
+
+
+# Shared asset registry for the application
+static_assets = StaticAssets()
+
+
+if __name__ == '__main__':
+    for name, filename in sorted(build().items()):
+        print(f'{name} -> dist/{filename}')
+    if brotli is None:
+        print('brotli is not installed, only gzip copies were written')
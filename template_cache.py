@@ -0,0 +1,304 @@
+"""
+Jinja bytecode cache and template warm-up
+
+The big templates (index.html ~3.4k lines, course_watch.html ~3.3k,
+user/dashboard.html ~2.4k) were compiled by every worker on first use, so the
+first visitors after each restart or deploy waited for Jinja's parser and the
+Python compiler. Now:
+
+- init_app() points Jinja's bytecode cache at TEMPLATE_CACHE_DIR on local disk,
+  which all workers on the host share. The directory must belong to the app's
+  user and is kept at mode 0700. A template is compiled by the first
+  worker that needs it and the others load its marshalled bytecode. Entries are
+  checked against a hash of the template source, so an edited template is
+  recompiled on its own and nothing has to be cleared on deploy;
+- warm(), called once app.py has registered every filter and global, compiles
+  (or loads) all templates before the worker accepts requests.
+
+`python template_cache.py` benchmarks compile and render time per template by
+requesting representative pages through the test client. It imports the app
+against a throwaway SQLite database filled with fixture rows
+(SQLALCHEMY_DATABASE_URI) and with BACKGROUND_WORKERS=0, so it never touches the
+production database or starts payment reconciliation and the other periodic
+threads. With --budget-ms it exits non-zero when a template's median render
+time exceeds the budget, so a CI job can catch template regressions.
+"""
+import os
+import statistics
+import tempfile
+import time
+
+from jinja2 import FileSystemBytecodeCache, TemplateError
+
+from page_cache import private_directory
+
+TEMPLATE_CACHE_DIR = os.environ.get('TEMPLATE_CACHE_DIR', os.path.join(tempfile.gettempdir(), f'skillfinesse_jinja-{os.getuid()}'))
+
+# Backup copies in templates/ (e.g. *.html.backup) are not templates
+TEMPLATE_EXTENSIONS = ('html', 'xml', 'txt')
+
+# Pages requested by the benchmark; {course}, {ebook}, {blog} and {enrolled_course}
+# are filled with the newest fixture rows, pages needing a user are requested as the fixture user
+BENCHMARK_PAGES = [
+    ('/', False),
+    ('/courses', False),
+    ('/course/{course}', False),
+    ('/ebooks', False),
+    ('/ebook/{ebook}', False),
+    ('/blog', False),
+    ('/blog/{blog}', False),
+    ('/about', False),
+    ('/user/dashboard', True),
+    ('/course/{enrolled_course}/watch', True),
+]
+
+BENCHMARK_REPEAT = 20
+
+# Fixture rows created in the benchmark database
+FIXTURE_COURSES = 12
+FIXTURE_EBOOKS = 12
+FIXTURE_BLOGS = 6
+FIXTURE_LESSONS = 8
+
+
+class CountingBytecodeCache(FileSystemBytecodeCache):
+    """FileSystemBytecodeCache that counts how often a compile was avoided"""
+
+    def __init__(self, directory, metrics):
+        super().__init__(directory)
+        self.metrics = metrics
+
+    def load_bytecode(self, bucket):
+        super().load_bytecode(bucket)
+        self.metrics['bytecode_hits' if bucket.code is not None else 'bytecode_misses'] += 1
+
+
+class TemplateCache:
+    """Shared on-disk bytecode cache and startup compilation of all templates"""
+
+    def __init__(self, directory=TEMPLATE_CACHE_DIR):
+        self.directory = directory
+        self._app = None
+        self.metrics = {
+            'bytecode_hits': 0,
+            'bytecode_misses': 0,
+            'warmed_templates': 0,
+            'warm_seconds': 0.0,
+            'failed_templates': [],
+            'last_error': None
+        }
+
+    def init_app(self, app):
+        """Install the bytecode cache before any template is loaded; TEMPLATE_CACHE_DIR can be set in the app config"""
+        self._app = app
+        self.directory = app.config.get('TEMPLATE_CACHE_DIR', self.directory)
+        try:
+            # Jinja executes the bytecode it finds here
+            private_directory(self.directory)
+        except OSError as e:
+            # Without the directory every worker just compiles for itself, as before
+            self.metrics['last_error'] = str(e)
+            print(f"⚠️ Template bytecode cache disabled: {str(e)}")
+            return
+        app.jinja_env.bytecode_cache = CountingBytecodeCache(self.directory, self.metrics)
+
+    def template_names(self):
+        return self._app.jinja_env.list_templates(extensions=TEMPLATE_EXTENSIONS)
+
+    def warm(self):
+        """
+        Compile every template into the environment's cache
+
+        A template that fails to compile is reported and left for the request that
+        uses it to fail on, as before; it does not stop the worker from starting.
+        """
+        env = self._app.jinja_env
+        started = time.perf_counter()
+        hits_before = self.metrics['bytecode_hits']
+        warmed = 0
+        failed = []
+        for name in self.template_names():
+            try:
+                env.get_template(name)
+                warmed += 1
+            except TemplateError as e:
+                failed.append(name)
+                self.metrics['last_error'] = f'{name}: {str(e)}'
+
+        self.metrics['warmed_templates'] = warmed
+        self.metrics['failed_templates'] = failed
+        self.metrics['warm_seconds'] = round(time.perf_counter() - started, 3)
+        from_cache = self.metrics['bytecode_hits'] - hits_before
+        print(f"📄 Warmed {warmed} templates in {self.metrics['warm_seconds']}s "
+              f"({from_cache} from bytecode cache, {warmed - from_cache} compiled)")
+        if failed:
+            print(f"⚠️ Templates that failed to compile: {', '.join(failed)}")
+        return self.metrics
+
+
+# Shared template cache for the application
+template_cache = TemplateCache()
+
+
+# Benchmark
+
+def compile_times(env, names):
+    """Milliseconds to parse and compile each template from source, bypassing every cache"""
+    times = {}
+    for name in names:
+        source, filename, _ = env.loader.get_source(env, name)
+        started = time.perf_counter()
+        try:
+            env.compile(source, name, filename)
+        except TemplateError:
+            continue
+        times[name] = (time.perf_counter() - started) * 1000
+    return times
+
+
+def _benchmark_pages(app, user_id):
+    """BENCHMARK_PAGES with their placeholders resolved against the database"""
+    import models
+
+    with app.app_context():
+        course = models.Course.query.filter_by(is_published=True).order_by(models.Course.id.desc()).first()
+        ebook = models.Ebook.query.filter_by(is_published=True).order_by(models.Ebook.id.desc()).first()
+        blog = models.Blog.query.order_by(models.Blog.id.desc()).first()
+        enrollment = (models.CourseEnrollment.query.filter_by(user_id=user_id)
+                      .order_by(models.CourseEnrollment.id.desc()).first() if user_id else None)
+        ids = {
+            'course': course.id if course else None,
+            'ebook': ebook.id if ebook else None,
+            'blog': blog.id if blog else None,
+            'enrolled_course': enrollment.course_id if enrollment else None,
+        }
+
+    pages = []
+    for path, needs_user in BENCHMARK_PAGES:
+        if needs_user and not user_id:
+            continue
+        if any(f'{{{key}}}' in path and value is None for key, value in ids.items()):
+            continue
+        pages.append((path.format(**ids), needs_user))
+    return pages
+
+
+def benchmark(app, repeat=BENCHMARK_REPEAT, user_id=None):
+    """
+    Request each benchmark page `repeat` times and time the templates it renders
+
+    Returns:
+        dict: Template name -> list of render times in milliseconds
+    """
+    env = app.jinja_env
+    timings = {}
+
+    class TimedTemplate(env.template_class):
+        def render(self, *args, **kwargs):
+            started = time.perf_counter()
+            try:
+                return super().render(*args, **kwargs)
+            finally:
+                timings.setdefault(self.name, []).append((time.perf_counter() - started) * 1000)
+
+    # Pages are rendered on every request instead of being answered from the page cache
+    page_cache_enabled = app.config.get('PAGE_CACHE_ENABLED', True)
+    app.config['PAGE_CACHE_ENABLED'] = False
+    original_class = env.template_class
+    env.template_class = TimedTemplate
+    env.cache.clear()
+    try:
+        client = app.test_client()
+        for path, needs_user in _benchmark_pages(app, user_id):
+            with client.session_transaction() as session:
+                session.clear()
+                if needs_user:
+                    session['user_id'] = user_id
+            for _ in range(repeat):
+                response = client.get(path)
+                if response.status_code != 200:
+                    print(f'{path}: HTTP {response.status_code}, skipped')
+                    break
+    finally:
+        env.template_class = original_class
+        env.cache.clear()
+        app.config['PAGE_CACHE_ENABLED'] = page_cache_enabled
+    return timings
+
+
+def _seed_fixtures(app):
+    """Fill the empty benchmark database with enough rows for every page; returns the fixture user's id"""
+    from datetime import date
+    import app as models  # not every model is registered in models.py
+
+    db = models.db
+    with app.app_context():
+        db.create_all()
+        user = models.User(first_name='Bench', last_name='Mark', username='benchmark', email='benchmark@example.com',
+                           phone_number='0000000000', country_code='+1', country='Benchmark',
+                           birth_date=date(1990, 1, 1), gender='other', password='!', email_verified=True)
+        db.session.add(user)
+        db.session.flush()
+
+        courses = [models.Course(title=f'Course {n}', description='Course description. ' * 20, price=1000.0 + n,
+                                 category='Development', admin_id=user.id, is_published=True)
+                   for n in range(FIXTURE_COURSES)]
+        ebooks = [models.Ebook(name=f'Ebook {n}', author='Author', description='Ebook description. ' * 20,
+                               price=500.0 + n, admin_id=user.id, is_published=True)
+                  for n in range(FIXTURE_EBOOKS)]
+        blogs = [models.Blog(title=f'Blog post {n}', summary='Summary of the post.', content='<p>Paragraph.</p>' * 40,
+                             category='Learning', tags='Python, Career', author_id=user.id, read_time='5 min read')
+                 for n in range(FIXTURE_BLOGS)]
+        db.session.add_all(courses + ebooks + blogs)
+        db.session.flush()
+
+        db.session.add_all([models.VideoLesson(course_id=courses[-1].id, title=f'Lesson {n}', order_index=n,
+                                               video_url=f'https://example.com/lesson-{n}.mp4')
+                            for n in range(FIXTURE_LESSONS)])
+        db.session.add(models.CourseEnrollment(user_id=user.id, course_id=courses[-1].id))
+        db.session.commit()
+        return user.id
+
+
+def main():
+    import argparse
+
+    parser = argparse.ArgumentParser(description='Benchmark template compile and render times')
+    parser.add_argument('--repeat', type=int, default=BENCHMARK_REPEAT, help='requests per page')
+    parser.add_argument('--budget-ms', type=float, help='fail when a median render time exceeds this')
+    args = parser.parse_args()
+
+    # Before the app is imported: its database and its background threads are set up at import time
+    workdir = tempfile.mkdtemp(prefix='template-benchmark-')
+    os.environ['SQLALCHEMY_DATABASE_URI'] = f"sqlite:///{os.path.join(workdir, 'benchmark.db')}"
+    os.environ['BACKGROUND_WORKERS'] = '0'
+    os.environ.setdefault('PAGE_CACHE_DIR', os.path.join(workdir, 'pages'))
+    os.environ.setdefault('PAGE_CACHE_TAGS_DIR', os.path.join(workdir, 'tags'))
+    os.environ.setdefault('TEMPLATE_CACHE_DIR', os.path.join(workdir, 'jinja'))
+
+    from app import app
+
+    user_id = _seed_fixtures(app)
+    env = app.jinja_env
+    compiled = compile_times(env, env.list_templates(extensions=TEMPLATE_EXTENSIONS))
+    timings = benchmark(app, repeat=args.repeat, user_id=user_id)
+
+    print(f"{'template':<36} {'compile':>9} {'renders':>8} {'median':>9} {'p95':>9} {'max':>9}")
+    over_budget = []
+    for name in sorted(timings, key=lambda name: -statistics.median(timings[name])):
+        times = sorted(timings[name])
+        median = statistics.median(times)
+        p95 = times[min(len(times) - 1, int(len(times) * 0.95))]
+        print(f"{name:<36} {compiled.get(name, 0):>7.1f}ms {len(times):>8} "
+              f"{median:>7.2f}ms {p95:>7.2f}ms {times[-1]:>7.2f}ms")
+        if args.budget_ms is not None and median > args.budget_ms:
+            over_budget.append(name)
+
+    print(f"Compiling all {len(compiled)} templates from source: {sum(compiled.values()):.0f}ms")
+    if over_budget:
+        print(f"Over the {args.budget_ms}ms budget: {', '.join(over_budget)}")
+        raise SystemExit(1)
+
+
+if __name__ == '__main__':
+    main()
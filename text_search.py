@@ -0,0 +1,25 @@
+"""
+Search text parsing shared by the blog and contact message search
+
+Both search over Postgres full-text search with a prefix match on every word,
+with a LIKE (or, for the blog, FTS5) fallback elsewhere. The words are
+extracted here, once, so they are safe to splice into any of those queries.
+"""
+import re
+
+# Search terms beyond this are ignored
+MAX_SEARCH_TERMS = 8
+
+
+def search_terms(search):
+    """
+    Words of a search string, lowercased, safe to splice into a tsquery or FTS5 query
+
+    Text without a single word (e.g. '!!!') gives [], which callers must treat as no search.
+    """
+    return re.findall(r'\w[\w@.+-]*', str(search or '').lower())[:MAX_SEARCH_TERMS]
+
+
+def prefix_tsquery(terms):
+    """tsquery matching every term as a prefix, e.g. ['refund', 'pay'] -> 'refund':* & 'pay':*"""
+    return ' & '.join(f"'{term}':*" for term in terms)
@@ -0,0 +1,108 @@
+"""
+Cloudflare Turnstile verifier with a pooled session, strict timeouts and a
+short-lived cache of tokens that have already been validated.
+
+A cached verification only answers the same token submitted again from the same
+IP to the same form (action), e.g. a double-submit; anywhere else the token goes
+to Cloudflare, which rejects it as already used.
+"""
+import time
+import hashlib
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+import requests
+from requests.adapters import HTTPAdapter
+
+
+class TurnstileVerifier:
+    """Verifies Turnstile tokens against Cloudflare's siteverify endpoint"""
+
+    def __init__(self, secret_key, verify_url, connect_timeout=2, read_timeout=3,
+                 cache_ttl=300, cache_size=10000, max_workers=4):
+        self.secret_key = secret_key
+        self.verify_url = verify_url
+        self.timeout = (connect_timeout, read_timeout)
+        self.cache_ttl = cache_ttl
+        self.cache_size = cache_size
+        self.max_workers = max_workers
+
+        # Keep-alive connections to challenges.cloudflare.com shared by all requests
+        self.session = requests.Session()
+        adapter = HTTPAdapter(pool_connections=1, pool_maxsize=max_workers * 2)
+        self.session.mount('https://', adapter)
+
+        # (token, remote IP, action) digest -> expiry timestamp, only successful verifications are cached
+        self._verified = {}
+        self._lock = threading.Lock()
+        self._executor = None
+
+    @staticmethod
+    def _token_key(token, remote_ip=None, action=None):
+        return hashlib.sha256(f'{token}|{remote_ip or ""}|{action or ""}'.encode()).hexdigest()
+
+    def _is_cached(self, key):
+        with self._lock:
+            expires_at = self._verified.get(key)
+            if expires_at is None:
+                return False
+            if expires_at < time.monotonic():
+                del self._verified[key]
+                return False
+            return True
+
+    def _remember(self, key):
+        now = time.monotonic()
+        with self._lock:
+            if len(self._verified) >= self.cache_size:
+                # Drop expired entries first, then the oldest ones
+                self._verified = {k: v for k, v in self._verified.items() if v >= now}
+                while len(self._verified) >= self.cache_size:
+                    self._verified.pop(next(iter(self._verified)))
+            self._verified[key] = now + self.cache_ttl
+
+    def verify(self, token, remote_ip=None, action=None):
+        """Verify a token, answering repeat submissions of the same form from the same IP from the cache"""
+        if not token:
+            return False
+
+        key = self._token_key(token, remote_ip, action)
+        if self._is_cached(key):
+            return True
+
+        try:
+            data = {
+                'secret': self.secret_key,
+                'response': token
+            }
+
+            if remote_ip:
+                data['remoteip'] = remote_ip
+
+            response = self.session.post(self.verify_url, data=data, timeout=self.timeout)
+            result = response.json()
+        except Exception as e:
+            print(f"Turnstile verification error: {e}")
+            return False
+
+        if result.get('success', False):
+            self._remember(key)
+            return True
+        return False
+
+    def verify_async(self, token, remote_ip=None, action=None):
+        """
+        Start verification in the background so callers can overlap it with
+        other work (e.g. the user lookup). Returns a Future resolving to a bool.
+        """
+        if self._executor is None:
+            with self._lock:
+                if self._executor is None:
+                    self._executor = ThreadPoolExecutor(max_workers=self.max_workers,
+                                                        thread_name_prefix='turnstile')
+        return self._executor.submit(self.verify, token, remote_ip, action)
+
+    def clear_cache(self):
+        """Forget all cached verifications"""
+        with self._lock:
+            self._verified.clear()